@@ -0,0 +1,140 @@
+# appointment_queries.py — indexed, projected reads over appointments
+# ----------------------------------------------------------------------
+# Used by summary_generator.py (doctor-day view) and handoff_export.py.
+#
+#   ensure_indexes(ap_col)
+#   docs, cursor = fetch_doctor_day(ap_col, "d003", date(2025, 8, 18), cal)
+#   docs, cursor = fetch_doctor_day(ap_col, "d003", day, cal, after=cursor)
+#   intakes = intakes_for_docs(docs, users_col)   # profile cache, then one users query per page
+#
+# Pages are keyset-paginated on (slot_start, _id) inside the index
+# (doctor_id, slot_start, _id), so page N costs the same as page 1 and a
+# full clinic day never touches documents of other doctors or days.
+# ----------------------------------------------------------------------
+
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from identity import identity_ready, lookup_keys
+from intake import APPOINTMENT_PROJECTION, Intake
+from profile_cache import profiles_for_keys
+
+# Only what the handoff summary needs (_id comes along as the cursor tiebreak)
+SUMMARY_PROJECTION = APPOINTMENT_PROJECTION
+
+DOCTOR_DAY_INDEX = [("doctor_id", 1), ("slot_start", 1), ("_id", 1)]
+
+
+def ensure_indexes(ap_col) -> None:
+    """Idempotent; safe to call on every process start."""
+    if ap_col is None:
+        return
+    try:
+        ap_col.create_index(DOCTOR_DAY_INDEX, name="doctor_day")
+        ap_col.create_index([("slot_start", 1), ("_id", 1)], name="slot_day")
+        ap_col.create_index([("created_at", -1)], name="created_desc")
+        ap_col.create_index([("doctor_name", 1), ("created_at", -1)], name="doctor_recent")
+    except Exception:
+        pass
+
+
+def day_bounds_utc(day: date, cal) -> Tuple[datetime, datetime]:
+    """[local midnight, next local midnight) for `day`, as naive UTC (Mongo's storage form)."""
+    tz = getattr(cal, "tz", None)
+    start = datetime.combine(day, time(0, 0))
+    end = datetime.combine(day + timedelta(days=1), time(0, 0))
+    if tz is not None:
+        start = start.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+        end = end.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+    return start, end
+
+
+def encode_cursor(doc: Dict[str, Any]) -> Optional[str]:
+    ss, oid = doc.get("slot_start"), doc.get("_id")
+    if not isinstance(ss, datetime) or oid is None:
+        return None
+    return f"{ss.isoformat()}|{oid}"
+
+
+def _decode_cursor(cursor: str):
+    ss, _, oid = cursor.partition("|")
+    try:
+        from bson import ObjectId
+        oid_val: Any = ObjectId(oid)
+    except Exception:
+        oid_val = oid
+    return datetime.fromisoformat(ss), oid_val
+
+
+def fetch_doctor_day(
+    ap_col,
+    doctor_id: str,
+    day: date,
+    cal,
+    after: Optional[str] = None,
+    limit: int = 200,
+    projection: Optional[Dict[str, int]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of a doctor's day ordered by slot_start. Returns (docs, next_cursor)."""
+    if ap_col is None or not doctor_id:
+        return [], None
+    start, end = day_bounds_utc(day, cal)
+    filt: Dict[str, Any] = {"doctor_id": doctor_id, "slot_start": {"$gte": start, "$lt": end},
+                            "status": {"$ne": "cancelled"}}      # pre-status bookings have none
+    if after:
+        ss, oid = _decode_cursor(after)
+        filt["$or"] = [{"slot_start": {"$gt": ss}}, {"slot_start": ss, "_id": {"$gt": oid}}]
+    try:
+        cur = (
+            ap_col.find(filt, projection or SUMMARY_PROJECTION)
+            .sort([("slot_start", 1), ("_id", 1)])
+            .limit(int(limit) + 1)
+            .batch_size(min(int(limit) + 1, 1000))
+        )
+        docs = list(cur)
+    except Exception:
+        return [], None
+    more = len(docs) > limit
+    docs = docs[:limit]
+    return docs, (encode_cursor(docs[-1]) if more and docs else None)
+
+
+def list_doctors(db, ap_col=None) -> List[Dict[str, str]]:
+    """[{doctor_id, name}] from the small doctor collection; falls back to an
+    index-backed distinct over appointments when the directory is empty."""
+    out: List[Dict[str, str]] = []
+    try:
+        if db is not None:
+            for d in db.doctor.find({}, {"_id": 0, "doctor_id": 1, "name": 1}):
+                if d.get("doctor_id") and d.get("name"):
+                    name = d["name"].strip()
+                    out.append({"doctor_id": d["doctor_id"], "name": name if name.lower().startswith("dr") else f"Dr. {name}"})
+    except Exception:
+        out = []
+    if not out and ap_col is not None:
+        try:
+            for did in ap_col.distinct("doctor_id"):
+                if not did:
+                    continue
+                one = ap_col.find_one({"doctor_id": did}, {"_id": 0, "doctor_name": 1})
+                out.append({"doctor_id": did, "name": (one or {}).get("doctor_name") or did})
+        except Exception:
+            return []
+    return sorted(out, key=lambda d: d["name"])
+
+
+def intakes_for_docs(docs: List[Dict[str, Any]], users_col) -> List[Dict[str, Any]]:
+    """Canonical intakes for appointment docs: profiles from the shared profile cache,
+    at most ONE users query per page for the ones it doesn't hold (not one per row)."""
+    doc_keys = [lookup_keys(d.get("contact"), d.get("patient_name"), (d.get("medical") or {}).get("dob")) for d in docs]
+    legacy: List[Dict[str, Any]] = []
+    if users_col is not None and docs and not identity_ready(users_col):
+        # profiles the identity backfill hasn't reached yet
+        raw = {(d.get("contact") or "").strip() for d in docs} - {""}
+        names = {d["patient_name"] for d in docs if not d.get("contact") and d.get("patient_name")}
+        legacy = [{"email": {"$in": sorted(c for c in raw if "@" in c)}},
+                  {"mobile": {"$in": sorted(re.sub(r"\D", "", c) for c in raw if "@" not in c)}},
+                  {"name": {"$in": sorted(names)}}]
+    users = profiles_for_keys(users_col, doc_keys, legacy)
+    return [Intake.from_docs(d, user).to_dict() for d, user in zip(docs, users)]
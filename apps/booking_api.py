@@ -0,0 +1,900 @@
+# booking_api.py — headless booking service (asyncio HTTP + JSON)
+# ----------------------------------------------------------------------
+#   python apps/booking_api.py --host 0.0.0.0 --port 8700
+#   (settings from the environment, or .streamlit/secrets.toml next to
+#    this file — the same keys as the chatbot, see booking_core.load_settings)
+#
+#   POST   /v1/sessions                       -> {"session_id", "say"}
+#   POST   /v1/sessions/<id>/turns {"text"}   -> {"session_id", "say", "done", "booking_id", "state"}
+#   DELETE /v1/sessions/<id>                  -> {"ok": true}
+#   GET    /v1/doctors                        -> {"version", "doctors"}
+#   GET    /v1/doctors/<id>/calendar.ics?token=…   -> text/calendar, ETag / 304 (ics_feeds.py)
+#   GET    /v1/stats                          -> parse rates + gateway / profile cache / feed counters
+#   GET    /healthz
+#
+# Turns are stateless for the caller: the booking state lives server-side
+# (db.chat_sessions, TTL-indexed; an in-process dict without Mongo) and
+# is saved with a version check, so two replicas never both apply a turn
+# to one session — the loser answers 409 and the client retries.
+#
+# Mongo goes through motor when installed (sync pymongo on worker threads
+# otherwise); model calls through LLMGateway.achat. The waitlist/outbox
+# helpers are sync pymongo code and run on worker threads.
+#
+# Front ends (the Streamlit chat included) use a client:
+#   client = get_client(cfg)     # HTTP when BOOKING_API_URL is set,
+#   sid, hello = client.start()  # else this service on a private event loop
+#   reply = client.turn(sid, "my heart is racing")
+# ----------------------------------------------------------------------
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+import weakref
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from appointment_queries import day_bounds_utc
+from booking_core import (
+    DOB_TO_VERIFY_NOTE, GREETING, PROMPT_VERSION, SimpleBookingState, after_model, assign_doctor,
+    booking_from_state, confirmation_text, directory_version, doctors_from_docs, fallback_turn, load_settings,
+    maybe_set_visit_type_from_text, model_messages, new_booking_id, new_user_doc, next_user_id,
+    parse_manage_command, patient_email, prefill_from_profile, profile_matches, returning_patient_note,
+    slot_problem, slot_taken_reply, staff_urgent_email, undo_prefill, user_filter, user_update,
+)
+from clinic_calendar import get_calendar
+from ics_feeds import STATS as FEED_STATS, bump_feed, feed_response, token_ok
+from identity import DUPLICATE_SCORE, ensure_identity_indexes, find_candidates, identity_ready
+from json_extract import (
+    PARSE_STATS, REPAIR_SYSTEM, TURN_TOOL, TURN_TOOL_CHOICE, extract_turn, response_text, turn_from_response,
+)
+from lazy_deps import HAS_IBM, HAS_MOTOR, HAS_PYMONGO, mongo_client_cls, motor_client_cls, wx
+from llm_cassette import cassette_model, replay_only
+from llm_gateway import LLMUnavailable, get_gateway
+from llm_ratelimit import PRIORITY_PATIENT, get_limiter
+from mailer import extract_email, outbox_sender
+from outbox import enqueue, start_outbox_worker
+from profile_cache import get_profile_cache, profile_for_contact
+from reminders import schedule_reminders, start_reminder_scheduler
+from rollups import compaction_tick, ensure_rollup_indexes, record_event
+from schedule_views import add_to_schedule, start_schedule_build
+from schema import normalize_appointment, start_background_migration
+from symptom_router import get_router
+from waitlist import (
+    NotFound, SlotTaken, accept_offer, cancel_appointment, claim_slot, claimed_slots, ensure_waitlist_indexes,
+    join_waitlist, mark_waitlist_booked, offer_sweeper_tick, release_slot, reschedule_appointment,
+)
+
+DIRECTORY_TTL_S = 300
+MAX_BODY = 64 * 1024
+MAX_TEXT = 2000
+IDLE_TIMEOUT_S = 75
+
+
+class SessionNotFound(Exception):
+    """Unknown or expired session id."""
+
+
+class SessionConflict(Exception):
+    """Another turn for this session was saved first."""
+
+# -------------------------------------------------
+# Mongo (motor, or pymongo on worker threads)
+# -------------------------------------------------
+
+class _ThreadedCursor:
+    def __init__(self, col, args, kwargs):
+        self._col, self._args, self._kwargs, self._ops = col, args, kwargs, []
+
+    def sort(self, *a):
+        self._ops.append(("sort", a))
+        return self
+
+    def limit(self, n):
+        self._ops.append(("limit", (n,)))
+        return self
+
+    async def to_list(self, length=None):
+        def run():
+            cur = self._col.find(*self._args, **self._kwargs)
+            for name, a in self._ops:
+                cur = getattr(cur, name)(*a)
+            return list(cur if length is None else cur.limit(length))
+        return await asyncio.to_thread(run)
+
+
+class _ThreadedCollection:
+    """motor-shaped awaitable facade over a pymongo collection."""
+
+    def __init__(self, col):
+        self._col = col
+
+    def find(self, *args, **kwargs):
+        return _ThreadedCursor(self._col, args, kwargs)
+
+    def __getattr__(self, name):
+        fn = getattr(self._col, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return call
+
+
+class _ThreadedDB:
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return _ThreadedCollection(self._db[name])
+
+
+def connect(cfg: Dict[str, Any]):
+    """(adb, db): awaitable handle for the turn path + the sync pymongo db for the waitlist/outbox helpers."""
+    uri = cfg.get("MONGO_URI")
+    if not (uri and HAS_PYMONGO):
+        return None, None
+    kw = dict(serverSelectionTimeoutMS=3000, connectTimeoutMS=3000, socketTimeoutMS=3000,
+              tls=True if "mongodb+srv://" in uri else False)
+    if HAS_MOTOR:
+        client = motor_client_cls()(uri, **kw)
+        return client[cfg["DB_NAME"]], client.delegate[cfg["DB_NAME"]]
+    db = mongo_client_cls()(uri, **kw)[cfg["DB_NAME"]]
+    return _ThreadedDB(db), db
+
+# -------------------------------------------------
+# Sessions
+# -------------------------------------------------
+
+class SessionStore:
+    """Booking state per session id: db.chat_sessions (TTL index) or an in-process dict."""
+
+    def __init__(self, adb=None, ttl_s: int = 86400, max_local: int = 100_000):
+        self.adb = adb
+        self.ttl_s = ttl_s
+        self.max_local = max_local
+        self._local: Dict[str, Tuple[Dict[str, Any], int, float]] = {}
+
+    async def ensure_indexes(self) -> None:
+        if self.adb is None:
+            return
+        try:
+            await self.adb.chat_sessions.create_index("updated_at", name="ttl", expireAfterSeconds=self.ttl_s)
+        except Exception:
+            pass
+
+    async def create(self) -> str:
+        sid = secrets.token_urlsafe(16)
+        if self.adb is not None:
+            await self.adb.chat_sessions.insert_one(
+                {"_id": sid, "state": SimpleBookingState().to_dict(), "version": 0, "updated_at": datetime.utcnow()})
+        else:
+            self._purge()
+            self._local[sid] = (SimpleBookingState().to_dict(), 0, time.monotonic())
+        return sid
+
+    async def load(self, sid: str) -> Tuple[SimpleBookingState, int]:
+        if self.adb is not None:
+            doc = await self.adb.chat_sessions.find_one({"_id": sid})
+            if doc is None:
+                raise SessionNotFound(sid)
+            return SimpleBookingState.from_dict(doc.get("state")), doc.get("version", 0)
+        entry = self._local.get(sid)
+        if entry is None or time.monotonic() - entry[2] > self.ttl_s:
+            self._local.pop(sid, None)
+            raise SessionNotFound(sid)
+        return SimpleBookingState.from_dict(entry[0]), entry[1]
+
+    async def save(self, sid: str, state: SimpleBookingState, version: int) -> bool:
+        """False if the session changed since load (another turn won)."""
+        if self.adb is not None:
+            res = await self.adb.chat_sessions.update_one(
+                {"_id": sid, "version": version},
+                {"$set": {"state": state.to_dict(), "updated_at": datetime.utcnow()}, "$inc": {"version": 1}})
+            return res.modified_count == 1
+        entry = self._local.get(sid)
+        if entry is None or entry[1] != version:
+            return False
+        self._local[sid] = (state.to_dict(), version + 1, time.monotonic())
+        return True
+
+    async def delete(self, sid: str) -> None:
+        if self.adb is not None:
+            await self.adb.chat_sessions.delete_one({"_id": sid})
+        else:
+            self._local.pop(sid, None)
+
+    def _purge(self) -> None:
+        if len(self._local) < self.max_local:
+            return
+        cutoff = time.monotonic() - self.ttl_s
+        for sid in [s for s, e in self._local.items() if e[2] < cutoff]:
+            del self._local[sid]
+        while len(self._local) >= self.max_local:          # oldest first (insertion order)
+            del self._local[next(iter(self._local))]
+
+# -------------------------------------------------
+# Models
+# -------------------------------------------------
+
+def chat_params(structured: str, **overrides):
+    kw = dict(temperature=0.25, max_tokens=320, top_p=0.9)
+    kw.update(overrides)
+    if not HAS_IBM:
+        # cassette replay without the SDK: params are only passed through
+        return kw
+    if structured == "json":
+        # JSON mode needs a recent ibm-watsonx-ai; older SDKs reject the kwarg
+        try:
+            return wx().TextChatParameters(**kw, response_format={"type": "json_object"})
+        except Exception:
+            pass
+    return wx().TextChatParameters(**kw)
+
+
+def init_models(cfg: Dict[str, Any]):
+    """(model, params, repair_model, repair_params); Nones when the SDK or credentials are missing
+    (unless a replay-only cassette stands in for watsonx, see llm_cassette.py)."""
+    cassette = (cfg.get("LLM_CASSETTE"), cfg.get("LLM_CASSETTE_MODE", "replay"), cfg.get("LLM_CASSETTE_LATENCY", "recorded"))
+    live = HAS_IBM and cfg["WX_API_KEY"] and cfg["WX_URL"] and cfg["WX_PROJECT_ID"]
+    if not (live or replay_only(*cassette[:2])):
+        return None, None, None, None
+    creds = {"apikey": cfg["WX_API_KEY"], "url": cfg["WX_URL"]}
+    model = params = repair_model = repair_params = None
+    try:
+        model = wx().ModelInference(model_id=cfg["MODEL_ID"], credentials=creds, project_id=cfg["WX_PROJECT_ID"]) if live else None
+        model = cassette_model(model, cfg["MODEL_ID"], *cassette)
+        params = chat_params(cfg["LLM_STRUCTURED"]) if model is not None else None
+    except Exception:
+        model = params = None
+    if cfg["REPAIR_MODEL_ID"]:
+        # Small model used for a single re-format pass when a turn fails to parse
+        try:
+            repair_model = wx().ModelInference(model_id=cfg["REPAIR_MODEL_ID"], credentials=creds,
+                                               project_id=cfg["WX_PROJECT_ID"]) if live else None
+            repair_model = cassette_model(repair_model, cfg["REPAIR_MODEL_ID"], *cassette)
+            repair_params = chat_params("json", temperature=0.0, max_tokens=200, top_p=1.0) if repair_model is not None else None
+        except Exception:
+            repair_model = repair_params = None
+    return model, params, repair_model, repair_params
+
+
+def _supports_kwarg(model, name: str) -> bool:
+    try:
+        return name in inspect.signature(getattr(model, "achat", None) or model.chat).parameters
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+# -------------------------------------------------
+# Service
+# -------------------------------------------------
+
+class BookingService:
+    def __init__(self, cfg: Dict[str, Any], adb=None, db=None, model=None, params=None,
+                 repair_model=None, repair_params=None):
+        self.cfg = cfg
+        self.adb, self.db = adb, db
+        self.model, self.params = model, params
+        self.repair_model, self.repair_params = repair_model, repair_params
+        self.cal = get_calendar(cfg["CLINIC_TZ"], cfg["CLINIC_HOLIDAYS"])
+        limiter = get_limiter()
+        limiter.configure("upstream", cfg["LLM_UPSTREAM_RPS"])
+        limiter.configure("chat", cfg["LLM_CHAT_RPS"])
+        self.llm = get_gateway("chat", deadline_s=cfg["LLM_DEADLINE_S"], max_retries=cfg["LLM_RETRIES"],
+                               hedge=cfg["LLM_HEDGE"], budget="chat", priority=PRIORITY_PATIENT)
+        self.sessions = SessionStore(adb, cfg["SESSION_TTL_S"])
+        self._directory = None
+        self._directory_at = 0.0
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    @classmethod
+    async def create(cls, cfg: Dict[str, Any]) -> "BookingService":
+        """Connect, build the models and start the background workers (once per process)."""
+        adb, db = connect(cfg)
+        if db is not None:
+            try:
+                await asyncio.to_thread(db.client.admin.command, "ping")
+            except Exception:
+                adb = db = None
+        models = await asyncio.to_thread(init_models, cfg)
+        await asyncio.to_thread(get_router)
+        svc = cls(cfg, adb, db, *models)
+        if db is not None:
+            await asyncio.to_thread(svc._start_workers)
+            await svc.sessions.ensure_indexes()
+        return svc
+
+    def _start_workers(self) -> None:
+        start_background_migration(self.db, self.cal)
+        ensure_waitlist_indexes(self.db)
+        ensure_identity_indexes(self.db.users)
+        start_schedule_build(self.db, self.cal)
+        ensure_rollup_indexes(self.db)
+        start_reminder_scheduler(self.db, self.cal)
+        # waitlist offers / staff flags / confirmations / reminders are queued in db.outbox and sent from here;
+        # the nightly rollup compaction rides on the same loop
+        start_outbox_worker(self.db, outbox_sender(self.cfg),
+                            ticks=[offer_sweeper_tick(self.db, self.cal), compaction_tick(self.db, self.cal)])
+
+    # -- directory --------------------------------------------------------
+
+    async def doctors(self):
+        """(DOCTORS, SPECIALIZATION_MAP, version), re-read at most every DIRECTORY_TTL_S."""
+        if self._directory is None or time.monotonic() - self._directory_at > DIRECTORY_TTL_S:
+            docs: List[Dict[str, Any]] = []
+            if self.adb is not None:
+                try:
+                    docs = await self.adb.doctor.find({}).to_list(None)
+                except Exception:
+                    docs = []
+            doctors, spec_map = doctors_from_docs(docs)
+            self._directory = (doctors, spec_map, directory_version(doctors))
+            self._directory_at = time.monotonic()
+        return self._directory
+
+    # -- model ------------------------------------------------------------
+
+    async def _repair_turn(self, raw: str):
+        """One cheap pass through the small model to coerce free text into the turn schema."""
+        if not raw or self.repair_model is None:
+            return None
+        msgs = [{"role": "system", "content": REPAIR_SYSTEM}, {"role": "user", "content": raw[:2000]}]
+        try:
+            resp = await self.llm.achat(self.repair_model, msgs, self.repair_params,
+                                        deadline_s=min(3.0, self.cfg["LLM_DEADLINE_S"]))
+        except Exception:
+            return None
+        return extract_turn(response_text(resp))
+
+    async def ai_driver(self, user_text, state, doctors, taken=None):
+        """Delegate flow to the model."""
+        msgs = model_messages(user_text, state, doctors, self.cal, taken)
+
+        # If model isn't available, return a soft fallback
+        if self.model is None or self.params is None:
+            return fallback_turn(state)
+
+        try:
+            extra = {}
+            if self.cfg["LLM_STRUCTURED"] == "tools" and _supports_kwarg(self.model, "tools"):
+                extra = {"tools": [TURN_TOOL], "tool_choice": TURN_TOOL_CHOICE}
+            resp = await self.llm.achat(self.model, msgs, self.params, **extra)
+            data = turn_from_response(resp)
+            if data is not None:
+                PARSE_STATS.record("first_pass")
+                return data
+            raw = response_text(resp)
+            data = await self._repair_turn(raw)
+            if data is not None:
+                PARSE_STATS.record("repaired")
+                return data
+            PARSE_STATS.record("failed")
+            return {"say": raw.strip()[:400], "set": {}, "done": False}
+        except LLMUnavailable:
+            # watsonx slow/degraded: keep the patient moving with the rule-based flow
+            return fallback_turn(state)
+        except Exception:
+            return {"say": "Sorry, I didn’t catch that. When would you like to schedule your appointment?", "set": {}, "done": False}
+
+    # -- persistence ------------------------------------------------------
+
+    async def upsert_user_for_booking(self, booking: dict, appt_date_dt: datetime) -> bool:
+        if self.adb is None:
+            return False
+        users = self.adb.users
+        try:
+            legacy = not await asyncio.to_thread(identity_ready, self.db.users)
+            existing = await users.find_one(user_filter(booking, legacy=legacy))
+            if existing is None:
+                try:
+                    user_id = next_user_id(await users.count_documents({}))
+                except Exception:
+                    user_id = f"u{int(datetime.now().timestamp())}"
+                doc = new_user_doc(booking, appt_date_dt, user_id)
+                # same-sounding name + DOB under another contact: flag for staff, never merge
+                similar = await asyncio.to_thread(find_candidates, self.db.users, booking.get("patient_name"),
+                                                  doc.get("dob"), 3, DUPLICATE_SCORE)
+                if similar:
+                    doc["possible_duplicate_of"] = [u.get("user_id") for _, u in similar]
+                await users.insert_one(doc)
+                written = doc["identity_keys"]
+            else:
+                update = user_update(booking, appt_date_dt, existing)
+                await users.update_one({"_id": existing["_id"]}, update)
+                written = (existing.get("identity_keys") or []) + update["$addToSet"]["identity_keys"]["$each"]
+            # write-through: the next turn / summary reads the profile as just written
+            get_profile_cache().invalidate(set(written))
+            return True
+        except Exception:
+            return False
+
+    async def save_appointment_and_user(self, booking_data: dict, offer_id: str = None, method: str = "api") -> bool:
+        """Claim the slot, insert the appointment and upsert the users collection.
+        Raises SlotTaken when the slot is already booked (or held for a waitlist offer).
+        Sets booking_data["booking_id"]."""
+        if self.adb is None:
+            return False
+        claimed = inserted = False
+        try:
+            booking_id = new_booking_id(booking_data["doctor_id"])
+            if booking_data.get("slot_start"):
+                if not await asyncio.to_thread(
+                        claim_slot, self.db, booking_data["doctor_id"], booking_data["slot_start"], booking_id, offer_id):
+                    raise SlotTaken(booking_data.get("appointment_slot"))
+                claimed = True
+            booking_data["booking_id"] = booking_id
+            appointment_doc = normalize_appointment({
+                **booking_data,
+                "booking_id": booking_id,
+                "status": "confirmed",
+                "created_at": datetime.now(),
+                "booking_method": method,
+            })
+            await self.adb.appointments.insert_one(appointment_doc)
+            inserted = True
+            try:
+                await asyncio.to_thread(add_to_schedule, self.db, appointment_doc, self.cal)
+            except Exception:
+                pass   # the view lags; schedule_views check --fix repairs it
+            try:
+                await asyncio.to_thread(record_event, self.db, "booked", appointment_doc, self.cal)
+            except Exception:
+                pass   # counters lag; rollups rebuild recounts
+            try:
+                await asyncio.to_thread(bump_feed, self.db, appointment_doc.get("doctor_id"), booking_id)
+            except Exception:
+                pass   # the feed catches up on the next write or day
+            try:
+                schedule_reminders(appointment_doc)
+            except Exception:
+                pass   # the scheduler picks it up when its window next reloads
+
+            # Appointment date: resolved slot, else next occurrence of selected_day
+            appt_date_dt = (booking_data.get("slot_start")
+                            or self.cal.slot_start(booking_data.get("selected_day"), "12:00 PM") or self.cal.now())
+            await self.upsert_user_for_booking(booking_data, appt_date_dt)
+            return True
+        except SlotTaken:
+            raise
+        except Exception:
+            if claimed and not inserted:
+                # no appointment holds the claim: free the slot or it stays booked forever
+                # (unless a failed-looking insert did land)
+                try:
+                    if await self.adb.appointments.find_one({"booking_id": booking_id}, {"_id": 1}) is None:
+                        await asyncio.to_thread(release_slot, self.db, booking_data["doctor_id"],
+                                                booking_data["slot_start"], booking_id)
+                except Exception:
+                    pass
+            return False
+
+    async def _notify(self, booking: dict, saved: bool) -> str:
+        """Queue the staff flag / patient confirmation; returns the email note for the reply."""
+        if not saved:
+            return ""
+        tri = booking.get("triage") or {}
+        if tri.get("urgency") == "High" and self.cfg["STAFF_EMAIL"]:
+            subject, body = staff_urgent_email(booking)
+            await asyncio.to_thread(enqueue, self.db, "staff_urgent", self.cfg["STAFF_EMAIL"], subject, body,
+                                    f"urgent|{booking.get('booking_id')}")
+        if not self.cfg["MAIL_ENABLED"]:
+            return " (Email notifications are currently disabled.)"
+        to_email = extract_email(booking.get("contact"))
+        subject, body = patient_email(booking)
+        if to_email and await asyncio.to_thread(enqueue, self.db, "booking_confirmation", to_email, subject, body,
+                                                f"confirm|{booking.get('booking_id')}"):
+            return " A confirmation email is on its way."
+        return " (Email could not be sent, but your appointment is confirmed.)"
+
+    # -- cancel / reschedule / waitlist -----------------------------------
+
+    async def handle_manage_command(self, cmd, state, doctors, channel: str) -> Tuple[str, bool]:
+        """(reply, reset_session) for a parsed ManageCommand."""
+        if self.db is None:
+            return "I can't manage appointments right now (database unavailable). Please call the clinic.", False
+        db, cal = self.db, self.cal
+        contact = cmd.contact or state.contact
+        try:
+            if cmd.kind == "accept":
+                booking = await asyncio.to_thread(accept_offer, db, cmd.offer_id, contact)
+                local = cal.to_local(booking["slot_start"])
+                day, time_s = local.strftime("%A"), local.strftime("%I:%M %p").lstrip("0")
+                booking.update(slot_start=local, selected_day=day, selected_time=time_s,
+                               appointment_slot=f"{day}, {local.strftime('%B %d')} at {time_s}")
+                if not await self.save_appointment_and_user(booking, offer_id=cmd.offer_id, method=channel):
+                    return "Sorry, I couldn't save that booking. Please try again in a moment.", False
+                await asyncio.to_thread(mark_waitlist_booked, db, cmd.offer_id, booking["booking_id"])
+                return (f"Done! You're booked with {booking['doctor_name']} on {booking['appointment_slot']}. "
+                        f"Booking ID: {booking['booking_id']}."), False
+
+            if cmd.kind == "waitlist":
+                day = state.waitlist_day or cal.next_date(state.selected_day)
+                if not (state.doctor_id and state.patient_name and state.contact and day):
+                    return "To join the waitlist I need your name, contact and the day you'd like — tell me those first.", False
+                # offers go out by email only
+                email = extract_email(cmd.contact) or extract_email(state.contact)
+                if not email:
+                    return ("Waitlist offers are sent by email, and I only have a phone number for you. "
+                            "Reply 'waitlist' with your email address, e.g. 'waitlist jane@example.com'."), False
+                entry_id = await asyncio.to_thread(join_waitlist, db, {**booking_from_state(state), "contact": email}, day,
+                                                   state.triage.score if state.triage else 0)
+                return (f"You're on the waitlist for {state.doctor_name} on {day.strftime('%A, %B %d')} (ref {entry_id}). "
+                        f"If a slot opens up we'll email {email} right away."), True
+
+            if not contact:
+                return "Please include the email or phone number you booked with, e.g. 'cancel apt_… jane@example.com'.", False
+            if cmd.kind == "cancel":
+                await asyncio.to_thread(cancel_appointment, db, cmd.booking_id, contact, cal, "patient_chat")
+                return f"Your appointment {cmd.booking_id} is cancelled. Thanks for letting us know — the slot goes to the next patient waiting.", False
+
+            if not (cmd.day and cmd.time):
+                return f"Which day and time would you like instead? e.g. 'reschedule {cmd.booking_id} to Tuesday 10:00 AM'.", False
+            appt = await self.adb.appointments.find_one({"booking_id": cmd.booking_id}, {"doctor_id": 1}) or {}
+            doctor = next((d for d in doctors.values() if d["id"] == appt.get("doctor_id")), None)
+            problem = slot_problem(doctor, cmd.day, cmd.time, cal) if doctor else None
+            if problem:
+                return f"Sorry, I can't move it there: {problem}. Please pick another time with {doctor['name']}.", False
+            moved = await asyncio.to_thread(reschedule_appointment, db, cmd.booking_id, contact,
+                                            cal.slot_start(cmd.day, cmd.time), cal, cmd.day, cmd.time)
+            return f"Rescheduled! {cmd.booking_id} is now {moved.get('appointment_slot')}.", False
+        except SlotTaken:
+            return "That time is already booked — please pick another time, or say 'waitlist' to be offered the next opening.", False
+        except NotFound as e:
+            return str(e), False
+        except Exception:
+            return "Sorry, something went wrong while updating your appointment. Please try again.", False
+
+    # -- calendar feeds ---------------------------------------------------
+
+    async def calendar_feed(self, doctor_id: str, token: Optional[str],
+                            if_none_match: Optional[str]) -> Tuple[int, bytes, str]:
+        """(status, body, etag); 404 unless feeds are configured and the token matches."""
+        if self.db is None or not token_ok(self.cfg["ICS_FEED_SECRET"], doctor_id, token):
+            return 404, b"", ""
+        return await asyncio.to_thread(feed_response, self.db, doctor_id, self.cal, if_none_match)
+
+    # -- turns ------------------------------------------------------------
+
+    async def start(self) -> Tuple[str, str]:
+        return await self.sessions.create(), GREETING
+
+    async def end(self, session_id: str) -> None:
+        await self.sessions.delete(session_id)
+
+    async def taken_slots(self, state):
+        """Claimed slots of the session's doctor over the dates the calendar offers."""
+        if self.db is None or state.doctor_id is None:
+            return None
+        dates = self.cal.table().values()
+        start, _ = day_bounds_utc(min(dates), self.cal)
+        _, end = day_bounds_utc(max(dates), self.cal)
+        try:
+            return await asyncio.to_thread(claimed_slots, self.db, state.doctor_id, start, end)
+        except Exception:
+            return None
+
+    async def recognize_patient(self, state) -> str:
+        """Returning patients: prefill their intake once contact, name and DOB all match
+        one profile, and take it back out when they stop matching. The note for the reply."""
+        if self.db is None or not (state.contact and state.patient_name):
+            return ""
+        check = "|".join([state.contact, state.patient_name, state.dob or ""])
+        if check == state.profile_check:
+            return ""
+        first, state.profile_check = state.profile_check is None, check
+        profile = None
+        if state.dob:
+            try:
+                profile = await asyncio.to_thread(profile_for_contact, self.db.users, state.contact)
+            except Exception:
+                profile = None
+        welcomed = state.existing_user
+        if welcomed:
+            undo_prefill(state)          # re-verified below against whatever the details match now
+        if not profile_matches(state, profile):
+            # asked of everyone, so the reply never tells whether the contact is on file
+            return DOB_TO_VERIFY_NOTE if first and not state.dob else ""
+        filled = prefill_from_profile(state, profile)
+        return "" if welcomed else returning_patient_note(filled)
+
+    async def _turn(self, user_text: str, state, channel: str):
+        doctors, _, _ = await self.doctors()
+
+        # cancel / reschedule / waitlist / accept-offer don't go through the model
+        cmd = parse_manage_command(user_text)
+        if cmd is not None:
+            say, reset = await self.handle_manage_command(cmd, state, doctors, channel)
+            return {"say": say, "done": False, "booking_id": None}, (SimpleBookingState() if reset else state)
+
+        # Respect explicit visit-type preference before calling the model
+        maybe_set_visit_type_from_text(user_text, state)
+        assign_doctor(user_text, state, doctors)     # as model_messages would; the claims are per doctor
+        taken = await self.taken_slots(state)
+        result = await self.ai_driver(user_text, state, doctors, taken)
+        to_say, finalize = after_model(user_text, state, result, doctors, self.cal, taken)
+        welcome = await self.recognize_patient(state)
+        if welcome and not finalize:
+            to_say = welcome + "\n\n" + to_say
+        if not finalize:
+            return {"say": to_say, "done": False, "booking_id": None}, state
+
+        booking = booking_from_state(state)
+        try:
+            saved = await self.save_appointment_and_user(booking, method=channel)
+        except SlotTaken:
+            return {"say": slot_taken_reply(state, self.cal), "done": False, "booking_id": None}, state
+        email_note = await self._notify(booking, saved)
+        reply = {"say": confirmation_text(state, booking, saved, email_note), "done": True,
+                 "booking_id": booking.get("booking_id") if saved else None}
+        return reply, SimpleBookingState()
+
+    async def turn(self, session_id: str, user_text: str, channel: str = "api") -> Dict[str, Any]:
+        """One patient message → reply. Raises SessionNotFound / SessionConflict."""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        async with lock:
+            state, version = await self.sessions.load(session_id)
+            reply, state = await self._turn(user_text, state, channel)
+            if not await self.sessions.save(session_id, state, version):
+                raise SessionConflict(session_id)
+        return {"session_id": session_id, **reply, "state": state.to_dict()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"parse": PARSE_STATS.rates(), "llm": dict(self.llm.stats), "structured": self.cfg["LLM_STRUCTURED"],
+                "prompt_version": PROMPT_VERSION,
+                "profile_cache": dict(get_profile_cache().stats),
+                "calendar_feeds": dict(FEED_STATS),
+                "mongo": self.db is not None, "model": self.model is not None}
+
+# -------------------------------------------------
+# HTTP
+# -------------------------------------------------
+
+_REASONS = {200: "OK", 201: "Created", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_request(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise _HTTPError(400, "malformed request line")
+    headers: Dict[str, str] = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = h.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+    n = int(headers.get("content-length") or 0)
+    if n > MAX_BODY:
+        raise _HTTPError(413, "request body too large")
+    body = await reader.readexactly(n) if n else b""
+    return method.upper(), urlsplit(target), headers, body
+
+
+def _response(status: int, payload: Dict[str, Any], keep_alive: bool) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+def _feed_bytes(status: int, body: bytes, etag: str, keep_alive: bool) -> bytes:
+    head = f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+    if status == 200:
+        head += "Content-Type: text/calendar; charset=utf-8\r\n"
+    if etag:
+        head += f"ETag: {etag}\r\nCache-Control: private, no-cache\r\n"
+    head += f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    return head.encode("latin-1") + body
+
+
+class BookingHTTPServer:
+    def __init__(self, service: BookingService):
+        self.service = service
+
+    async def handle(self, reader, writer) -> None:
+        try:
+            while True:
+                try:
+                    req = await asyncio.wait_for(_read_request(reader), IDLE_TIMEOUT_S)
+                except _HTTPError as e:
+                    writer.write(_response(e.status, {"error": str(e)}, False))
+                    await writer.drain()
+                    break
+                if req is None:
+                    break
+                method, url, headers, body = req
+                keep = headers.get("connection", "").lower() != "close"
+                feed = await self.feed(method, url, headers)
+                if feed is not None:
+                    writer.write(_feed_bytes(*feed, keep))
+                else:
+                    status, payload = await self.route(method, url.path, body)
+                    writer.write(_response(status, payload, keep))
+                await writer.drain()
+                if not keep:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def feed(self, method: str, url, headers: Dict[str, str]) -> Optional[Tuple[int, bytes, str]]:
+        """GET /v1/doctors/<id>/calendar.ics; None for every other route."""
+        parts = [p for p in url.path.split("/") if p]
+        if not (method == "GET" and len(parts) == 4 and parts[:2] == ["v1", "doctors"] and parts[3] == "calendar.ics"):
+            return None
+        try:
+            token = (parse_qs(url.query).get("token") or [None])[0]
+            return await self.service.calendar_feed(parts[2], token, headers.get("if-none-match"))
+        except Exception:
+            return 500, b"", ""
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        svc = self.service
+        parts = [p for p in path.split("/") if p]
+        try:
+            if parts == ["healthz"]:
+                return 200, {"ok": True}
+            if parts == ["v1", "doctors"] and method == "GET":
+                doctors, _, version = await svc.doctors()
+                return 200, {"version": version, "doctors": doctors}
+            if parts == ["v1", "stats"] and method == "GET":
+                return 200, svc.stats()
+            if parts == ["v1", "sessions"] and method == "POST":
+                sid, say = await svc.start()
+                return 201, {"session_id": sid, "say": say}
+            if len(parts) == 3 and parts[:2] == ["v1", "sessions"] and method == "DELETE":
+                await svc.end(parts[2])
+                return 200, {"ok": True}
+            if len(parts) == 4 and parts[:2] == ["v1", "sessions"] and parts[3] == "turns" and method == "POST":
+                data = json.loads(body or b"{}")
+                text = str(data.get("text") or "").strip()
+                if not text:
+                    return 400, {"error": "text is required"}
+                if len(text) > MAX_TEXT:
+                    return 413, {"error": f"text longer than {MAX_TEXT} characters"}
+                channel = str(data.get("channel") or "api")[:40]
+                return 200, await svc.turn(parts[2], text, channel)
+            return 404, {"error": "not found"}
+        except SessionNotFound:
+            return 404, {"error": "unknown or expired session"}
+        except SessionConflict:
+            return 409, {"error": "session was updated by another request; retry"}
+        except (ValueError, AttributeError):
+            return 400, {"error": "body must be a JSON object"}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}"}
+
+
+async def serve(cfg: Dict[str, Any], host: str = "127.0.0.1", port: int = 8700) -> None:
+    svc = await BookingService.create(cfg)
+    server = await asyncio.start_server(BookingHTTPServer(svc).handle, host, port, backlog=1024)
+    print(f"booking api on http://{host}:{port} (mongo={'on' if svc.db is not None else 'off'}, "
+          f"model={'on' if svc.model is not None else 'off'})", flush=True)
+    async with server:
+        await server.serve_forever()
+
+# -------------------------------------------------
+# Clients (sync; for the Streamlit app and scripts)
+# -------------------------------------------------
+
+class HTTPBookingClient:
+    def __init__(self, base_url: str, timeout_s: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout_s = timeout_s
+
+    def _call(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout_s) as resp:
+                return json.loads(resp.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            if e.code == 404 and path.startswith("/v1/sessions/"):
+                raise SessionNotFound(path) from e
+            if e.code == 409:
+                raise SessionConflict(path) from e
+            raise
+
+    def start(self) -> Tuple[str, str]:
+        out = self._call("POST", "/v1/sessions", {})
+        return out["session_id"], out["say"]
+
+    def turn(self, session_id: str, text: str, channel: str = "api") -> Dict[str, Any]:
+        return self._call("POST", f"/v1/sessions/{session_id}/turns", {"text": text, "channel": channel})
+
+    def end(self, session_id: str) -> None:
+        try:
+            self._call("DELETE", f"/v1/sessions/{session_id}")
+        except SessionNotFound:
+            pass
+
+    def doctors(self) -> Tuple[Dict[str, Any], str]:
+        out = self._call("GET", "/v1/doctors")
+        return out["doctors"], out["version"]
+
+    def stats(self) -> Dict[str, Any]:
+        return self._call("GET", "/v1/stats")
+
+
+class LocalBookingClient:
+    """The same BookingService on a private event loop thread (no BOOKING_API_URL configured)."""
+
+    def __init__(self, cfg: Dict[str, Any]):
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="booking-loop", daemon=True).start()
+        self.service = self._run(BookingService.create(cfg))
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def start(self) -> Tuple[str, str]:
+        return self._run(self.service.start())
+
+    def turn(self, session_id: str, text: str, channel: str = "api") -> Dict[str, Any]:
+        return self._run(self.service.turn(session_id, text, channel))
+
+    def end(self, session_id: str) -> None:
+        self._run(self.service.end(session_id))
+
+    def doctors(self) -> Tuple[Dict[str, Any], str]:
+        doctors, _, version = self._run(self.service.doctors())
+        return doctors, version
+
+    def stats(self) -> Dict[str, Any]:
+        return self.service.stats()
+
+
+def get_client(cfg: Dict[str, Any]):
+    """HTTP client when BOOKING_API_URL is set, else the service in-process (connects now)."""
+    if cfg.get("BOOKING_API_URL"):
+        return HTTPBookingClient(cfg["BOOKING_API_URL"])
+    return LocalBookingClient(cfg)
+
+
+def _secrets_file() -> Dict[str, Any]:
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+    try:
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except Exception:
+        return {}
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="MedBird headless booking API.")
+    ap.add_argument("--host", default=os.getenv("BOOKING_API_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("BOOKING_API_PORT", "8700")))
+    args = ap.parse_args(argv)
+    try:
+        asyncio.run(serve(load_settings(_secrets_file()), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
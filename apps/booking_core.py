@@ -0,0 +1,831 @@
+# booking_core.py — the booking conversation, without any UI or I/O
+# ----------------------------------------------------------------------
+# Everything here is plain functions over SimpleBookingState plus the
+# clinic calendar; booking_api.py (BookingService) adds Mongo, the model
+# and sessions, and every front end — the Streamlit chat, kiosks, SMS
+# gateways — talks to that service.
+#
+# One turn, as BookingService runs it:
+#   parse_manage_command(text)              cancel / reschedule / waitlist / accept
+#   maybe_set_visit_type_from_text(text, state)
+#   msgs = model_messages(text, state, doctors, cal, taken)   (assigns a doctor)
+#   result = <model turn>  or  fallback_turn(state)
+#   to_say, finalize = after_model(text, state, result, doctors, cal, taken)
+#   (taken: the doctor's claimed slots, so the earliest offered slot is free)
+#   finalize → booking_from_state(state) → save → confirmation_text(...)
+#
+# Settings: load_settings(secrets) resolves env → secrets → default, the
+# same keys for the Streamlit app (st.secrets) and the API (secrets.toml).
+# ----------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from clinic_calendar import parse_time
+from identity import (
+    MIN_CANDIDATE_SCORE, canonical_phone, lookup_filter, name_similarity, normalize_contact, normalize_dob, user_identity_fields,
+)
+from schema import SCHEMA_VERSION, clean, severity_label, user_migration_update
+from symptom_router import CONDITIONS, get_router
+from triage import EMERGENCY_ADVISORY, Triage, score_triage
+
+# -------------------------------------------------
+# Settings
+# -------------------------------------------------
+
+def _lookup(secrets: Mapping, env: str, section: str, key: str, default: Any = "") -> Any:
+    v = os.getenv(env)
+    if v is not None and v.strip() != "":
+        return v
+    try:
+        return (secrets.get(section) or {}).get(key, default)
+    except Exception:
+        return default
+
+
+def load_settings(secrets: Optional[Mapping] = None) -> Dict[str, Any]:
+    """Every setting the booking flow needs (env → secrets → default)."""
+    secrets = secrets or {}
+    get = lambda env, section, key, default="": _lookup(secrets, env, section, key, default)
+    try:
+        mail = dict(secrets.get("mail") or {})
+    except Exception:
+        mail = {}
+    return {
+        "MODEL_ID":        get("WX_MODEL_ID", "ibm", "model_id", "ibm/granite-3-3-8b-instruct"),
+        "WX_URL":          get("WX_URL", "ibm", "url", "https://us-south.ml.cloud.ibm.com"),
+        "WX_API_KEY":      get("WX_API_KEY", "ibm", "api_key", ""),
+        "WX_PROJECT_ID":   get("WX_PROJECT_ID", "ibm", "project_id", ""),
+        "REPAIR_MODEL_ID": get("WX_REPAIR_MODEL_ID", "ibm", "repair_model_id", ""),
+        "MONGO_URI":       get("MONGO_URI", "mongo", "uri", ""),
+        "DB_NAME":         get("DB_NAME",  "mongo", "db",  "medbird"),
+        "CLINIC_TZ":       get("CLINIC_TZ", "clinic", "tz", "America/New_York"),
+        "CLINIC_HOLIDAYS": get("CLINIC_HOLIDAYS", "clinic", "holidays", ""),
+        "STAFF_EMAIL":     get("STAFF_EMAIL", "clinic", "staff_email", ""),
+        # Headless booking service (empty → the Streamlit app runs it in-process)
+        "BOOKING_API_URL": get("BOOKING_API_URL", "api", "url", ""),
+        "SESSION_TTL_S":   int(get("SESSION_TTL_S", "api", "session_ttl_s", "86400") or 86400),
+        # Doctor calendar feeds (ics_feeds.py); empty → feeds are off
+        "ICS_FEED_SECRET": get("ICS_FEED_SECRET", "api", "feed_secret", ""),
+        # LLM gateway policy (per-call deadline, retries, hedging)
+        "LLM_DEADLINE_S":  float(get("LLM_DEADLINE_S", "llm", "deadline_s", "8") or 8),
+        "LLM_RETRIES":     int(get("LLM_RETRIES", "llm", "retries", "2") or 2),
+        "LLM_HEDGE":       str(get("LLM_HEDGE", "llm", "hedge", "false")).lower() == "true",
+        "LLM_STRUCTURED":  str(get("LLM_STRUCTURED", "llm", "structured", "off")).lower(),
+        # Record/replay fixtures (llm_cassette.py); empty → live calls only
+        "LLM_CASSETTE":         get("LLM_CASSETTE", "llm", "cassette", ""),
+        "LLM_CASSETTE_MODE":    str(get("LLM_CASSETTE_MODE", "llm", "cassette_mode", "replay")).lower(),
+        "LLM_CASSETTE_LATENCY": str(get("LLM_CASSETTE_LATENCY", "llm", "cassette_latency", "recorded")).lower(),
+        # Client-side quota (requests/sec), shared by every session in this process
+        "LLM_UPSTREAM_RPS": float(get("LLM_UPSTREAM_RPS", "llm", "upstream_rps", "8") or 8),
+        "LLM_CHAT_RPS":     float(get("LLM_CHAT_RPS", "llm", "chat_rps", "6") or 6),
+        "LLM_SUMMARY_RPS":  float(get("LLM_SUMMARY_RPS", "llm", "summary_rps", "2") or 2),
+        # Email/SMTP (optional) — read straight from the [mail] section
+        "MAIL_ENABLED": str(mail.get("enabled", "false")).lower() == "true",
+        "MAIL_HOST":    mail.get("host", ""),
+        "MAIL_PORT":    int(mail.get("port", 587) or 587),
+        "MAIL_USER":    mail.get("user", ""),
+        "MAIL_PASS":    mail.get("pass", ""),
+        "MAIL_FROM":    mail.get("from_email", ""),
+        "DEBUG_EMAIL":  str(mail.get("debug", "false")).lower() == "true",
+    }
+
+# -------------------------------------------------
+# Booking state
+# -------------------------------------------------
+
+class SimpleBookingState:
+    def __init__(self):
+        self.step = 1
+        self.condition = None
+        self.doctor_id = None
+        self.doctor_name = None
+        self.specialty = None
+        self.location = None
+        self.visit_type = None
+        self.patient_name = None
+        self.contact = None
+        self.selected_day = None
+        self.selected_time = None
+        self.final_slot = None
+        self.slot_start = None        # tz-aware datetime in clinic time
+        # optional clinical/intake fields
+        self.duration = None          # e.g., "3 days"
+        self.severity = None          # "Low|Medium|High|0-5"
+        self.allergies = None         # "penicillin, peanuts"
+        self.medications = None       # "omeprazole 20mg daily"
+        self.gender = None            # "M|F|Other|N/A"
+        self.dob = None               # "YYYY-MM-DD"
+        # triage (recomputed every turn; highest score of the session is kept)
+        self.triage = None            # triage.Triage
+        self.urgent_notice = False    # earliest-slot / emergency advice shown once
+        self.waitlist_day = None      # date whose slot was taken under us (for "waitlist")
+        # intake flow flags
+        self.asked_optional = False
+        self.optional_declined = False
+        # validation flag
+        self.invalid_contact_notice = False
+        # user meta
+        self.existing_user = False    # verified against a profile (contact + name + DOB)
+        self.prefilled = []           # intake fields taken from that profile
+        self.profile_check = None     # contact|name|dob the profile lookup last ran for
+        self.last_booking_id = None
+
+    def is_complete(self):
+        # Require core scheduling + identity fields only.
+        return all([
+            self.doctor_id,
+            self.doctor_name,
+            self.specialty,
+            self.location,
+            self.visit_type,
+            self.patient_name,
+            self.contact,
+            self.selected_day,
+            self.selected_time,
+        ])
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-safe snapshot (server-side sessions, API responses)."""
+        d = dict(vars(self))
+        d["slot_start"] = self.slot_start.isoformat() if self.slot_start else None
+        d["waitlist_day"] = self.waitlist_day.isoformat() if self.waitlist_day else None
+        d["triage"] = asdict(self.triage) if self.triage is not None else None
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Optional[Mapping[str, Any]]) -> "SimpleBookingState":
+        state = cls()
+        for k, v in (d or {}).items():
+            if hasattr(state, k):
+                setattr(state, k, v)
+        if isinstance(state.slot_start, str):
+            state.slot_start = datetime.fromisoformat(state.slot_start)
+        if isinstance(state.waitlist_day, str):
+            state.waitlist_day = date.fromisoformat(state.waitlist_day)
+        if isinstance(state.triage, Mapping):
+            t = dict(state.triage)
+            state.triage = Triage(**{**t, "reasons": tuple(t.get("reasons") or ())})
+        return state
+
+# -------------------------------------------------
+# Doctor directory
+# -------------------------------------------------
+
+def parse_schedule_days(schedule_string):
+    if not schedule_string:
+        return ["Monday","Tuesday","Wednesday","Thursday","Friday"]
+    s = schedule_string.lower()
+    days = []
+    if "m-f" in s or "mon-fri" in s:
+        days = ["Monday","Tuesday","Wednesday","Thursday","Friday"]
+    elif "m-s" in s or "mon-sat" in s:
+        days = ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday"]
+    else:
+        if "mon" in s: days.append("Monday")
+        if "tue" in s: days.append("Tuesday")
+        if "wed" in s: days.append("Wednesday")
+        if "thu" in s: days.append("Thursday")
+        if "fri" in s: days.append("Friday")
+        if "sat" in s: days.append("Saturday")
+        if "sun" in s: days.append("Sunday")
+        if not days:
+            days = ["Monday","Tuesday","Wednesday","Thursday","Friday"]
+    return days
+
+def parse_schedule_hours(schedule_string):
+    if not schedule_string:
+        return "10:00 AM - 6:00 PM"
+    m = re.search(r'(\d+)\.?(\d*)\s*(am|pm)\s*-\s*(\d+)\.?(\d*)\s*(am|pm)', schedule_string.lower())
+    if m:
+        h1 = int(m.group(1)); m1 = m.group(2) or "00"; p1 = m.group(3).upper()
+        h2 = int(m.group(4)); m2 = m.group(5) or "00"; p2 = m.group(6).upper()
+        return f"{h1}:{m1} {p1} - {h2}:{m2} {p2}"
+    return "10:00 AM - 6:00 PM"
+
+def map_specialization_to_category(specialization):
+    s = (specialization or "").lower()
+    if 'cardiology' in s or 'cardiac' in s: return 'cardiology'
+    if 'dermatology' in s or 'skin' in s:   return 'dermatology'
+    if 'orthopedic' in s or 'ortho' in s or 'bone' in s: return 'orthopedics'
+    return 'internal'
+
+def get_fallback_doctors():
+    doctors_dict = {
+        "cardiology":  {"id":"d001","name":"Dr. Maya Patel","specialty":"Cardiology","location":"Downtown Clinic","schedule":"M-F 9:00am - 5:00pm","available_days":["Monday","Tuesday","Wednesday","Thursday","Friday"],"working_hours":"9:00 AM - 5:00 PM"},
+        "dermatology": {"id":"d002","name":"Dr. Alex Nguyen","specialty":"Dermatology","location":"Uptown Medical Center","schedule":"M-F 10:00am - 4:00pm","available_days":["Monday","Tuesday","Wednesday","Thursday","Friday"],"working_hours":"10:00 AM - 4:00 PM"},
+        "orthopedics": {"id":"d003","name":"Dr. Sara Haddad","specialty":"Orthopedics","location":"City Ortho Hub","schedule":"M-F 8:00am - 6:00pm","available_days":["Monday","Tuesday","Wednesday","Thursday","Friday"],"working_hours":"8:00 AM - 6:00 PM"},
+        "internal":    {"id":"d004","name":"Dr. Priya Sharma","specialty":"Internal Medicine","location":"Riverside Family Practice","schedule":"M-F 9:00am - 5:00pm","available_days":["Monday","Tuesday","Wednesday","Thursday","Friday"],"working_hours":"9:00 AM - 5:00 PM"},
+    }
+    specialization_map = {
+        "cardiology":"cardiology","dermatology":"dermatology","orthopedics":"orthopedics","internal medicine":"internal"
+    }
+    return doctors_dict, specialization_map
+
+def doctors_from_docs(docs):
+    """(DOCTORS, SPECIALIZATION_MAP) from db.doctor documents; fallback directory when empty."""
+    doctors_dict = {}
+    specialization_map = {}
+    for doc in docs or []:
+        doctor_id = doc.get('doctor_id')
+        name = (doc.get('name') or '').strip()
+        specialization = (doc.get('specialization') or '').strip()
+        weekly_schedule = doc.get('weekly_schedule', '')
+        if not doctor_id or not name:
+            continue
+        if not name.lower().startswith('dr'):
+            name = f"Dr. {name}"
+        cat = map_specialization_to_category(specialization)
+        doctors_dict[cat] = {
+            "id": doctor_id,
+            "name": name,
+            "specialty": specialization or cat.title(),
+            "location": f"{(specialization or cat.title())} Department",
+            "schedule": weekly_schedule,
+            "available_days": parse_schedule_days(weekly_schedule),
+            "working_hours": parse_schedule_hours(weekly_schedule),
+        }
+        if specialization:
+            specialization_map[specialization.lower()] = cat
+    if not doctors_dict:
+        return get_fallback_doctors()
+    if not specialization_map:
+        return doctors_dict, get_fallback_doctors()[1]
+    return doctors_dict, specialization_map
+
+def directory_version(doctors) -> str:
+    """Content hash of the directory (keys prebuilt UI fragments, ETags)."""
+    return hashlib.sha1(json.dumps(doctors, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+def doctor_for_state(state, doctors):
+    return next((v for v in doctors.values() if v["id"] == state.doctor_id), doctors["internal"])
+
+def match_condition_to_doctor(condition_text, DOCTORS):
+    """Embedding router first (lay phrasing), CONDITIONS keywords when it isn't confident."""
+    specialty = get_router().route(condition_text or "").category
+    if specialty in DOCTORS:
+        return DOCTORS[specialty]
+    return DOCTORS["internal"]
+
+def infer_condition(text: str):
+    tl = (text or "").lower()
+    for condition in CONDITIONS.keys():
+        if condition in tl:
+            return condition
+    return None
+
+_INTL_PHONE_RE = re.compile(r'\+\d[\d\s().-]{6,}\d')
+
+def validate_contact(contact_text):
+    email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b', contact_text or "")
+    if email_match: return email_match.group()
+    digits = re.sub(r'\D', '', contact_text or "")
+    if len(digits) < 10: return None
+    # national numbers stay bare digits (stored bookings match on them); an
+    # international one keeps its "+" so canonical_phone can key it
+    phone_match = _INTL_PHONE_RE.search(contact_text or "")
+    if phone_match and not canonical_phone(digits):
+        return canonical_phone(phone_match.group()) or digits
+    return digits
+
+# -------------------------------------------------
+# Users (pure part of the profile upsert)
+# -------------------------------------------------
+
+def _booking_dob(booking: dict):
+    return (booking.get("medical") or {}).get("dob") or booking.get("dob")
+
+def user_filter(booking: dict, legacy: bool = False) -> dict:
+    """Indexed identity_keys lookup (contact, else name + DOB); see identity.lookup_filter."""
+    return lookup_filter(booking.get("contact"), booking.get("patient_name"), _booking_dob(booking), legacy=legacy)
+
+def next_user_id(user_count: int) -> str:
+    return f"u{user_count + 1:03d}"
+
+def new_user_doc(booking: dict, appt_date_dt: datetime, user_id: str) -> dict:
+    email, mobile = normalize_contact(booking.get("contact", ""))
+    med = booking.get("medical", {}) or {}
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "user_id": user_id,
+        "name": booking.get("patient_name", ""),
+        "mobile": mobile or None,
+        "email": email or None,
+        "dob": clean(med.get("dob") or booking.get("dob")),
+        "gender": clean(med.get("gender") or booking.get("gender")),
+        "height": None,
+        "weight": None,
+        "blood_group": None,
+        "emergency_contact": None,
+        "diet_preferance": None,
+        **user_identity_fields({"name": booking.get("patient_name"), "email": email, "mobile": mobile,
+                                "dob": _booking_dob(booking)}),
+        "last_appointment": appt_date_dt.strftime("%m-%d-%Y"),
+        "total_appointments": 1,
+        "symptoms": booking.get("condition", "unspecified"),
+        "medical": {
+            "allergies": clean(med.get("allergies")),
+            "chronic_conditions": None,
+            "medications": clean(med.get("medications")),
+            "history": None,
+        },
+    }
+
+def user_update(booking: dict, appt_date_dt: datetime, existing: dict) -> dict:
+    """$set/$inc(/$unset) for a returning patient; v1 profiles are upgraded on write."""
+    email, mobile = normalize_contact(booking.get("contact", ""))
+    med = booking.get("medical", {}) or {}
+    allergies, medications = clean(med.get("allergies")), clean(med.get("medications"))
+    gender = clean(med.get("gender") or booking.get("gender"))
+    dob = clean(med.get("dob") or booking.get("dob"))
+
+    update_set, update_unset = ({}, {}) if existing.get("schema_version") == SCHEMA_VERSION else user_migration_update(existing)
+    update_set.update({
+        "name": booking.get("patient_name", "") or existing.get("name", ""),
+        "email": email or clean(existing.get("email")),
+        "mobile": mobile or clean(existing.get("mobile")),
+        "last_appointment": appt_date_dt.strftime("%m-%d-%Y"),
+        "symptoms": booking.get("condition", "unspecified") or existing.get("symptoms", ""),
+    })
+    if dob:        update_set["dob"] = dob
+    if gender:     update_set["gender"] = gender
+    if "medical" in update_set:
+        if allergies:   update_set["medical"]["allergies"] = allergies
+        if medications: update_set["medical"]["medications"] = medications
+    else:
+        if allergies:   update_set["medical.allergies"] = allergies
+        if medications: update_set["medical.medications"] = medications
+
+    # keys accumulate: a patient known by email who now books by phone keeps both
+    keys = user_identity_fields({"name": update_set["name"], "email": update_set["email"],
+                                 "mobile": update_set["mobile"], "dob": dob or existing.get("dob")})
+    update_set["name_keys"] = keys["name_keys"]
+    update = {"$set": update_set, "$inc": {"total_appointments": 1},
+              "$addToSet": {"identity_keys": {"$each": keys["identity_keys"]}}}
+    if update_unset:
+        update["$unset"] = update_unset
+    return update
+
+PREFILL_LABELS = {"gender": "gender", "allergies": "allergies", "medications": "medications"}
+
+def profile_matches(state, profile: Optional[dict]) -> bool:
+    """The contact alone proves nothing: the name this session gave must match the
+    profile's, and the date of birth must be the same date."""
+    if not (profile and state.patient_name and state.dob):
+        return False
+    if name_similarity(state.patient_name, profile.get("name")) < MIN_CANDIDATE_SCORE:
+        return False
+    given, known = normalize_dob(state.dob), normalize_dob(profile.get("dob"))
+    return bool(given and given == known)
+
+def prefill_from_profile(state, profile: dict) -> List[str]:
+    """Verified returning patient (profile_matches): fill the intake fields their profile
+    already knows, never over what was said this session. Returns the fields filled."""
+    med = profile.get("medical") or {}
+    known = {
+        "gender": profile.get("gender"),
+        "allergies": med.get("allergies") or profile.get("allergies"),       # v1 kept these top-level
+        "medications": med.get("medications") or profile.get("medications"),
+    }
+    filled = []
+    for k, v in known.items():
+        v = clean(v)
+        if v and not getattr(state, k):
+            setattr(state, k, v)
+            filled.append(k)
+    state.prefilled = filled
+    state.existing_user = True
+    if state.allergies and state.medications:
+        state.asked_optional = True   # nothing left to ask; the patient can still correct them
+    return filled
+
+def undo_prefill(state) -> None:
+    """Name / DOB / contact no longer match the profile: take its fields back out."""
+    for k in state.prefilled:
+        setattr(state, k, None)
+    if {"allergies", "medications"} & set(state.prefilled):
+        state.asked_optional = False
+    state.prefilled = []
+    state.existing_user = False
+
+
+def returning_patient_note(filled: List[str]) -> str:
+    if not filled:
+        return ""
+    labels = [PREFILL_LABELS[k] for k in filled]
+    listed = labels[0] if len(labels) == 1 else ", ".join(labels[:-1]) + " and " + labels[-1]
+    return f"Welcome back! I've filled in your {listed} from your last visit — just tell me if anything has changed."
+
+DOB_TO_VERIFY_NOTE = "Have you booked with us before? Share your date of birth (YYYY-MM-DD) and I'll reuse the details from your last visit."
+
+# -------------------------------------------------
+# Model-driven flow (JSON only)
+# -------------------------------------------------
+AI_SYSTEM = """
+You are MedBird, a courteous medical appointment booking assistant.
+You must return ONLY JSON, no extra text, using this exact schema:
+{
+  "say": "STRING (<=2 sentences) — what to show the user next",
+  "set": {
+    "condition": "STRING",
+    "visit_type": "in-person|telehealth",
+    "patient_name": "STRING",
+    "contact": "STRING",
+    "selected_day": "Monday|Tuesday|...",
+    "selected_time": "e.g., 10:00 AM",
+
+    "duration": "e.g., 3 days",
+    "severity": "Low|Medium|High|0-5",
+    "allergies": "comma list",
+    "medications": "free text",
+    "gender": "M|F|Other|N/A",
+    "dob": "YYYY-MM-DD"
+  },
+  "done": false
+}
+
+Rules:
+- If the user asks a QUESTION (e.g., “what is telehealth?”), answer briefly in “say” and DO NOT set visit_type unless they explicitly choose it.
+- If the user explicitly says "telehealth" (or synonyms: virtual, video visit, online), set visit_type=telehealth and DO NOT switch to in-person unless they later ask to change it. Likewise, if they say "in-person" (or "in person"), set visit_type=in-person and do not switch away unless requested.
+- Convert vague times like “tomorrow morning” into a concrete weekday and a time that is inside the provided working hours.
+- Never invent unavailable days/hours. Stay within the provided availability.
+- Keep “say” helpful, friendly, and short. If more info is needed, end “say” with exactly one clear question.
+- Ask OPTIONAL clinical intake (duration, severity, allergies, medications) **at most once**. If the user declines or says “nothing else,” **do not ask again**.
+- Map numeric severity 0–1→Low, 2–3→Medium, 4–5→High.
+- If state.triage.urgency is "High", offer state.triage.earliest_slot first; only use a later time if the patient insists.
+- **Do not book or mark done until BOTH patient name and contact are captured.**
+- If state.existing_user is true, the gender, allergies and medications already in state come from the patient's profile: do not ask for them again (the patient may still correct them).
+- **When patient_name, contact, visit_type, selected_day and selected_time are all set, and you have NOT asked clinical intake yet, your NEXT `say` MUST (in one short sentence) ask for allergies and current medications (optional), then ask for confirmation to book.**
+- **If the user declines the optional clinical intake and all core details are present, set `done=true` and confirm the booking.**
+- **After explicit user confirmation (e.g., “yes/confirm/book it”), set done=true and do NOT ask for other times or additional preferences.**
+- Only set "done": true when ALL scheduling details are set and the user has explicitly confirmed to book (or when the user declines optional intake after core details are present).
+"""
+
+GREETING = "👋 Hello! I’m MedBird. What symptoms are you experiencing today?"
+
+CONFIRM_RE = re.compile(r"\b(yes|yep|yeah|confirm|confirmed|book it|go ahead|that works|sounds good|looks good|ok|okay|that's correct|correct)\b", re.I)
+DECLINE_OPT_RE = re.compile(r"\b(no|nope|none|nothing else|that's it|that is all|no other)\b", re.I)
+_OPTIONAL_ASK_RE = re.compile(r"allerg|medicat|severity|duration", re.I)
+OPTIONAL_NUDGE = "(Optional) Any allergies or current medications? If not, just say 'no'."
+
+# Bump the label when the prompt or the turn guards change on purpose; the
+# hash catches edits that forgot to (bench/bench_turns_to_booking.py reports
+# efficiency per version).
+PROMPT_LABEL = "v2"
+PROMPT_VERSION = PROMPT_LABEL + "+" + hashlib.sha1("\x00".join([
+    AI_SYSTEM, GREETING, CONFIRM_RE.pattern, DECLINE_OPT_RE.pattern, _OPTIONAL_ASK_RE.pattern, OPTIONAL_NUDGE,
+]).encode("utf-8")).hexdigest()[:8]
+
+def maybe_set_visit_type_from_text(user_text: str, state) -> None:
+    """Honor explicit user preference for visit type regardless of model drift."""
+    lt = (user_text or "").lower()
+    if any(k in lt for k in ["telehealth", "virtual", "video visit", "video call", "online appointment", "online visit"]):
+        state.visit_type = "telehealth"
+    elif any(k in lt for k in ["in-person", "in person", "clinic visit", "office visit"]):
+        state.visit_type = "in-person"
+
+def booking_context(state, doctor, cal, taken=None):
+    return {
+        "state": {
+            "condition": state.condition,
+            "visit_type": state.visit_type,
+            "patient_name": state.patient_name,
+            "contact": state.contact,
+            "selected_day": state.selected_day,
+            "selected_time": state.selected_time,
+            # optional (for awareness)
+            "duration": state.duration,
+            "severity": state.severity,
+            "allergies": state.allergies,
+            "medications": state.medications,
+            "gender": state.gender,
+            "dob": state.dob,
+            "triage": triage_context(state, doctor, cal, taken),
+            "asked_optional": state.asked_optional,
+            "optional_declined": state.optional_declined,
+            "existing_user": state.existing_user,
+        },
+        "doctor": {
+            "id": doctor.get("id"),
+            "name": doctor.get("name"),
+            "specialty": doctor.get("specialty"),
+            "available_days": doctor.get("available_days"),
+            "working_hours": doctor.get("working_hours"),
+            "location": doctor.get("location"),
+        }
+    }
+
+def assign_doctor(user_text, state, doctors) -> None:
+    """If no doctor chosen yet, map from user input or current condition."""
+    if state.doctor_id is not None:
+        return
+    if state.condition is None:
+        ic = infer_condition(user_text)
+        if ic: state.condition = ic
+    doc = match_condition_to_doctor(user_text or state.condition or "", doctors)
+    state.doctor_id = doc["id"]; state.doctor_name = doc["name"]
+    state.specialty = doc["specialty"]; state.location = doc["location"]
+
+def model_messages(user_text, state, doctors, cal, taken=None):
+    assign_doctor(user_text, state, doctors)
+    doc_info = doctor_for_state(state, doctors)
+    availability = {"available_days": doc_info["available_days"], "working_hours": doc_info["working_hours"]}
+    ctx = booking_context(state, doc_info, cal, taken)
+    return [
+        {"role": "system", "content": AI_SYSTEM + "\n\nAvailability:\n" + json.dumps(availability)},
+        {"role": "user", "content": f"Context: {json.dumps(ctx)}"},
+        {"role": "user", "content": user_text},
+    ]
+
+def apply_updates(state, updates: dict, cal):
+    if not updates:
+        return
+    # core fields
+    for k in ["condition","visit_type","patient_name","contact","selected_day","selected_time"]:
+        if k in updates and updates[k]:
+            if k == "contact":
+                vc = validate_contact(updates[k])
+                if not vc:
+                    state.invalid_contact_notice = True
+                    continue
+                setattr(state, k, vc)
+            else:
+                setattr(state, k, updates[k])
+    # optional intake fields
+    for k in ["duration","severity","allergies","medications","gender","dob"]:
+        if k in updates and updates[k]:
+            setattr(state, k, updates[k])
+    # compute final slot if we have day+time
+    if state.selected_day and state.selected_time:
+        resolve_slot(state, cal)
+
+def update_triage(state, user_text: str):
+    """Re-score with everything known so far; never downgrade within a session."""
+    t = score_triage(" ".join(filter(None, [state.condition, user_text])), state.severity, state.duration)
+    if state.triage is None or t.score >= state.triage.score:
+        state.triage = t
+    return state.triage
+
+def slot_problem(doctor, day, time_str, cal):
+    """Why the doctor can't be booked at (day, time), or None; see ClinicCalendar.slot_problem."""
+    return cal.slot_problem(doctor.get("available_days") or [], doctor.get("working_hours"), day, time_str)
+
+def earliest_slot(doctor, cal, taken=None):
+    """First open slot; `taken` is the doctor's claimed slot starts (waitlist.claimed_slots)."""
+    return cal.earliest_slot(doctor.get("available_days") or [], doctor.get("working_hours"), taken)
+
+def triage_context(state, doctor, cal, taken=None):
+    if state.triage is None:
+        return None
+    ctx = {"urgency": state.triage.urgency}
+    if state.triage.is_high:
+        early = earliest_slot(doctor, cal, taken)
+        if early:
+            ctx["earliest_slot"] = {"selected_day": early[0], "selected_time": early[1]}
+    return ctx
+
+def triage_record(state):
+    """appointment["triage"]: patient's severity label + local score/urgency/flag."""
+    sev = severity_label(state.severity)
+    if state.triage is None:
+        return {"severity": sev}
+    return state.triage.to_dict(sev)
+
+def resolve_slot(state, cal):
+    """Pin selected_day/selected_time to a concrete clinic-local datetime."""
+    state.slot_start = cal.slot_start(state.selected_day, state.selected_time)
+    state.final_slot = cal.slot_label(state.selected_day, state.selected_time) or f"{state.selected_day} at {state.selected_time}"
+
+def fallback_turn(state):
+    """Deterministic next prompt used when the model is missing or degraded."""
+    missing = []
+    if not state.patient_name: missing.append("your full name")
+    if not state.contact: missing.append("your email or 10-digit phone")
+    if not state.visit_type: missing.append("in-person or telehealth")
+    if not state.selected_day or not state.selected_time: missing.append("a preferred day and time")
+    if missing:
+        return {"say": "Thanks! Please share " + ", ".join(missing) + ".", "set": {}, "done": False}
+    # gentle optional ask once
+    if (not state.asked_optional) and (not state.optional_declined):
+        return {"say": "(Optional) Any allergies or current medications? If not, say 'no'.", "set": {}, "done": False}
+    return {"say": "Say 'confirm' to finalize your booking.", "set": {}, "done": False}
+
+def after_model(user_text, state, result, doctors, cal, taken=None) -> Tuple[str, bool]:
+    """Apply the model's turn plus the local guards; returns (reply, finalize)."""
+    apply_updates(state, result.get("set"), cal)
+
+    # Re-assert user preference if the model tried to flip it
+    maybe_set_visit_type_from_text(user_text, state)
+
+    # Local triage: urgent complaints get the earliest opening (and staff are flagged on save)
+    triage = update_triage(state, user_text)
+    early = earliest_slot(doctor_for_state(state, doctors), cal, taken) if triage.is_high else None
+    if early and re.search(r"\bearliest\b", user_text or "", re.I):
+        state.selected_day, state.selected_time = early
+        resolve_slot(state, cal)
+
+    # Never keep a slot the doctor doesn't have (model drift, typed times like 5:15)
+    problem = None
+    if state.selected_day and state.selected_time:
+        doc_info = doctor_for_state(state, doctors)
+        problem = slot_problem(doc_info, state.selected_day, state.selected_time, cal)
+        if problem:
+            if str(state.selected_day).capitalize() not in (doc_info.get("available_days") or []):
+                state.selected_day = None
+            state.selected_time = state.final_slot = state.slot_start = None
+
+    # If user declines optional after we asked once, remember it
+    auto_finalize = False
+    if state.asked_optional and DECLINE_OPT_RE.search(user_text or ""):
+        state.optional_declined = True
+        auto_finalize = state.is_complete()
+
+    to_say = result.get("say") or "OK."
+    if problem:   # whatever the model said assumed the slot
+        to_say = f"⚠️ That time doesn't work: {problem}. Which {'time' if state.selected_day else 'day and time'} would you like instead?"
+
+    if triage.is_high and not state.urgent_notice:
+        state.urgent_notice = True
+        note = "⚠️ " + EMERGENCY_ADVISORY
+        if early and (state.selected_day, state.selected_time) != early:
+            note += f" The earliest opening with {state.doctor_name} is {cal.slot_label(*early)} — reply 'earliest' to take it."
+        to_say = note + "\n\n" + to_say
+
+    # Contact validity notice
+    if state.invalid_contact_notice:
+        to_say += "\n\n⚠️ That contact info doesn’t look valid—please double-check your email or enter a 10-digit phone number."
+        state.invalid_contact_notice = False
+
+    # Detect if the model is asking optional intake now
+    if not state.asked_optional and _OPTIONAL_ASK_RE.search(to_say):
+        state.asked_optional = True
+
+    # If optional was declined, strip any repeated ask
+    if state.optional_declined and _OPTIONAL_ASK_RE.search(to_say):
+        to_say = "You're all set."
+
+    # Decide if we should finalize regardless of model's 'done'
+    done = bool(result.get("done"))
+    if (not done) and state.is_complete() and CONFIRM_RE.search(user_text or ""):
+        done = True
+
+    # Gentle one-time optional-intake nudge when core fields are present
+    if (not done) and (not state.asked_optional) and (not state.optional_declined):
+        core_ok = all([
+            state.patient_name, state.contact, state.visit_type,
+            state.selected_day, state.selected_time
+        ])
+        if core_ok and not _OPTIONAL_ASK_RE.search(to_say):
+            to_say += "\n\n" + OPTIONAL_NUDGE
+            state.asked_optional = True
+
+    finalize = (auto_finalize or done) and state.is_complete()
+    if finalize and (not state.final_slot or not state.slot_start) and state.selected_day and state.selected_time:
+        resolve_slot(state, cal)
+    return to_say, finalize
+
+def booking_from_state(state) -> dict:
+    return {
+        "patient_name": state.patient_name,
+        "contact": state.contact,
+        "condition": state.condition or "unspecified",
+        "doctor_id": state.doctor_id,
+        "doctor_name": state.doctor_name,
+        "specialty": state.specialty,
+        "location": state.location,
+        "visit_type": state.visit_type,
+        "appointment_slot": state.final_slot,
+        "slot_start": state.slot_start,
+        "selected_day": state.selected_day,
+        "selected_time": state.selected_time,
+        # optional intake -> saved into appointment; Agent 2 can use them
+        "duration": state.duration,
+        "triage": triage_record(state),
+        "medical": {
+            "allergies": state.allergies,
+            "medications": state.medications,
+            "gender": state.gender,
+            "dob": state.dob,
+        },
+    }
+
+def new_booking_id(doctor_id: str) -> str:
+    return f"apt_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{doctor_id}"
+
+# -------------------------------------------------
+# Replies
+# -------------------------------------------------
+
+def slot_taken_reply(state, cal) -> str:
+    """The slot went to someone else between choosing and confirming: clear the time, keep the rest."""
+    taken = state.final_slot
+    state.waitlist_day = cal.to_local(state.slot_start).date() if state.slot_start else None
+    state.selected_time = state.final_slot = state.slot_start = None
+    return (f"Sorry, {taken} was just booked by someone else. Please pick another time, "
+            f"or say 'waitlist' to be offered the next opening with {state.doctor_name} that day.")
+
+def confirmation_text(state, booking: dict, saved: bool, email_note: str) -> str:
+    confirm = f"Perfect! Your {state.visit_type} appointment with {state.doctor_name} is confirmed for {state.final_slot}. You'll receive a confirmation at {state.contact}.{email_note}"
+    if saved:
+        confirm += f" Your booking ID is {booking['booking_id']} — use it to cancel or reschedule."
+    else:
+        confirm += " (Note: failed to save to DB; please screenshot this confirmation.)"
+    return confirm
+
+def patient_email(booking: dict) -> Tuple[str, str]:
+    """(subject, body) of the booking confirmation."""
+    subject = f"Your MedBird appointment with {booking.get('doctor_name')} is confirmed"
+    slot = booking.get("appointment_slot") or f"{booking.get('selected_day')} at {booking.get('selected_time')}"
+    patient = booking.get("patient_name") or "Patient"
+    visit = booking.get("visit_type") or "appointment"
+    dept  = booking.get("location") or "Clinic"
+
+    summary_lines = []
+    if booking.get("condition"): summary_lines.append(f"Reason: {booking['condition']}")
+    med = booking.get("medical") or {}
+    if med.get("allergies"):   summary_lines.append(f"Allergies: {med['allergies']}")
+    if med.get("medications"): summary_lines.append(f"Medications: {med['medications']}")
+    summary = "\n".join(summary_lines) if summary_lines else "(No clinical details provided)"
+    booking_id = booking.get("booking_id") or "your booking ID"
+
+    body = f"""Hi {patient},
+
+Your {visit} with {booking.get('doctor_name')} is confirmed.
+
+When: {slot}
+Where: {dept}
+
+Details:
+{summary}
+
+Booking ID: {booking_id}
+Need a change? Message the MedBird assistant with your booking ID and
+the email or phone you booked with:
+  cancel {booking_id} {booking.get('contact') or 'you@example.com'}
+  reschedule {booking_id} to Tuesday 10:00 AM {booking.get('contact') or 'you@example.com'}
+
+— MedBird"""
+    return subject, body
+
+def staff_urgent_email(booking: dict) -> Tuple[str, str]:
+    """(subject, body) of the front-desk heads-up for high-urgency bookings."""
+    tri = booking.get("triage") or {}
+    subject = f"[URGENT] {booking.get('patient_name')} – {booking.get('appointment_slot')}"
+    body = f"""Urgency: {tri.get('urgency')} (score {tri.get('score')}/10)
+Flag: {tri.get('flag')}
+
+Patient: {booking.get('patient_name')} ({booking.get('contact')})
+Reason: {booking.get('condition')}
+Severity: {tri.get('severity') or 'N/A'}   Duration: {booking.get('duration') or 'N/A'}
+Doctor: {booking.get('doctor_name')} – {booking.get('visit_type')}
+When: {booking.get('appointment_slot')}
+
+— MedBird triage"""
+    return subject, body
+
+# -------------------------------------------------
+# Cancel / reschedule / waitlist (chat commands)
+# -------------------------------------------------
+_BOOKING_ID_RE = re.compile(r"\bapt_\w+", re.I)
+_OFFER_RE = re.compile(r"\baccept\s+(wl_[0-9a-f]{8})\b", re.I)
+_WAITLIST_RE = re.compile(r"\bwait\s*-?\s*list\b", re.I)
+_WEEKDAY_RE = re.compile(r"\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b", re.I)
+_TIME_IN_TEXT_RE = re.compile(r"\b(\d{1,2}(?::\d{2})?\s*[ap]\.?m\.?)", re.I)
+
+
+@dataclass(frozen=True)
+class ManageCommand:
+    kind: str                         # accept | waitlist | cancel | reschedule
+    contact: Optional[str] = None     # contact found in the message (else the session's)
+    offer_id: Optional[str] = None
+    booking_id: Optional[str] = None
+    day: Optional[str] = None         # reschedule target, e.g. "Tuesday"
+    time: Optional[str] = None        # "10:00 AM"
+
+
+def parse_manage_command(user_text: str) -> Optional[ManageCommand]:
+    """Cancel / reschedule / waitlist / accept-offer turns skip the model; None for anything else."""
+    text = user_text or ""
+    m_offer, m_id = _OFFER_RE.search(text), _BOOKING_ID_RE.search(text)
+    wants_waitlist = bool(_WAITLIST_RE.search(text))
+    wants_change = bool(m_id and re.search(r"\b(cancel|reschedule|move|change)\b", text, re.I))
+    if not (m_offer or wants_waitlist or wants_change):
+        return None
+    # booking IDs, offer codes and times carry digits that would run into a phone number
+    contact = validate_contact(_TIME_IN_TEXT_RE.sub(" ", _BOOKING_ID_RE.sub(" ", _OFFER_RE.sub(" ", text))))
+    if m_offer:
+        return ManageCommand("accept", contact, offer_id=m_offer.group(1).lower())
+    if wants_waitlist:
+        return ManageCommand("waitlist", contact)
+    if re.search(r"\bcancel\b", text, re.I):
+        return ManageCommand("cancel", contact, booking_id=m_id.group(0))
+    day_m, time_m = _WEEKDAY_RE.search(text), _TIME_IN_TEXT_RE.search(text)
+    t = parse_time(time_m.group(1)) if time_m else None
+    return ManageCommand("reschedule", contact, booking_id=m_id.group(0),
+                         day=day_m.group(1).capitalize() if day_m else None,
+                         time=t.strftime("%I:%M %p").lstrip("0") if t else None)
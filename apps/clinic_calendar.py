@@ -0,0 +1,274 @@
+# clinic_calendar.py — one place for "which date is Monday?" in clinic time
+# ----------------------------------------------------------------------
+# Shared by medbird_chatbot.py (booking) and summary_generator.py (handoff).
+#
+#   cal = get_calendar("America/New_York", holidays=["2025-12-25"])
+#   cal.next_date("Monday")              -> date (next occurrence, skips holidays)
+#   cal.slot_date("Monday", "3:00 PM")   -> today if it is Monday and 3 PM is still ahead, else next_date
+#   cal.slot_start("Monday", "10:00 AM") -> tz-aware datetime in clinic time (via slot_date)
+#   cal.human(dt)                        -> "11 Aug 2025, 3:30 PM (EDT)"
+#   cal.earliest_slot(days, "9:00 AM - 5:00 PM", taken) -> ("Monday", "9:30 AM")
+#   cal.slot_problem(days, "9:00 AM - 5:00 PM", "Monday", "5:15 PM") -> "..." or None
+#
+# Appointments start every SLOT_MINUTES inside a doctor's working hours.
+# A weekday name on its own means the next such day. With a time it can also
+# mean later today, if that slot is at least SAME_DAY_LEAD_MINUTES away.
+# earliest_slot offers today's remaining slots first.
+#
+# The weekday → date table is computed once per clinic-local day and
+# rebuilt lazily on the first lookup after local midnight.
+# ----------------------------------------------------------------------
+
+import calendar
+import re
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Container, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    from zoneinfo import ZoneInfo
+except Exception:
+    ZoneInfo = None  # type: ignore
+
+DAY_NAMES = list(calendar.day_name)
+SLOT_MINUTES = 30
+SAME_DAY_LEAD_MINUTES = 30
+_TIME_RE = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*([ap])\.?\s*m?\.?\s*$", re.I)
+_TIME_24_RE = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*$")
+
+
+@lru_cache(maxsize=16)
+def _zone(tz_name: str):
+    if ZoneInfo is None or not tz_name:
+        return None
+    try:
+        return ZoneInfo(tz_name)
+    except Exception:
+        return None
+
+
+def _parse_holidays(holidays: Union[str, Iterable, None]) -> frozenset:
+    if not holidays:
+        return frozenset()
+    if isinstance(holidays, str):
+        holidays = [h for h in re.split(r"[,\s]+", holidays) if h]
+    out = set()
+    for h in holidays:
+        if isinstance(h, datetime):
+            out.add(h.date())
+        elif isinstance(h, date):
+            out.add(h)
+        else:
+            try:
+                out.add(date.fromisoformat(str(h).strip()))
+            except ValueError:
+                continue
+    return frozenset(out)
+
+
+def parse_time(value: Optional[str]) -> Optional[time]:
+    """'10:00 AM', '10am', '3.30 pm', '14:30' -> time; None if unparseable."""
+    if not value:
+        return None
+    s = re.sub(r"^(\s*\d{1,2})\.(\d{2})", r"\1:\2", str(value))   # "3.30 pm"
+    m = _TIME_RE.match(s)
+    if m:
+        h, mi = int(m.group(1)), int(m.group(2) or 0)
+        if not (1 <= h <= 12 and 0 <= mi < 60):
+            return None
+        h = h % 12 + (12 if m.group(3).lower() == "p" else 0)
+        return time(h, mi)
+    m = _TIME_24_RE.match(s)
+    if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+        return time(int(m.group(1)), int(m.group(2)))
+    return None
+
+
+def format_time(t: time) -> str:
+    return t.strftime("%I:%M %p").lstrip("0")
+
+
+def working_window(working_hours: Optional[str]) -> Tuple[time, time]:
+    """'9:00 AM - 5:00 PM' -> (09:00, 17:00); either end defaults to 9 AM / 5 PM."""
+    parts = (working_hours or "").split("-", 1)
+    start = parse_time(parts[0]) or time(9, 0)
+    end = (parse_time(parts[1]) if len(parts) > 1 else None) or time(17, 0)
+    return start, end
+
+
+def slot_times(working_hours: Optional[str], minutes: int = SLOT_MINUTES) -> List[time]:
+    """Every appointment start inside the working hours (the last one ends at closing)."""
+    start, end = working_window(working_hours)
+    out, cur = [], datetime.combine(date.min, start)
+    while (cur + timedelta(minutes=minutes)).time() <= end and cur.date() == date.min:
+        out.append(cur.time())
+        cur += timedelta(minutes=minutes)
+    return out
+
+
+class ClinicCalendar:
+    def __init__(self, tz_name: str = "America/New_York", holidays: Union[str, Iterable, None] = None):
+        self.tz_name = tz_name
+        self.tz = _zone(tz_name)
+        self.holidays = _parse_holidays(holidays)
+        self._lock = threading.Lock()
+        self._table_day: Optional[date] = None
+        self._table: Dict[str, date] = {}
+
+    # --- clock
+    def now(self) -> datetime:
+        return datetime.now(self.tz) if self.tz else datetime.now()
+
+    def today(self) -> date:
+        return self.now().date()
+
+    def is_holiday(self, d: date) -> bool:
+        return d in self.holidays
+
+    # --- weekday table
+    def _build(self, today: date) -> Dict[str, date]:
+        table = {}
+        for idx, name in enumerate(DAY_NAMES):
+            delta = (idx - today.weekday()) % 7 or 7   # same weekday means next week
+            d = today + timedelta(days=delta)
+            for _ in range(52):
+                if d not in self.holidays:
+                    break
+                d += timedelta(days=7)
+            table[name] = d
+        return table
+
+    def table(self) -> Dict[str, date]:
+        today = self.today()
+        if self._table_day != today:
+            with self._lock:
+                if self._table_day != today:
+                    self._table = self._build(today)
+                    self._table_day = today
+        return self._table
+
+    def next_date(self, day_name: Optional[str]) -> Optional[date]:
+        if not day_name:
+            return None
+        return self.table().get(str(day_name).strip().capitalize())
+
+    # --- slots
+    def _today_if_open(self, t: Optional[time]) -> Optional[date]:
+        """Today, if `t` is still at least SAME_DAY_LEAD_MINUTES ahead and the clinic is open."""
+        now = self.now()
+        today = now.date()
+        if t is None or today in self.holidays:
+            return None
+        if datetime.combine(today, t) < now.replace(tzinfo=None) + timedelta(minutes=SAME_DAY_LEAD_MINUTES):
+            return None
+        return today
+
+    def slot_date(self, day_name: Optional[str], time_str: Optional[str]) -> Optional[date]:
+        """The date a (day, time) pair books: later today when day_name is today's weekday
+        and the time is still ahead, otherwise next_date(day_name)."""
+        name = str(day_name or "").strip().capitalize()
+        if name and name == DAY_NAMES[self.today().weekday()]:
+            today = self._today_if_open(parse_time(time_str))
+            if today is not None:
+                return today
+        return self.next_date(name)
+
+    def slot_start(self, day_name: Optional[str], time_str: Optional[str]) -> Optional[datetime]:
+        d = self.slot_date(day_name, time_str)
+        t = parse_time(time_str)
+        if d is None or t is None:
+            return None
+        local = datetime.combine(d, t)
+        return local.replace(tzinfo=self.tz) if self.tz else local
+
+    def to_local(self, value: Union[str, datetime, None]) -> Optional[datetime]:
+        """ISO string or datetime → clinic-local datetime. Naive values (as
+        returned by pymongo) are taken to be UTC."""
+        if value is None or value == "":
+            return None
+        if isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+            except ValueError:
+                return None
+        if not isinstance(value, datetime):
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(self.tz) if self.tz else value
+
+    def utc(self, local: datetime) -> datetime:
+        """Clinic-local (naive or aware) → naive UTC, the Mongo storage form."""
+        if local.tzinfo is None and self.tz is not None:
+            local = local.replace(tzinfo=self.tz)
+        if local.tzinfo is not None:
+            local = local.astimezone(timezone.utc).replace(tzinfo=None)
+        return local
+
+    def human(self, value: Union[str, datetime, None]) -> Optional[str]:
+        local = self.to_local(value)
+        if local is None:
+            return None
+        return local.strftime("%d %b %Y, %I:%M %p (%Z)").replace(", 0", ", ")
+
+    def slot_label(self, day_name: Optional[str], time_str: Optional[str]) -> Optional[str]:
+        """Chat-facing label, e.g. 'Monday, August 18 at 10:00 AM'."""
+        d = self.slot_date(day_name, time_str)
+        if d is None or not time_str:
+            return None
+        return f"{DAY_NAMES[d.weekday()]}, {d.strftime('%B %d')} at {time_str}"
+
+    def slot_problem(self, available_days: Iterable[str], working_hours: Optional[str],
+                     day_name: Optional[str], time_str: Optional[str]) -> Optional[str]:
+        """Why a doctor can't be booked at (day, time) — not a working day, no open date
+        (holidays), an unreadable time, outside working hours, off the slot grid — or None."""
+        days = [str(d).strip().capitalize() for d in available_days or ()]
+        name = str(day_name or "").strip().capitalize()
+        if name not in days:
+            return f"the doctor isn't available on {name or 'that day'} (available: {', '.join(days)})"
+        t = parse_time(time_str)
+        if t is None:
+            return f"I couldn't read the time '{time_str}' (e.g. 10:00 AM)"
+        slots = slot_times(working_hours)
+        if not slots or not (slots[0] <= t <= slots[-1]):
+            return f"{format_time(t)} is outside working hours ({working_hours})"
+        if t not in slots:
+            return f"appointments start every {SLOT_MINUTES} minutes, e.g. {format_time(slots[0])}"
+        return None
+
+    def earliest_slot(self, available_days: Iterable[str], working_hours: Optional[str],
+                      taken: Optional[Container[datetime]] = None) -> Optional[Tuple[str, str]]:
+        """(day_name, "9:00 AM") for the soonest opening of a doctor, walking the slot grid
+        past every start in `taken` (naive UTC, as db.slots stores claims), e.g.
+        earliest_slot(["Monday", "Wednesday"], "9:00 AM - 5:00 PM", taken={...}).
+        Today's remaining slots come first; slot_date resolves them back to today."""
+        days = {str(d).strip().capitalize() for d in available_days or ()}
+        today = self.today()
+        candidates = sorted(self.table().items(), key=lambda kv: kv[1])
+        if DAY_NAMES[today.weekday()] in days:
+            candidates.insert(0, (DAY_NAMES[today.weekday()], today))
+        for name, d in candidates:
+            if name not in days:
+                continue
+            for t in slot_times(working_hours):
+                if d == today and self._today_if_open(t) is None:
+                    continue
+                if taken and self.utc(datetime.combine(d, t)) in taken:
+                    continue
+                return name, format_time(t)
+        return None
+
+
+_CALENDARS: Dict[Tuple[str, frozenset], ClinicCalendar] = {}
+_CALENDARS_LOCK = threading.Lock()
+
+
+def get_calendar(tz_name: str = "America/New_York", holidays: Union[str, Iterable, None] = None) -> ClinicCalendar:
+    """Process-wide calendar per (tz, holidays) — survives Streamlit reruns."""
+    key = (tz_name, _parse_holidays(holidays))
+    with _CALENDARS_LOCK:
+        cal = _CALENDARS.get(key)
+        if cal is None:
+            cal = _CALENDARS[key] = ClinicCalendar(tz_name, key[1])
+        return cal
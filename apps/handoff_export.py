@@ -0,0 +1,262 @@
+# handoff_export.py — streaming handoff archive (zstd JSONL / Parquet)
+# ----------------------------------------------------------------------
+# One record per appointment still on the books (cancelled ones are left
+# out): ids, slot, canonical intake, summary text.
+#
+#   python apps/handoff_export.py --day 2025-08-18 --out exports
+#   python apps/handoff_export.py --day 2025-08-18 --out exports --format parquet
+#   (MONGO_URI / DB_NAME / CLINIC_TZ from the environment)
+#
+#   stats = export_handoffs(ap_col, users_col, "exports", day, cal,
+#                           summarize=generate_summaries)   # from the app
+#
+# Appointments are read with one batched cursor in (slot_start, _id)
+# order (index slot_day) and handled batch by batch, so memory is bounded
+# by batch_size regardless of how many appointments the day holds.
+#
+# Resume: <name>.checkpoint.json next to the archive records the keyset
+# cursor of the last durable record.
+#   jsonl:   every batch is its own compressed frame/member, flushed
+#            before the checkpoint moves; a rerun truncates the file back
+#            to the checkpointed offset and continues after the cursor.
+#   parquet: the checkpoint moves when a part file is closed; a rerun
+#            drops unfinished parts and restarts from the last closed one.
+# zstd needs `zstandard` (falls back to gzip, .jsonl.gz); parquet needs
+# `pyarrow`.
+# ----------------------------------------------------------------------
+
+import argparse
+import gzip
+import json
+import os
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from appointment_queries import SUMMARY_PROJECTION, _decode_cursor, day_bounds_utc, encode_cursor, intakes_for_docs
+from clinic_calendar import get_calendar
+from lazy_deps import HAS_ARROW, arrow
+from summary_format import FORMATTER
+
+HAS_ZSTD = True
+try:
+    import zstandard
+except Exception:
+    HAS_ZSTD = False
+
+
+EXPORT_PROJECTION = dict(SUMMARY_PROJECTION, doctor_id=1)
+
+# -------------------------------------------------
+# Reading
+# -------------------------------------------------
+
+def iter_batches(ap_col, filt: Dict[str, Any], after: Optional[str] = None,
+                 batch_size: int = 500, projection: Optional[Dict[str, int]] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Lists of up to batch_size docs from ONE cursor, in (slot_start, _id) order, after `after`."""
+    q = dict(filt)
+    if after:
+        ss, oid = _decode_cursor(after)
+        q["$or"] = [{"slot_start": {"$gt": ss}}, {"slot_start": ss, "_id": {"$gt": oid}}]
+    cur = ap_col.find(q, projection or EXPORT_PROJECTION).sort([("slot_start", 1), ("_id", 1)]).batch_size(batch_size)
+    batch: List[Dict[str, Any]] = []
+    for doc in cur:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _default_summarize(intakes: List[Dict[str, Any]]) -> List[str]:
+    return FORMATTER.render_batch(intakes)
+
+
+def _records(docs, users_col, cal, summarize) -> List[Dict[str, Any]]:
+    intakes = intakes_for_docs(docs, users_col)
+    for it, d in zip(intakes, docs):
+        if not it.get("scheduled_time_human") and cal is not None:
+            human = cal.human(d.get("slot_start"))
+            if human:
+                it["scheduled_time_human"] = human
+    texts = summarize(intakes)
+    now = datetime.now(timezone.utc).isoformat()
+    out = []
+    for d, it, text in zip(docs, intakes, texts):
+        ss = d.get("slot_start")
+        out.append({
+            "appointment_id": it.get("appointment_id") or str(d.get("_id")),
+            "doctor_id": d.get("doctor_id"),
+            "doctor_name": it.get("doctor_name"),
+            "slot_start": ss.isoformat() if isinstance(ss, datetime) else ss,
+            "exported_at": now,
+            "intake": it,
+            "summary": text,
+        })
+    return out
+
+# -------------------------------------------------
+# Checkpoint
+# -------------------------------------------------
+
+def _load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# -------------------------------------------------
+# Writers
+# -------------------------------------------------
+
+def _compress(data: bytes) -> bytes:
+    # Concatenated zstd frames / gzip members decode as one stream
+    if HAS_ZSTD:
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    return gzip.compress(data)
+
+
+def _write_jsonl(path: str, ckpt_path: str, state: Dict[str, Any], batches, progress) -> Dict[str, Any]:
+    mode = "r+b" if os.path.exists(path) else "wb"
+    with open(path, mode) as f:
+        f.truncate(state.get("offset", 0))
+        f.seek(state.get("offset", 0))
+        for recs, cursor in batches:
+            data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in recs).encode("utf-8")
+            f.write(_compress(data))
+            f.flush()
+            os.fsync(f.fileno())
+            state.update(offset=f.tell(), written=state.get("written", 0) + len(recs), cursor=cursor)
+            _save_checkpoint(ckpt_path, state)
+            if progress:
+                progress(state["written"])
+    return state
+
+
+def _arrow_table(recs: List[Dict[str, Any]]):
+    cols = ("appointment_id", "doctor_id", "doctor_name", "slot_start", "exported_at", "summary")
+    data = {c: [r.get(c) for r in recs] for c in cols}
+    data["intake"] = [json.dumps(r["intake"], ensure_ascii=False, default=str) for r in recs]
+    pa = arrow().pa
+    return pa.table({k: pa.array(v, type=pa.string()) for k, v in data.items()})
+
+
+def _write_parquet(base: str, ckpt_path: str, state: Dict[str, Any], batches, progress, part_rows: int) -> Dict[str, Any]:
+    if not HAS_ARROW:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow).")
+    part = state.get("part", 0)
+    # Parts past the checkpoint were never closed (no footer): drop them
+    stale = part
+    while os.path.exists(f"{base}-{stale:05d}.parquet"):
+        os.remove(f"{base}-{stale:05d}.parquet")
+        stale += 1
+    writer, rows, pending = None, 0, 0
+    cursor = state.get("cursor")
+    for recs, cursor in batches:
+        if writer is None:
+            writer = arrow().pq.ParquetWriter(f"{base}-{part:05d}.parquet", _arrow_table(recs[:1]).schema, compression="zstd")
+        writer.write_table(_arrow_table(recs))   # one row group per batch
+        rows += len(recs)
+        pending += len(recs)
+        if rows >= part_rows:
+            writer.close()
+            writer, rows, part = None, 0, part + 1
+            state.update(part=part, written=state.get("written", 0) + pending, cursor=cursor)
+            pending = 0
+            _save_checkpoint(ckpt_path, state)
+        if progress:
+            progress(state.get("written", 0) + pending)
+    if writer is not None:
+        writer.close()
+        state.update(part=part + 1, written=state.get("written", 0) + pending, cursor=cursor)
+        _save_checkpoint(ckpt_path, state)
+    return state
+
+# -------------------------------------------------
+# Entry point
+# -------------------------------------------------
+
+def export_handoffs(
+    ap_col,
+    users_col,
+    out_dir: str,
+    day: date,
+    cal,
+    fmt: str = "jsonl",
+    doctor_id: Optional[str] = None,
+    summarize: Optional[Callable[[List[Dict[str, Any]]], List[str]]] = None,
+    batch_size: int = 500,
+    part_rows: int = 100_000,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Dict[str, Any]:
+    """Export one clinic day (optionally one doctor). Safe to rerun: resumes, or no-ops when done."""
+    if fmt not in ("jsonl", "parquet"):
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"handoffs-{day.isoformat()}" + (f"-{doctor_id}" if doctor_id else "")
+    ckpt_path = os.path.join(out_dir, name + ".checkpoint.json")
+    state = _load_checkpoint(ckpt_path)
+    if state.get("done"):
+        return state
+    state.setdefault("format", fmt)
+    if state["format"] != fmt:
+        raise ValueError(f"{name} was started as {state['format']}; finish or delete its checkpoint first.")
+
+    start, end = day_bounds_utc(day, cal)
+    filt: Dict[str, Any] = {"slot_start": {"$gte": start, "$lt": end}, "status": {"$ne": "cancelled"}}
+    if doctor_id:
+        filt["doctor_id"] = doctor_id
+    summarize = summarize or _default_summarize
+
+    def batches():
+        for docs in iter_batches(ap_col, filt, state.get("cursor"), batch_size):
+            yield _records(docs, users_col, cal, summarize), encode_cursor(docs[-1])
+
+    if fmt == "jsonl":
+        ext = ".jsonl.zst" if HAS_ZSTD else ".jsonl.gz"
+        state.setdefault("path", os.path.join(out_dir, name + ext))
+        state = _write_jsonl(state["path"], ckpt_path, state, batches(), progress)
+    else:
+        state.setdefault("path", os.path.join(out_dir, name))
+        state = _write_parquet(state["path"], ckpt_path, state, batches(), progress, part_rows)
+    state["done"] = True
+    _save_checkpoint(ckpt_path, state)
+    return state
+
+
+def main(argv=None) -> None:
+    from pymongo import MongoClient  # only the CLI needs a client of its own
+
+    ap = argparse.ArgumentParser(description="Export one clinic day of handoffs.")
+    ap.add_argument("--day", required=True, help="YYYY-MM-DD (clinic-local)")
+    ap.add_argument("--out", default="exports")
+    ap.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    ap.add_argument("--doctor-id")
+    ap.add_argument("--batch-size", type=int, default=500)
+    args = ap.parse_args(argv)
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        raise SystemExit("MONGO_URI is not set.")
+    db = MongoClient(uri)[os.getenv("DB_NAME", "medbird")]
+    cal = get_calendar(os.getenv("CLINIC_TZ", "America/New_York"), os.getenv("CLINIC_HOLIDAYS", ""))
+    state = export_handoffs(
+        db.appointments, db.users, args.out, date.fromisoformat(args.day), cal,
+        fmt=args.format, doctor_id=args.doctor_id, batch_size=args.batch_size,
+        progress=lambda n: print(f"\r{n} records", end="", flush=True),
+    )
+    print(f"\n{state.get('written', 0)} records -> {state['path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# ics_feeds.py — per-doctor iCalendar feeds, cached and regenerated incrementally
+# ----------------------------------------------------------------------
+#   bump_feed(db, "d003", "apt_...")                  # after any booking write for d003
+#   status, body, etag = feed_response(db, "d003", cal, if_none_match='"d003-41-20251018"')
+#   token = feed_token(secret, "d003")                # ?token= for the feed URL
+#
+# db.calendar_feeds holds one small document per doctor:
+#   {_id: "d003", version: 41, changes: ["apt_…", ...], updated_at}
+# Every booking write ($inc version + $push the booking_id, one atomic
+# update) bumps it; `changes` keeps the last CHANGE_LOG booking ids, the
+# last one being the write that produced `version`.
+#
+# A poll costs one _id read of that document. Matching ETag → 304 with no
+# rendering at all. Otherwise the process's cached feed is brought up to
+# the current version by re-reading and re-rendering only the bookings
+# changed since (one $in), and a full rebuild from the (doctor_id,
+# slot_start) index happens only for a first request, a feed that fell
+# more than CHANGE_LOG writes behind, or when the day rolls the window.
+#
+# Events cover FEED_PAST_DAYS back to FEED_AHEAD_DAYS ahead, as UTC
+# times. They carry the patient name and visit type only, no clinical
+# fields. Feeds are served by booking_api.py at
+# GET /v1/doctors/<id>/calendar.ics?token=…, and only when ICS_FEED_SECRET
+# is set.
+#
+#   python apps/ics_feeds.py url d003          # path + token for a doctor
+#   python apps/ics_feeds.py render d003       # print the feed
+#   (MONGO_URI / DB_NAME / CLINIC_TZ / ICS_FEED_SECRET from the environment)
+# ----------------------------------------------------------------------
+
+import argparse
+import hashlib
+import hmac
+import os
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from appointment_queries import day_bounds_utc
+from clinic_calendar import get_calendar
+
+CHANGE_LOG = 500
+FEED_PAST_DAYS = 30
+FEED_AHEAD_DAYS = 120
+EVENT_MINUTES = 30
+REFRESH = "PT5M"
+
+FEED_PROJECTION = {
+    "_id": 0, "booking_id": 1, "doctor_id": 1, "doctor_name": 1, "patient_name": 1, "visit_type": 1,
+    "location": 1, "slot_start": 1, "status": 1, "created_at": 1, "rescheduled_at": 1, "cancelled_at": 1,
+}
+
+
+def _utc(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def feed_token(secret: str, doctor_id: str) -> str:
+    return hmac.new(secret.encode("utf-8"), f"ics|{doctor_id}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def token_ok(secret: str, doctor_id: str, token: Optional[str]) -> bool:
+    return bool(secret and token) and hmac.compare_digest(feed_token(secret, doctor_id), token)
+
+# -------------------------------------------------
+# Version stamps
+# -------------------------------------------------
+
+def bump_feed(db, doctor_id: Optional[str], booking_id: Optional[str]) -> None:
+    """Record a booking write for the doctor's feed (booking, cancel, reschedule)."""
+    if db is None or not (doctor_id and booking_id):
+        return
+    db.calendar_feeds.update_one(
+        {"_id": doctor_id},
+        {"$inc": {"version": 1},
+         "$push": {"changes": {"$each": [booking_id], "$slice": -CHANGE_LOG}},
+         "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def feed_state(db, doctor_id: str) -> Tuple[int, List[str]]:
+    doc = db.calendar_feeds.find_one({"_id": doctor_id}, {"version": 1, "changes": 1}) or {}
+    return int(doc.get("version") or 0), list(doc.get("changes") or [])
+
+# -------------------------------------------------
+# Rendering
+# -------------------------------------------------
+
+def _esc(text: Any) -> str:
+    return (str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> str:
+    """RFC 5545 line folding: at most 75 octets per line, continuations start with a space."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    out, cur = [], ""
+    for ch in line:
+        limit = 75 if not out else 74
+        if len((cur + ch).encode("utf-8")) > limit:
+            out.append(cur)
+            cur = ""
+        cur += ch
+    out.append(cur)
+    return "\r\n ".join(out)
+
+
+def _stamp(dt: datetime) -> str:
+    return _utc(dt).strftime("%Y%m%dT%H%M%SZ")
+
+
+def render_event(appt: Dict[str, Any]) -> str:
+    """One VEVENT (CRLF-terminated lines). Deterministic, so replicas at one version serve one body."""
+    start = _utc(appt["slot_start"])
+    changed = appt.get("rescheduled_at") or appt.get("created_at") or start
+    visit = appt.get("visit_type") or "appointment"
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{appt['booking_id']}@medbird",
+        f"DTSTAMP:{_stamp(changed)}",
+        f"LAST-MODIFIED:{_stamp(changed)}",
+        f"DTSTART:{_stamp(start)}",
+        f"DTEND:{_stamp(start + timedelta(minutes=EVENT_MINUTES))}",
+        f"SUMMARY:{_esc((appt.get('patient_name') or 'Patient') + ' – ' + visit)}",
+        f"LOCATION:{_esc('Telehealth' if visit == 'telehealth' else (appt.get('location') or 'Clinic'))}",
+        f"DESCRIPTION:{_esc('Booking ' + str(appt['booking_id']))}",
+        "STATUS:CONFIRMED",
+        "END:VEVENT",
+    ]
+    return "".join(_fold(line) + "\r\n" for line in lines)
+
+
+def _calendar(doctor_name: str, events: Iterable[str]) -> bytes:
+    head = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//MedBird//Doctor schedule//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_esc('MedBird – ' + doctor_name)}",
+        f"REFRESH-INTERVAL;VALUE=DURATION:{REFRESH}",
+        f"X-PUBLISHED-TTL:{REFRESH}",
+    ]
+    return ("".join(_fold(line) + "\r\n" for line in head) + "".join(events) + "END:VCALENDAR\r\n").encode("utf-8")
+
+# -------------------------------------------------
+# Cached feeds
+# -------------------------------------------------
+
+class _Feed:
+    def __init__(self, doctor_id: str, window_start: date):
+        self.doctor_id = doctor_id
+        self.window_start = window_start
+        self.version = -1
+        self.doctor_name = doctor_id
+        self.events: Dict[str, Tuple[datetime, str]] = {}     # booking_id -> (slot_start, VEVENT)
+        self.body = b""
+
+
+_FEEDS: Dict[str, _Feed] = {}
+_FEEDS_LOCK = threading.Lock()
+_feed_locks: Dict[str, threading.Lock] = {}         # one regeneration per doctor at a time
+STATS = {"not_modified": 0, "cached": 0, "incremental": 0, "full": 0, "events_rendered": 0}
+
+
+def feed_etag(doctor_id: str, version: int, window_start: date) -> str:
+    return f'"{doctor_id}-{version}-{window_start:%Y%m%d}"'
+
+
+def _window(cal) -> Tuple[date, datetime, datetime]:
+    today = cal.today()
+    first = today - timedelta(days=FEED_PAST_DAYS)
+    lo, _ = day_bounds_utc(first, cal)
+    _, hi = day_bounds_utc(today + timedelta(days=FEED_AHEAD_DAYS), cal)
+    return first, lo, hi
+
+
+def _apply(feed: _Feed, appts: Iterable[Dict[str, Any]], lo: datetime, hi: datetime) -> None:
+    for a in appts:
+        ss = a.get("slot_start")
+        if a.get("status") != "confirmed" or not isinstance(ss, datetime) or not (lo <= _utc(ss) < hi):
+            feed.events.pop(a["booking_id"], None)
+            continue
+        feed.events[a["booking_id"]] = (_utc(ss), render_event(a))
+        feed.doctor_name = a.get("doctor_name") or feed.doctor_name
+        STATS["events_rendered"] += 1
+
+
+def _refresh(db, feed: _Feed, version: int, changes: List[str], lo: datetime, hi: datetime) -> None:
+    behind = version - feed.version
+    if feed.version >= 0 and 0 < behind <= len(changes):
+        changed = set(changes[len(changes) - behind:])
+        found = list(db.appointments.find({"doctor_id": feed.doctor_id, "booking_id": {"$in": sorted(changed)}},
+                                          FEED_PROJECTION))
+        seen = {a["booking_id"] for a in found}
+        for gone in changed - seen:              # deleted outright
+            feed.events.pop(gone, None)
+        _apply(feed, found, lo, hi)
+        STATS["incremental"] += 1
+    else:
+        feed.events = {}
+        _apply(feed, db.appointments.find({"doctor_id": feed.doctor_id, "slot_start": {"$gte": lo, "$lt": hi},
+                                           "status": "confirmed"}, FEED_PROJECTION), lo, hi)
+        STATS["full"] += 1
+    feed.version = version
+    feed.body = _calendar(feed.doctor_name, (ev for _ss, ev in sorted(feed.events.values())))
+
+
+def feed_response(db, doctor_id: str, cal, if_none_match: Optional[str] = None) -> Tuple[int, bytes, str]:
+    """(200 | 304, body, etag) for a doctor's feed; body is empty for 304."""
+    version, changes = feed_state(db, doctor_id)
+    first, lo, hi = _window(cal)
+    etag = feed_etag(doctor_id, version, first)
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        STATS["not_modified"] += 1
+        return 304, b"", etag
+    with _FEEDS_LOCK:
+        feed = _FEEDS.get(doctor_id)
+        if feed is None or feed.window_start != first:
+            feed = _FEEDS[doctor_id] = _Feed(doctor_id, first)
+        lock = _feed_locks.setdefault(doctor_id, threading.Lock())
+    with lock:
+        if feed.version == version:
+            STATS["cached"] += 1
+        else:
+            _refresh(db, feed, version, changes, lo, hi)
+        return 200, feed.body, etag
+
+
+def main(argv=None) -> None:
+    from pymongo import MongoClient  # only the CLI needs a client of its own
+
+    ap = argparse.ArgumentParser(description="Doctor calendar feeds.")
+    ap.add_argument("command", choices=("url", "render"))
+    ap.add_argument("doctor_id")
+    args = ap.parse_args(argv)
+
+    if args.command == "url":
+        secret = os.getenv("ICS_FEED_SECRET", "")
+        if not secret:
+            raise SystemExit("ICS_FEED_SECRET is not set.")
+        print(f"/v1/doctors/{args.doctor_id}/calendar.ics?token={feed_token(secret, args.doctor_id)}")
+        return
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        raise SystemExit("MONGO_URI is not set.")
+    db = MongoClient(uri)[os.getenv("DB_NAME", "medbird")]
+    cal = get_calendar(os.getenv("CLINIC_TZ", "America/New_York"), os.getenv("CLINIC_HOLIDAYS", ""))
+    _status, body, _etag = feed_response(db, args.doctor_id, cal)
+    print(body.decode("utf-8"), end="")
+
+
+if __name__ == "__main__":
+    main()
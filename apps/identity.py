@@ -0,0 +1,398 @@
+# identity.py — patient identity keys + fuzzy name candidates (db.users)
+# ----------------------------------------------------------------------
+#   email, phone = normalize_contact(" Jane.Doe@Example.COM ")   # ("jane.doe@example.com", None)
+#   email, phone = normalize_contact("(555) 123-4567")           # (None, "+15551234567")
+#   user  = users.find_one(lookup_filter(contact, name, dob))
+#   cands = find_candidates(users, "Jon Smyth", dob="1990-04-05")  # [(0.82, user), ...]
+#
+# Every profile carries two indexed arrays:
+#   identity_keys  exact keys: "email:jane.doe@example.com", "tel:+15551234567",
+#                  "name_dob:jane doe|1990-04-05", "name:jane doe"
+#   name_keys      phonetic keys for fuzzy retrieval: Soundex of first + last
+#                  name in both orders, and each Soundex with the other
+#                  token's initial
+# A lookup by contact is one multikey index probe. A lookup without a
+# contact uses the normalized name (+ DOB) key, not an unindexed {"name":}.
+# A number canonical_phone can't place keeps its bare digits as the tel
+# key, so a contact never falls back to the name key.
+# Fuzzy candidates come from one $in over name_keys and are ranked
+# locally by trigram + Soundex similarity, so the cost scales with the few
+# similar-sounding names rather than with the patient base. Nothing here
+# merges profiles; candidates are for flagging and staff review.
+#
+# Profiles written before this module get their keys from
+# backfill_identity (run by schema.start_background_migration). Until
+# that has finished, lookups also try the legacy raw email / mobile
+# fields (see identity_ready). Profiles keyed by an older IDENTITY_VERSION
+# (DOBs guessed day-first) are re-keyed by the same backfill.
+#
+# DOBs are read month-first when a part can only be a day; an ambiguous
+# "04/05/1990" follows DOB_ORDER (MDY / DMY) and gets no DOB key at all
+# when that isn't set.
+#
+#   python apps/identity.py backfill
+#   python apps/identity.py duplicates          # profiles sharing a contact key
+#   python apps/identity.py lookup "Jon Smyth" [--dob 1990-04-05]
+#   (MONGO_URI / DB_NAME from the environment)
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_CC = os.getenv("PHONE_DEFAULT_CC", "1")     # country code for national numbers
+MIN_CANDIDATE_SCORE = 0.6
+DUPLICATE_SCORE = 0.9
+READY_TTL_S = 60.0
+
+_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+# How to read a numeric DOB whose first two parts could each be the month
+# ("04/05/1990"): "MDY" (US) or "DMY". Unset, such dates are rejected.
+DOB_ORDER = os.getenv("DOB_ORDER", "").strip().upper()
+IDENTITY_VERSION = 3                                # 2: DOBs month-first; 3: raw-digit tel keys
+_DOB_NUMERIC_RE = re.compile(r"^(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})$")
+
+# -------------------------------------------------
+# Canonical forms
+# -------------------------------------------------
+
+def canonical_email(text: Optional[str]) -> Optional[str]:
+    m = _EMAIL_RE.search(text or "")
+    return m.group().lower() if m else None
+
+
+def canonical_phone(text: Optional[str], default_cc: str = DEFAULT_CC) -> Optional[str]:
+    """E.164-style "+<cc><number>": national 10-digit numbers get `default_cc`,
+    "+" / "00" prefixed numbers keep theirs. None if it can't be a phone number."""
+    s = (text or "").strip()
+    digits = re.sub(r"\D", "", s)
+    if s.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif len(digits) == 10:
+        digits = default_cc + digits
+    elif not (len(digits) == 10 + len(default_cc) and digits.startswith(default_cc)):
+        return None
+    return "+" + digits if 8 <= len(digits) <= 15 else None
+
+
+def contact_phone(text: Optional[str]) -> Optional[str]:
+    """canonical_phone, else the bare digits of anything phone-length (an international
+    number stored without its "+"), so a given number always yields a tel key."""
+    phone = canonical_phone(text)
+    if phone:
+        return phone
+    digits = re.sub(r"\D", "", text or "")
+    return digits if 8 <= len(digits) <= 15 else None
+
+
+def normalize_contact(contact: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(email, phone) in canonical form; at most one is set."""
+    if "@" in (contact or ""):
+        return canonical_email(contact), None
+    return None, contact_phone(contact)
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """'  José  O'Neil-Smith ' → 'jose oneil smith' (accents, case and punctuation dropped)."""
+    s = unicodedata.normalize("NFKD", name or "")
+    s = "".join(c for c in s if not unicodedata.combining(c)).casefold()
+    s = re.sub(r"[-_.]", " ", s)
+    s = re.sub(r"[^a-z ]", "", s)
+    return " ".join(s.split())
+
+
+def normalize_dob(dob: Optional[str], order: str = DOB_ORDER) -> Optional[str]:
+    """ISO date for "1990-04-25", "04/25/1990", "25-04-1990"; a part above 12 settles which
+    one is the day. "04/05/1990" is read per `order` (MDY / DMY) and is None without one."""
+    s = (dob or "").strip()
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        pass
+    m = _DOB_NUMERIC_RE.match(s)
+    if not m:
+        return None
+    a, b, year = (int(g) for g in m.groups())
+    if b > 12 or a == b:
+        month, day = a, b
+    elif a > 12:
+        month, day = b, a
+    elif order in ("MDY", "DMY"):
+        month, day = (a, b) if order == "MDY" else (b, a)
+    else:
+        return None                # ambiguous: better no DOB key than the wrong one
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def age_from_dob(dob: Any, today: Optional[date] = None) -> Optional[int]:
+    """Whole years since a DOB read as normalize_dob reads it; None when it can't be read."""
+    iso = normalize_dob(dob) if isinstance(dob, str) else None
+    if not iso:
+        return None
+    d, today = date.fromisoformat(iso), today or date.today()
+    return max(0, today.year - d.year - ((today.month, today.day) < (d.month, d.day)))
+
+# -------------------------------------------------
+# Keys
+# -------------------------------------------------
+
+_SOUNDEX = {c: d for d, letters in {"1": "bfpv", "2": "cgjkqsxz", "3": "dt", "4": "l", "5": "mn", "6": "r"}.items()
+            for c in letters}
+
+
+def soundex(token: str) -> str:
+    token = re.sub(r"[^a-z]", "", token.lower())
+    if not token:
+        return ""
+    out, last = token[0].upper(), _SOUNDEX.get(token[0], "")
+    for c in token[1:]:
+        code = _SOUNDEX.get(c, "")
+        if code and code != last:
+            out += code
+            if len(out) == 4:
+                break
+        if c not in "hw":          # h / w don't separate equal codes
+            last = code
+    return out.ljust(4, "0")
+
+
+def name_keys(name: Optional[str]) -> List[str]:
+    tokens = normalize_name(name).split()
+    if not tokens:
+        return []
+    first, last = tokens[0], tokens[-1]
+    if first == last:
+        return [f"sx:{soundex(first)}"]
+    sf, sl = soundex(first), soundex(last)
+    # a typo changes at most one token's code; the initial keys still hit
+    return [f"sx:{sf}|{sl}", f"sx:{sl}|{sf}", f"in:{first[0]}|{sl}", f"in:{sf}|{last[0]}"]
+
+
+def identity_keys(email: Optional[str] = None, phone: Optional[str] = None, name: Optional[str] = None,
+                  dob: Optional[str] = None) -> List[str]:
+    keys = []
+    if email:
+        keys.append(f"email:{email}")
+    if phone:
+        keys.append(f"tel:{phone}")
+    n, d = normalize_name(name), normalize_dob(dob)
+    if n and d:
+        keys.append(f"name_dob:{n}|{d}")
+    if n:
+        keys.append(f"name:{n}")
+    return keys
+
+
+def user_identity_fields(user: Dict[str, Any]) -> Dict[str, Any]:
+    """identity_keys / name_keys (+ identity_v) for a profile document (any schema version)."""
+    email = canonical_email(user.get("email"))
+    phone = contact_phone(user.get("mobile"))
+    return {"identity_keys": identity_keys(email, phone, user.get("name"), user.get("dob")),
+            "name_keys": name_keys(user.get("name")), "identity_v": IDENTITY_VERSION}
+
+
+def lookup_keys(contact: Optional[str], name: Optional[str] = None, dob: Optional[str] = None) -> List[str]:
+    """The keys that identify a patient: the contact when there is one, else name (+ DOB).
+    A contact that doesn't normalize yields no keys rather than a name-only match."""
+    if (contact or "").strip():
+        email, phone = normalize_contact(contact)
+        return identity_keys(email, phone)
+    keys = identity_keys(name=name, dob=dob)
+    return keys[:1]                # name_dob when the DOB is known, else name
+
+
+def lookup_filter(contact: Optional[str], name: Optional[str] = None, dob: Optional[str] = None,
+                  legacy: bool = False) -> Dict[str, Any]:
+    """Users filter on identity_keys; legacy=True also matches un-backfilled profiles by raw field."""
+    keys = lookup_keys(contact, name, dob)
+    ors: List[Dict[str, Any]] = [{"identity_keys": {"$in": keys}}] if keys else []
+    if legacy:
+        raw = (contact or "").strip()
+        email = canonical_email(raw)
+        if email:
+            # case-insensitive, unindexed: only until the backfill is done
+            ors.append({"email": {"$regex": f"^{re.escape(email)}$", "$options": "i"}})
+        elif raw:
+            digits = re.sub(r"\D", "", raw)
+            ors.append({"mobile": {"$in": sorted({digits, digits[-10:]})}})
+        elif name:
+            ors.append({"name": name})
+    return {"$or": ors} if ors else {"_id": None}
+
+# -------------------------------------------------
+# Fuzzy candidates
+# -------------------------------------------------
+
+def _trigrams(s: str) -> set:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def name_similarity(a: Optional[str], b: Optional[str]) -> float:
+    """0..1: half trigram Dice over the normalized names (token order ignored), half the
+    share of tokens that sound alike, so "Jon Smyth" ~ "John Smith" scores ~0.74."""
+    ta, tb = sorted(normalize_name(a).split()), sorted(normalize_name(b).split())
+    if not ta or not tb:
+        return 0.0
+    ga, gb = _trigrams(" ".join(ta)), _trigrams(" ".join(tb))
+    dice = 2 * len(ga & gb) / (len(ga) + len(gb))
+    sa, sb = {soundex(t) for t in ta}, {soundex(t) for t in tb}
+    phonetic = len(sa & sb) / max(len(sa), len(sb))
+    return 0.5 * dice + 0.5 * phonetic
+
+
+def key_tiers(name: Optional[str]) -> List[List[str]]:
+    """name_keys split by selectivity: both codes first, then code + initial (typo recall)."""
+    keys = name_keys(name)
+    return [t for t in (keys[:2], keys[2:]) if t]
+
+
+def find_candidates(users_col, name: Optional[str], dob: Optional[str] = None, limit: int = 5,
+                    min_score: float = MIN_CANDIDATE_SCORE, scan_cap: int = 200) -> List[Tuple[float, Dict[str, Any]]]:
+    """Profiles whose name sounds like `name`, best first. A matching DOB adds to the score,
+    a conflicting one takes away from it. The broad tier is only read when the selective
+    one leaves fewer than `limit` candidates."""
+    if users_col is None:
+        return []
+    proj = {"user_id": 1, "name": 1, "email": 1, "mobile": 1, "dob": 1, "last_appointment": 1}
+    want_dob = normalize_dob(dob)
+    scored, seen = [], set()
+    for tier in key_tiers(name):
+        filt: Dict[str, Any] = {"name_keys": {"$in": tier}}
+        if seen:
+            filt["_id"] = {"$nin": list(seen)}
+        for u in users_col.find(filt, proj).limit(scan_cap):
+            seen.add(u["_id"])
+            score = name_similarity(name, u.get("name"))
+            have_dob = normalize_dob(u.get("dob"))
+            if want_dob and have_dob:
+                score = min(1.0, score + 0.2) if want_dob == have_dob else score - 0.3
+            if score >= min_score:
+                scored.append((round(score, 3), u))
+        if len(scored) >= limit:
+            break
+    scored.sort(key=lambda su: -su[0])
+    return scored[:limit]
+
+# -------------------------------------------------
+# Indexes, backfill, readiness
+# -------------------------------------------------
+
+def ensure_identity_indexes(users_col) -> None:
+    if users_col is None:
+        return
+    try:
+        users_col.create_index([("identity_keys", 1)], name="identity_keys")
+        users_col.create_index([("name_keys", 1)], name="name_keys")
+    except Exception:
+        pass
+
+
+def backfill_identity(users_col, batch_size: int = 500, stop: Optional[threading.Event] = None,
+                      pause_s: float = 0.05, progress: Optional[Dict[str, Any]] = None) -> int:
+    """(Re)key every profile below IDENTITY_VERSION, in _id order (same batching as
+    schema.migrate_collection). Contact keys it already has are kept; name / name_dob
+    keys are recomputed. A profile written meanwhile is left for the next run. Returns
+    profiles updated."""
+    from pymongo import UpdateOne
+
+    done, last_id = 0, None
+    while not (stop and stop.is_set()):
+        filt: Dict[str, Any] = {"identity_v": {"$ne": IDENTITY_VERSION}}
+        if last_id is not None:
+            filt["_id"] = {"$gt": last_id}
+        batch = list(users_col.find(filt, {"name": 1, "email": 1, "mobile": 1, "dob": 1, "identity_keys": 1})
+                     .sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        ops = [UpdateOne({"_id": u["_id"], "identity_v": {"$ne": IDENTITY_VERSION},
+                          "identity_keys": u.get("identity_keys")}, {"$set": _rekeyed(u)})
+               for u in batch]
+        done += users_col.bulk_write(ops, ordered=False).modified_count
+        last_id = batch[-1]["_id"]
+        if progress is not None:
+            progress["identity"] = done
+        time.sleep(pause_s)
+    return done
+
+
+def _rekeyed(user: Dict[str, Any]) -> Dict[str, Any]:
+    fields = user_identity_fields(user)
+    kept = [k for k in user.get("identity_keys") or () if k.startswith(("email:", "tel:"))]
+    fields["identity_keys"] = list(dict.fromkeys(kept + fields["identity_keys"]))
+    return fields
+
+
+_ready = {"at": 0.0, "value": False}
+
+
+def identity_ready(users_col) -> bool:
+    """True once no profile lacks identity_keys (checked at most every READY_TTL_S; sticky)."""
+    if users_col is None:
+        return False
+    if _ready["value"] or time.monotonic() - _ready["at"] < READY_TTL_S:
+        return _ready["value"]
+    try:
+        _ready["value"] = users_col.find_one({"identity_keys": {"$exists": False}}, {"_id": 1}) is None
+    except Exception:
+        _ready["value"] = False
+    _ready["at"] = time.monotonic()
+    return _ready["value"]
+
+
+def duplicate_groups(users_col) -> List[Dict[str, Any]]:
+    """Contact keys shared by more than one profile (created before keys were canonical)."""
+    pipeline = [
+        {"$unwind": "$identity_keys"},
+        {"$match": {"identity_keys": {"$regex": "^(email|tel):"}}},
+        {"$group": {"_id": "$identity_keys", "users": {"$push": "$user_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+        {"$sort": {"n": -1}},
+    ]
+    return list(users_col.aggregate(pipeline))
+
+
+def main(argv=None) -> None:
+    from pymongo import MongoClient  # only the CLI needs a client of its own
+
+    ap = argparse.ArgumentParser(description="Patient identity keys: backfill, duplicate report, fuzzy lookup.")
+    ap.add_argument("command", choices=("backfill", "duplicates", "lookup"))
+    ap.add_argument("name", nargs="?")
+    ap.add_argument("--dob")
+    args = ap.parse_args(argv)
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        raise SystemExit("MONGO_URI is not set.")
+    users = MongoClient(uri)[os.getenv("DB_NAME", "medbird")].users
+    ensure_identity_indexes(users)
+
+    if args.command == "backfill":
+        print(f"{backfill_identity(users)} profiles updated")
+    elif args.command == "duplicates":
+        groups = duplicate_groups(users)
+        for g in groups:
+            print(f"{g['_id']}: {', '.join(str(u) for u in g['users'])}")
+        print(f"{len(groups)} shared contact keys")
+    else:
+        if not args.name:
+            raise SystemExit("lookup needs a name")
+        t0 = time.perf_counter()
+        cands = find_candidates(users, args.name, args.dob, limit=10)
+        for score, u in cands:
+            print(f"{score:.2f}  {u.get('user_id')}  {u.get('name')}  {u.get('dob') or ''}  {u.get('email') or u.get('mobile') or ''}")
+        print(f"{len(cands)} candidates in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# intake.py — compact, typed summary intake
+# ----------------------------------------------------------------------
+# The one shape the handoff summarizer works with:
+#
+#   it = Intake.from_docs(appt_doc, user_doc)   # docs read with the projections below
+#   it = Intake.from_payload(edited_json)       # legacy / hand-edited payloads
+#   it.to_dict()     -> non-empty fields, for the editable JSON box
+#
+# The summarizer's model prompt is built from an Intake by
+# summary_llm.free_text_prompt (only the fields the free text needs).
+#
+# APPOINTMENT_PROJECTION / USER_PROJECTION select only what an Intake
+# reads, down to sub-fields of triage / medical.
+# ----------------------------------------------------------------------
+
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from schema import SCHEMA_VERSION, canonical_intake, clean, intake_from_docs
+
+APPOINTMENT_PROJECTION = {
+    "patient_name": 1, "contact": 1, "booking_id": 1,
+    "symptoms": 1, "condition": 1,          # condition only matters for v1 docs
+    "doctor_name": 1, "specialty": 1, "location": 1, "visit_type": 1,
+    "slot_start": 1, "selected_day": 1, "selected_time": 1, "duration": 1,
+    "triage.severity": 1, "triage.urgency": 1, "triage.flag": 1,
+    "medical.allergies": 1, "medical.medications": 1, "medical.gender": 1, "medical.dob": 1,
+    "schema_version": 1,
+}
+USER_PROJECTION = {
+    "_id": 0, "name": 1, "email": 1, "mobile": 1, "dob": 1, "gender": 1,
+    "medical.allergies": 1, "medical.chronic_conditions": 1, "medical.medications": 1, "medical.history": 1,
+    "schema_version": 1, "identity_keys": 1,
+    # v1 stragglers until the migrator reaches them
+    "allergies": 1, "Chronic_condition": 1, "medications": 1, "history": 1,
+}
+
+
+@dataclass
+class Intake:
+    patient_name: Optional[str] = None
+    age: Optional[int] = None
+    dob: Optional[str] = None
+    gender: Optional[str] = None
+    contact: Optional[str] = None
+    email: Optional[str] = None
+    mobile: Optional[str] = None
+    appointment_id: Optional[str] = None
+    slot_start: Optional[str] = None
+    scheduled_time_human: Optional[str] = None
+    selected_day: Optional[str] = None
+    selected_time: Optional[str] = None
+    symptoms: List[str] = field(default_factory=list)
+    duration: Optional[str] = None
+    severity: Optional[str] = None
+    suspected_cause: Optional[str] = None
+    allergies: Optional[str] = None
+    chronic_conditions: Optional[str] = None
+    medications: Optional[str] = None
+    history: Optional[str] = None
+    urgency: Optional[str] = None
+    flag: Optional[str] = None
+    doctor_name: Optional[str] = None
+    specialty: Optional[str] = None
+    visit_type: Optional[str] = None
+    location: Optional[str] = None
+
+    # --- construction
+    @classmethod
+    def from_payload(cls, p: Dict[str, Any]) -> "Intake":
+        c = canonical_intake(p)
+        kw = {}
+        for f in fields(cls):
+            v = c.get(f.name)
+            if f.name == "symptoms":
+                kw[f.name] = list(v or [])
+            elif f.name == "age":
+                kw[f.name] = v if isinstance(v, int) else None
+            else:
+                v = clean(v)
+                kw[f.name] = v.isoformat() if isinstance(v, datetime) else (None if v is None else str(v))
+        return cls(**kw)
+
+    @classmethod
+    def from_docs(cls, appt: Dict[str, Any], user: Optional[Dict[str, Any]] = None) -> "Intake":
+        return cls.from_payload(intake_from_docs(appt, user))
+
+    # --- serialization
+    def to_dict(self) -> Dict[str, Any]:
+        d = {k: v for k, v in asdict(self).items() if v not in (None, "", [])}
+        d["schema_version"] = SCHEMA_VERSION
+        return d
@@ -0,0 +1,299 @@
+# json_extract.py — pull the first valid turn object out of model output
+# ----------------------------------------------------------------------
+# Replaces the old greedy `\{.*\}` DOTALL regex in _extract_json, which
+# spans from the first "{" to the LAST "}" (so trailing commentary or a
+# second object breaks it) and backtracks badly on long completions.
+#
+#   extract_turn(raw)        -> {"say", "set", "done"} or None
+#   extract_first_object(raw, accept=None) -> first dict accepted, or None
+#   TurnStreamParser().feed(chunk) -> turn once the first object closes
+#   turn_from_response(resp)  -> turn from a chat response (tool call or text)
+#
+# Strategy per candidate "{" (found with str.find, left to right):
+#   1. json raw_decode at that offset — stops at the end of the object and
+#      ignores code fences / trailing text.
+#   2. if that fails, a string-aware brace balancer finds the matching "}"
+#      and a lenient repair (trailing commas, Python literals, smart quotes)
+#      is tried on just that slice.
+# Candidates are capped so adversarial inputs stay linear-ish.
+# ----------------------------------------------------------------------
+
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, Optional
+
+MAX_CANDIDATES = 64
+MAX_DEPTH = 64
+
+_decoder = json.JSONDecoder()
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERALS_RE = re.compile(r"(?<![\"\w])(True|False|None)(?![\"\w])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"'})
+
+TURN_SET_KEYS = (
+    "condition", "visit_type", "patient_name", "contact", "selected_day", "selected_time",
+    "duration", "severity", "allergies", "medications", "gender", "dob",
+)
+
+
+def balanced_end(txt: str, start: int, max_depth: int = MAX_DEPTH) -> int:
+    """Index just past the "}" closing the "{" at `start`, or -1 (unclosed / too deep)."""
+    depth = 0
+    in_str = esc = False
+    i, n = start, len(txt)
+    while i < n:
+        c = txt[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{" or c == "[":
+            depth += 1
+            if depth > max_depth:
+                return -1
+        elif c == "}" or c == "]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
+
+
+def _lenient_loads(chunk: str) -> Any:
+    fixed = chunk.translate(_SMART_QUOTES)
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", fixed)
+    fixed = _PY_LITERALS_RE.sub(lambda m: _PY_LITERALS[m.group(1)], fixed)
+    return json.loads(fixed)
+
+
+def _decode_at(txt: str, i: int) -> Optional[Any]:
+    try:
+        obj, _ = _decoder.raw_decode(txt, i)
+        return obj
+    except (ValueError, RecursionError):
+        pass
+    end = balanced_end(txt, i)
+    if end == -1:
+        return None
+    try:
+        return _lenient_loads(txt[i:end])
+    except (ValueError, RecursionError):
+        return None
+
+
+def extract_first_object(txt: str, accept: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                         max_candidates: int = MAX_CANDIDATES) -> Optional[Any]:
+    """First JSON object in txt (optionally the first one `accept` maps to non-None)."""
+    if not txt:
+        return None
+    i = txt.find("{")
+    tried = 0
+    while i != -1 and tried < max_candidates:
+        tried += 1
+        obj = _decode_at(txt, i)
+        if isinstance(obj, dict):
+            if accept is None:
+                return obj
+            out = accept(obj)
+            if out is not None:
+                return out
+        i = txt.find("{", i + 1)
+    return None
+
+
+# ---------------------------
+# say / set / done schema
+# ---------------------------
+
+def _as_text(v: Any) -> str:
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return v if isinstance(v, str) else str(v)
+
+
+def validate_turn(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Normalize a model turn to {"say": str, "set": dict, "done": bool}, or None if it isn't one."""
+    if not isinstance(obj, dict) or not any(k in obj for k in ("say", "set", "done")):
+        return None
+    say = obj.get("say")
+    if say is None:
+        say = ""
+    if not isinstance(say, str):
+        return None
+    upd = obj.get("set") or {}
+    if not isinstance(upd, dict):
+        return None
+    # the schema says strings; a bare number ("contact": 5551234567, "severity": 4) becomes one
+    upd = {k: _as_text(v) for k, v in upd.items()
+           if k in TURN_SET_KEYS and isinstance(v, (str, int, float)) and not isinstance(v, bool)}
+    done = obj.get("done", False)
+    if isinstance(done, str):
+        done = done.strip().lower() == "true"
+    elif not isinstance(done, bool):
+        done = bool(done)
+    return {"say": say, "set": upd, "done": done}
+
+
+def extract_turn(txt: str) -> Optional[Dict[str, Any]]:
+    return extract_first_object(txt, accept=validate_turn)
+
+
+class TurnStreamParser:
+    """Incremental variant for streamed completions: feed chunks, get the turn
+    as soon as the first schema-valid object closes (no need to wait for EOS)."""
+
+    def __init__(self):
+        self._buf = ""
+        self._start = -1          # offset of the candidate "{"
+        self._pos = 0             # scan position
+        self._depth = 0
+        self._in_str = self._esc = False
+        self._tried = 0
+        self.result: Optional[Dict[str, Any]] = None
+
+    def _reset_from(self, offset: int) -> None:
+        self._start = self._buf.find("{", offset)
+        self._pos = self._start if self._start != -1 else len(self._buf)
+        self._depth = 0
+        self._in_str = self._esc = False
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        if self.result is not None or self._tried >= MAX_CANDIDATES:
+            return self.result
+        self._buf += chunk or ""
+        if self._start == -1:
+            self._reset_from(self._pos)
+        buf, n = self._buf, len(self._buf)
+        while self._start != -1 and self._pos < n:
+            c = buf[self._pos]
+            self._pos += 1
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                continue
+            if c == '"':
+                self._in_str = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._tried += 1
+                    chunk_txt = buf[self._start:self._pos]
+                    try:
+                        obj = json.loads(chunk_txt)
+                    except ValueError:
+                        try:
+                            obj = _lenient_loads(chunk_txt)
+                        except ValueError:
+                            obj = None
+                    turn = validate_turn(obj) if isinstance(obj, dict) else None
+                    if turn is not None:
+                        self.result = turn
+                        return turn
+                    if self._tried >= MAX_CANDIDATES:
+                        return None
+                    self._reset_from(self._start + 1)
+            if self._depth > MAX_DEPTH:
+                self._reset_from(self._start + 1)
+        return None
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """End of stream: fall back to the one-shot extractor (handles nested candidates)."""
+        if self.result is None:
+            self.result = extract_turn(self._buf)
+        return self.result
+
+
+# ---------------------------
+# Structured-output helpers
+# ---------------------------
+TURN_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "say": {"type": "string"},
+        "set": {"type": "object", "properties": {k: {"type": "string"} for k in TURN_SET_KEYS}},
+        "done": {"type": "boolean"},
+    },
+    "required": ["say", "set", "done"],
+}
+
+TURN_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "record_turn",
+        "description": "Reply to the patient and record any booking fields they provided.",
+        "parameters": TURN_JSON_SCHEMA,
+    },
+}
+TURN_TOOL_CHOICE = {"type": "function", "function": {"name": "record_turn"}}
+
+REPAIR_SYSTEM = (
+    "Rewrite the assistant reply below as ONE JSON object with keys "
+    '"say" (string), "set" (object with only these optional string keys: '
+    + ", ".join(TURN_SET_KEYS)
+    + ') and "done" (boolean). Keep the wording of "say". Output only the JSON.'
+)
+
+
+def response_text(resp: Dict[str, Any]) -> str:
+    try:
+        return resp["choices"][0]["message"].get("content") or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+def turn_from_response(resp: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Prefer a record_turn tool call; otherwise parse the text content."""
+    try:
+        calls = resp["choices"][0]["message"].get("tool_calls") or []
+    except (KeyError, IndexError, TypeError, AttributeError):
+        calls = []
+    for call in calls:
+        fn = (call or {}).get("function") or {}
+        args = fn.get("arguments")
+        if isinstance(args, dict):
+            turn = validate_turn(args)
+        else:
+            turn = extract_turn(args or "")
+        if turn is not None:
+            return turn
+    return extract_turn(response_text(resp))
+
+
+class ParseStats:
+    """Process-wide outcome counts for model turns (first_pass / repaired / failed)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"first_pass": 0, "repaired": 0, "failed": 0}
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def rates(self) -> Dict[str, float]:
+        with self._lock:
+            c = dict(self.counts)
+        total = sum(c.values())
+        if not total:
+            return {"turns": 0, "first_pass_rate": 0.0, "success_rate": 0.0}
+        return {
+            "turns": total,
+            "first_pass_rate": c["first_pass"] / total,
+            "success_rate": (c["first_pass"] + c["repaired"]) / total,
+        }
+
+
+PARSE_STATS = ParseStats()
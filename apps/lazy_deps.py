@@ -0,0 +1,105 @@
+# lazy_deps.py — deferred SDK imports + background warm-up (both apps)
+# ----------------------------------------------------------------------
+# ibm_watsonx_ai and pymongo together cost seconds of import time; the
+# apps only need them once a model call or a query actually happens.
+#
+#   HAS_IBM, HAS_PYMONGO        # installed? (find_spec — imports nothing)
+#   wx().ModelInference         # imported on first use, then cached
+#   mongo_client_cls()(uri, ...)
+#   motor_client_cls()(uri, ...)  # asyncio driver (booking_api.py), HAS_MOTOR
+#   arrow().pq.ParquetWriter(...)  # handoff Parquet export, HAS_ARROW
+#
+#   fut = warm("chat", init_fn, *args)   # starts init_fn in a daemon thread,
+#   ...draw the page...                  # once per process per key
+#   result = fut.result()                # blocks only if still warming
+#
+# Futures live in this module (not in the Streamlit script), so reruns
+# and other sessions reuse the same warm result.
+# ----------------------------------------------------------------------
+
+import importlib.util
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Callable, Dict
+
+
+def _installed(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except Exception:
+        return False
+
+
+HAS_IBM = _installed("ibm_watsonx_ai")
+HAS_PYMONGO = _installed("pymongo")
+HAS_MOTOR = _installed("motor")
+HAS_ARROW = _installed("pyarrow")
+
+
+@lru_cache(maxsize=1)
+def wx() -> SimpleNamespace:
+    """ModelInference / TextChatParameters, imported on first call."""
+    from ibm_watsonx_ai.foundation_models import ModelInference
+    from ibm_watsonx_ai.foundation_models.schema import TextChatParameters
+    return SimpleNamespace(ModelInference=ModelInference, TextChatParameters=TextChatParameters)
+
+
+@lru_cache(maxsize=1)
+def mongo_client_cls():
+    from pymongo import MongoClient
+    return MongoClient
+
+
+@lru_cache(maxsize=1)
+def motor_client_cls():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient
+
+
+@lru_cache(maxsize=1)
+def arrow() -> SimpleNamespace:
+    """pyarrow / pyarrow.parquet (~100 ms), imported on the first Parquet export."""
+    import pyarrow
+    import pyarrow.parquet
+    return SimpleNamespace(pa=pyarrow, pq=pyarrow.parquet)
+
+
+def preload_sdks() -> None:
+    """Pay the SDK import cost now (call from a warm-up thread, never the render path)."""
+    for ok, load in ((HAS_PYMONGO, mongo_client_cls), (HAS_IBM, wx)):
+        if ok:
+            try:
+                load()
+            except Exception:
+                pass
+
+# -------------------------------------------------
+# Warm-up futures (one per key per process)
+# -------------------------------------------------
+
+_warm: Dict[str, Future] = {}
+_warm_lock = threading.Lock()
+
+
+def warm(key: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run fn(*args, **kwargs) once per process in a daemon thread; later calls get the same future.
+    A failed warm-up is forgotten, so the next call retries it."""
+    with _warm_lock:
+        fut = _warm.get(key)
+        if fut is not None and not (fut.done() and fut.exception() is not None):
+            return fut
+        fut = Future()
+        _warm[key] = fut
+
+    def run():
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run, name=f"warm-{key}", daemon=True).start()
+    return fut
@@ -0,0 +1,201 @@
+# llm_cassette.py — record/replay of watsonx chat calls (offline benches, CI)
+# ----------------------------------------------------------------------
+#   model = cassette_model(real_model, MODEL_ID, "fixtures/chat.jsonl", mode="record")
+#   resp  = gateway.chat(model, messages, params)     # real call, appended
+#
+#   model = cassette_model(None, MODEL_ID, "fixtures/chat.jsonl", mode="replay", latency="zero")
+#   resp  = gateway.chat(model, messages, params)     # no network
+#
+# Modes: "record" (call through, append every exchange), "replay" (never
+# calls out; unknown prompt → CassetteMiss), "auto" (replay hits, record
+# misses), "off". Latency on replay: "recorded" sleeps what the real call
+# took, "zero" returns immediately, a number scales the recorded time.
+#
+# Exchanges are keyed by a hash of model id + messages (+ tools). Params
+# are left out so a temperature tweak doesn't orphan the fixtures. A
+# prompt whose context drifted (e.g. a different "earliest slot" on
+# another day) still replays via a looser key: model id + last user
+# message. Repeated prompts replay their recordings in order, wrapping.
+#
+# Settings ([llm] in secrets.toml, or env):
+#   cassette = "fixtures/chat.jsonl"   # LLM_CASSETTE
+#   cassette_mode = "replay"           # LLM_CASSETTE_MODE
+#   cassette_latency = "recorded"      # LLM_CASSETTE_LATENCY
+# ----------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+MODES = ("record", "replay", "auto", "off")
+
+
+class CassetteMiss(Exception):
+    """Replay-only cassette has no recording for this prompt."""
+
+
+def _digest(obj: Any) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def exchange_keys(model_id: Optional[str], messages: List[Dict[str, Any]], tools: Any = None) -> Tuple[str, str]:
+    """(exact, loose) keys for one chat request."""
+    last_user = next((m.get("content") for m in reversed(messages or []) if m.get("role") == "user"), "")
+    return _digest([model_id, messages, tools]), _digest([model_id, last_user])
+
+
+def _latency_factor(latency: Any) -> float:
+    if latency in (None, "", "recorded"):
+        return 1.0
+    if latency == "zero":
+        return 0.0
+    return max(0.0, float(latency))
+
+
+class Cassette:
+    """One JSONL fixture file: {"key", "loose", "model", "messages", "response", "latency_s", "recorded_at"} per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._exact: Dict[str, List[Dict[str, Any]]] = {}
+        self._loose: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.stats = {"exact": 0, "loose": 0, "misses": 0, "recorded": 0}
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self._index(json.loads(line))
+                except ValueError:
+                    continue
+
+    def _index(self, entry: Dict[str, Any]) -> None:
+        self._exact.setdefault(entry["key"], []).append(entry)
+        if entry.get("loose"):
+            self._loose.setdefault(entry["loose"], []).append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._exact.values())
+
+    def lookup(self, keys: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        exact, loose = keys
+        with self._lock:
+            for kind, table, key in (("exact", self._exact, exact), ("loose", self._loose, loose)):
+                entries = table.get(key)
+                if entries:
+                    i = self._cursor.get(kind + key, 0)
+                    self._cursor[kind + key] = i + 1
+                    self.stats[kind] += 1
+                    return entries[i % len(entries)]
+            self.stats["misses"] += 1
+            return None
+
+    def record(self, keys: Tuple[str, str], model_id: Optional[str], messages: List[Dict[str, Any]],
+               response: Any, latency_s: float) -> None:
+        entry = {
+            "key": keys[0], "loose": keys[1], "model": model_id, "messages": messages,
+            "response": json.loads(json.dumps(response, default=str)),
+            "latency_s": round(latency_s, 4), "recorded_at": datetime.utcnow().isoformat(timespec="seconds"),
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._index(entry)
+            self.stats["recorded"] += 1
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: str) -> Cassette:
+    """One Cassette per file per process (shared by every model wrapping it)."""
+    key = os.path.abspath(path)
+    with _cassettes_lock:
+        if key not in _cassettes:
+            _cassettes[key] = Cassette(path)
+        return _cassettes[key]
+
+
+class CassetteModel:
+    """Drop-in for ModelInference in LLMGateway.chat / achat (tools are forwarded only when given)."""
+
+    def __init__(self, inner: Any, model_id: str, cassette: Cassette, mode: str = "replay", latency: Any = "recorded"):
+        if mode not in MODES:
+            raise ValueError(f"cassette mode must be one of {MODES}, got {mode!r}")
+        self.inner = inner
+        self.model_id = model_id
+        self.cassette = cassette
+        self.mode = mode
+        self.factor = _latency_factor(latency)
+
+    def _replay(self, keys) -> Optional[Tuple[Any, float]]:
+        if self.mode == "record":
+            return None
+        entry = self.cassette.lookup(keys)
+        if entry is None:
+            if self.mode == "replay" or self.inner is None:
+                raise CassetteMiss(f"no recording for {self.model_id} prompt {keys[0]}")
+            return None
+        return entry["response"], entry.get("latency_s", 0.0) * self.factor
+
+    def chat(self, messages=None, params=None, tools=None, tool_choice=None, **kwargs):
+        if tools is not None:
+            kwargs.update(tools=tools, tool_choice=tool_choice)
+        keys = exchange_keys(self.model_id, messages, tools)
+        hit = self._replay(keys)
+        if hit is not None:
+            if hit[1] > 0:
+                time.sleep(hit[1])
+            return hit[0]
+        t0 = time.monotonic()
+        resp = self.inner.chat(messages=messages, params=params, **kwargs)
+        self.cassette.record(keys, self.model_id, messages, resp, time.monotonic() - t0)
+        return resp
+
+    async def achat(self, messages=None, params=None, tools=None, tool_choice=None, **kwargs):
+        if tools is not None:
+            kwargs.update(tools=tools, tool_choice=tool_choice)
+        keys = exchange_keys(self.model_id, messages, tools)
+        hit = self._replay(keys)
+        if hit is not None:
+            if hit[1] > 0:
+                await asyncio.sleep(hit[1])
+            return hit[0]
+        t0 = time.monotonic()
+        if hasattr(self.inner, "achat"):
+            resp = await self.inner.achat(messages=messages, params=params, **kwargs)
+        else:
+            resp = await asyncio.to_thread(self.inner.chat, messages=messages, params=params, **kwargs)
+        self.cassette.record(keys, self.model_id, messages, resp, time.monotonic() - t0)
+        return resp
+
+
+def cassette_model(model: Any, model_id: str, path: Optional[str], mode: str = "replay", latency: Any = "recorded"):
+    """Wrap `model` per the cassette settings; returns it unchanged when no cassette is configured.
+    In replay mode `model` may be None (no SDK / credentials needed)."""
+    if not path or mode == "off":
+        return model
+    if model is None and mode != "replay":
+        return None
+    return CassetteModel(model, model_id, get_cassette(path), mode, latency)
+
+
+def replay_only(path: Optional[str], mode: str) -> bool:
+    """True when calls are served from the cassette alone (no credentials required)."""
+    return bool(path) and mode == "replay"
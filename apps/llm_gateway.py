@@ -0,0 +1,455 @@
+# llm_gateway.py — shared, resilient front door for watsonx chat calls
+# ----------------------------------------------------------------------
+# Used by both medbird_chatbot.py and summary_generator.py.
+#
+#   gw = get_gateway("chat", deadline_s=8.0)
+#   resp = gw.chat(model, messages, params)   # raises LLMUnavailable
+#
+# Every call gets:
+#   - a hard deadline (the Streamlit thread never waits longer than this)
+#   - jittered retries on transient errors (timeouts, 429, 5xx, resets)
+#   - optional hedging: a duplicate request once a call exceeds the p95
+#   - a circuit breaker shared per upstream; while it is open callers get
+#     LLMUnavailable immediately and use their deterministic fallback.
+#     An attempt that timed out still queued behind hung calls on the
+#     worker pool never reached watsonx, so it gives no verdict
+#     (PoolSaturated): it neither opens the breaker nor burns its probe
+#   - admission through the process-wide RateLimiter (llm_ratelimit.py):
+#     a token from the gateway's budget before every upstream attempt,
+#     and coalescing of identical in-flight requests
+#
+#   resp = await gw.achat(model, messages, params)   # same policy, asyncio
+#
+# achat uses model.achat when the SDK has it (otherwise model.chat on the
+# gateway's thread pool), so an event loop can hold thousands of pending
+# conversations without a thread parked per call (booking_api.py).
+# ----------------------------------------------------------------------
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from llm_ratelimit import PRIORITY_BACKGROUND, RateLimiter, SingleFlight, get_limiter, request_key
+
+
+class LLMUnavailable(Exception):
+    """No completion within the deadline (or breaker open). Callers fall back."""
+
+
+class PoolSaturated(TimeoutError):
+    """The attempt timed out before a pool worker picked it up (all busy with hung calls)."""
+
+
+# _aattempt's list of pool jobs for the attempt in flight (see LLMGateway._in_pool)
+_POOL_STARTS: ContextVar[Optional[List[threading.Event]]] = ContextVar("llm_pool_starts", default=None)
+
+
+# ---------------------------
+# Error classification
+# ---------------------------
+_TRANSIENT_MARKERS = (
+    "timeout", "timed out", "temporarily", "unavailable", "connection",
+    "reset", "429", "too many requests", "rate limit", "500", "502", "503", "504",
+)
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    msg = str(exc).lower()
+    return any(m in msg for m in _TRANSIENT_MARKERS)
+
+
+# ---------------------------
+# Circuit breaker
+# ---------------------------
+class CircuitBreaker:
+    """closed → open after N consecutive failures; half-open probe after cooldown."""
+
+    def __init__(self, failure_threshold: int = 5, reset_after_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_after_s:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after_s:
+                return False
+            # half-open: let exactly one probe through
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self) -> None:
+        """Give back a half-open probe slot without a verdict (e.g. locally throttled)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def shared_breaker(upstream: str = "watsonx") -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        if upstream not in _BREAKERS:
+            _BREAKERS[upstream] = CircuitBreaker()
+        return _BREAKERS[upstream]
+
+
+# ---------------------------
+# Latency tracking (for hedging)
+# ---------------------------
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            data = sorted(self._samples)
+        idx = min(len(data) - 1, max(0, int(round(q * (len(data) - 1)))))
+        return data[idx]
+
+
+# ---------------------------
+# Gateway
+# ---------------------------
+class LLMGateway:
+    def __init__(
+        self,
+        name: str,
+        deadline_s: float = 8.0,
+        max_retries: int = 2,
+        backoff_base_s: float = 0.25,
+        backoff_cap_s: float = 2.0,
+        hedge: bool = False,
+        hedge_min_samples: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+        max_workers: int = 8,
+        budget: Optional[str] = None,
+        priority: int = PRIORITY_BACKGROUND,
+        limiter: Optional[RateLimiter] = None,
+        coalesce: bool = True,
+    ):
+        self.name = name
+        self.deadline_s = deadline_s
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_cap_s = backoff_cap_s
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or shared_breaker()
+        self.latency = LatencyWindow()
+        self.budget = budget or name
+        self.priority = priority
+        self.limiter = limiter or get_limiter()
+        self.coalesce = coalesce
+        self.max_workers = max_workers
+        self._flights = SingleFlight()
+        self._aflights: Dict[Any, "asyncio.Future"] = {}
+        self.stats = {"calls": 0, "ok": 0, "retries": 0, "hedges": 0, "timeouts": 0, "short_circuited": 0, "errors": 0, "throttled": 0, "saturated": 0}
+        self._stats_lock = threading.Lock()
+        # Worker threads outlive a timed-out call; keep the pool bounded.
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"llm-{name}")
+
+    def _bump(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter: U(0, min(cap, base * 2^attempt))
+        return random.uniform(0, min(self.backoff_cap_s, self.backoff_base_s * (2 ** attempt)))
+
+    def _timed(self, fn: Callable[[], Any]) -> Any:
+        t0 = time.monotonic()
+        out = fn()
+        self.latency.add(time.monotonic() - t0)
+        return out
+
+    def _attempt(self, fn: Callable[[], Any], budget_s: float) -> Any:
+        """One logical attempt (possibly hedged) bounded by budget_s."""
+        started = threading.Event()
+
+        def run():
+            started.set()
+            return self._timed(fn)
+
+        futures = [self._pool.submit(run)]
+        hedge_after = None
+        if self.hedge and len(self.latency) >= self.hedge_min_samples:
+            hedge_after = self.latency.percentile(0.95)
+        end = time.monotonic() + budget_s
+
+        if hedge_after is not None and hedge_after < budget_s:
+            done, _ = wait(futures, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            # a hedge is only worth it if it doesn't have to queue for quota
+            if not done and self.limiter.acquire(self.budget, self.priority, timeout=0):
+                self._bump("hedges")
+                futures.append(self._pool.submit(run))
+
+        last_exc: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for f in done:
+                exc = f.exception()
+                if exc is None:
+                    for p in pending:
+                        p.cancel()
+                    return f.result()
+                last_exc = exc
+        if last_exc is not None and not pending:
+            raise last_exc
+        for p in pending:
+            p.cancel()
+        if not started.is_set():
+            raise PoolSaturated(f"all {self.max_workers} workers busy for {budget_s:.2f}s")
+        raise TimeoutError(f"no response within {budget_s:.2f}s")
+
+    def _no_verdict(self, e: PoolSaturated) -> LLMUnavailable:
+        self._bump("saturated")
+        self.breaker.release()
+        return LLMUnavailable(f"{self.name}: {e}")
+
+    def call(self, fn: Callable[[], Any], deadline_s: Optional[float] = None) -> Any:
+        """Run fn() under deadline/retry/hedge/breaker policy."""
+        self._bump("calls")
+        if not self.breaker.allow():
+            self._bump("short_circuited")
+            raise LLMUnavailable(f"{self.name}: circuit open")
+
+        deadline = time.monotonic() + (deadline_s if deadline_s is not None else self.deadline_s)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._bump("timeouts")
+                self.breaker.record_failure()
+                raise LLMUnavailable(f"{self.name}: deadline exceeded")
+            if not self.limiter.acquire(self.budget, self.priority, timeout=remaining):
+                self._bump("throttled")
+                self.breaker.release()
+                raise LLMUnavailable(f"{self.name}: no rate-limit token within deadline")
+            try:
+                out = self._attempt(fn, deadline - time.monotonic())
+                self.breaker.record_success()
+                self._bump("ok")
+                return out
+            except PoolSaturated as e:
+                raise self._no_verdict(e) from e
+            except Exception as e:
+                if isinstance(e, TimeoutError):
+                    self._bump("timeouts")
+                transient = is_transient(e)
+                if not transient or attempt >= self.max_retries:
+                    self._bump("errors")
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"{self.name}: {e}") from e
+                pause = self._backoff(attempt)
+                if time.monotonic() + pause >= deadline:
+                    self._bump("errors")
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"{self.name}: {e}") from e
+                self._bump("retries")
+                time.sleep(pause)
+                attempt += 1
+
+    def chat(self, model: Any, messages: List[Dict[str, Any]], params: Any = None, deadline_s: Optional[float] = None, **chat_kwargs) -> Any:
+        """model.chat(messages=..., params=..., **chat_kwargs) under the gateway policy."""
+        run = lambda: self.call(lambda: model.chat(messages=messages, params=params, **chat_kwargs), deadline_s=deadline_s)
+        if not self.coalesce:
+            return run()
+        p = params.to_dict() if hasattr(params, "to_dict") else params
+        key = request_key(getattr(model, "model_id", None), messages, p, chat_kwargs)
+        try:
+            return self._flights.do(key, run, timeout=deadline_s if deadline_s is not None else self.deadline_s)
+        except TimeoutError as e:
+            raise LLMUnavailable(f"{self.name}: coalesced request timed out") from e
+
+    # ---------------------------
+    # asyncio variant
+    # ---------------------------
+    async def _aattempt(self, make: Callable[[], Awaitable[Any]], budget_s: float) -> Any:
+        async def timed():
+            t0 = time.monotonic()
+            out = await make()
+            self.latency.add(time.monotonic() - t0)
+            return out
+
+        starts: List[threading.Event] = []
+        token = _POOL_STARTS.set(starts)
+        tasks = [asyncio.ensure_future(timed())]
+        end = time.monotonic() + budget_s
+        hedge_after = None
+        if self.hedge and len(self.latency) >= self.hedge_min_samples:
+            hedge_after = self.latency.percentile(0.95)
+        try:
+            if hedge_after is not None and hedge_after < budget_s:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done and self.limiter.acquire(self.budget, self.priority, timeout=0):
+                    self._bump("hedges")
+                    tasks.append(asyncio.ensure_future(timed()))
+            last_exc: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    last_exc = t.exception()
+            if last_exc is not None and not pending:
+                raise last_exc
+            if starts and not any(s.is_set() for s in starts):
+                raise PoolSaturated(f"all {self.max_workers} workers busy for {budget_s:.2f}s")
+            raise TimeoutError(f"no response within {budget_s:.2f}s")
+        finally:
+            _POOL_STARTS.reset(token)
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    def _in_pool(self, loop, fn: Callable[[], Any]) -> "asyncio.Future":
+        """fn on the gateway pool, letting _aattempt see whether it ever left the queue."""
+        started = threading.Event()
+        starts = _POOL_STARTS.get()
+        if starts is not None:
+            starts.append(started)
+
+        def run():
+            started.set()
+            return fn()
+
+        return loop.run_in_executor(self._pool, run)
+
+    async def acall(self, make: Callable[[], Awaitable[Any]], deadline_s: Optional[float] = None) -> Any:
+        """await make() under the same deadline/retry/hedge/breaker policy as call()."""
+        self._bump("calls")
+        if not self.breaker.allow():
+            self._bump("short_circuited")
+            raise LLMUnavailable(f"{self.name}: circuit open")
+
+        deadline = time.monotonic() + (deadline_s if deadline_s is not None else self.deadline_s)
+        attempt = 0
+        while True:
+            if deadline - time.monotonic() <= 0:
+                self._bump("timeouts")
+                self.breaker.record_failure()
+                raise LLMUnavailable(f"{self.name}: deadline exceeded")
+            if not await self.limiter.aacquire(self.budget, self.priority, timeout=deadline - time.monotonic()):
+                self._bump("throttled")
+                self.breaker.release()
+                raise LLMUnavailable(f"{self.name}: no rate-limit token within deadline")
+            try:
+                out = await self._aattempt(make, deadline - time.monotonic())
+                self.breaker.record_success()
+                self._bump("ok")
+                return out
+            except PoolSaturated as e:
+                raise self._no_verdict(e) from e
+            except Exception as e:
+                if isinstance(e, TimeoutError):
+                    self._bump("timeouts")
+                if not is_transient(e) or attempt >= self.max_retries:
+                    self._bump("errors")
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"{self.name}: {e}") from e
+                pause = self._backoff(attempt)
+                if time.monotonic() + pause >= deadline:
+                    self._bump("errors")
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"{self.name}: {e}") from e
+                self._bump("retries")
+                await asyncio.sleep(pause)
+                attempt += 1
+
+    async def achat(self, model: Any, messages: List[Dict[str, Any]], params: Any = None, deadline_s: Optional[float] = None, **chat_kwargs) -> Any:
+        """Async chat(): model.achat if the SDK has it, else model.chat on the gateway pool."""
+        loop = asyncio.get_running_loop()
+        if hasattr(model, "achat"):
+            make = lambda: model.achat(messages=messages, params=params, **chat_kwargs)
+        else:
+            make = lambda: self._in_pool(loop, lambda: model.chat(messages=messages, params=params, **chat_kwargs))
+        if not self.coalesce:
+            return await self.acall(make, deadline_s)
+        p = params.to_dict() if hasattr(params, "to_dict") else params
+        key = (id(loop), request_key(getattr(model, "model_id", None), messages, p, chat_kwargs))
+        leader = self._aflights.get(key)
+        if leader is not None:
+            return await asyncio.shield(leader)
+        fut = self._aflights[key] = loop.create_future()
+        try:
+            out = await self.acall(make, deadline_s)
+            fut.set_result(out)
+            return out
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()    # followers re-raise it; don't warn when there are none
+            raise
+        finally:
+            self._aflights.pop(key, None)
+
+
+
+_GATEWAYS: Dict[str, LLMGateway] = {}
+_GATEWAYS_LOCK = threading.Lock()
+
+
+def get_gateway(name: str, **kwargs) -> LLMGateway:
+    """Process-wide gateway per name; kwargs only apply on first creation."""
+    with _GATEWAYS_LOCK:
+        gw = _GATEWAYS.get(name)
+        if gw is None:
+            gw = _GATEWAYS[name] = LLMGateway(name, **kwargs)
+        return gw
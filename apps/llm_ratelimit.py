@@ -0,0 +1,220 @@
+# llm_ratelimit.py — process-wide admission control for watsonx calls
+# ----------------------------------------------------------------------
+# One limiter is shared by every Streamlit session in the process:
+#   - token buckets per budget ("chat", "summary") plus one "upstream"
+#     bucket modelling the project-wide watsonx quota
+#   - waiters are served in priority order (PRIORITY_PATIENT before
+#     PRIORITY_BACKGROUND), FIFO within a priority; a waiter whose own
+#     budget is empty never blocks other budgets
+#   - aacquire: the same queue for asyncio callers; an async waiter is
+#     woken (call_soon_threadsafe) when the queue changes or when its
+#     tokens are due, so the loop never polls and priority order holds
+#     across threads and coroutines
+#   - SingleFlight coalesces identical in-flight requests into one call
+# ----------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+PRIORITY_PATIENT = 0       # ai_driver turns — a patient is waiting
+PRIORITY_BACKGROUND = 10   # handoff summaries, batch jobs
+
+
+class TokenBucket:
+    """Not thread-safe on its own; RateLimiter holds the lock."""
+
+    def __init__(self, rate_per_s: float, burst: float):
+        self.rate = float(rate_per_s)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self._ts = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def wait_time(self) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "budget", "wake")
+
+    def __init__(self, priority: int, seq: int, budget: str, wake: Optional[Callable[[], None]] = None):
+        self.priority, self.seq, self.budget = priority, seq, budget
+        self.wake = wake      # async waiters only; thread waiters sit on the condition
+
+    def key(self):
+        return (self.priority, self.seq)
+
+
+class RateLimiter:
+    def __init__(self, upstream_rps: float = 8.0, upstream_burst: float = 8.0):
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, TokenBucket] = {"upstream": TokenBucket(upstream_rps, upstream_burst)}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.stats = {"granted": 0, "rejected": 0, "waited_s": 0.0}
+
+    def configure(self, budget: str, rate_per_s: float, burst: Optional[float] = None) -> None:
+        # Called on every Streamlit rerun: update limits in place so the
+        # current token level survives instead of resetting to a full burst.
+        burst = burst if burst is not None else max(1.0, rate_per_s)
+        with self._cond:
+            b = self._buckets.get(budget)
+            if b is None:
+                self._buckets[budget] = TokenBucket(rate_per_s, burst)
+            elif (b.rate, b.burst) != (float(rate_per_s), float(burst)):
+                b.refill(time.monotonic())
+                b.rate, b.burst = float(rate_per_s), float(burst)
+                b.tokens = min(b.tokens, b.burst)
+            self._changed()
+
+    def _changed(self) -> None:
+        """Queue or limits changed: every waiter re-checks whether it is now the head."""
+        self._cond.notify_all()
+        for w in self._waiters:
+            if w.wake is not None:
+                w.wake()
+
+    def _head_for(self, now: float) -> Optional[_Waiter]:
+        """Highest-priority waiter whose own budget currently has a token."""
+        best = None
+        for w in self._waiters:
+            b = self._buckets.get(w.budget)
+            if b is not None:
+                b.refill(now)
+                if b.tokens < 1:
+                    continue
+            if best is None or w.key() < best.key():
+                best = w
+        return best
+
+    def _try_grant(self, me: _Waiter, t0: float, end: Optional[float]):
+        """Under the lock: (True, 0) when `me` got its tokens, (False, 0) past `end`,
+        else (None, seconds until it is worth checking again)."""
+        now = time.monotonic()
+        up = self._buckets["upstream"]
+        up.refill(now)
+        own = self._buckets.get(me.budget)
+        if self._head_for(now) is me and up.tokens >= 1:
+            up.tokens -= 1
+            if own is not None:
+                own.tokens -= 1
+            self.stats["granted"] += 1
+            self.stats["waited_s"] += now - t0
+            return True, 0.0
+        pause = max(up.wait_time(), own.wait_time() if own is not None else 0.0, 0.005)
+        if end is not None:
+            if now >= end:
+                self.stats["rejected"] += 1
+                return False, 0.0
+            pause = min(pause, end - now)
+        return None, pause
+
+    def acquire(self, budget: str, priority: int = PRIORITY_BACKGROUND, timeout: Optional[float] = None) -> bool:
+        """Block until a token for `budget` (and upstream) is granted. False on timeout."""
+        t0 = time.monotonic()
+        end = None if timeout is None else t0 + timeout
+        me = _Waiter(priority, next(self._seq), budget)
+        with self._cond:
+            self._waiters.append(me)
+            try:
+                while True:
+                    granted, pause = self._try_grant(me, t0, end)
+                    if granted is not None:
+                        return granted
+                    self._cond.wait(pause)
+            finally:
+                self._waiters.remove(me)
+                self._changed()
+
+    async def aacquire(self, budget: str, priority: int = PRIORITY_BACKGROUND, timeout: Optional[float] = None) -> bool:
+        """acquire() without blocking the event loop: same queue, woken instead of polling."""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass          # loop already closed; the waiter is gone with it
+
+        t0 = time.monotonic()
+        end = None if timeout is None else t0 + timeout
+        me = _Waiter(priority, next(self._seq), budget, wake)
+        with self._cond:
+            self._waiters.append(me)
+        try:
+            while True:
+                with self._cond:
+                    granted, pause = self._try_grant(me, t0, end)
+                    if granted is not None:
+                        return granted
+                    ready.clear()
+                try:
+                    await asyncio.wait_for(ready.wait(), pause)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._waiters.remove(me)
+                self._changed()
+
+
+_LIMITER: Optional[RateLimiter] = None
+_LIMITER_LOCK = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    global _LIMITER
+    with _LIMITER_LOCK:
+        if _LIMITER is None:
+            _LIMITER = RateLimiter()
+        return _LIMITER
+
+
+# ---------------------------
+# Request coalescing
+# ---------------------------
+def request_key(*parts: Any) -> str:
+    blob = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one execution of fn."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+        if not leader:
+            return fut.result(timeout=timeout)
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return fut.result()
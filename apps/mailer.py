@@ -0,0 +1,174 @@
+# mailer.py — SMTP sending for the outbox worker and the test-email tool
+# ----------------------------------------------------------------------
+#   smtp_send(cfg, "pat@example.com", subject, body)   # raises on failure
+#   send = outbox_sender(cfg)        # None unless [mail] is enabled + complete
+#   start_outbox_worker(db, send)
+#
+# The outbox sender goes through SmtpPool: a few logged-in connections kept
+# open between batches, and a claimed batch goes out over ONE of them
+# (send.batch) instead of a connect + STARTTLS + login per message.
+#
+# cfg is the settings dict from booking_core.load_settings (MAIL_* keys).
+# No Streamlit calls: this runs in worker threads and in booking_api.py.
+# ----------------------------------------------------------------------
+
+import smtplib
+import ssl
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from outbox import Undeliverable
+
+POOL_SIZE = 2
+POOL_IDLE_S = 60.0
+
+
+def extract_email(contact: Optional[str]) -> Optional[str]:
+    c = (contact or "").strip()
+    return c if ("@" in c and "." in c) else None
+
+
+def mail_configured(cfg: Dict[str, Any]) -> bool:
+    return bool(cfg.get("MAIL_HOST") and cfg.get("MAIL_USER") and cfg.get("MAIL_PASS") and cfg.get("MAIL_FROM"))
+
+
+def _message(cfg: Dict[str, Any], to_email: str, subject: str, body_text: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = cfg["MAIL_FROM"]
+    msg["To"] = to_email
+    msg.set_content(body_text)
+    return msg
+
+
+def _login(cfg: Dict[str, Any]) -> smtplib.SMTP:
+    server = smtplib.SMTP(cfg["MAIL_HOST"], cfg["MAIL_PORT"])
+    try:
+        server.ehlo()
+        server.starttls(context=ssl.create_default_context())
+        server.login(cfg["MAIL_USER"], cfg["MAIL_PASS"])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def smtp_send(cfg: Dict[str, Any], to_email: str, subject: str, body_text: str) -> None:
+    """Plain SMTP send (STARTTLS + login). Raises on failure."""
+    with _login(cfg) as server:
+        server.send_message(_message(cfg, to_email, subject, body_text))
+
+
+class SmtpPool:
+    """Logged-in SMTP connections reused across sends, at most `size` open at once.
+    A connection idle longer than `idle_s`, or one that failed a send, is replaced."""
+
+    def __init__(self, cfg: Dict[str, Any], size: int = POOL_SIZE, idle_s: float = POOL_IDLE_S):
+        self.cfg = cfg
+        self.idle_s = idle_s
+        self._free: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.stats = {"connects": 0, "sent": 0, "errors": 0}
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _acquire(self) -> smtplib.SMTP:
+        self._slots.acquire()
+        with self._lock:
+            while self._free:
+                server, at = self._free.pop()
+                if time.monotonic() - at < self.idle_s:
+                    return server
+                self._quit(server)
+        try:
+            server = _login(self.cfg)
+        except Exception:
+            self._slots.release()
+            raise
+        self.stats["connects"] += 1
+        return server
+
+    def _release(self, server: smtplib.SMTP, healthy: bool) -> None:
+        if healthy:
+            with self._lock:
+                self._free.append((server, time.monotonic()))
+        else:
+            self._quit(server)
+        self._slots.release()
+
+    def send_many(self, messages: List[Tuple[str, str, str]]) -> List[Optional[str]]:
+        """Send (to, subject, body) messages over one pooled connection; per message
+        None when sent, else the error text."""
+        out: List[Optional[str]] = []
+        server = None
+        for to_email, subject, body in messages:
+            try:
+                if server is None:
+                    server = self._acquire()
+                server.send_message(_message(self.cfg, to_email, subject, body))
+                out.append(None)
+                self.stats["sent"] += 1
+            except smtplib.SMTPRecipientsRefused as e:     # this address only; the connection is fine
+                out.append(str(e))
+                self.stats["errors"] += 1
+            except Exception as e:
+                out.append(str(e))
+                self.stats["errors"] += 1
+                if server is not None:
+                    self._release(server, False)
+                    server = None
+        if server is not None:
+            self._release(server, True)
+        return out
+
+
+_POOLS: Dict[Tuple[Any, ...], SmtpPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_smtp_pool(cfg: Dict[str, Any]) -> SmtpPool:
+    key = (cfg.get("MAIL_HOST"), cfg.get("MAIL_PORT"), cfg.get("MAIL_USER"))
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = SmtpPool(cfg)
+        return _POOLS[key]
+
+
+def outbox_sender(cfg: Dict[str, Any]) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """send(doc) for outbox.start_outbox_worker, with send.batch(docs) -> [(ok, error)] for a
+    claimed batch; None when mail is disabled (messages stay queued)."""
+    if not (cfg.get("MAIL_ENABLED") and mail_configured(cfg)):
+        return None
+    pool = get_smtp_pool(cfg)
+
+    def send_batch(docs: List[Dict[str, Any]]) -> List[Tuple[bool, Any]]:
+        # no address: failed for good, not retried (outbox.Undeliverable)
+        out: List[Tuple[bool, Any]] = [(False, Undeliverable("no email address"))] * len(docs)
+        idx, messages = [], []
+        for i, doc in enumerate(docs):
+            to_email = extract_email(doc.get("to"))
+            if to_email:
+                idx.append(i)
+                messages.append((to_email, doc.get("subject", ""), doc.get("body", "")))
+        for i, err in zip(idx, pool.send_many(messages)):
+            out[i] = (err is None, err)
+        return out
+
+    def send(doc: Dict[str, Any]) -> bool:
+        ok, err = send_batch([doc])[0]
+        if isinstance(err, Undeliverable):
+            raise err
+        if err:
+            raise RuntimeError(err)
+        return ok
+
+    send.batch = send_batch
+    return send
@@ -0,0 +1,184 @@
+# outbox.py — durable outgoing-message queue (db.outbox)
+# ----------------------------------------------------------------------
+# Anything that must reach a patient or staff member is written here
+# first, next to the state change that caused it, and sent by a worker:
+#
+#   enqueue(db, "waitlist_offer", "pat@example.com", subject, body,
+#           dedupe_key="offer|d001|2025-08-18T14:00:00|wl_1a2b3c4d")
+#   enqueue_many(db, [{"kind", "to", "subject", "body", "dedupe_key"}, ...])   # one insert
+#   start_outbox_worker(db, send_fn)    # once per process (daemon thread)
+#   notify()                            # wake the worker now
+#
+# Messages are claimed with a lease (pending → sending) by one atomic
+# update each, so several app processes can drain the same outbox without
+# sending anything twice; a crashed sender's lease simply runs out.
+# Failed sends are retried with backoff up to MAX_ATTEMPTS; an Undeliverable
+# error (no address to send to) fails the message at once. A sender with
+# a .batch(docs) method (mailer.outbox_sender) gets each claimed batch in
+# one call.
+# ----------------------------------------------------------------------
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+MAX_ATTEMPTS = 5
+LEASE_S = 60
+
+
+
+class Undeliverable(Exception):
+    """Raised (or returned as a batch error) by a sender when retrying cannot help."""
+
+
+_wake = threading.Event()
+_worker_lock = threading.Lock()
+_worker_started = False
+
+
+def ensure_outbox_indexes(db) -> None:
+    try:
+        db.outbox.create_index([("status", 1), ("next_attempt_at", 1)], name="due")
+        db.outbox.create_index("dedupe_key", name="dedupe", unique=True, sparse=True)
+    except Exception:
+        pass
+
+
+def notify() -> None:
+    _wake.set()
+
+
+def _outbox_doc(kind: str, to: str, subject: str, body: str, dedupe_key: Optional[str],
+                meta: Optional[Dict[str, Any]], now: datetime) -> Dict[str, Any]:
+    doc = {
+        "kind": kind, "to": to, "subject": subject, "body": body, "meta": meta or {},
+        "status": "pending", "attempts": 0, "created_at": now, "next_attempt_at": now,
+    }
+    if dedupe_key:
+        doc["dedupe_key"] = dedupe_key
+    return doc
+
+
+def enqueue(db, kind: str, to: str, subject: str, body: str,
+            dedupe_key: Optional[str] = None, meta: Optional[Dict[str, Any]] = None) -> bool:
+    """False if the message was already queued (same dedupe_key) or the insert failed."""
+    if db is None or not to:
+        return False
+    try:
+        db.outbox.insert_one(_outbox_doc(kind, to, subject, body, dedupe_key, meta, datetime.utcnow()))
+    except Exception:
+        return False
+    notify()
+    return True
+
+
+def enqueue_many(db, messages: List[Dict[str, Any]]) -> int:
+    """enqueue() for a batch in one unordered insert; returns how many were queued
+    (duplicates of already-queued dedupe_keys are skipped)."""
+    now = datetime.utcnow()
+    docs = [_outbox_doc(m["kind"], m["to"], m["subject"], m["body"], m.get("dedupe_key"), m.get("meta"), now)
+            for m in messages if m.get("to")]
+    if db is None or not docs:
+        return 0
+    try:
+        queued = len(db.outbox.insert_many(docs, ordered=False).inserted_ids)
+    except Exception as e:               # BulkWriteError: the rest went in
+        queued = int((getattr(e, "details", None) or {}).get("nInserted", 0))
+    if queued:
+        notify()
+    return queued
+
+
+def claim_batch(db, limit: int = 50, lease_s: int = LEASE_S) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    out = []
+    for _ in range(limit):
+        doc = db.outbox.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "lease_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": "sending", "lease_until": now + timedelta(seconds=lease_s)}, "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=True,
+        )
+        if doc is None:
+            break
+        out.append(doc)
+    return out
+
+
+def _finish(db, doc: Dict[str, Any], ok: bool, error: Any = None) -> None:
+    permanent = isinstance(error, Undeliverable)
+    if permanent:
+        error = str(error)
+    if ok:
+        update = {"$set": {"status": "sent", "sent_at": datetime.utcnow()}, "$unset": {"lease_until": ""}}
+    elif permanent or doc.get("attempts", 1) >= MAX_ATTEMPTS:
+        update = {"$set": {"status": "failed", "error": error}, "$unset": {"lease_until": ""}}
+    else:
+        backoff = min(600, 5 * 2 ** doc.get("attempts", 1))
+        update = {"$set": {"status": "pending", "error": error,
+                           "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff)},
+                  "$unset": {"lease_until": ""}}
+    db.outbox.update_one({"_id": doc["_id"], "status": "sending"}, update)
+
+
+def drain(db, send: Callable[[Dict[str, Any]], bool], limit: int = 50) -> int:
+    """Send up to `limit` due messages; returns how many were sent."""
+    sent = 0
+    docs = claim_batch(db, limit)
+    batch = getattr(send, "batch", None)
+    if batch is not None and docs:
+        try:
+            results = batch(docs)
+        except Exception as e:
+            results = [(False, str(e))] * len(docs)
+        for doc, (ok, err) in zip(docs, results):
+            _finish(db, doc, ok, err if not ok else None)
+            sent += ok
+        return sent
+    for doc in docs:
+        try:
+            ok, err = bool(send(doc)), None
+        except Undeliverable as e:
+            ok, err = False, e
+        except Exception as e:
+            ok, err = False, str(e)
+        _finish(db, doc, ok, err if not ok else None)
+        sent += ok
+    return sent
+
+
+def start_outbox_worker(db, send: Optional[Callable[[Dict[str, Any]], bool]], interval_s: float = 5.0,
+                        ticks: Optional[List[Callable[[], None]]] = None) -> bool:
+    """Daemon thread draining the outbox (once per process). `ticks` run on every loop
+    (e.g. the waitlist offer sweeper); with send=None messages just stay queued.
+    Returns False if already running or no db."""
+    global _worker_started
+    if db is None:
+        return False
+    with _worker_lock:
+        if _worker_started:
+            return False
+        _worker_started = True
+    ensure_outbox_indexes(db)
+
+    def run():
+        while True:
+            for tick in ticks or ():
+                try:
+                    tick()
+                except Exception:
+                    pass
+            try:
+                while send is not None and drain(db, send):
+                    pass
+            except Exception:
+                time.sleep(interval_s)
+            _wake.wait(interval_s)
+            _wake.clear()
+
+    threading.Thread(target=run, name="outbox-worker", daemon=True).start()
+    return True
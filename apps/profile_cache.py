@@ -0,0 +1,169 @@
+# profile_cache.py — read-through LRU + TTL cache of patient profiles (db.users)
+# ----------------------------------------------------------------------
+#   user  = profile_for_contact(users, "Jane.Doe@EXAMPLE.com")      # dict or None
+#   found = profiles_for_keys(users, [["email:jane.doe@example.com"], ["name:sam lee"]])
+#   get_profile_cache().invalidate(keys)                           # after a users write
+#
+# Entries are keyed by identity key (identity.lookup_keys: the canonical
+# email / phone, else name + DOB), so "Jane.Doe@EXAMPLE.com" and
+# "jane.doe@example.com" share one entry. Misses are cached too, for a
+# shorter NEGATIVE_TTL_S, so a new patient typing their contact doesn't
+# cost a round trip per turn.
+#
+# BookingService invalidates every key of a profile it writes
+# (write-through), so the booking process never serves a stale profile.
+# Other processes (the summarizer) only see those writes once their
+# entries expire — staleness there is bounded by PROFILE_CACHE_TTL_S.
+#
+# Cached profiles are shared between callers: treat them as read-only.
+# ----------------------------------------------------------------------
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from identity import identity_ready, lookup_filter, lookup_keys, user_identity_fields
+from intake import USER_PROJECTION
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000") or 10000)
+PROFILE_CACHE_TTL_S = float(os.getenv("PROFILE_CACHE_TTL_S", "300") or 300)
+NEGATIVE_TTL_S = 30.0
+
+_MISS = object()
+
+
+class ProfileCache:
+    """Thread-safe LRU of {identity key: profile or None} with per-entry expiry."""
+
+    def __init__(self, max_entries: int = PROFILE_CACHE_SIZE, ttl_s: float = PROFILE_CACHE_TTL_S,
+                 negative_ttl_s: float = NEGATIVE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.negative_ttl_s = negative_ttl_s
+        self._entries: "OrderedDict[str, Tuple[Optional[Dict[str, Any]], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Any:
+        """The cached profile (None for a cached miss), or _MISS when unknown / expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.stats["misses"] += 1
+                return _MISS
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, keys: Iterable[str], profile: Optional[Dict[str, Any]]) -> None:
+        expires = time.monotonic() + (self.ttl_s if profile is not None else self.negative_ttl_s)
+        with self._lock:
+            for k in keys:
+                self._entries[k] = (profile, expires)
+                self._entries.move_to_end(k)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for k in keys:
+                if self._entries.pop(k, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_CACHE: Optional[ProfileCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_profile_cache() -> ProfileCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ProfileCache()
+        return _CACHE
+
+# -------------------------------------------------
+# Read-through
+# -------------------------------------------------
+
+def profile_keys(user: Dict[str, Any]) -> List[str]:
+    """Every identity key of a profile (stored identity_keys, else computed)."""
+    return list(user.get("identity_keys") or user_identity_fields(user)["identity_keys"])
+
+
+def _contact_keys(user: Dict[str, Any]) -> List[str]:
+    # a name alone may belong to several profiles; only contacts are cached on the profile's behalf
+    return [k for k in profile_keys(user) if k.startswith(("email:", "tel:"))]
+
+
+def profile_for_contact(users_col, contact: Optional[str], name: Optional[str] = None,
+                        dob: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The profile behind a contact (or name + DOB), from the cache when possible."""
+    keys = lookup_keys(contact, name, dob)
+    if not keys:
+        return None
+    cache = get_profile_cache()
+    for k in keys:
+        hit = cache.get(k)
+        if hit is not _MISS:
+            return hit
+    if users_col is None:
+        return None
+    try:
+        user = users_col.find_one(lookup_filter(contact, name, dob, legacy=not identity_ready(users_col)),
+                                  USER_PROJECTION)
+    except Exception:
+        return None
+    cache.put(keys, user)
+    if user is not None:
+        cache.put(_contact_keys(user), user)
+    return user
+
+
+def profiles_for_keys(users_col, key_lists: List[List[str]], legacy_ors: Optional[List[Dict[str, Any]]] = None
+                      ) -> List[Optional[Dict[str, Any]]]:
+    """One profile (or None) per key list; cache hits first, then ONE users query for the rest.
+    `legacy_ors` are extra $or clauses for profiles the identity backfill hasn't reached;
+    profiles they find are matched by their computed keys."""
+    cache = get_profile_cache()
+    out: List[Any] = []
+    for keys in key_lists:
+        found = _MISS
+        for k in keys:
+            found = cache.get(k)
+            if found is not _MISS:
+                break
+        out.append(found)
+    missing = sorted({k for keys, got in zip(key_lists, out) if got is _MISS for k in keys})
+    if missing and users_col is not None:
+        ors: List[Dict[str, Any]] = [{"identity_keys": {"$in": missing}}] + list(legacy_ors or [])
+        try:
+            users = list(users_col.find({"$or": ors}, USER_PROJECTION))
+        except Exception:
+            users = None
+        if users is not None:
+            by_key: Dict[str, Dict[str, Any]] = {}
+            for u in users:
+                for k in profile_keys(u):
+                    by_key.setdefault(k, u)
+            for i, keys in enumerate(key_lists):
+                if out[i] is not _MISS:
+                    continue
+                out[i] = next((by_key[k] for k in keys if k in by_key), None)
+                cache.put(keys, out[i])
+                if out[i] is not None:
+                    cache.put(_contact_keys(out[i]), out[i])
+    return [None if u is _MISS else u for u in out]
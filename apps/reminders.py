@@ -0,0 +1,260 @@
+# reminders.py — T-24h / T-1h appointment reminders from an in-process heap
+# ----------------------------------------------------------------------
+#   start_reminder_scheduler(db, cal)        # once per process (daemon thread)
+#   schedule_reminders(appt)                 # booking / reschedule
+#   drop_reminders(booking_id)               # cancellation
+#
+# Each process keeps the reminders due in the next WINDOW in a min-heap
+# ordered by fire time: inserts are O(log n) and the thread sleeps until
+# the earliest one (or until an earlier one is pushed). Only that window
+# is ever read from Mongo — on start, then again as it runs down — with
+# one range query per lead over the (status, slot_start) index, so a
+# restart reloads the next few hours, never the appointments collection.
+# Cancelled / moved bookings are dropped lazily: a popped entry whose
+# booking no longer has that slot_start is skipped.
+#
+# Due reminders are re-checked against Mongo in one $in per batch (still
+# confirmed, same slot) and queued in db.outbox with one insert; the
+# dedupe key is booking + slot + lead, so replicas firing the same
+# reminder queue it once and a rescheduled appointment gets fresh ones.
+# The outbox worker sends them in batches over mailer's pooled SMTP
+# connections. Reminders that came due while nothing was running are
+# still sent up to GRACE late.
+#
+#   python apps/reminders.py pending [--hours 24]     # what would fire
+#   (MONGO_URI / DB_NAME / CLINIC_TZ from the environment)
+# ----------------------------------------------------------------------
+
+import argparse
+import heapq
+import itertools
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from clinic_calendar import get_calendar
+from mailer import extract_email
+from outbox import enqueue_many
+
+LEADS = (("24h", timedelta(hours=24)), ("1h", timedelta(hours=1)))
+WINDOW = timedelta(hours=6)
+GRACE = timedelta(minutes=30)
+MAX_SLEEP_S = 60.0
+FIRE_BATCH = 500
+
+REMINDER_PROJECTION = {
+    "_id": 0, "booking_id": 1, "contact": 1, "patient_name": 1, "doctor_name": 1,
+    "location": 1, "visit_type": 1, "slot_start": 1, "status": 1,
+}
+
+Entry = Tuple[datetime, int, str, str, datetime]     # (fire_at, seq, booking_id, lead, slot_start)
+
+
+def _utc(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def ensure_reminder_indexes(db) -> None:
+    try:
+        db.appointments.create_index([("status", 1), ("slot_start", 1)], name="upcoming")
+    except Exception:
+        pass
+
+
+def reminder_message(appt: Dict[str, Any], lead: str, cal) -> Tuple[str, str]:
+    """(subject, body) of one reminder."""
+    local = cal.to_local(appt["slot_start"])
+    when = f"{local.strftime('%A, %B %d')} at {local.strftime('%I:%M %p').lstrip('0')}"
+    soon = "tomorrow" if lead == "24h" else "in about an hour"
+    subject = f"Reminder: your appointment with {appt.get('doctor_name')} is {soon}"
+    where = "Online (telehealth)" if appt.get("visit_type") == "telehealth" else (appt.get("location") or "Clinic")
+    body = f"""Hi {appt.get('patient_name') or 'there'},
+
+This is a reminder of your appointment with {appt.get('doctor_name')}.
+
+When: {when}
+Where: {where}
+
+Can't make it? Tell the MedBird assistant "cancel {appt.get('booking_id')}" (or "reschedule
+{appt.get('booking_id')} to <day> <time>") together with this email address, and the slot
+goes to the next patient waiting.
+
+— MedBird"""
+    return subject, body
+
+
+class ReminderScheduler:
+    def __init__(self, db, cal, window: timedelta = WINDOW, grace: timedelta = GRACE):
+        self.db, self.cal = db, cal
+        self.window, self.grace = window, grace
+        self._heap: List[Entry] = []
+        self._queued: Set[Tuple[str, str, datetime]] = set()   # (booking_id, lead, slot_start) in the heap
+        self._slots: Dict[str, datetime] = {}                   # booking_id -> the slot its entries are for
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._horizon: Optional[datetime] = None                # fire times up to here are loaded
+        self.stats = {"loaded": 0, "pushed": 0, "fired": 0, "queued": 0, "stale": 0}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _push(self, booking_id: str, lead: str, fire_at: datetime, slot: datetime) -> bool:
+        # caller holds self._cond
+        if (booking_id, lead, slot) in self._queued:
+            return False
+        self._queued.add((booking_id, lead, slot))
+        heapq.heappush(self._heap, (fire_at, next(self._seq), booking_id, lead, slot))
+        return True
+
+    def push(self, appt: Dict[str, Any], now: Optional[datetime] = None, late_ok: bool = False) -> int:
+        """Schedule an appointment's reminders that fall inside the window; returns how many."""
+        bid, ss = appt.get("booking_id"), appt.get("slot_start")
+        if not (bid and isinstance(ss, datetime) and extract_email(appt.get("contact"))):
+            return 0
+        slot, now = _utc(ss), now or datetime.utcnow()
+        earliest = now - self.grace if late_ok else now
+        n = 0
+        with self._cond:
+            top = self._heap[0][0] if self._heap else None
+            for lead, before in LEADS:
+                fire_at = slot - before
+                if earliest <= fire_at < now + self.window:
+                    n += self._push(bid, lead, fire_at, slot)
+            if n or bid in self._slots:
+                self._slots[bid] = slot       # a move outside the window still makes old entries stale
+            if n and (top is None or self._heap[0][0] < top):
+                self._cond.notify()           # earlier than what the thread sleeps towards
+        self.stats["pushed"] += n
+        return n
+
+    def drop(self, booking_id: str) -> None:
+        with self._cond:
+            self._slots.pop(booking_id, None)
+
+    def refill(self, now: Optional[datetime] = None) -> int:
+        """Load reminders firing between the current horizon and now + window."""
+        now = now or datetime.utcnow()
+        start, end = (self._horizon or now - self.grace), now + self.window
+        if end <= start:
+            return 0
+        n = 0
+        for _lead, before in LEADS:
+            cur = self.db.appointments.find(
+                {"status": "confirmed", "slot_start": {"$gte": start + before, "$lt": end + before}},
+                REMINDER_PROJECTION)
+            for appt in cur:
+                n += self.push(appt, now, late_ok=True)
+        self._horizon = end
+        self.stats["loaded"] += n
+        return n
+
+    def pop_due(self, now: Optional[datetime] = None, limit: int = FIRE_BATCH) -> List[Entry]:
+        now = now or datetime.utcnow()
+        out: List[Entry] = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now and len(out) < limit:
+                entry = heapq.heappop(self._heap)
+                self._queued.discard((entry[2], entry[3], entry[4]))
+                if self._slots.get(entry[2]) != entry[4]:
+                    self.stats["stale"] += 1          # cancelled / moved since it was pushed
+                    continue
+                if entry[3] == LEADS[-1][0]:
+                    del self._slots[entry[2]]         # its last reminder
+                out.append(entry)
+        return out
+
+    def fire(self, due: List[Entry]) -> int:
+        """Re-check the due bookings in one query and queue their reminders in one insert."""
+        if not due:
+            return 0
+        ids = sorted({e[2] for e in due})
+        current = {a["booking_id"]: a for a in self.db.appointments.find(
+            {"booking_id": {"$in": ids}, "status": "confirmed"}, REMINDER_PROJECTION)}
+        messages = []
+        for _fire_at, _seq, bid, lead, slot in due:
+            appt = current.get(bid)
+            if appt is None or not isinstance(appt.get("slot_start"), datetime) or _utc(appt["slot_start"]) != slot:
+                self.stats["stale"] += 1
+                continue
+            subject, body = reminder_message(appt, lead, self.cal)
+            messages.append({"kind": f"reminder_{lead}", "to": extract_email(appt.get("contact")),
+                             "subject": subject, "body": body, "meta": {"booking_id": bid},
+                             "dedupe_key": f"reminder|{bid}|{slot.isoformat()}|{lead}"})
+        queued = enqueue_many(self.db, messages)
+        self.stats["fired"] += len(due)
+        self.stats["queued"] += queued
+        return queued
+
+    def run(self) -> None:
+        while True:
+            now = datetime.utcnow()
+            try:
+                if self._horizon is None or self._horizon - now < self.window / 2:
+                    self.refill(now)
+                due = self.pop_due(now)
+                while due:
+                    self.fire(due)
+                    due = self.pop_due(now)
+            except Exception:
+                pass                          # Mongo hiccup: try again on the next wake-up
+            with self._cond:
+                wait = MAX_SLEEP_S
+                if self._heap:
+                    wait = min(wait, max(0.0, (self._heap[0][0] - datetime.utcnow()).total_seconds()))
+                self._cond.wait(wait)
+
+
+_SCHEDULER: Optional[ReminderScheduler] = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def start_reminder_scheduler(db, cal) -> Optional[ReminderScheduler]:
+    """Load the next window and start the daemon thread (once per process)."""
+    global _SCHEDULER
+    if db is None:
+        return None
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            ensure_reminder_indexes(db)
+            _SCHEDULER = ReminderScheduler(db, cal)
+            threading.Thread(target=_SCHEDULER.run, name="medbird-reminders", daemon=True).start()
+        return _SCHEDULER
+
+
+def schedule_reminders(appt: Dict[str, Any]) -> None:
+    """Booking / reschedule hook; a no-op in processes without a running scheduler."""
+    if _SCHEDULER is not None:
+        _SCHEDULER.push(appt)
+
+
+def drop_reminders(booking_id: str) -> None:
+    """Cancellation hook; a no-op in processes without a running scheduler."""
+    if _SCHEDULER is not None:
+        _SCHEDULER.drop(booking_id)
+
+
+def main(argv=None) -> None:
+    from pymongo import MongoClient  # only the CLI needs a client of its own
+
+    ap = argparse.ArgumentParser(description="Show the appointment reminders due soon.")
+    ap.add_argument("command", choices=("pending",))
+    ap.add_argument("--hours", type=float, default=24.0)
+    args = ap.parse_args(argv)
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        raise SystemExit("MONGO_URI is not set")
+    db = MongoClient(uri)[os.getenv("DB_NAME", "medbird")]
+    cal = get_calendar(os.getenv("CLINIC_TZ", "America/New_York"))
+    sched = ReminderScheduler(db, cal, window=timedelta(hours=args.hours))
+    sched.refill()
+    for fire_at, _seq, bid, lead, slot in sorted(sched._heap):
+        print(f"{cal.to_local(fire_at):%Y-%m-%d %H:%M}  {lead:>3}  {bid}  (slot {cal.to_local(slot):%a %H:%M})")
+    print(f"{len(sched)} reminders in the next {args.hours:g}h")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+# rollups.py — utilization / demand counters for capacity planning
+# ----------------------------------------------------------------------
+#   record_event(db, "booked", appt, cal)           # on every write path
+#   rows = query_rollups(db, cal, start, end, by="specialty")
+#   -> [{"key": "Cardiology", "booked": 41, "cancelled": 3, "telehealth": 12,
+#        "no_show": 2, "telehealth_share": 0.29, "no_show_rate": 0.05}, ...]
+#
+# Bookings are counted by the clinic-local hour of their slot:
+#   db.rollup_hourly   "2025-08-18T10|d003"   one $inc per event, upserted
+#   db.rollup_daily    "2025-08-18|d003"      totals + by_hour
+#   db.rollup_weekly   "2025-W34|d003"        totals + by_weekday + by_hour
+# The nightly compaction (compaction_tick on the outbox worker, or the CLI)
+# folds the hourly documents of finished days into daily and weekly
+# buckets. Only days touched since the previous run are recomputed, and
+# each rewrite replaces the whole document, so re-running is harmless.
+# Hourly documents are kept HOURLY_KEEP_DAYS and then purged. Events for
+# days already compacted also $inc the daily and weekly documents, so a
+# no-show marked the next morning shows up without waiting a night.
+#
+# "booked" is net: a cancellation or a reschedule away takes the booking
+# back out of its hour. Queries never touch db.appointments. Compacted
+# days are read from weekly/daily documents, the rest from hourly ones.
+#
+#   python apps/rollups.py rebuild                       # from appointments
+#   python apps/rollups.py compact [--through 2025-08-17]
+#   python apps/rollups.py query --from 2025-08-01 --to 2025-08-31 --by hour
+#   (MONGO_URI / DB_NAME / CLINIC_TZ from the environment)
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from clinic_calendar import DAY_NAMES, get_calendar
+
+COUNTERS = ("booked", "cancelled", "telehealth", "no_show")
+GROUPS = ("doctor", "specialty", "weekday", "hour", "day")
+HOURLY_KEEP_DAYS = 35
+COMPACT_AT_HOUR = 2            # clinic-local; compaction_tick runs after this
+COMPACT_LEASE_S = 600
+QUERY_TTL_S = 60.0
+META_ID = "_meta"
+
+
+def _is_tele(appt: Dict[str, Any]) -> bool:
+    return str(appt.get("visit_type") or "").lower() == "telehealth"
+
+
+def _deltas(event: str, appt: Dict[str, Any]) -> Dict[str, int]:
+    # a booking carries its telehealth / no-show marks wherever it is counted
+    tele, no_show = int(_is_tele(appt)), int(appt.get("attendance") == "no_show")
+    if event == "booked":
+        d = {"booked": 1, "telehealth": tele, "no_show": no_show}
+    elif event == "cancelled":
+        d = {"booked": -1, "cancelled": 1, "telehealth": -tele, "no_show": -no_show}
+    elif event == "moved_out":
+        d = {"booked": -1, "telehealth": -tele, "no_show": -no_show}
+    elif event == "no_show":
+        d = {"no_show": 1}
+    else:
+        raise ValueError(f"unknown rollup event {event!r}")
+    return {k: v for k, v in d.items() if v}
+
+
+def _week(day: date) -> Tuple[str, date]:
+    y, w, _ = day.isocalendar()
+    return f"{y}-W{w:02d}", day - timedelta(days=day.weekday())
+
+
+def _local_slot(appt: Dict[str, Any], cal) -> Optional[datetime]:
+    ss = appt.get("slot_start")
+    return cal.to_local(ss) if isinstance(ss, datetime) and appt.get("doctor_id") else None
+
+
+def ensure_rollup_indexes(db) -> None:
+    try:
+        db.rollup_hourly.create_index([("day", 1), ("doctor_id", 1)], name="day_doctor")
+        db.rollup_hourly.create_index([("updated_at", 1)], name="updated_at")
+        db.rollup_daily.create_index([("day", 1), ("doctor_id", 1)], name="day_doctor")
+        db.rollup_weekly.create_index([("week_start", 1), ("doctor_id", 1)], name="week_doctor")
+    except Exception:
+        pass
+
+# -------------------------------------------------
+# Write path
+# -------------------------------------------------
+
+_meta_cache = {"at": 0.0, "through": ""}
+
+
+def _compacted_through(db) -> str:
+    """meta.compacted_through, re-read at most every QUERY_TTL_S (a stale value only delays
+    an edit to a just-compacted day until the next compaction)."""
+    if time.monotonic() - _meta_cache["at"] > QUERY_TTL_S:
+        meta = db.rollup_daily.find_one({"_id": META_ID}, {"compacted_through": 1}) or {}
+        _meta_cache.update(at=time.monotonic(), through=meta.get("compacted_through") or "")
+    return _meta_cache["through"]
+
+
+def record_event(db, event: str, appt: Dict[str, Any], cal) -> bool:
+    """Upserted $inc for a booking / cancellation / reschedule / no-show. False if the
+    appointment has no doctor or slot (nothing to attribute it to)."""
+    local = _local_slot(appt, cal)
+    if db is None or local is None:
+        return False
+    deltas = _deltas(event, appt)
+    day, hour, now = local.date(), local.hour, datetime.utcnow()
+    dims = {"doctor_id": appt["doctor_id"], "specialty": appt.get("specialty"), "doctor_name": appt.get("doctor_name")}
+    hourly = day >= cal.today() - timedelta(days=HOURLY_KEEP_DAYS)
+    if hourly:
+        db.rollup_hourly.update_one(
+            {"_id": f"{day.isoformat()}T{hour:02d}|{appt['doctor_id']}"},
+            {"$inc": deltas, "$set": {**dims, "updated_at": now},
+             "$setOnInsert": {"day": day.isoformat(), "weekday": day.weekday(), "hour": hour}},
+            upsert=True,
+        )
+        if day.isoformat() > _compacted_through(db):
+            return True
+    # already compacted (e.g. a no-show marked the next morning), or hourly buckets purged:
+    # keep the daily / weekly documents current too; the next compaction rewrites them identically
+    week, week_start = _week(day)
+    db.rollup_daily.update_one(
+        {"_id": f"{day.isoformat()}|{appt['doctor_id']}"},
+        {"$inc": {**{f"totals.{k}": v for k, v in deltas.items()}, **{f"by_hour.{hour}.{k}": v for k, v in deltas.items()}},
+         "$set": {**dims, "updated_at": now},
+         "$setOnInsert": {"day": day.isoformat(), "weekday": day.weekday(), "week": week}},
+        upsert=True,
+    )
+    db.rollup_weekly.update_one(
+        {"_id": f"{week}|{appt['doctor_id']}"},
+        {"$inc": {**{f"totals.{k}": v for k, v in deltas.items()},
+                  **{f"by_weekday.{day.weekday()}.{k}": v for k, v in deltas.items()},
+                  **{f"by_hour.{hour}.{k}": v for k, v in deltas.items()}},
+         "$set": {**dims, "updated_at": now},
+         "$setOnInsert": {"week": week, "week_start": week_start.isoformat()}},
+        upsert=True,
+    )
+    return True
+
+
+def record_move(db, old: Dict[str, Any], new: Dict[str, Any], cal) -> None:
+    record_event(db, "moved_out", old, cal)
+    record_event(db, "booked", new, cal)
+
+# -------------------------------------------------
+# Compaction
+# -------------------------------------------------
+
+def _zero() -> Dict[str, int]:
+    return dict.fromkeys(COUNTERS, 0)
+
+
+def _add(into: Dict[str, int], src: Dict[str, Any]) -> None:
+    for k in COUNTERS:
+        into[k] += int(src.get(k) or 0)
+
+
+def _compact_days(db, days: Iterable[str]) -> List[str]:
+    """Rewrite the daily documents of `days` from their hourly buckets; returns the weeks touched."""
+    days = sorted(set(days))
+    daily: Dict[str, Dict[str, Any]] = {}
+    for h in db.rollup_hourly.find({"day": {"$in": days}}):
+        key = f"{h['day']}|{h['doctor_id']}"
+        d = daily.get(key)
+        if d is None:
+            day = date.fromisoformat(h["day"])
+            d = daily[key] = {"doctor_id": h["doctor_id"], "specialty": h.get("specialty"),
+                              "doctor_name": h.get("doctor_name"), "day": h["day"], "weekday": day.weekday(),
+                              "week": _week(day)[0], "totals": _zero(), "by_hour": {}}
+        _add(d["totals"], h)
+        _add(d["by_hour"].setdefault(str(h["hour"]), _zero()), h)
+    now = datetime.utcnow()
+    stale = [x["_id"] for x in db.rollup_daily.find({"day": {"$in": days}}, {"_id": 1}) if x["_id"] not in daily]
+    for key, d in daily.items():
+        db.rollup_daily.replace_one({"_id": key}, {**d, "updated_at": now}, upsert=True)
+    if stale:
+        db.rollup_daily.delete_many({"_id": {"$in": stale}})
+    return sorted({_week(date.fromisoformat(d))[0] for d in days})
+
+
+def _compact_weeks(db, weeks: Iterable[str]) -> None:
+    weeks = sorted(set(weeks))
+    weekly: Dict[str, Dict[str, Any]] = {}
+    for d in db.rollup_daily.find({"week": {"$in": weeks}}):
+        key = f"{d['week']}|{d['doctor_id']}"
+        w = weekly.get(key)
+        if w is None:
+            w = weekly[key] = {"doctor_id": d["doctor_id"], "specialty": d.get("specialty"),
+                               "doctor_name": d.get("doctor_name"), "week": d["week"],
+                               "week_start": _week(date.fromisoformat(d["day"]))[1].isoformat(),
+                               "totals": _zero(), "by_weekday": {}, "by_hour": {}}
+        _add(w["totals"], d.get("totals") or {})
+        _add(w["by_weekday"].setdefault(str(d["weekday"]), _zero()), d.get("totals") or {})
+        for hour, c in (d.get("by_hour") or {}).items():
+            _add(w["by_hour"].setdefault(hour, _zero()), c)
+    now = datetime.utcnow()
+    stale = [x["_id"] for x in db.rollup_weekly.find({"week": {"$in": weeks}}, {"_id": 1}) if x["_id"] not in weekly]
+    for key, w in weekly.items():
+        db.rollup_weekly.replace_one({"_id": key}, {**w, "updated_at": now}, upsert=True)
+    if stale:
+        db.rollup_weekly.delete_many({"_id": {"$in": stale}})
+
+
+def compact_rollups(db, cal, through: Optional[date] = None, full: bool = False) -> Dict[str, Any]:
+    """Fold finished days (≤ `through`, default yesterday) into daily/weekly buckets and purge
+    hourly buckets past HOURLY_KEEP_DAYS. Only days with hourly writes since the last run are
+    recomputed unless full=True."""
+    through = through or cal.today() - timedelta(days=1)
+    started = datetime.utcnow()
+    meta = db.rollup_daily.find_one({"_id": META_ID}) or {}
+    filt: Dict[str, Any] = {"day": {"$lte": through.isoformat()}}
+    if meta.get("compacted_at") and not full:
+        filt["updated_at"] = {"$gte": meta["compacted_at"]}
+    # a through-date moved forward also makes the days in between dirty
+    if meta.get("compacted_through") and not full:
+        filt = {"$or": [filt, {"day": {"$gt": meta["compacted_through"], "$lte": through.isoformat()}}]}
+    days = db.rollup_hourly.distinct("day", filt)
+    weeks = _compact_days(db, days) if days else []
+    if weeks:
+        _compact_weeks(db, weeks)
+    purge_before = (cal.today() - timedelta(days=HOURLY_KEEP_DAYS)).isoformat()
+    purged = db.rollup_hourly.delete_many({"day": {"$lt": min(purge_before, through.isoformat())}}).deleted_count
+    db.rollup_daily.update_one(
+        {"_id": META_ID},
+        {"$set": {"compacted_at": started, "compacted_through": max(through.isoformat(), meta.get("compacted_through") or "")}},
+        upsert=True,
+    )
+    _QUERY_CACHE.clear()
+    _meta_cache["at"] = 0.0
+    return {"days": len(days), "weeks": len(weeks), "purged_hourly": purged, "through": through.isoformat()}
+
+
+def compaction_tick(db, cal, at_hour: int = COMPACT_AT_HOUR, check_every_s: float = 600.0):
+    """Tick for outbox.start_outbox_worker: compact once per clinic day after `at_hour`.
+    A lease on the meta document keeps concurrent processes from doing it twice. On a
+    database that has never had rollups, the first tick backfills them from appointments."""
+    from pymongo.errors import DuplicateKeyError
+
+    state = {"checked": 0.0}
+
+    def tick():
+        if time.monotonic() - state["checked"] < check_every_s:
+            return
+        state["checked"] = time.monotonic()
+        try:
+            db.rollup_daily.insert_one({"_id": META_ID, "compacted_through": "",
+                                        "lease_until": datetime.utcnow() + timedelta(seconds=COMPACT_LEASE_S)})
+            rebuild_rollups(db, cal)
+            return
+        except DuplicateKeyError:
+            pass                      # rollups exist (or another process is building them)
+        now = cal.now()
+        yesterday = (now.date() - timedelta(days=1)).isoformat()
+        if now.hour < at_hour:
+            return
+        lease = db.rollup_daily.find_one_and_update(
+            {"_id": META_ID, "compacted_through": {"$lt": yesterday},
+             "$or": [{"lease_until": {"$lt": datetime.utcnow()}}, {"lease_until": {"$exists": False}}]},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=COMPACT_LEASE_S)}},
+        )
+        if lease is not None:
+            compact_rollups(db, cal)
+
+    return tick
+
+# -------------------------------------------------
+# Query API
+# -------------------------------------------------
+
+_QUERY_CACHE: Dict[Tuple, Tuple[float, List[Dict[str, Any]]]] = {}
+_QUERY_LOCK = threading.Lock()
+
+
+def _group_key(by: str, doc: Dict[str, Any]) -> Any:
+    if by == "doctor":
+        return doc.get("doctor_name") or doc["doctor_id"]
+    if by == "specialty":
+        return doc.get("specialty") or "Unknown"
+    return doc[by]
+
+
+def _full_weeks(start: date, end: date) -> Tuple[List[str], List[str]]:
+    """Split [start, end] into ISO weeks wholly inside it and the leftover days."""
+    weeks, days = [], []
+    d = start
+    while d <= end:
+        if d.weekday() == 0 and d + timedelta(days=6) <= end:
+            weeks.append(_week(d)[0])
+            d += timedelta(days=7)
+        else:
+            days.append(d.isoformat())
+            d += timedelta(days=1)
+    return weeks, days
+
+
+def _rows(acc: Dict[Any, Dict[str, int]], by: str) -> List[Dict[str, Any]]:
+    rows = []
+    for key, c in acc.items():
+        booked = max(c["booked"], 0)
+        rows.append({"key": DAY_NAMES[key] if by == "weekday" else key, **c,
+                     "telehealth_share": round(c["telehealth"] / booked, 3) if booked else 0.0,
+                     "no_show_rate": round(c["no_show"] / booked, 3) if booked else 0.0})
+    if by in ("doctor", "specialty"):
+        rows.sort(key=lambda r: (-r["booked"], str(r["key"])))
+    else:
+        rows.sort(key=lambda r: DAY_NAMES.index(r["key"]) if by == "weekday" else r["key"])
+    return rows
+
+
+def query_rollups(db, cal, start: date, end: date, by: str = "doctor", doctor_id: Optional[str] = None,
+                  specialty: Optional[str] = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Counters over the clinic-local days [start, end] grouped by doctor / specialty / weekday /
+    hour / day, plus telehealth share and no-show rate. Served from rollups only (cached QUERY_TTL_S)."""
+    if by not in GROUPS:
+        raise ValueError(f"by must be one of {GROUPS}")
+    if db is None or end < start:
+        return []
+    ck = (start, end, by, doctor_id, specialty)
+    if use_cache:
+        with _QUERY_LOCK:
+            hit = _QUERY_CACHE.get(ck)
+        if hit and time.monotonic() - hit[0] < QUERY_TTL_S:
+            return hit[1]
+
+    # days up to `cut` come from daily/weekly documents: everything compacted, and anything
+    # past the hourly retention (record_event writes those straight into daily/weekly)
+    meta = db.rollup_daily.find_one({"_id": META_ID}, {"compacted_through": 1}) or {}
+    cut = cal.today() - timedelta(days=HOURLY_KEEP_DAYS + 1)
+    if meta.get("compacted_through"):
+        cut = max(cut, date.fromisoformat(meta["compacted_through"]))
+    dims: Dict[str, Any] = {}
+    if doctor_id:
+        dims["doctor_id"] = doctor_id
+    if specialty:
+        dims["specialty"] = specialty
+    acc: Dict[Any, Dict[str, int]] = {}
+
+    def add(key, counters):
+        _add(acc.setdefault(key, _zero()), counters)
+
+    def add_compacted(doc, kind):
+        # hour / weekday groupings read the sub-buckets, everything else the totals
+        if by == "hour":
+            for h, c in (doc.get("by_hour") or {}).items():
+                add(int(h), c)
+        elif by == "weekday" and kind == "weekly":
+            for wd, c in (doc.get("by_weekday") or {}).items():
+                add(int(wd), c)
+        else:
+            add(_group_key(by, doc), doc.get("totals") or {})
+
+    if start <= cut:
+        weeks, days = _full_weeks(start, min(end, cut))
+        if by == "day":               # weekly buckets have no per-day split
+            days, weeks = days + [d for w in weeks for d in _week_days(w)], []
+        if weeks:
+            for doc in db.rollup_weekly.find({"week": {"$in": weeks}, **dims}):
+                add_compacted(doc, "weekly")
+        if days:
+            for doc in db.rollup_daily.find({"day": {"$in": days}, **dims}):
+                add_compacted(doc, "daily")
+    if end > cut:
+        lo = max(start, cut + timedelta(days=1))
+        for doc in db.rollup_hourly.find({"day": {"$gte": lo.isoformat(), "$lte": end.isoformat()}, **dims}):
+            add(_group_key(by, doc), doc)
+
+    rows = _rows(acc, by)
+    with _QUERY_LOCK:
+        _QUERY_CACHE[ck] = (time.monotonic(), rows)
+    return rows
+
+
+def _week_days(week: str) -> List[str]:
+    y, w = week.split("-W")
+    monday = date.fromisocalendar(int(y), int(w), 1)
+    return [(monday + timedelta(days=i)).isoformat() for i in range(7)]
+
+
+def totals(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum of query_rollups rows with the same derived rates."""
+    acc = _zero()
+    for r in rows:
+        _add(acc, r)
+    return _rows({"all": acc}, "doctor")[0]
+
+# -------------------------------------------------
+# Rebuild from appointments
+# -------------------------------------------------
+
+def rebuild_rollups(db, cal) -> Dict[str, Any]:
+    """Recount every bucket from db.appointments (first deploy, or after a bad migration)."""
+    hourly: Dict[str, Dict[str, Any]] = {}
+    proj = {"doctor_id": 1, "doctor_name": 1, "specialty": 1, "visit_type": 1, "slot_start": 1,
+            "status": 1, "attendance": 1}
+    for appt in db.appointments.find({"slot_start": {"$type": "date"}}, proj):
+        local = _local_slot(appt, cal)
+        if local is None:
+            continue
+        day = local.date()
+        key = f"{day.isoformat()}T{local.hour:02d}|{appt['doctor_id']}"
+        h = hourly.setdefault(key, {"doctor_id": appt["doctor_id"], "specialty": appt.get("specialty"),
+                                    "doctor_name": appt.get("doctor_name"), "day": day.isoformat(),
+                                    "weekday": day.weekday(), "hour": local.hour, **_zero()})
+        if appt.get("status") == "cancelled":
+            h["cancelled"] += 1
+        elif appt.get("status", "confirmed") == "confirmed":
+            h["booked"] += 1
+            h["telehealth"] += int(_is_tele(appt))
+            h["no_show"] += int(appt.get("attendance") == "no_show")
+    for col in (db.rollup_hourly, db.rollup_daily, db.rollup_weekly):
+        col.delete_many({"_id": {"$ne": META_ID}})
+    now = datetime.utcnow()
+    for key, h in hourly.items():
+        db.rollup_hourly.replace_one({"_id": key}, {**h, "updated_at": now}, upsert=True)
+    _QUERY_CACHE.clear()
+    return {"hourly": len(hourly), **compact_rollups(db, cal, full=True)}
+
+
+def main(argv=None) -> None:
+    from pymongo import MongoClient  # only the CLI needs a client of its own
+
+    ap = argparse.ArgumentParser(description="Build, compact or query the capacity rollups.")
+    ap.add_argument("command", choices=("rebuild", "compact", "query"))
+    ap.add_argument("--through", help="compact: last day to fold (YYYY-MM-DD, default yesterday)")
+    ap.add_argument("--from", dest="start", help="query: first day (YYYY-MM-DD)")
+    ap.add_argument("--to", dest="end", help="query: last day (YYYY-MM-DD)")
+    ap.add_argument("--by", choices=GROUPS, default="doctor")
+    ap.add_argument("--doctor-id")
+    ap.add_argument("--specialty")
+    args = ap.parse_args(argv)
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        raise SystemExit("MONGO_URI is not set.")
+    db = MongoClient(uri)[os.getenv("DB_NAME", "medbird")]
+    cal = get_calendar(os.getenv("CLINIC_TZ", "America/New_York"), os.getenv("CLINIC_HOLIDAYS", ""))
+    ensure_rollup_indexes(db)
+
+    if args.command == "rebuild":
+        print(rebuild_rollups(db, cal))
+    elif args.command == "compact":
+        print(compact_rollups(db, cal, date.fromisoformat(args.through) if args.through else None))
+    else:
+        end = date.fromisoformat(args.end) if args.end else cal.today()
+        start = date.fromisoformat(args.start) if args.start else end - timedelta(days=27)
+        t0 = time.perf_counter()
+        rows = query_rollups(db, cal, start, end, args.by, args.doctor_id, args.specialty, use_cache=False)
+        print(f"{'key':<28}{'booked':>8}{'cancel':>8}{'tele%':>8}{'noshow%':>9}")
+        for r in rows + [totals(rows)]:
+            print(f"{str(r['key']):<28}{r['booked']:>8}{r['cancelled']:>8}"
+                  f"{r['telehealth_share']:>8.0%}{r['no_show_rate']:>9.1%}")
+        print(f"{start} → {end} by {args.by}: {(time.perf_counter() - t0) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
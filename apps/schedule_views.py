@@ -0,0 +1,356 @@
+# schedule_views.py — materialized per-doctor-day schedules (db.doctor_day_schedule)
+# ----------------------------------------------------------------------
+# One document per doctor per clinic-local day:
+#   {_id: "d003|2025-08-18", doctor_id, day: "2025-08-18", count,
+#    entries: [{_id, booking_id, slot_start, patient_name, ...}, ...],   # by slot_start
+#    updated_at}
+# so the doctor day view is a single _id read instead of a range query
+# plus sort over appointments.
+#
+# Maintained on every write path, one atomic update per document:
+#   add_to_schedule(db, appt, cal)            # booking      ($push, sorted)
+#   remove_from_schedule(db, appt, cal)       # cancellation ($pull)
+#   move_in_schedule(db, old, new, cal)       # reschedule   ($pull + $push)
+# The $push is guarded on the booking_id not being there yet, so replays
+# are no-ops. A crash between the appointment write and the view write
+# leaves the view behind; the checker finds that and --fix repairs it:
+#
+#   python apps/schedule_views.py rebuild [--doctor-id d003] [--day 2025-08-18 [--to 2025-08-31]]
+#   python apps/schedule_views.py check   [--doctor-id d003] [--day ...] [--fix]
+#   (MONGO_URI / DB_NAME / CLINIC_TZ from the environment)
+#
+# Readers fall back to appointment_queries.fetch_doctor_day until a full
+# rebuild has completed once (marker doc "_meta"); start_schedule_build
+# runs that rebuild in a daemon thread after the schema migration.
+# Rebuilds run next to live bookings: each view is replaced only if no
+# incremental update touched it after the appointments were read, and a
+# view that was touched is re-read and written again.
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from appointment_queries import _decode_cursor, day_bounds_utc, encode_cursor, fetch_doctor_day
+from clinic_calendar import get_calendar
+from intake import APPOINTMENT_PROJECTION
+
+META_ID = "_meta"
+READY_TTL_S = 60.0
+SYNC_RETRIES = 5
+
+
+def _utc(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def view_key(doctor_id: str, day: date) -> str:
+    return f"{doctor_id}|{day.isoformat()}"
+
+
+def _placement(appt: Dict[str, Any], cal) -> Optional[Tuple[str, str, date]]:
+    """(view _id, doctor_id, local day) for a confirmed, slotted appointment; None otherwise."""
+    ss, doctor_id = appt.get("slot_start"), appt.get("doctor_id")
+    if not (doctor_id and isinstance(ss, datetime)):
+        return None
+    day = cal.to_local(ss).date()
+    return view_key(doctor_id, day), doctor_id, day
+
+
+def schedule_entry(appt: Dict[str, Any]) -> Dict[str, Any]:
+    """The appointment fields the day view / handoff intake read (APPOINTMENT_PROJECTION)."""
+    out: Dict[str, Any] = {"_id": appt.get("_id"), "booking_id": appt.get("booking_id")}
+    for path in APPOINTMENT_PROJECTION:
+        head, _, sub = path.partition(".")
+        v = appt.get(head)
+        if sub:
+            if isinstance(v, dict) and sub in v:
+                out.setdefault(head, {})[sub] = v[sub]
+        elif v is not None:
+            out[head] = v
+    out["slot_start"] = _utc(appt["slot_start"])
+    return out
+
+
+def ensure_schedule_indexes(db) -> None:
+    try:
+        db.doctor_day_schedule.create_index([("day", 1), ("doctor_id", 1)], name="day_doctor")
+    except Exception:
+        pass
+
+# -------------------------------------------------
+# Incremental maintenance
+# -------------------------------------------------
+
+def add_to_schedule(db, appt: Dict[str, Any], cal) -> bool:
+    """Push the appointment into its doctor-day document (created on first booking). False if already there."""
+    from pymongo.errors import DuplicateKeyError
+
+    placed = _placement(appt, cal)
+    if db is None or placed is None or appt.get("status", "confirmed") != "confirmed":
+        return False
+    key, doctor_id, day = placed
+    entry = schedule_entry(appt)
+    try:
+        res = db.doctor_day_schedule.update_one(
+            {"_id": key, "entries.booking_id": {"$ne": entry["booking_id"]}},
+            {"$push": {"entries": {"$each": [entry], "$sort": {"slot_start": 1, "_id": 1}}},
+             "$inc": {"count": 1},
+             "$set": {"updated_at": datetime.utcnow()},
+             "$setOnInsert": {"doctor_id": doctor_id, "day": day.isoformat()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False          # document exists and already holds this booking
+    return bool(res.modified_count or res.upserted_id)
+
+
+def remove_from_schedule(db, appt: Dict[str, Any], cal) -> bool:
+    placed = _placement(appt, cal)
+    if db is None or placed is None:
+        return False
+    res = db.doctor_day_schedule.update_one(
+        {"_id": placed[0], "entries.booking_id": appt.get("booking_id")},
+        {"$pull": {"entries": {"booking_id": appt.get("booking_id")}},
+         "$inc": {"count": -1},
+         "$set": {"updated_at": datetime.utcnow()}},
+    )
+    return res.modified_count == 1
+
+
+def move_in_schedule(db, old: Dict[str, Any], new: Dict[str, Any], cal) -> None:
+    """Reschedule: the same day document is rewritten in place, otherwise pulled from one and pushed to the other."""
+    if db is None:
+        return
+    remove_from_schedule(db, old, cal)
+    add_to_schedule(db, {**new, "status": "confirmed"}, cal)
+
+# -------------------------------------------------
+# Reads
+# -------------------------------------------------
+
+_ready = {"at": 0.0, "value": False}
+
+
+def view_ready(db) -> bool:
+    """True once a full rebuild has completed (re-checked at most every READY_TTL_S)."""
+    if db is None:
+        return False
+    if _ready["value"] or time.monotonic() - _ready["at"] < READY_TTL_S:
+        return _ready["value"]
+    try:
+        _ready["value"] = db.doctor_day_schedule.find_one({"_id": META_ID}, {"_id": 1}) is not None
+    except Exception:
+        _ready["value"] = False
+    _ready["at"] = time.monotonic()
+    return _ready["value"]
+
+
+def fetch_schedule(db, doctor_id: str, day: date) -> List[Dict[str, Any]]:
+    """All entries of one doctor-day, in slot order (one _id lookup)."""
+    doc = db.doctor_day_schedule.find_one({"_id": view_key(doctor_id, day)}, {"entries": 1})
+    return list((doc or {}).get("entries") or [])
+
+
+def fetch_doctor_day_view(db, ap_col, doctor_id: str, day: date, cal, after: Optional[str] = None,
+                          limit: int = 200) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Same contract as appointment_queries.fetch_doctor_day, served from the materialized view
+    when it is ready (falls back to the appointments range query otherwise)."""
+    if not doctor_id:
+        return [], None
+    if not view_ready(db):
+        return fetch_doctor_day(ap_col, doctor_id, day, cal, after=after, limit=limit)
+    try:
+        entries = fetch_schedule(db, doctor_id, day)
+    except Exception:
+        return fetch_doctor_day(ap_col, doctor_id, day, cal, after=after, limit=limit)
+    if after:
+        ss, oid = _decode_cursor(after)
+        entries = [e for e in entries if (e["slot_start"], str(e["_id"])) > (ss, str(oid))]
+    page = entries[:limit]
+    return page, (encode_cursor(page[-1]) if len(entries) > limit and page else None)
+
+# -------------------------------------------------
+# Rebuild + consistency check
+# -------------------------------------------------
+
+def _scope(cal, doctor_id: Optional[str], start: Optional[date], end: Optional[date]):
+    """(appointments filter, views filter) for an optional doctor / inclusive day range."""
+    appt_f: Dict[str, Any] = {"status": "confirmed", "slot_start": {"$type": "date"}}
+    view_f: Dict[str, Any] = {"_id": {"$ne": META_ID}}
+    if doctor_id:
+        appt_f["doctor_id"] = view_f["doctor_id"] = doctor_id
+    if start:
+        end = end or start
+        appt_f["slot_start"] = {"$gte": day_bounds_utc(start, cal)[0], "$lt": day_bounds_utc(end, cal)[1]}
+        view_f["day"] = {"$gte": start.isoformat(), "$lte": end.isoformat()}
+    return appt_f, view_f
+
+
+def expected_views(db, cal, doctor_id=None, start=None, end=None) -> Dict[str, Dict[str, Any]]:
+    """What doctor_day_schedule should hold, computed from appointments: {view _id: {booking_id: entry}}."""
+    appt_f, _ = _scope(cal, doctor_id, start, end)
+    proj = {**APPOINTMENT_PROJECTION, "doctor_id": 1, "status": 1}
+    out: Dict[str, Dict[str, Any]] = {}
+    for appt in db.appointments.find(appt_f, proj).sort([("doctor_id", 1), ("slot_start", 1), ("_id", 1)]):
+        placed = _placement(appt, cal)
+        if placed is not None:
+            out.setdefault(placed[0], {})[appt.get("booking_id") or str(appt["_id"])] = schedule_entry(appt)
+    return out
+
+
+def _write_view(db, key: str, entries: Iterable[Dict[str, Any]], read_at: datetime) -> bool:
+    """Replace (or, with no entries, drop) one view with what appointments held at read_at.
+    False, writing nothing, when an incremental update has touched the view since."""
+    from pymongo.errors import DuplicateKeyError
+
+    untouched = {"_id": key, "$or": [{"updated_at": {"$lt": read_at}}, {"updated_at": {"$exists": False}}]}
+    rows = sorted(entries, key=lambda e: (e["slot_start"], str(e["_id"])))
+    if not rows:
+        if db.doctor_day_schedule.delete_one(untouched).deleted_count:
+            return True
+        return db.doctor_day_schedule.find_one({"_id": key}, {"_id": 1}) is None
+    doctor_id, _, day = key.partition("|")
+    try:
+        db.doctor_day_schedule.replace_one(
+            untouched,
+            {"doctor_id": doctor_id, "day": day, "entries": rows, "count": len(rows), "updated_at": datetime.utcnow()},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False          # the view exists and is newer than our snapshot
+    return True
+
+
+def _sync_view(db, cal, key: str, entries: Iterable[Dict[str, Any]], read_at: datetime) -> bool:
+    """_write_view, re-reading just that doctor-day while bookings keep racing the write."""
+    doctor_id, _, day = key.partition("|")
+    for _ in range(SYNC_RETRIES):
+        if _write_view(db, key, entries, read_at):
+            return True
+        read_at, d = datetime.utcnow(), date.fromisoformat(day)
+        entries = list(expected_views(db, cal, doctor_id, d, d).get(key, {}).values())
+    return False
+
+
+def rebuild_schedule(db, cal, doctor_id=None, start=None, end=None) -> Dict[str, int]:
+    """Rewrite the views in scope from appointments; drops views that no longer have bookings.
+    Bookings written while it runs are kept: a view updated after the snapshot was read is
+    re-read and written again (_sync_view). A full rebuild (no scope) in which every view
+    got written marks the view ready for readers."""
+    read_at = datetime.utcnow()
+    expected = expected_views(db, cal, doctor_id, start, end)
+    _, view_f = _scope(cal, doctor_id, start, end)
+    stale = [d["_id"] for d in db.doctor_day_schedule.find(view_f, {"_id": 1}) if d["_id"] not in expected]
+    failed = [key for key, entries in expected.items() if not _sync_view(db, cal, key, entries.values(), read_at)]
+    failed += [key for key in stale if not _sync_view(db, cal, key, [], read_at)]
+    if not (doctor_id or start or failed):
+        db.doctor_day_schedule.update_one({"_id": META_ID}, {"$set": {"built_at": datetime.utcnow()}}, upsert=True)
+        _ready.update(value=True, at=time.monotonic())
+    return {"views": len(expected), "entries": sum(len(v) for v in expected.values()), "dropped": len(stale),
+            "unsynced": len(failed)}
+
+
+def check_schedule(db, cal, doctor_id=None, start=None, end=None, fix: bool = False) -> Dict[str, Any]:
+    """Compare views with appointments. Reports per view: missing / extra / moved bookings and
+    count drift; with fix=True rewrites only the views that disagree."""
+    read_at = datetime.utcnow()
+    expected = expected_views(db, cal, doctor_id, start, end)
+    _, view_f = _scope(cal, doctor_id, start, end)
+    problems: Dict[str, Dict[str, Any]] = {}
+    seen = set()
+    for doc in db.doctor_day_schedule.find(view_f, {"entries.booking_id": 1, "entries.slot_start": 1, "count": 1}):
+        key = doc["_id"]
+        seen.add(key)
+        have = {e.get("booking_id"): e.get("slot_start") for e in doc.get("entries") or []}
+        want = {b: e["slot_start"] for b, e in expected.get(key, {}).items()}
+        p = {
+            "missing": sorted(set(want) - set(have)),
+            "extra": sorted(b for b in set(have) - set(want) if b is not None),
+            "moved": sorted(b for b in set(want) & set(have) if want[b] != have[b]),
+        }
+        if doc.get("count") != len(have):
+            p["count"] = {"stored": doc.get("count"), "actual": len(have)}
+        if any(p.values()):
+            problems[key] = p
+    for key in set(expected) - seen:
+        problems[key] = {"missing": sorted(expected[key]), "extra": [], "moved": []}
+
+    if fix:
+        for key in problems:
+            _sync_view(db, cal, key, expected.get(key, {}).values(), read_at)
+    return {"views_checked": len(seen | set(expected)), "inconsistent": len(problems),
+            "problems": problems, "fixed": bool(fix and problems)}
+
+# -------------------------------------------------
+# Background build (once per process, after the schema migration)
+# -------------------------------------------------
+
+_BUILD: Dict[str, Any] = {"thread": None, "result": None, "error": None}
+_BUILD_LOCK = threading.Lock()
+
+
+def start_schedule_build(db, cal) -> Dict[str, Any]:
+    """Full rebuild in a daemon thread unless the view is already marked ready."""
+    with _BUILD_LOCK:
+        t = _BUILD["thread"]
+        if db is None or (t is not None and t.is_alive()):
+            return _BUILD
+        ensure_schedule_indexes(db)
+        if view_ready(db):
+            return _BUILD
+
+        def run():
+            from schema import wait_for_migration
+            try:
+                wait_for_migration()          # v1 docs get their slot_start first
+                _BUILD["result"] = rebuild_schedule(db, cal)
+            except Exception as e:            # readers keep using the appointments query
+                _BUILD["error"] = str(e)
+
+        t = threading.Thread(target=run, name="medbird-schedule-build", daemon=True)
+        _BUILD["thread"] = t
+        t.start()
+        return _BUILD
+
+
+def main(argv=None) -> None:
+    from pymongo import MongoClient  # only the CLI needs a client of its own
+
+    ap = argparse.ArgumentParser(description="Rebuild or check the per-doctor-day schedule views.")
+    ap.add_argument("command", choices=("rebuild", "check"))
+    ap.add_argument("--doctor-id")
+    ap.add_argument("--day", help="YYYY-MM-DD (clinic-local); first day of the range")
+    ap.add_argument("--to", help="YYYY-MM-DD, last day of the range (default: --day)")
+    ap.add_argument("--fix", action="store_true", help="check: rewrite inconsistent views")
+    args = ap.parse_args(argv)
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        raise SystemExit("MONGO_URI is not set.")
+    db = MongoClient(uri)[os.getenv("DB_NAME", "medbird")]
+    cal = get_calendar(os.getenv("CLINIC_TZ", "America/New_York"), os.getenv("CLINIC_HOLIDAYS", ""))
+    start = date.fromisoformat(args.day) if args.day else None
+    end = date.fromisoformat(args.to) if args.to else None
+    ensure_schedule_indexes(db)
+
+    if args.command == "rebuild":
+        print(rebuild_schedule(db, cal, args.doctor_id, start, end))
+        return
+    report = check_schedule(db, cal, args.doctor_id, start, end, fix=args.fix)
+    for key, p in sorted(report["problems"].items()):
+        parts = [f"{k}={v}" for k, v in p.items() if v]
+        print(f"{key}: " + "  ".join(parts))
+    print(f"{report['views_checked']} views checked, {report['inconsistent']} inconsistent"
+          + (" (fixed)" if report["fixed"] else ""))
+    if report["inconsistent"] and not args.fix:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
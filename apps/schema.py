@@ -0,0 +1,324 @@
+# schema.py — canonical (versioned) shapes for appointments, users, intakes
+# ----------------------------------------------------------------------
+# v1 (legacy, still in the collections):
+#   users:        top-level allergies / Chronic_condition / medications /
+#                 history, "NA" / "None" / "none" as missing markers
+#   appointments: triage {} or {"severity": "3"}, condition only
+# v2 (canonical, SCHEMA_VERSION):
+#   users:        missing = null; medical {allergies, chronic_conditions,
+#                 medications, history}
+#   appointments: symptoms [..], triage {severity: Low|Medium|High},
+#                 medical {..} cleaned, slot_start backfilled when derivable
+#
+# normalize_* are pure and idempotent. The migrator rewrites v1 documents
+# in _id-ordered batches in a daemon thread; readers only fall back to
+# normalizing on the fly for documents it has not reached yet. The same
+# thread gives older profiles their identity keys (identity.py).
+# ----------------------------------------------------------------------
+
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from identity import backfill_identity, ensure_identity_indexes
+
+SCHEMA_VERSION = 2
+
+_MISSING = {"", "na", "n/a", "none", "null", "nil", "-", "unspecified"}
+_NUM_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:/\s*(?:5|10))?\s*$")
+_SLOT_RE = re.compile(r"^\s*\w+,\s*([A-Za-z]+ \d{1,2}) at (.+?)\s*$")
+
+USER_LEGACY_MEDICAL = {
+    "allergies": "allergies",
+    "Chronic_condition": "chronic_conditions",
+    "medications": "medications",
+    "history": "history",
+}
+USER_PROFILE_FIELDS = ("mobile", "email", "dob", "gender", "height", "weight", "blood_group",
+                       "emergency_contact", "diet_preferance")
+
+
+def clean(v: Any) -> Any:
+    """Legacy missing markers ('NA', 'None', '', ...) → None; strings stripped."""
+    if v is None:
+        return None
+    if isinstance(v, str):
+        s = v.strip()
+        return None if s.lower() in _MISSING else s
+    return v
+
+
+def severity_label(v: Any) -> Optional[str]:
+    """'High' / 'medium' / 4 / '2' / '3/5' → Low|Medium|High (0–1 Low, 2–3 Medium, ≥4 High)."""
+    v = clean(v)
+    if v is None:
+        return None
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        n = float(v)
+    else:
+        s = str(v).strip().lower()
+        for label in ("low", "medium", "high"):
+            if s.startswith(label):
+                return label.capitalize()
+        if s in ("mild",):
+            return "Low"
+        if s in ("moderate",):
+            return "Medium"
+        if s in ("severe", "critical", "urgent"):
+            return "High"
+        m = _NUM_RE.match(s)
+        if not m:
+            return None
+        n = float(m.group(1))
+    return "Low" if n <= 1 else ("Medium" if n <= 3 else "High")
+
+
+def split_symptoms(v: Any) -> List[str]:
+    if isinstance(v, (list, tuple)):
+        items = [clean(x) for x in v]
+    else:
+        s = clean(v)
+        items = re.split(r"\s*(?:,|;|\band\b)\s*", s) if isinstance(s, str) else []
+    out, seen = [], set()
+    for x in items:
+        if x and x.lower() not in seen:
+            seen.add(x.lower())
+            out.append(x)
+    return out
+
+
+# ---------------------------
+# Users
+# ---------------------------
+
+def normalize_user(doc: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(doc)
+    med = dict(out.get("medical") or {})
+    for legacy, canon in USER_LEGACY_MEDICAL.items():
+        if legacy in out:
+            val = out.pop(legacy)
+            if clean(med.get(canon)) is None:
+                med[canon] = val
+    out["medical"] = {k: clean(med.get(k)) for k in ("allergies", "chronic_conditions", "medications", "history")}
+    for k in USER_PROFILE_FIELDS:
+        if k in out:
+            out[k] = clean(out[k])
+    out["schema_version"] = SCHEMA_VERSION
+    return out
+
+
+def user_migration_update(doc: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    canon = normalize_user(doc)
+    sets = {k: canon[k] for k in ("medical", "schema_version", *USER_PROFILE_FIELDS) if k in canon}
+    unsets = {k: "" for k in USER_LEGACY_MEDICAL if k in doc}
+    return sets, unsets
+
+
+# ---------------------------
+# Appointments
+# ---------------------------
+
+def _backfill_slot_start(doc: Dict[str, Any], cal) -> Optional[datetime]:
+    """Recover slot_start for v1 docs from 'Monday, August 18 at 6:00 PM' + created_at year."""
+    if cal is None:
+        return None
+    m = _SLOT_RE.match(doc.get("appointment_slot") or "")
+    created = doc.get("created_at")
+    if not m or not isinstance(created, datetime):
+        return None
+    try:
+        from clinic_calendar import parse_time
+        md = datetime.strptime(f"{m.group(1)} {created.year}", "%B %d %Y").date()
+        if md < created.date():
+            md = md.replace(year=md.year + 1)
+        t = parse_time(m.group(2))
+    except ValueError:
+        return None
+    if t is None:
+        return None
+    local = datetime.combine(md, t)
+    return local.replace(tzinfo=cal.tz) if getattr(cal, "tz", None) else local
+
+
+def normalize_appointment(doc: Dict[str, Any], cal=None) -> Dict[str, Any]:
+    out = dict(doc)
+    out["condition"] = clean(out.get("condition"))
+    out["symptoms"] = split_symptoms(out.get("symptoms") or out.get("condition"))
+    out["duration"] = clean(out.get("duration"))
+    tri = dict(out.get("triage") or {})
+    legacy_sev = out.pop("severity", None)   # some v1 docs carried it top-level
+    tri["severity"] = severity_label(tri.get("severity")) or severity_label(legacy_sev)
+    out["triage"] = {k: clean(v) for k, v in tri.items()}
+    med = dict(out.get("medical") or {})
+    out["medical"] = {k: clean(med.get(k)) for k in ("allergies", "medications", "gender", "dob")}
+    if not out.get("slot_start"):
+        ss = _backfill_slot_start(out, cal)
+        if ss is not None:
+            out["slot_start"] = ss
+    out["schema_version"] = SCHEMA_VERSION
+    return out
+
+
+def appointment_migration_update(doc: Dict[str, Any], cal=None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    canon = normalize_appointment(doc, cal)
+    keys = ("condition", "symptoms", "duration", "triage", "medical", "schema_version")
+    sets = {k: canon[k] for k in keys}
+    if canon.get("slot_start") and not doc.get("slot_start"):
+        sets["slot_start"] = canon["slot_start"]
+    unsets = {"severity": ""} if "severity" in doc else {}
+    return sets, unsets
+
+
+# ---------------------------
+# Summary intake (flat, canonical keys)
+# ---------------------------
+
+def intake_from_docs(appt: Dict[str, Any], user: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Canonical flat intake from (appointment, user) documents."""
+    a = appt if appt.get("schema_version") == SCHEMA_VERSION else normalize_appointment(appt)
+    tri, amed = a.get("triage") or {}, a.get("medical") or {}
+    out: Dict[str, Any] = {
+        "schema_version": SCHEMA_VERSION,
+        "patient_name": clean(a.get("patient_name")),
+        "contact": clean(a.get("contact")),
+        "appointment_id": clean(a.get("booking_id")),
+        "symptoms": a.get("symptoms") or [],
+        "duration": a.get("duration"),
+        "severity": tri.get("severity"),
+        "urgency": tri.get("urgency"),
+        "flag": tri.get("flag"),
+        "doctor_name": clean(a.get("doctor_name")),
+        "specialty": clean(a.get("specialty")),
+        "location": clean(a.get("location")),
+        "visit_type": clean(a.get("visit_type")),
+        "selected_day": a.get("selected_day"),
+        "selected_time": a.get("selected_time"),
+        "slot_start": a.get("slot_start"),
+        "gender": amed.get("gender"),
+        "dob": amed.get("dob"),
+        "allergies": amed.get("allergies"),
+        "medications": amed.get("medications"),
+    }
+    if user:
+        u = user if user.get("schema_version") == SCHEMA_VERSION else normalize_user(user)
+        umed = u.get("medical") or {}
+        out["email"], out["mobile"] = u.get("email"), u.get("mobile")
+        out["dob"] = out["dob"] or u.get("dob")
+        out["gender"] = out["gender"] or u.get("gender")
+        out["allergies"] = out["allergies"] or umed.get("allergies")
+        out["medications"] = out["medications"] or umed.get("medications")
+        out["chronic_conditions"] = umed.get("chronic_conditions")
+        out["history"] = umed.get("history")
+    return out
+
+
+def canonical_intake(p: Dict[str, Any]) -> Dict[str, Any]:
+    """Any intake payload (canonical or legacy/hand-edited) → canonical flat keys."""
+    if p.get("schema_version") == SCHEMA_VERSION:
+        return p
+    reason, med, tri = p.get("reason") or {}, p.get("medical") or {}, p.get("triage") or {}
+
+    def first(*vals):
+        for v in vals:
+            v = clean(v)
+            if v is not None:
+                return v
+        return None
+
+    out = dict(p)
+    out.update({
+        "schema_version": SCHEMA_VERSION,
+        "patient_name": first(p.get("patient_name"), p.get("name")),
+        "appointment_id": first(p.get("appointment_id"), p.get("booking_id")),
+        "symptoms": split_symptoms(p.get("symptoms") or reason.get("symptoms") or p.get("condition")),
+        "duration": first(p.get("duration"), reason.get("duration")),
+        "severity": severity_label(first(p.get("severity"), tri.get("severity"))) or
+                    severity_label(first(p.get("severity_score"), reason.get("severity_score"))),
+        "suspected_cause": first(p.get("suspected_cause"), reason.get("suspected_cause")),
+        "allergies": first(p.get("allergies"), med.get("allergies")),
+        "chronic_conditions": first(p.get("chronic_conditions"), p.get("Chronic_condition"), med.get("chronic_conditions")),
+        "medications": first(p.get("medications"), med.get("medications")),
+        "history": first(p.get("history"), med.get("history")),
+        "urgency": first(p.get("urgency"), tri.get("urgency")),
+        "flag": first(p.get("flag"), tri.get("flag")),
+        "gender": first(p.get("gender"), med.get("gender")),
+        "dob": first(p.get("dob"), med.get("dob")),
+    })
+    for k in ("reason", "triage", "medical", "Chronic_condition", "severity_score", "condition", "name", "booking_id"):
+        out.pop(k, None)
+    return out
+
+
+# ---------------------------
+# Background migrator
+# ---------------------------
+
+def migrate_collection(col, update_fn, batch_size: int = 500, stop: Optional[threading.Event] = None,
+                       pause_s: float = 0.05, progress: Optional[Dict[str, Any]] = None) -> int:
+    """Rewrite every document with schema_version != SCHEMA_VERSION, in _id order.
+
+    Each write is guarded on the version so a document re-written
+    concurrently by the app is left alone. Returns documents migrated."""
+    from pymongo import UpdateOne
+
+    done = 0
+    last_id = None
+    while not (stop and stop.is_set()):
+        filt: Dict[str, Any] = {"schema_version": {"$ne": SCHEMA_VERSION}}
+        if last_id is not None:
+            filt["_id"] = {"$gt": last_id}
+        batch = list(col.find(filt).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        ops = []
+        for doc in batch:
+            sets, unsets = update_fn(doc)
+            upd: Dict[str, Any] = {"$set": sets}
+            if unsets:
+                upd["$unset"] = unsets
+            ops.append(UpdateOne({"_id": doc["_id"], "schema_version": {"$ne": SCHEMA_VERSION}}, upd))
+        res = col.bulk_write(ops, ordered=False)
+        done += res.modified_count
+        last_id = batch[-1]["_id"]
+        if progress is not None:
+            progress[col.name] = done
+        time.sleep(pause_s)   # yield to foreground traffic
+    return done
+
+
+_MIGRATION: Dict[str, Any] = {"thread": None, "stop": threading.Event(), "progress": {}, "error": None}
+_MIGRATION_LOCK = threading.Lock()
+
+
+def start_background_migration(db, cal=None, batch_size: int = 500) -> Dict[str, Any]:
+    """Start (once per process) a daemon thread migrating users + appointments."""
+    with _MIGRATION_LOCK:
+        t = _MIGRATION["thread"]
+        if db is None or (t is not None and t.is_alive()):
+            return _MIGRATION
+
+        def run():
+            try:
+                migrate_collection(db.users, user_migration_update, batch_size, _MIGRATION["stop"], progress=_MIGRATION["progress"])
+                ensure_identity_indexes(db.users)
+                backfill_identity(db.users, batch_size, _MIGRATION["stop"], progress=_MIGRATION["progress"])
+                migrate_collection(db.appointments, lambda d: appointment_migration_update(d, cal), batch_size,
+                                   _MIGRATION["stop"], progress=_MIGRATION["progress"])
+            except Exception as e:   # never take the app down; retried next process start
+                _MIGRATION["error"] = str(e)
+
+        t = threading.Thread(target=run, name="medbird-schema-migrator", daemon=True)
+        _MIGRATION["thread"] = t
+        t.start()
+        return _MIGRATION
+
+
+
+def wait_for_migration(timeout: Optional[float] = None) -> bool:
+    """Block until this process's background migration (if any) has finished."""
+    t = _MIGRATION["thread"]
+    if t is not None:
+        t.join(timeout)
+    return t is None or not t.is_alive()
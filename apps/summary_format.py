@@ -0,0 +1,189 @@
+# summary_format.py — compiled, batch-capable handoff formatter
+# ----------------------------------------------------------------------
+# The fixed handoff layout is declared once as SUMMARY_SPEC (label +
+# column name per line). compile_formatter() turns it into a single
+# str.format template plus one resolver per column, so rendering N
+# payloads is: normalize once, resolve each column as a list, then
+# format the zipped rows in one pass.
+#
+#   fmt = compile_formatter()          # (module-level FORMATTER is prebuilt)
+#   texts = fmt.render_batch(payloads)
+#   text  = fmt.render(payload, symptoms_text=..., rationale=...)
+# ----------------------------------------------------------------------
+
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from identity import age_from_dob
+from schema import canonical_intake, clean
+
+# (line label, column) — "" column = literal line; None = blank separator line
+SUMMARY_SPEC: Tuple[Tuple[str, Optional[str]], ...] = (
+    ("Patient: ", "patient_name"),
+    ("Age: ", "age"),
+    ("Gender: ", "gender"),
+    ("Contact: ", "contact"),
+    ("Appointment ID: ", "appointment_id"),
+    ("Scheduled Time: ", "scheduled_time"),
+    ("", None),
+    ("Reason for Visit:", ""),
+    ("- Symptoms: ", "symptoms"),
+    ("- Duration: ", "duration"),
+    ("- Severity: ", "severity"),
+    ("- Suspected cause: ", "suspected_cause"),
+    ("", None),
+    ("Medical Background:", ""),
+    ("- Allergies: ", "allergies"),
+    ("- Chronic conditions: ", "chronic_conditions"),
+    ("- Current medications: ", "medications"),
+    ("- Relevant history: ", "history"),
+    ("", None),
+    ("Triage Notes:", ""),
+    ("- Urgency: ", "urgency"),
+    ("- Flag: ", "flag"),
+    ("", None),
+    ("Booking Details:", ""),
+    ("- Doctor: ", "doctor"),
+    ("- Appointment Type: ", "visit_type"),
+    ("- Location: ", "location"),
+)
+
+_LEVELS = ("Low", "Medium", "High")
+
+
+def _shown(default: str) -> Callable[[str], Callable[[List[Dict[str, Any]], Dict[str, Any]], List[Any]]]:
+    def column(key: str):
+        def resolve(ps, ctx):
+            out = []
+            for p in ps:
+                v = clean(p.get(key))
+                out.append(default if v is None else v)
+            return out
+        return resolve
+    return column
+
+
+_na, _none = _shown("N/A"), _shown("None")
+
+
+def _col_age(ps, ctx):
+    today, memo = ctx["today"], {}
+    out = []
+    for p in ps:
+        age = p.get("age")
+        if age is None:
+            dob = p.get("dob")
+            if dob not in memo:
+                memo[dob] = age_from_dob(dob, today)
+            age = memo[dob]
+        out.append("N/A" if age is None else age)
+    return out
+
+
+def _col_contact(ps, ctx):
+    out = []
+    for p in ps:
+        v = clean(p.get("mobile")) or clean(p.get("email")) or clean(p.get("contact"))
+        out.append("N/A" if v is None else v)
+    return out
+
+
+def _col_time(ps, ctx):
+    return [p.get("scheduled_time_human") or "N/A" for p in ps]
+
+
+def _col_symptoms(ps, ctx):
+    override = ctx.get("symptoms_texts")
+    out = [", ".join(p.get("symptoms") or []) or "N/A" for p in ps]
+    if override:
+        out = [o or d for o, d in zip(override, out)]
+    return out
+
+
+def _col_severity(ps, ctx):
+    return [p.get("severity") or "N/A" for p in ps]
+
+
+def _col_urgency(ps, ctx):
+    rationales = ctx.get("rationales") or [None] * len(ps)
+    out = []
+    for p, r in zip(ps, rationales):
+        sev = p.get("severity") or "N/A"
+        u = p.get("urgency") or (sev if sev in _LEVELS else "N/A")
+        out.append(f"{u} – N/A" if u == "N/A" else f"{u} – {r or 'as per reported symptoms'}")
+    return out
+
+
+def _col_doctor(ps, ctx):
+    out = []
+    for p in ps:
+        d, s = clean(p.get("doctor_name")), clean(p.get("specialty"))
+        out.append(f"{'N/A' if d is None else d} ({'N/A' if s is None else s})")
+    return out
+
+
+def _col_visit_type(ps, ctx):
+    return [(p.get("visit_type") or "").replace("telehealth", "Telehealth").replace("in-person", "In-person") or "N/A"
+            for p in ps]
+
+
+COLUMNS: Dict[str, Callable[[List[Dict[str, Any]], Dict[str, Any]], List[Any]]] = {
+    "patient_name": _na("patient_name"),
+    "age": _col_age,
+    "gender": _na("gender"),
+    "contact": _col_contact,
+    "appointment_id": _na("appointment_id"),
+    "scheduled_time": _col_time,
+    "symptoms": _col_symptoms,
+    "duration": _na("duration"),
+    "severity": _col_severity,
+    "suspected_cause": _na("suspected_cause"),
+    "allergies": _none("allergies"),
+    "chronic_conditions": _none("chronic_conditions"),
+    "medications": _none("medications"),
+    "history": _none("history"),
+    "urgency": _col_urgency,
+    "flag": _none("flag"),
+    "doctor": _col_doctor,
+    "visit_type": _col_visit_type,
+    "location": _na("location"),
+}
+
+
+class CompiledFormatter:
+    def __init__(self, template: str, columns: Sequence[str]):
+        self.template = template
+        self.columns = tuple(columns)
+        self._resolvers = [COLUMNS[c] for c in self.columns]
+
+    def render_batch(
+        self,
+        payloads: Sequence[Dict[str, Any]],
+        symptoms_texts: Optional[Sequence[Optional[str]]] = None,
+        rationales: Optional[Sequence[Optional[str]]] = None,
+        today: Optional[date] = None,
+    ) -> List[str]:
+        ps = [canonical_intake(p) for p in payloads]
+        ctx = {"today": today or date.today(), "symptoms_texts": symptoms_texts, "rationales": rationales}
+        cols = [resolve(ps, ctx) for resolve in self._resolvers]
+        fmt = self.template.format
+        return [fmt(*row) for row in zip(*cols)]
+
+    def render(self, payload: Dict[str, Any], symptoms_text: Optional[str] = None,
+               rationale: Optional[str] = None, today: Optional[date] = None) -> str:
+        return self.render_batch([payload], [symptoms_text], [rationale], today)[0]
+
+
+def compile_formatter(spec: Sequence[Tuple[str, Optional[str]]] = SUMMARY_SPEC) -> CompiledFormatter:
+    lines, columns = [], []
+    for label, col in spec:
+        text = label.replace("{", "{{").replace("}", "}}")
+        if col:
+            lines.append(text + "{}")
+            columns.append(col)
+        else:
+            lines.append(text)
+    return CompiledFormatter("\n".join(lines), columns)
+
+
+FORMATTER = compile_formatter()
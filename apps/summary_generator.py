@@ -1,8 +1,8 @@
-# doctor_summary_agent.py
+# summary_generator.py
 # -------------------------------------------------
 # Quick start:
 #   pip install --upgrade streamlit pymongo ibm-watsonx-ai
-#   python -m streamlit run "doctor_summary_agent.py"
+#   python -m streamlit run "summary_generator.py"
 #
 # Optional: .streamlit/secrets.toml (same folder)
 # [ibm]
@@ -14,32 +14,38 @@
 # db  = "medbird"
 # [clinic]
 # tz  = "America/New_York"
+# holidays = ["2025-12-25"]
+# [llm]
+# deadline_s = 8        # hard cap per model call (summary_deadline_s for Agent 2)
+# retries    = 2
+# hedge      = false    # duplicate a call once it passes the observed p95
+# upstream_rps = 8      # client-side quota shared by all sessions
+# chat_rps   = 6  /  summary_rps = 2
+# cassette   = ""       # record/replay fixture file (see llm_cassette.py)
+# [export]
+# dir = "exports"        # daily handoff archives (.jsonl.zst / .parquet) + checkpoints
 # -------------------------------------------------
 
-import os, json, re, calendar
+import os, json, time
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Optional
 
 import streamlit as st
 
-# Optional deps
-HAS_WX = True
-try:
-    from ibm_watsonx_ai.foundation_models import ModelInference
-    from ibm_watsonx_ai.foundation_models.schema import TextChatParameters
-except Exception:
-    HAS_WX = False
-
-HAS_PYMONGO = True
-try:
-    from pymongo import MongoClient
-except Exception:
-    HAS_PYMONGO = False
-
-try:
-    from zoneinfo import ZoneInfo
-except Exception:
-    ZoneInfo = None  # type: ignore
+from appointment_queries import SUMMARY_PROJECTION, ensure_indexes, intakes_for_docs, list_doctors
+from clinic_calendar import get_calendar
+from handoff_export import HAS_ARROW, export_handoffs
+from rollups import query_rollups, totals
+from schedule_views import fetch_doctor_day_view, start_schedule_build
+from schema import start_background_migration
+from summary_llm import HandoffSummarizer
+from waitlist import NotFound, mark_no_show
+from llm_cassette import cassette_model, replay_only
+from llm_gateway import get_gateway
+from llm_ratelimit import PRIORITY_BACKGROUND, get_limiter
+
+# Optional deps (installed-or-not only; the SDKs are imported lazily, see lazy_deps.py)
+from lazy_deps import HAS_IBM as HAS_WX, HAS_PYMONGO, mongo_client_cls, preload_sdks, warm, wx
 
 # -------------------------------------------------
 # Config helpers
@@ -55,63 +61,35 @@ def _env_or_secret(env: str, section: str, key: str, default: str = "") -> str:
         return default
 
 CLINIC_TZ = _env_or_secret("CLINIC_TZ", "clinic", "tz", "America/New_York")
+CLINIC_HOLIDAYS = _env_or_secret("CLINIC_HOLIDAYS", "clinic", "holidays", "")
 MODEL_ID      = _env_or_secret("WX_MODEL_ID", "ibm", "model_id", "ibm/granite-3-3-8b-instruct")
 WX_URL        = _env_or_secret("WX_URL", "ibm", "url", "https://us-south.ml.cloud.ibm.com")
 WX_API_KEY    = _env_or_secret("WX_API_KEY", "ibm", "api_key", "")
 WX_PROJECT_ID = _env_or_secret("WX_PROJECT_ID", "ibm", "project_id", "")
 MONGO_URI     = _env_or_secret("MONGO_URI", "mongo", "uri", "")
 DB_NAME       = _env_or_secret("DB_NAME",  "mongo", "db",  "medbird")
+EXPORT_DIR    = _env_or_secret("EXPORT_DIR", "export", "dir", "exports")
+LLM_DEADLINE_S = float(_env_or_secret("LLM_DEADLINE_S", "llm", "summary_deadline_s", "15") or 15)
+LLM_RETRIES    = int(_env_or_secret("LLM_RETRIES", "llm", "retries", "2") or 2)
+LLM_HEDGE      = str(_env_or_secret("LLM_HEDGE", "llm", "hedge", "false")).lower() == "true"
+# Client-side quota (requests/sec), shared by every session in this process
+LLM_UPSTREAM_RPS = float(_env_or_secret("LLM_UPSTREAM_RPS", "llm", "upstream_rps", "8") or 8)
+LLM_CHAT_RPS     = float(_env_or_secret("LLM_CHAT_RPS", "llm", "chat_rps", "6") or 6)
+LLM_SUMMARY_RPS  = float(_env_or_secret("LLM_SUMMARY_RPS", "llm", "summary_rps", "2") or 2)
+# Record/replay fixtures for offline runs (llm_cassette.py)
+LLM_CASSETTE         = _env_or_secret("LLM_CASSETTE", "llm", "cassette", "")
+LLM_CASSETTE_MODE    = str(_env_or_secret("LLM_CASSETTE_MODE", "llm", "cassette_mode", "replay")).lower()
+LLM_CASSETTE_LATENCY = str(_env_or_secret("LLM_CASSETTE_LATENCY", "llm", "cassette_latency", "recorded")).lower()
 
 # -------------------------------------------------
-# Prompt
+# Mongo connections (warmed once per process, pure)
 # -------------------------------------------------
-SYSTEM = """You are a clinical intake summarizer. Convert the provided intake JSON into the EXACT human-readable summary below. Follow this format precisely—same section titles, order, punctuation, and dash bullets. Output ONLY the text summary (no JSON, no explanations, no code fences).
-
-Format:
-Patient: <Full name>
-Age: <number or N/A>
-Gender: <value or N/A>
-Contact: <phone/email or N/A>
-Appointment ID: <id>
-Scheduled Time: <DD Mon YYYY, h:mm AM/PM (TZ)>
-
-Reason for Visit:
-- Symptoms: <comma-separated symptoms or N/A>
-- Duration: <N days/weeks or N/A>
-- Severity: <Low|Medium|High>
-- Suspected cause: <text or N/A>
-
-Medical Background:
-- Allergies: <comma-separated or None>
-- Chronic conditions: <comma-separated or None>
-- Current medications: <name + dose + frequency or None>
-- Relevant history: <brief or None>
-
-Triage Notes:
-- Urgency: <Low|Medium|High> – <short rationale or N/A>
-- Flag: <brief flag or None>
-
-Booking Details:
-- Doctor: <Dr. Full Name> (<Specialty>)
-- Appointment Type: <In-person|Telehealth>
-- Location: <clinic address or N/A>
-
-Rules:
-- Do not invent facts; if unknown, write 'N/A' or 'None' as appropriate.
-- Map numeric severity (severity_score) to: 0–1=Low, 2–3=Medium, ≥4=High. If a text 'triage'/'severity' is provided, use it.
-- 'Urgency' mirrors the severity and may include a one-line rationale from symptoms/duration.
-- If 'scheduled_time_human' is provided, use it as-is; otherwise convert slot_start (ISO 8601) to 'DD Mon  YYYY, h:mm AM/PM (TZ)' (e.g., '11 Aug 2025, 3:30 PM (EDT)').
-- Keep exactly one blank line between sections."""
 
-# -------------------------------------------------
-# Mongo connections (cached, pure)
-# -------------------------------------------------
-
-@st.cache_resource(show_spinner=False)
-def _init_mongo(uri: str, dbname: str):
+def _connect_mongo(uri: str, dbname: str):
+    preload_sdks()
     if not (HAS_PYMONGO and uri):
         return None, None, None
-    client = MongoClient(
+    client = mongo_client_cls()(
         uri,
         serverSelectionTimeoutMS=3000,
         connectTimeoutMS=3000,
@@ -123,176 +101,86 @@ def _init_mongo(uri: str, dbname: str):
         client.admin.command("ping")
     except Exception:
         pass
+    ensure_indexes(db.appointments)
+    # v1 → v2 document rewrite, batched, in a daemon thread (once per process)
+    start_background_migration(db, get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS))
+    # per-doctor-day schedule documents; day view reads appointments until built
+    start_schedule_build(db, get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS))
     return db.appointments, db.users, db
 
+
+def _init_mongo(uri: str, dbname: str):
+    """(appointments, users, db); blocks only while the background warm-up is still connecting."""
+    return warm(f"summary|{uri}|{dbname}", _connect_mongo, uri, dbname).result()
+
 # -------------------------------------------------
 # Utilities
 # -------------------------------------------------
 
-def _normalize_contact(contact: str) -> Tuple[Optional[str], Optional[str]]:
-    if (contact or "").find("@") != -1:
-        return (contact, None)
-    digits = re.sub(r"\D", "", contact or "")
-    return (None, digits if digits else None)
-
-
-def _compute_age(dob_str: Optional[str]) -> Optional[int]:
-    if not dob_str or dob_str.upper() == "NA":
-        return None
-    fmts = ["%Y-%m-%d", "%d-%m-%Y", "%m-%d-%Y", "%d/%m/%Y", "%m/%d/%Y"]
-    for fmt in fmts:
-        try:
-            dob = datetime.strptime(dob_str, fmt).date()
-            today = datetime.now().date()
-            years = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
-            return max(0, years)
-        except Exception:
-            continue
-    return None
-
-
-def _next_occurrence(day_name: str, ref: Optional[datetime] = None) -> datetime:
-    ref = ref or datetime.now()
-    try:
-        idx = list(calendar.day_name).index(day_name)
-    except ValueError:
-        idx = ref.weekday()
-    delta = (idx - ref.weekday()) % 7
-    if delta == 0:
-        delta = 7
-    return ref + timedelta(days=delta)
+def _iso(v: Any) -> Any:
+    return v.isoformat() if isinstance(v, datetime) else v
 
 
 def _enrich_time(payload: Dict[str, Any], tz_name: str = CLINIC_TZ) -> Dict[str, Any]:
     out = dict(payload)
-    tz = ZoneInfo(tz_name) if ZoneInfo else None
+    cal = get_calendar(tz_name, CLINIC_HOLIDAYS)
     # Priority: scheduled_time_human, then slot_start, then selected_day+selected_time
     if "scheduled_time_human" in out and out.get("scheduled_time_human"):
         return out
 
-    if out.get("slot_start"):
-        try:
-            iso_in = out["slot_start"].replace("Z", "+00:00")
-            dt = datetime.fromisoformat(iso_in)
-            local = dt.astimezone(tz) if tz else dt
-            out["scheduled_time_human"] = local.strftime("%d %b %Y, %I:%M %p (%Z)").replace(", 0", ", ")
-            return out
-        except Exception:
-            pass
+    human = cal.human(out.get("slot_start"))
+    if human:
+        out["slot_start"] = _iso(out["slot_start"])
+        out["scheduled_time_human"] = human
+        return out
 
-    # selected_day + selected_time
-    sday, stime = out.get("selected_day"), out.get("selected_time")
-    if sday and stime:
-        try:
-            base = _next_occurrence(sday)
-            # Parse time like "10:00 AM"
-            t = datetime.strptime(stime.upper(), "%I:%M %p").time()
-            local = datetime.combine(base.date(), t)
-            if tz:
-                local = local.replace(tzinfo=tz)
-            out["slot_start"] = local.isoformat()
-            out["scheduled_time_human"] = local.strftime("%d %b %Y, %I:%M %p (%Z)").replace(", 0", ", ")
-        except Exception:
-            pass
+    # Legacy documents written before slot_start was stored
+    local = cal.slot_start(out.get("selected_day"), out.get("selected_time"))
+    if local is not None:
+        out["slot_start"] = local.isoformat()
+        out["scheduled_time_human"] = cal.human(local)
     return out
 
-# Fallback (no LLM) formatter to guarantee demo works
-
-def _format_summary_deterministic(p: Dict[str, Any]) -> str:
-    def pick(*vals):
-        for v in vals:
-            if v not in (None, "", "NA"): return v
-        return "N/A"
-
-    age = p.get("age")
-    if age is None:
-        age = _compute_age(p.get("dob"))
-    contact = pick(p.get("mobile"), p.get("email"), p.get("contact"))
-    appt_id = pick(p.get("appointment_id"), p.get("booking_id"))
-    t_human = p.get("scheduled_time_human") or "N/A"
-
-    symptoms = p.get("symptoms") or p.get("reason", {}).get("symptoms")
-    if isinstance(symptoms, list):
-        symptoms = ", ".join([s for s in symptoms if s]) or "N/A"
-    symptoms = symptoms or pick(p.get("condition"))
-
-    duration = pick(p.get("duration"), p.get("reason", {}).get("duration"))
-    sev_text = p.get("severity") or p.get("triage", {}).get("severity")
-    sev_score = p.get("severity_score") or p.get("reason", {}).get("severity_score")
-    if not sev_text and sev_score is not None:
-        try:
-            sev_text = "Low" if sev_score <= 1 else ("Medium" if sev_score <= 3 else "High")
-        except Exception:
-            pass
-    sev_text = sev_text or "N/A"
-
-    cause = pick(p.get("suspected_cause"), p.get("reason", {}).get("suspected_cause"))
-
-    allergies = p.get("allergies") or p.get("medical", {}).get("allergies") or "None"
-    chron = p.get("Chronic_condition") or p.get("medical", {}).get("chronic_conditions") or "None"
-    meds = p.get("medications") or p.get("medical", {}).get("medications") or "None"
-    hist = p.get("history") or p.get("medical", {}).get("history") or "None"
-
-    urgency = p.get("urgency") or p.get("triage", {}).get("urgency") or (sev_text if sev_text in ("Low","Medium","High") else "N/A")
-    flag = p.get("flag") or p.get("triage", {}).get("flag") or "None"
-
-    doctor = pick(p.get("doctor_name"))
-    spec = pick(p.get("specialty"))
-    vtype = (p.get("visit_type") or "").replace("telehealth","Telehealth").replace("in-person","In-person") or "N/A"
-    loc = pick(p.get("location"))
-
-    return (
-        f"Patient: {pick(p.get('patient_name'), p.get('name'))}\n"
-        f"Age: {age if age is not None else 'N/A'}\n"
-        f"Gender: {pick(p.get('gender'))}\n"
-        f"Contact: {contact}\n"
-        f"Appointment ID: {appt_id}\n"
-        f"Scheduled Time: {t_human}\n\n"
-        f"Reason for Visit:\n"
-        f"- Symptoms: {symptoms or 'N/A'}\n"
-        f"- Duration: {duration}\n"
-        f"- Severity: {sev_text}\n"
-        f"- Suspected cause: {cause}\n\n"
-        f"Medical Background:\n"
-        f"- Allergies: {allergies}\n"
-        f"- Chronic conditions: {chron}\n"
-        f"- Current medications: {meds}\n"
-        f"- Relevant history: {hist}\n\n"
-        f"Triage Notes:\n"
-        f"- Urgency: {urgency} – {'N/A' if urgency=='N/A' else 'as per reported symptoms'}\n"
-        f"- Flag: {flag}\n\n"
-        f"Booking Details:\n"
-        f"- Doctor: {doctor} ({spec})\n"
-        f"- Appointment Type: {vtype}\n"
-        f"- Location: {loc}"
-    )
-
 # -------------------------------------------------
 # LLM summarizer
 # -------------------------------------------------
+# The fixed sections of the handoff are rendered locally by the compiled
+# template in summary_format.py; the model only fills the two free-text
+# parts (cleaned symptom list, one-line urgency rationale) — summary_llm.py.
+
+_limiter = get_limiter()
+_limiter.configure("upstream", LLM_UPSTREAM_RPS)
+_limiter.configure("summary", LLM_SUMMARY_RPS)
+_llm = get_gateway("summary", deadline_s=LLM_DEADLINE_S, max_retries=LLM_RETRIES, hedge=LLM_HEDGE,
+                   budget="summary", priority=PRIORITY_BACKGROUND)
+
+LLM_LIVE = bool(HAS_WX and WX_API_KEY and WX_PROJECT_ID and WX_URL)
+
+
+@st.cache_resource(show_spinner=False)
+def _summarizer(model_id: str) -> HandoffSummarizer:
+    model = None
+    if LLM_LIVE:
+        try:
+            model = wx().ModelInference(
+                model_id=model_id,
+                credentials={"apikey": WX_API_KEY, "url": WX_URL},
+                project_id=WX_PROJECT_ID,
+            )
+        except Exception:
+            model = None
+    # record/replay fixtures (llm_cassette.py); a replay-only cassette needs no credentials
+    model = cassette_model(model, model_id, LLM_CASSETTE, LLM_CASSETTE_MODE, LLM_CASSETTE_LATENCY)
+    return HandoffSummarizer(model, _llm, get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS))
+
 
 def generate_summary_llm(payload: Dict[str, Any]) -> str:
-    if not (HAS_WX and WX_API_KEY and WX_PROJECT_ID and WX_URL):
-        return _format_summary_deterministic(payload)
-    model = ModelInference(
-        model_id=MODEL_ID,
-        credentials={"apikey": WX_API_KEY, "url": WX_URL},
-        project_id=WX_PROJECT_ID,
-    )
-    params = TextChatParameters(temperature=0.1, max_tokens=700)
-    messages = [
-        {"role": "system", "content": SYSTEM},
-        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
-    ]
-    try:
-        resp = model.chat(messages=messages, params=params)
-        out = resp["choices"][0]["message"]["content"].strip()
-        # Safety: ensure no JSON/code fences leaked
-        if out.startswith("{") or out.startswith("```"):
-            return _format_summary_deterministic(payload)
-        return out
-    except Exception:
-        return _format_summary_deterministic(payload)
+    return _summarizer(MODEL_ID).generate(payload)
+
+
+def generate_summaries(payloads) -> list:
+    """Batch variant: per-payload free-text parts, then one compiled render over the whole batch."""
+    return _summarizer(MODEL_ID).generate_batch(payloads)
 
 # -------------------------------------------------
 # Build intake from latest appointment
@@ -301,107 +189,66 @@ def generate_summary_llm(payload: Dict[str, Any]) -> str:
 def _fetch_latest(ap_col, users_col) -> Optional[Dict[str, Any]]:
     if ap_col is None:
         return None
-    doc = ap_col.find_one({}, sort=[("created_at", -1)])
+    doc = ap_col.find_one({"status": {"$ne": "cancelled"}}, SUMMARY_PROJECTION, sort=[("created_at", -1)])
     if not doc:
         return None
-    intake: Dict[str, Any] = {
-        "patient_name": doc.get("patient_name"),
-        "contact": doc.get("contact"),
-        "appointment_id": doc.get("booking_id"),
-        "condition": doc.get("condition"),
-        "symptoms": [doc.get("condition")] if doc.get("condition") else None,
-        "doctor_name": doc.get("doctor_name"),
-        "specialty": doc.get("specialty"),
-        "location": doc.get("location"),
-        "visit_type": doc.get("visit_type"),
-        "selected_day": doc.get("selected_day"),
-        "selected_time": doc.get("selected_time"),
-    }
-    # enrich from users
-    if users_col is not None:
-        email, mobile = _normalize_contact(intake.get("contact"))
-        filt = {"$or": ([{"email": email}] if email else []) + ([{"mobile": mobile}] if mobile else [])}
-        user = users_col.find_one(filt) if filt.get("$or") else users_col.find_one({"name": intake.get("patient_name")})
-        if user:
-            intake.update({
-                "email": user.get("email"),
-                "mobile": user.get("mobile"),
-                "dob": user.get("dob"),
-                "gender": user.get("gender"),
-                "allergies": user.get("allergies", "None"),
-                "Chronic_condition": user.get("Chronic_condition", "NA"),
-                "medications": user.get("medications", "None"),
-                "history": user.get("history", "None"),
-            })
-    return intake
+    return intakes_for_docs([doc], users_col)[0]
 
 # Extra queries for doctor-specific views
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_doctors(uri: str, dbname: str):
+    """Doctor directory (tiny collection), refreshed at most once a minute."""
+    ap, _users, db = _init_mongo(uri, dbname)
+    return list_doctors(db, ap)
+
+
 def _distinct_doctors(ap_col):
     if ap_col is None:
         return []
-    try:
-        vals = ap_col.distinct('doctor_name')
-        return sorted([v for v in vals if v])
-    except Exception:
-        return []
+    return [d["name"] for d in _cached_doctors(MONGO_URI, DB_NAME)]
 
 
 def _fetch_recent_by_doctor(ap_col, users_col, doctor_name: str, limit: int = 5):
+    """Most recently *booked* appointments. Deliberately not served from schedule_views: that
+    view is keyed by slot day and carries no created_at, while this is one bounded read on
+    the (doctor_name, created_at) index."""
     if ap_col is None or not doctor_name:
         return []
     try:
-        cur = ap_col.find({"doctor_name": doctor_name}, sort=[("created_at", -1)]).limit(int(limit))
+        cur = ap_col.find({"doctor_name": doctor_name, "status": {"$ne": "cancelled"}}, SUMMARY_PROJECTION,
+                          sort=[("created_at", -1)]).limit(int(limit))
+        docs = list(cur)
     except Exception:
         return []
-    items = []
-    for doc in cur:
-        intake: Dict[str, Any] = {
-            "patient_name": doc.get("patient_name"),
-            "contact": doc.get("contact"),
-            "appointment_id": doc.get("booking_id"),
-            "condition": doc.get("condition"),
-            "symptoms": [doc.get("condition")] if doc.get("condition") else None,
-            "doctor_name": doc.get("doctor_name"),
-            "specialty": doc.get("specialty"),
-            "location": doc.get("location"),
-            "visit_type": doc.get("visit_type"),
-            "selected_day": doc.get("selected_day"),
-            "selected_time": doc.get("selected_time"),
-        }
-        # enrich from users
-        if users_col is not None:
-            email, mobile = _normalize_contact(intake.get("contact"))
-            filt = {"$or": ([{"email": email}] if email else []) + ([{"mobile": mobile}] if mobile else [])}
-            user = users_col.find_one(filt) if filt.get("$or") else users_col.find_one({"name": intake.get("patient_name")})
-            if user:
-                intake.update({
-                    "email": user.get("email"),
-                    "mobile": user.get("mobile"),
-                    "dob": user.get("dob"),
-                    "gender": user.get("gender"),
-                    "allergies": user.get("allergies", "None"),
-                    "Chronic_condition": user.get("Chronic_condition", "NA"),
-                    "medications": user.get("medications", "None"),
-                    "history": user.get("history", "None"),
-                })
-        items.append(_enrich_time(intake, CLINIC_TZ))
-    return items
+    return [_enrich_time(it, CLINIC_TZ) for it in intakes_for_docs(docs, users_col)]
+
+
+def _fetch_doctor_day_page(db, ap_col, users_col, doctor_id: str, day, after: Optional[str], page_size: int):
+    docs, next_cursor = fetch_doctor_day_view(db, ap_col, doctor_id, day, get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS),
+                                              after=after, limit=page_size)
+    return [_enrich_time(it, CLINIC_TZ) for it in intakes_for_docs(docs, users_col)], next_cursor
 
 # -------------------------------------------------
 # Streamlit UI
 # -------------------------------------------------
 
+# Start connecting (and importing the SDKs) in the background before drawing anything
+warm(f"summary|{MONGO_URI}|{DB_NAME}", _connect_mongo, MONGO_URI, DB_NAME)
+
 st.set_page_config(page_title="🧾 MedBird – Doctor Handoff", page_icon="🧾", layout="centered")
 st.title("🧾 Doctor Handoff Summarizer")
 
+# Title is painted; wait for the warm-up (instant on reruns)
 with st.spinner("Connecting…"):
     ap_col, users_col, _db = _init_mongo(MONGO_URI, DB_NAME)
 
 status = []
-if not HAS_WX:
+if replay_only(LLM_CASSETTE, LLM_CASSETTE_MODE):
+    status.append(f"Replaying model output from {LLM_CASSETTE} (no watsonx calls)")
+elif not HAS_WX:
     status.append("watsonx SDK missing → fallback formatter active")
-if not WX_API_KEY or not WX_PROJECT_ID:
+elif not WX_API_KEY or not WX_PROJECT_ID:
     status.append("IBM credentials not set → fallback formatter active")
 if ap_col is None:
     status.append("Mongo not connected → using sample booking")
@@ -409,15 +256,51 @@ if ap_col is None:
 if status:
     st.info("\n".join(f"• {s}" for s in status))
 
+# ---- Capacity panel (served from the rollups; never aggregates appointments) ----
+if _db is not None:
+    with st.sidebar:
+        st.header("📊 Capacity")
+        _cal = get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS)
+        _today = _cal.today()
+        windows = {
+            "Last 4 weeks": (_today - timedelta(days=27), _today),
+            "Next 2 weeks": (_today, _today + timedelta(days=13)),
+            "Last 13 weeks": (_today - timedelta(days=90), _today),
+        }
+        cap_window = st.selectbox("Window", list(windows))
+        cap_by = st.selectbox("Group by", ["specialty", "doctor", "weekday", "hour"])
+        cap_start, cap_end = windows[cap_window]
+        t0 = time.perf_counter()
+        try:
+            cap_rows = query_rollups(_db, _cal, cap_start, cap_end, cap_by)
+        except Exception as e:
+            cap_rows = None
+            st.warning(f"Rollups unavailable: {e}")
+        if cap_rows is not None:
+            cap_tot = totals(cap_rows)
+            st.metric("Booked", cap_tot["booked"])
+            mc1, mc2 = st.columns(2)
+            mc1.metric("Telehealth", f"{cap_tot['telehealth_share']:.0%}")
+            mc2.metric("No-show", f"{cap_tot['no_show_rate']:.1%}")
+            st.dataframe(
+                [{cap_by.capitalize(): r["key"], "Booked": r["booked"], "Cancelled": r["cancelled"],
+                  "Tele": f"{r['telehealth_share']:.0%}", "No-show": f"{r['no_show_rate']:.0%}"} for r in cap_rows],
+                use_container_width=True, hide_index=True,
+            )
+            st.caption(f"{cap_start} → {cap_end} · {(time.perf_counter() - t0) * 1e3:.0f} ms")
+
 # ---- Selection controls ----
 doctors = _distinct_doctors(ap_col) if ap_col is not None else []
 colf1, colf2, colf3 = st.columns([2,1,1])
 with colf1:
     doc_sel = st.selectbox("Doctor", options=(['(All doctors)'] + doctors) if doctors else ['(All doctors)'])
 with colf2:
-    mode = st.selectbox("Mode", ["Latest overall", "Latest for selected doctor", "Batch for selected doctor"])
+    mode = st.selectbox("Mode", ["Latest overall", "Latest for selected doctor", "Batch for selected doctor", "Doctor day view"])
 with colf3:
-    batch_n = st.number_input("Batch size", min_value=1, max_value=10, value=5) if mode.endswith("Batch for selected doctor") else 5
+    if mode == "Doctor day view":
+        batch_n = st.number_input("Page size", min_value=10, max_value=500, value=200, step=10)
+    else:
+        batch_n = st.number_input("Batch size", min_value=1, max_value=10, value=5) if mode.endswith("Batch for selected doctor") else 5
 
 latest = None
 batch_items = []
@@ -429,6 +312,28 @@ elif mode == "Latest for selected doctor" and doc_sel != "(All doctors)":
 elif mode == "Batch for selected doctor" and doc_sel != "(All doctors)":
     batch_items = _fetch_recent_by_doctor(ap_col, users_col, doc_sel, limit=int(batch_n))
     latest = batch_items[0] if batch_items else None
+elif mode == "Doctor day view" and doc_sel != "(All doctors)":
+    doc_id = next((d["doctor_id"] for d in _cached_doctors(MONGO_URI, DB_NAME) if d["name"] == doc_sel), None)
+    day_sel = st.date_input("Day", value=get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS).today())
+    # cursor stack per (doctor, day, page size): [None, c1, c2, ...]
+    view_key = f"{doc_id}|{day_sel}|{int(batch_n)}"
+    if st.session_state.get("day_view_key") != view_key:
+        st.session_state["day_view_key"] = view_key
+        st.session_state["day_cursors"] = [None]
+    cursors = st.session_state["day_cursors"]
+    batch_items, next_cursor = _fetch_doctor_day_page(_db, ap_col, users_col, doc_id, day_sel, cursors[-1], int(batch_n))
+    latest = batch_items[0] if batch_items else None
+    pc1, pc2, pc3 = st.columns([1,1,2])
+    with pc1:
+        if len(cursors) > 1 and st.button("← Previous page"):
+            cursors.pop()
+            st.rerun()
+    with pc2:
+        if next_cursor and st.button("Next page →"):
+            cursors.append(next_cursor)
+            st.rerun()
+    with pc3:
+        st.caption(f"Page {len(cursors)} · {len(batch_items)} appointments")
 
 with st.expander("Input payload", expanded=True):
     if latest is None:
@@ -452,7 +357,26 @@ with st.expander("Input payload", expanded=True):
         raw = st.text_area("Edit JSON", value=json.dumps(latest, indent=2), height=260)
 
 # Show batch preview (if any)
-if batch_items:
+if batch_items and mode == "Doctor day view":
+    st.markdown("**Day schedule (by slot):**")
+    st.dataframe(
+        [{"Time": it.get("scheduled_time_human") or it.get("selected_time"), "Patient": it.get("patient_name"),
+          "Reason": it.get("condition"), "Type": it.get("visit_type"), "ID": it.get("appointment_id")} for it in batch_items],
+        use_container_width=True, hide_index=True,
+    )
+    if _db is not None and day_sel <= get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS).today():
+        with st.expander("Record no-show"):
+            ns_items = [it for it in batch_items if it.get("appointment_id")]
+            ns_pick = st.selectbox("Appointment", [it["appointment_id"] for it in ns_items],
+                                   format_func=lambda a: next(f"{it.get('scheduled_time_human') or it.get('selected_time')} — "
+                                                              f"{it.get('patient_name')}" for it in ns_items if it["appointment_id"] == a))
+            if ns_pick and st.button("Mark no-show"):
+                try:
+                    mark_no_show(_db, ns_pick, get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS))
+                    st.success("Recorded ✅")
+                except NotFound as e:
+                    st.warning(str(e))
+elif batch_items:
     st.markdown("**Batch preview (most recent first):**")
     for i, it in enumerate(batch_items, 1):
         st.write(f"{i}. {it.get('patient_name','N/A')} — {it.get('selected_day','?')} {it.get('selected_time','?')} — {it.get('doctor_name','N/A')}")
@@ -487,11 +411,10 @@ with col2:
 with col3:
     if st.session_state.get('batch_payloads') and st.button("Generate Batch Summary"):
         try:
-            texts = []
             with st.spinner("Generating batch…"):
-                for p in st.session_state['batch_payloads']:
-                    texts.append(generate_summary_llm(p))
+                texts = generate_summaries(st.session_state['batch_payloads'])
             st.session_state['last_batch_summary'] = ("---").join(texts)
+            st.session_state['last_batch_items'] = list(zip(st.session_state['batch_payloads'], texts))
         except Exception as e:
             st.error(f"Batch failed: {e}")
 
@@ -505,18 +428,37 @@ if 'last_batch_summary' in st.session_state:
     st.code(st.session_state['last_batch_summary'], language="markdown")
 
     # Optional: store handoff record
-    if _db is not None and st.button("Save batch to handoffs"):
+    if _db is not None and st.session_state.get('last_batch_items') and st.button("Save batch to handoffs"):
         try:
-            _db.handoffs.insert_one({
-                "created_at": datetime.now(),
-                "payload": st.session_state.get("last_payload"),
-                "summary": st.session_state.get("last_batch_summary"),
+            now = datetime.now()
+            _db.handoffs.insert_many([{
+                "created_at": now,
+                "appointment_id": p.get("appointment_id"),
+                "payload": p,
+                "summary": text,
                 "type": "batch",
-                "doctor": doc_sel if 'doc_sel' in locals() else None,
-            })
-            st.success("Saved batch to handoffs ✅")
+                "doctor": p.get("doctor_name"),
+            } for p, text in st.session_state['last_batch_items']], ordered=False)
+            st.success(f"Saved {len(st.session_state['last_batch_items'])} handoffs ✅")
         except Exception as e:
             st.warning(f"Could not save handoff: {e}")
 
+if ap_col is not None:
+    with st.expander("Export day archive"):
+        ex_day = st.date_input("Clinic day", value=get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS).today(), key="export_day")
+        ex_fmt = st.radio("Format", ["jsonl", "parquet"] if HAS_ARROW else ["jsonl"], horizontal=True)
+        ex_llm = st.checkbox("Use LLM free-text parts (slower)", value=False)
+        if st.button("Export"):
+            bar = st.empty()
+            try:
+                state = export_handoffs(
+                    ap_col, users_col, EXPORT_DIR, ex_day, get_calendar(CLINIC_TZ, CLINIC_HOLIDAYS),
+                    fmt=ex_fmt, summarize=generate_summaries if ex_llm else None,
+                    progress=lambda n: bar.caption(f"{n} records written…"),
+                )
+                st.success(f"{state.get('written', 0)} records → {state['path']}")
+            except Exception as e:
+                st.error(f"Export stopped (rerun to resume from the checkpoint): {e}")
+
 st.markdown("---")
-st.caption("Uses IBM watsonx Granite when available; otherwise falls back to a deterministic formatter. Timezone configurable via [clinic] tz in secrets.")
\ No newline at end of file
+st.caption("Uses IBM watsonx Granite when available; otherwise falls back to a deterministic formatter. Timezone configurable via [clinic] tz in secrets.")
\ No newline at end of file
@@ -0,0 +1,96 @@
+# summary_llm.py — model-written parts of the doctor handoff (no Streamlit)
+# ----------------------------------------------------------------------
+#   s = HandoffSummarizer(model, get_gateway("summary"), cal)
+#   text  = s.generate(payload)            # summary_generator.generate_summary_llm
+#   texts = s.generate_batch(payloads)
+#
+# The fixed sections are rendered locally by summary_format.FORMATTER; the
+# model only fills the cleaned symptom list and a one-line urgency
+# rationale. model=None (no SDK / credentials) or an open breaker keeps
+# the deterministic text. `model` may be a llm_cassette.CassetteModel,
+# which is how the benches run this offline.
+# ----------------------------------------------------------------------
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from intake import Intake
+from json_extract import extract_first_object
+from lazy_deps import HAS_IBM, wx
+from summary_format import FORMATTER
+
+SYSTEM = """You clean up clinical intake notes. Reply with ONLY this JSON:
+{"symptoms": "<comma-separated symptoms in clinical wording>", "rationale": "<one short clause explaining the urgency>"}
+Rules: use only the facts given; no diagnoses; rationale under 15 words; if urgency is N/A, rationale is "N/A"."""
+SUMMARY_MAX_TOKENS = 60
+
+
+def free_text_prompt(it: Intake) -> Optional[str]:
+    """Tiny user message with just what the free-text parts depend on (None → nothing to ask)."""
+    if not it.symptoms:
+        return None
+    d = {"symptoms": ", ".join(it.symptoms), "duration": it.duration,
+         "urgency": it.urgency or it.severity or "N/A", "history": it.history}
+    return json.dumps({k: v for k, v in d.items() if v}, ensure_ascii=False, separators=(",", ":"))
+
+
+def one_line(v: Any, limit: int) -> Optional[str]:
+    if not isinstance(v, str):
+        return None
+    v = " ".join(v.split()).strip(" .")
+    return v if v and len(v) <= limit and v.upper() != "N/A" else None
+
+
+def summary_params():
+    kw = dict(temperature=0.1, max_tokens=SUMMARY_MAX_TOKENS)
+    # cassette replay without the SDK: params are only passed through
+    return wx().TextChatParameters(**kw) if HAS_IBM else kw
+
+
+class HandoffSummarizer:
+    def __init__(self, model: Any = None, gateway: Any = None, cal: Any = None):
+        self.model = model
+        self.gateway = gateway
+        self.cal = cal
+        self._params = None
+
+    def free_text_parts(self, payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        """(symptoms_text, rationale) from the model, or (None, None) to keep the deterministic text."""
+        if self.model is None or self.gateway is None:
+            return None, None
+        if self.gateway.breaker.state == "open":
+            # watsonx degraded: skip the call entirely
+            return None, None
+        prompt = free_text_prompt(Intake.from_payload(payload))
+        if prompt is None:
+            return None, None
+        if self._params is None:
+            self._params = summary_params()
+        messages = [
+            {"role": "system", "content": SYSTEM},
+            {"role": "user", "content": prompt},
+        ]
+        try:
+            resp = self.gateway.chat(self.model, messages, self._params)
+            data = extract_first_object(resp["choices"][0]["message"]["content"]) or {}
+        except Exception:
+            # includes LLMUnavailable (deadline exceeded / circuit open)
+            data = {}
+        return one_line(data.get("symptoms"), 200), one_line(data.get("rationale"), 120)
+
+    def _today(self):
+        return self.cal.today() if self.cal is not None else None
+
+    def generate(self, payload: Dict[str, Any]) -> str:
+        symptoms_text, rationale = self.free_text_parts(payload)
+        return FORMATTER.render(payload, symptoms_text, rationale, today=self._today())
+
+    def generate_batch(self, payloads: List[Dict[str, Any]]) -> List[str]:
+        """Per-payload free-text parts, then one compiled render over the whole batch."""
+        parts = [self.free_text_parts(p) for p in payloads]
+        return FORMATTER.render_batch(
+            payloads,
+            symptoms_texts=[s for s, _ in parts],
+            rationales=[r for _, r in parts],
+            today=self._today(),
+        )
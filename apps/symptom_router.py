@@ -0,0 +1,318 @@
+# symptom_router.py — offline symptom → specialty routing (no LLM call)
+# ----------------------------------------------------------------------
+#   r = get_router().route("my heart keeps fluttering")
+#   r.category -> "cardiology"
+#   r.score    -> 0.75        (cosine similarity of the best match)
+#   r.source   -> "embedding" | "keyword" | "default"
+#   r.matches  -> (("fluttering in chest", "cardiology", 0.75), ...)   # top-k
+#
+# A curated corpus of lay phrasings (SYMPTOM_CORPUS, plus the CONDITIONS
+# keywords) is embedded once per process into a matrix: hashed word,
+# word-bigram and character-trigram features, idf-weighted, L2-normalized.
+# A message is cut into short word windows (1..WINDOW words, so "I'd like
+# to book, my heart is racing" is not diluted by the pleasantries) and all
+# windows are scored against the corpus in one vectorized pass; the best
+# match's specialty wins, and matches within TIE_MARGIN of it vote by
+# summed score so a near-tie isn't settled by rounding. Below
+# MIN_SCORE the CONDITIONS substring map decides; failing that, "default"
+# (the caller's internal-medicine doctor).
+#
+# NumPy is optional; without it the same scores come from a sparse
+# inverted index in pure Python (slower, same answers).
+# ----------------------------------------------------------------------
+
+import math
+import re
+import threading
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except Exception:
+    HAS_NUMPY = False
+
+DIM = 2048
+WINDOW = 4
+MAX_TOKENS = 40
+MIN_SCORE = 0.5
+TOP_K = 5
+TIE_MARGIN = 0.02
+
+# Exact keywords (the original routing table); also seeds the corpus
+CONDITIONS: Dict[str, str] = {
+    "chest pain":"cardiology","hypertension":"cardiology","palpitations":"cardiology","shortness of breath":"cardiology",
+    "acne":"dermatology","eczema":"dermatology","rash":"dermatology","psoriasis":"dermatology","mole":"dermatology",
+    "knee pain":"orthopedics","back pain":"orthopedics","shoulder pain":"orthopedics","sprain":"orthopedics","fracture":"orthopedics",
+    "headache":"internal","fever":"internal","cold":"internal","migraine":"internal","fatigue":"internal","checkup":"internal","vomiting":"internal","nausea":"internal"
+}
+
+SYMPTOM_CORPUS: Dict[str, Tuple[str, ...]] = {
+    "cardiology": (
+        "heart racing", "heart pounding", "racing heartbeat", "fast heartbeat", "rapid pulse",
+        "irregular heartbeat", "skipped heartbeat", "heart flutters", "fluttering in chest",
+        "chest tightness", "tight chest", "chest pressure", "pressure in chest", "heavy feeling in chest",
+        "squeezing chest", "pain spreading to left arm", "jaw pain with exertion", "heart problem",
+        "high blood pressure", "blood pressure high", "low blood pressure", "swollen ankles",
+        "swelling in legs", "out of breath climbing stairs", "breathless when walking",
+        "short of breath lying down", "cholesterol", "murmur", "angina", "heart attack",
+        "arrhythmia", "atrial fibrillation", "dizzy when standing with palpitations",
+        # home readings and near-faints (misrouted to dermatology before)
+        "high bp", "bp readings high", "blood pressure monitor reads high", "high numbers on blood pressure cuff",
+        "nearly fainted", "almost passed out", "fainting spells",
+        "heartbeat all over the place", "heart beating erratically",
+    ),
+    "dermatology": (
+        "itchy skin", "itchy patches", "itching all over", "red itchy spots", "dry flaky skin",
+        "scaly patches", "skin peeling", "red bumps", "bumps on skin", "hives", "welts",
+        "pimples", "breakouts", "blackheads", "cystic acne", "oily skin", "blisters",
+        "changing mole", "new mole", "dark spot on skin", "skin lesion", "wart", "warts",
+        "sunburn", "skin infection", "fungal infection", "athlete's foot", "nail fungus",
+        "hair loss", "bald patches", "dandruff", "dermatitis", "skin allergy", "rosacea",
+        "skin discoloration", "cracked skin", "burning skin",
+    ),
+    "orthopedics": (
+        "joint pain", "aching joints", "swollen joint", "stiff joints", "twisted ankle",
+        "rolled my ankle", "ankle swollen", "wrist pain", "hurt my wrist", "elbow pain",
+        "tennis elbow", "hip pain", "knee swelling", "knee gives way", "can't bend my knee",
+        "torn ligament", "acl", "meniscus", "neck pain", "stiff neck", "lower back ache",
+        "sciatica", "pinched nerve", "slipped disc", "broken bone", "broken arm", "broken leg",
+        "bone pain", "sports injury", "pulled muscle", "muscle strain", "tendonitis",
+        "frozen shoulder", "rotator cuff", "arthritis", "osteoporosis", "foot pain",
+        "heel pain", "plantar fasciitis", "fell and hurt",
+    ),
+    "internal": (
+        "sore throat", "cough", "coughing", "runny nose", "stuffy nose", "congestion",
+        "flu", "flu symptoms", "chills", "body aches", "high temperature", "feeling feverish",
+        "stomach ache", "stomach pain", "belly pain", "diarrhea", "constipation", "heartburn",
+        "acid reflux", "indigestion", "bloating", "throwing up", "feel sick", "dizzy",
+        "lightheaded", "tired all the time", "always tired", "weakness", "no energy",
+        "weight loss", "loss of appetite", "burning when urinating", "urinary infection",
+        "thyroid", "diabetes", "blood sugar", "annual physical", "general checkup",
+        "routine exam", "vaccination", "blood test", "ear pain", "sinus pressure",
+        "trouble sleeping", "sleep problems", "insomnia", "allergies", "head hurts", "pounding head",
+    ),
+}
+
+_STOP = frozenset(
+    "a an the i i'm im me my mine we our you your it its is are was were be been being am "
+    "have has had having do does did to of in on at for with and or but so if from by as "
+    "this that these those there here some any very really just like since about please "
+    "hi hello hey want would could can can't cannot need book appointment see doctor get".split()
+)
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def _tokens(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOP][:MAX_TOKENS]
+
+
+def _hash(feature: str) -> Tuple[int, float]:
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % DIM, (1.0 if h & 0x80000000 else -1.0)
+
+
+@lru_cache(maxsize=8192)
+def _word_features(word: str) -> Tuple[Tuple[int, float], ...]:
+    """Hashed word + character trigrams of <word> (signed bucket weights, merged)."""
+    acc: Dict[int, float] = defaultdict(float)
+    b, s = _hash("w:" + word)
+    acc[b] += 2.0 * s
+    padded = f"<{word}>"
+    for i in range(len(padded) - 2):
+        b, s = _hash("c:" + padded[i:i + 3])
+        acc[b] += s
+    return tuple(acc.items())
+
+
+@lru_cache(maxsize=8192)
+def _bigram_features(w1: str, w2: str) -> Tuple[Tuple[int, float], ...]:
+    b, s = _hash(f"b:{w1} {w2}")
+    return ((b, 2.0 * s),)
+
+
+@lru_cache(maxsize=8192)
+def _word_array(word: str):
+    f = _word_features(word)
+    return np.array([b for b, _ in f], dtype=np.intp), np.array([v for _, v in f])
+
+
+@lru_cache(maxsize=8192)
+def _bigram_array(w1: str, w2: str):
+    f = _bigram_features(w1, w2)
+    return np.array([b for b, _ in f], dtype=np.intp), np.array([v for _, v in f])
+
+
+def _phrase_sparse(tokens: Sequence[str]) -> Dict[int, float]:
+    acc: Dict[int, float] = defaultdict(float)
+    for i, t in enumerate(tokens):
+        for b, v in _word_features(t):
+            acc[b] += v
+        if i:
+            for b, v in _bigram_features(tokens[i - 1], t):
+                acc[b] += v
+    return acc
+
+
+def _windows(n: int) -> List[Tuple[int, int]]:
+    return [(i, j) for i in range(n) for j in range(i + 1, min(n, i + WINDOW) + 1)]
+
+
+@lru_cache(maxsize=MAX_TOKENS)
+def _window_matrix(n: int):
+    """0/1 rows selecting the words i..j-1 and the bigrams inside them."""
+    wins = _windows(n)
+    a = np.zeros((len(wins), 2 * n))
+    for k, (i, j) in enumerate(wins):
+        a[k, i:j] = 1.0
+        a[k, n + i + 1:n + j] = 1.0
+    return a
+
+
+@dataclass(frozen=True)
+class Route:
+    category: Optional[str]
+    score: float
+    source: str
+    matches: Tuple[Tuple[str, str, float], ...] = field(default_factory=tuple)
+
+
+class SymptomRouter:
+    def __init__(self, corpus: Dict[str, Sequence[str]] = SYMPTOM_CORPUS,
+                 keywords: Dict[str, str] = CONDITIONS, min_score: float = MIN_SCORE,
+                 use_numpy: bool = HAS_NUMPY):
+        self.keywords = dict(keywords)
+        self.min_score = min_score
+        rows: Dict[str, str] = {}
+        for cat, phrases in corpus.items():
+            for p in phrases:
+                rows.setdefault(p.lower(), cat)
+        for kw, cat in self.keywords.items():
+            rows.setdefault(kw.lower(), cat)
+        self.phrases = list(rows)
+        self.categories = [rows[p] for p in self.phrases]
+        sparse = [_phrase_sparse(_tokens(p)) for p in self.phrases]
+
+        # idf over buckets: generic pieces ("pain", "-ing") count for less
+        df: Dict[int, int] = defaultdict(int)
+        for vec in sparse:
+            for b in vec:
+                df[b] += 1
+        n = len(sparse)
+        self.idf = [math.log((1 + n) / (1 + df.get(b, 0))) + 1.0 for b in range(DIM)]
+
+        self.use_numpy = bool(use_numpy and HAS_NUMPY)
+        if self.use_numpy:
+            self._idf = np.asarray(self.idf)
+            m = np.zeros((n, DIM))
+            for r, vec in enumerate(sparse):
+                m[r, list(vec)] = list(vec.values())
+            m *= self._idf
+            m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-9)
+            self._matrix_t = np.ascontiguousarray(m.T)          # DIM x n
+        else:
+            self._postings: Dict[int, List[Tuple[int, float]]] = defaultdict(list)
+            for r, vec in enumerate(sparse):
+                w = {b: v * self.idf[b] for b, v in vec.items()}
+                norm = math.sqrt(sum(v * v for v in w.values())) or 1.0
+                for b, v in w.items():
+                    self._postings[b].append((r, v / norm))
+
+    # -- scoring --------------------------------------------------------
+
+    def _scores_numpy(self, tokens: List[str]):
+        """Best cosine per corpus row over all windows, from two small matrix products:
+        feature rows x corpus (gathered from the sparse features) and windows x rows."""
+        n = len(tokens)
+        rows, feats = [], []
+        for i, t in enumerate(tokens):
+            rows.append(np.full(len(_word_array(t)[0]), i))
+            feats.append(_word_array(t))
+            if i:
+                bg = _bigram_array(tokens[i - 1], t)
+                rows.append(np.full(len(bg[0]), n + i))
+                feats.append(bg)
+        rows = np.concatenate(rows)
+        cols = np.concatenate([f[0] for f in feats])
+        vals = np.concatenate([f[1] for f in feats]) * self._idf[cols]
+
+        a = _window_matrix(n)                                    # windows x 2n (words, bigrams)
+        x = np.bincount(rows * DIM + cols, weights=vals, minlength=2 * n * DIM).reshape(2 * n, DIM)
+        norms = np.sqrt(np.maximum(((a @ (x @ x.T)) * a).sum(axis=1), 1e-18))
+        p = np.zeros((2 * n, len(self.phrases)))
+        np.add.at(p, rows, self._matrix_t[cols] * vals[:, None])
+        return ((a @ p) / norms[:, None]).max(axis=0)
+
+    def _scores_python(self, tokens: List[str]) -> List[float]:
+        best = [0.0] * len(self.phrases)
+        for i, j in _windows(len(tokens)):
+            vec = _phrase_sparse(tokens[i:j])
+            w = {b: v * self.idf[b] for b, v in vec.items()}
+            norm = math.sqrt(sum(v * v for v in w.values())) or 1.0
+            dots: Dict[int, float] = defaultdict(float)
+            for b, v in w.items():
+                for r, mv in self._postings.get(b, ()):
+                    dots[r] += v * mv
+            for r, d in dots.items():
+                if d / norm > best[r]:
+                    best[r] = d / norm
+        return best
+
+    def top_k(self, text: str, k: int = TOP_K) -> List[Tuple[str, str, float]]:
+        tokens = _tokens(text)
+        if not tokens:
+            return []
+        if self.use_numpy:
+            s = self._scores_numpy(tokens)
+            k = min(k, len(s))
+            idx = np.argpartition(-s, k - 1)[:k]
+            idx = idx[np.argsort(-s[idx])]
+            return [(self.phrases[r], self.categories[r], round(float(s[r]), 3)) for r in idx]
+        s = self._scores_python(tokens)
+        idx = sorted(range(len(s)), key=lambda r: -s[r])[:k]
+        return [(self.phrases[r], self.categories[r], round(s[r], 3)) for r in idx]
+
+    def keyword(self, text: str) -> Optional[str]:
+        tl = (text or "").lower()
+        for kw, cat in self.keywords.items():
+            if kw in tl:
+                return cat
+        return None
+
+    @staticmethod
+    def _vote(matches: Sequence[Tuple[str, str, float]]) -> str:
+        """Category of the best match; near-ties (within TIE_MARGIN) are settled by summed score,
+        so "stiff and swollen" isn't decided by one phrase out-scoring two others by 0.001."""
+        top = matches[0][2]
+        votes: Dict[str, float] = defaultdict(float)
+        for _, cat, score in matches:
+            if top - score <= TIE_MARGIN:
+                votes[cat] += score
+        return max(votes, key=lambda c: (votes[c], c == matches[0][1]))
+
+    def route(self, text: str, k: int = TOP_K) -> Route:
+        matches = tuple(self.top_k(text, k))
+        if matches and matches[0][2] >= self.min_score:
+            return Route(self._vote(matches), matches[0][2], "embedding", matches)
+        cat = self.keyword(text)
+        if cat:
+            return Route(cat, matches[0][2] if matches else 0.0, "keyword", matches)
+        return Route(None, matches[0][2] if matches else 0.0, "default", matches)
+
+
+_router: Optional[SymptomRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> SymptomRouter:
+    """Process-wide router (the corpus is embedded on first use)."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = SymptomRouter()
+    return _router
@@ -0,0 +1,195 @@
+# triage.py — local urgency scoring from what the patient already told us
+# ----------------------------------------------------------------------
+# Cheap enough to run on every chat turn (one precompiled regex pass per
+# field, results memoized):
+#
+#   t = score_triage("severe chest pain", severity="4", duration="2 hours")
+#   t.score   -> 10         (0–10)
+#   t.urgency -> "High"     (Low | Medium | High)
+#   t.flag    -> "Possible cardiac symptoms; patient reports severe symptoms;
+#                 acute onset – staff review before slot"
+#   t.to_dict() -> stored as appointment["triage"] (read by the handoff formatter)
+#
+# Score = strongest matched condition + severity words / rating + duration
+# modifier. Emergency phrases ("can't breathe", "fainted", ...) always land
+# in High with an emergency-care advisory.
+#
+# Keywords inside a negation ("no chest pain", "not severe", "denies
+# fainting") don't count: a cue (no / not / never / without / denies / …)
+# covers at most NEGATION_WORDS words up to the next clause boundary
+# (punctuation, and / but / …), so "no fever and chest pain" still
+# scores the chest pain.
+# ----------------------------------------------------------------------
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from schema import severity_label
+
+HIGH_SCORE = 7
+MEDIUM_SCORE = 4
+
+# phrase -> (weight, staff-facing reason). Longest phrases are tried first.
+CONDITION_WEIGHTS: Dict[str, Tuple[int, str]] = {
+    "chest pain": (6, "Possible cardiac symptoms"),
+    "chest tightness": (6, "Possible cardiac symptoms"),
+    "shortness of breath": (6, "Breathing difficulty"),
+    "difficulty breathing": (6, "Breathing difficulty"),
+    "palpitations": (4, "Palpitations"),
+    "fainting": (6, "Syncope"),
+    "fainted": (6, "Syncope"),
+    "numbness": (5, "Possible neurological deficit"),
+    "slurred speech": (7, "Possible stroke signs"),
+    "blood in stool": (5, "GI bleeding"),
+    "vomiting blood": (7, "GI bleeding"),
+    "coughing blood": (7, "Hemoptysis"),
+    "high fever": (4, "High fever"),
+    "fracture": (4, "Suspected fracture"),
+    "hypertension": (2, "Hypertension"),
+    "migraine": (2, "Migraine"),
+    "headache": (2, "Headache"),
+    "fever": (2, "Fever"),
+    "vomiting": (2, "Vomiting"),
+    "back pain": (2, "Back pain"),
+    "knee pain": (1, "Joint pain"),
+    "shoulder pain": (1, "Joint pain"),
+    "sprain": (1, "Sprain"),
+    "rash": (1, "Rash"),
+    "nausea": (1, "Nausea"),
+    "fatigue": (1, "Fatigue"),
+    "cold": (1, "Cold symptoms"),
+    "eczema": (0, "Skin condition"),
+    "psoriasis": (0, "Skin condition"),
+    "acne": (0, "Skin condition"),
+    "mole": (0, "Skin check"),
+    "checkup": (0, "Routine checkup"),
+}
+
+EMERGENCY_PHRASES = (
+    "can't breathe", "cannot breathe", "can not breathe", "passed out", "unconscious",
+    "crushing chest", "worst headache", "face drooping", "severe bleeding", "suicidal",
+)
+
+SEVERITY_WORDS: Dict[str, int] = {
+    "unbearable": 3, "excruciating": 3, "worst": 3, "severe": 2, "intense": 2, "sharp": 1,
+    "getting worse": 2, "worsening": 2, "sudden": 2, "moderate": 1, "mild": -1, "slight": -1,
+}
+
+EMERGENCY_ADVISORY = ("If your symptoms are severe or getting worse, please call 911 "
+                      "or go to the nearest emergency department now.")
+
+
+def _alternation(phrases) -> "re.Pattern[str]":
+    ordered = sorted(phrases, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(p).replace(r"\ ", r"\s+") for p in ordered) + r")\b", re.I)
+
+
+_CONDITION_RE = _alternation(CONDITION_WEIGHTS)
+_EMERGENCY_RE = _alternation(EMERGENCY_PHRASES)
+_SEVERITY_RE = _alternation(SEVERITY_WORDS)
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?|an?|one|two|three|few|couple(?: of)?)\s*(min|minute|hour|hr|day|week|month|year)s?", re.I)
+_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "few": 3, "couple": 2, "couple of": 2}
+_UNIT_HOURS = {"min": 1 / 60, "minute": 1 / 60, "hour": 1, "hr": 1, "day": 24, "week": 168, "month": 720, "year": 8760}
+_NEGATION_RE = re.compile(
+    r"\b(no|not|never|without|denies|denied|deny|don't|doesn't|didn't|haven't|hasn't|isn't|wasn't|aren't)\b", re.I)
+_CLAUSE_END_RE = re.compile(r"[.,;:!?()]|\b(and|but|though|although|however|except|yet|now)\b", re.I)
+_WORD_RE = re.compile(r"\S+")
+NEGATION_WORDS = 5
+_ACUTE_RE = re.compile(r"\b(today|this morning|tonight|last night|just now|an hour ago|suddenly)\b", re.I)
+
+
+@dataclass(frozen=True)
+class Triage:
+    score: int
+    urgency: str
+    flag: Optional[str] = None
+    reasons: Tuple[str, ...] = field(default_factory=tuple)
+    emergency: bool = False
+
+    @property
+    def is_high(self) -> bool:
+        return self.urgency == "High"
+
+    def to_dict(self, severity: Optional[str] = None) -> Dict[str, Any]:
+        """Shape of appointment["triage"]; severity is the patient's own rating."""
+        return {"severity": severity, "urgency": self.urgency, "score": self.score, "flag": self.flag}
+
+
+def duration_hours(text: Optional[str]) -> Optional[float]:
+    """'3 days' -> 72, 'a couple of weeks' -> 336, 'since this morning' -> 6; None if unknown."""
+    if not text:
+        return None
+    m = _DURATION_RE.search(text)
+    if m:
+        n = m.group(1).lower()
+        qty = float(n) if n[0].isdigit() else _WORDS.get(n, 1)
+        return qty * _UNIT_HOURS[m.group(2).lower()]
+    if _ACUTE_RE.search(text):
+        return 6.0
+    return None
+
+
+def _negated_spans(blob: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets a negation cue covers."""
+    spans = []
+    for m in _NEGATION_RE.finditer(blob):
+        stop = _CLAUSE_END_RE.search(blob, m.end())
+        end = stop.start() if stop else len(blob)
+        words = _WORD_RE.findall(blob, m.end(), end)
+        if len(words) > NEGATION_WORDS:
+            end = [w.end() for w in _WORD_RE.finditer(blob, m.end(), end)][NEGATION_WORDS - 1]
+        spans.append((m.end(), end))
+    return spans
+
+
+def _affirmed(rx: "re.Pattern[str]", blob: str, spans: List[Tuple[int, int]]):
+    """rx matches outside every negated span."""
+    return [m for m in rx.finditer(blob) if not any(a <= m.start() < b for a, b in spans)]
+
+
+@lru_cache(maxsize=4096)
+def _score(text: str, severity: str, duration: str) -> Triage:
+    reasons: List[str] = []
+    blob = f"{text} {duration}".replace("\u2019", "'")
+    negated = _negated_spans(blob)
+
+    best, label = 0, None
+    for m in _affirmed(_CONDITION_RE, blob, negated):
+        w, why = CONDITION_WEIGHTS[" ".join(m.group(1).lower().split())]
+        if label is None or w > best:
+            best, label = w, why
+    if label:
+        reasons.append(label)
+    score = best
+
+    words = sum(SEVERITY_WORDS[" ".join(m.group(1).lower().split())] for m in _affirmed(_SEVERITY_RE, blob, negated))
+    rating = severity_label(severity) if severity else None
+    score += max(words, {"High": 3, "Medium": 1, "Low": -1}.get(rating or "", 0))
+    if words >= 2 or rating == "High":
+        reasons.append("patient reports severe symptoms")
+
+    hours = duration_hours(duration) or duration_hours(text)
+    if hours is not None:
+        if hours <= 24 and best >= 4:
+            score += 2
+            reasons.append("acute onset")
+        elif hours >= 24 * 14:
+            score -= 1
+
+    emergency = bool(_affirmed(_EMERGENCY_RE, blob, negated))
+    if emergency:
+        score = max(score, 10)
+        reasons.insert(0, "emergency warning signs")
+    score = max(0, min(10, score))
+    urgency = "High" if score >= HIGH_SCORE else "Medium" if score >= MEDIUM_SCORE else "Low"
+    flag = None
+    if urgency == "High":
+        flag = "; ".join(reasons or ["High urgency score"]) + " – staff review before slot"
+    return Triage(score=score, urgency=urgency, flag=flag, reasons=tuple(reasons), emergency=emergency)
+
+
+def score_triage(text: Optional[str], severity: Any = None, duration: Optional[str] = None) -> Triage:
+    """Urgency for a free-text complaint plus the optional severity rating and duration."""
+    return _score((text or "").strip().lower(), str(severity or "").strip(), (duration or "").strip().lower())
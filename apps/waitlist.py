@@ -0,0 +1,389 @@
+# waitlist.py — cancel / reschedule, per-doctor-day waitlist, slot backfill
+# ----------------------------------------------------------------------
+#   entry_id = join_waitlist(db, booking, day, score=triage.score)
+#   appt     = cancel_appointment(db, "apt_...", contact, cal)      # frees + backfills the slot
+#   appt     = reschedule_appointment(db, "apt_...", contact, new_start, cal, day, time)
+#   appt     = mark_no_show(db, "apt_...", cal)                     # after the slot; counted in rollups
+#   booking  = accept_offer(db, "wl_1a2b3c4d", contact)             # then save with offer_id
+#
+# Slot state lives in db.slots, one document per (doctor_id, slot_start):
+#   booked ──cancel──▶ free ──backfill──▶ offered ──accept──▶ booked
+#                        ▲                   │
+#                        └──── expiry ───────┘  (next patient is offered; the one
+#                                                who let it lapse waits for others)
+# Every transition is ONE conditional update on the current status, so
+# concurrent cancellations / accepts / sweeps can never double-free a slot
+# or hand it to two patients; the loser of a race just sees no match.
+#
+# The waitlist is persisted in db.waitlist; each process keeps a heap per
+# (doctor_id, day) ordered by (-triage score, joined_at) as its pick order
+# and reloads it from Mongo when stale. Offers go out through outbox.py.
+# Cancel / reschedule / no-show keep schedule_views' per-doctor-day documents,
+# the rollups counters, the doctors' calendar feed stamps and this
+# process's reminder heap in step.
+# ----------------------------------------------------------------------
+
+import heapq
+import secrets
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from clinic_calendar import parse_time
+from identity import lookup_keys
+from ics_feeds import bump_feed
+from outbox import enqueue
+from reminders import drop_reminders, schedule_reminders
+from rollups import record_event, record_move
+from schedule_views import add_to_schedule, move_in_schedule, remove_from_schedule
+
+OFFER_TTL_S = 15 * 60
+HEAP_REFRESH_S = 30.0
+
+BOOKING_FIELDS = ("patient_name", "contact", "condition", "doctor_id", "doctor_name", "specialty",
+                  "location", "visit_type", "duration", "triage", "medical")
+
+
+class SlotTaken(Exception):
+    """The requested slot is already booked (or offered to someone else)."""
+
+
+class NotFound(Exception):
+    """No matching confirmed appointment / open offer."""
+
+# -------------------------------------------------
+# Slots
+# -------------------------------------------------
+
+def _utc(dt: datetime) -> datetime:
+    """Mongo storage form: naive UTC (naive input is taken to be UTC already)."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def slot_key(doctor_id: str, slot_start: datetime) -> str:
+    return f"{doctor_id}|{_utc(slot_start).isoformat()}"
+
+
+def ensure_waitlist_indexes(db) -> None:
+    try:
+        db.slots.create_index([("status", 1), ("offer_expires_at", 1)], name="offers_due")
+        db.slots.create_index([("doctor_id", 1), ("slot_start", 1)], name="doctor_slots")
+        db.waitlist.create_index([("doctor_id", 1), ("day", 1), ("status", 1)], name="doctor_day_status")
+        db.appointments.create_index("booking_id", name="booking_id")
+    except Exception:
+        pass
+
+
+def claim_slot(db, doctor_id: str, slot_start: datetime, booking_id: str, offer_id: Optional[str] = None) -> bool:
+    """Atomically mark the slot booked for booking_id. True on success, False if it is taken.
+    An offered slot can only be claimed by the holder of that (unexpired) offer."""
+    from pymongo.errors import DuplicateKeyError
+
+    key, now = slot_key(doctor_id, slot_start), datetime.utcnow()
+    booked = {"status": "booked", "booking_id": booking_id, "updated_at": now}
+    try:
+        db.slots.insert_one({"_id": key, "doctor_id": doctor_id, "slot_start": _utc(slot_start), **booked})
+        return True
+    except DuplicateKeyError:
+        pass
+    ors: List[Dict[str, Any]] = [{"status": "free"}]
+    if offer_id:
+        ors.append({"status": "offered", "offer_to": offer_id, "offer_expires_at": {"$gt": now}})
+    res = db.slots.update_one({"_id": key, "$or": ors},
+                              {"$set": booked, "$unset": {"offer_to": "", "offer_expires_at": ""}})
+    return res.modified_count == 1
+
+
+def claimed_slots(db, doctor_id: Optional[str], start: datetime, end: datetime) -> Set[datetime]:
+    """Naive-UTC starts of the doctor's booked / offered slots in [start, end)."""
+    if db is None or not doctor_id:
+        return set()
+    cur = db.slots.find({"doctor_id": doctor_id, "slot_start": {"$gte": _utc(start), "$lt": _utc(end)},
+                         "status": {"$in": ["booked", "offered"]}}, {"_id": 0, "slot_start": 1})
+    return {d["slot_start"] for d in cur}
+
+
+def release_slot(db, doctor_id: str, slot_start: datetime, booking_id: str) -> bool:
+    """booked(booking_id) → free. Slots booked before db.slots existed are created as free."""
+    from pymongo.errors import DuplicateKeyError
+
+    key = slot_key(doctor_id, slot_start)
+    res = db.slots.update_one({"_id": key, "status": "booked", "booking_id": booking_id},
+                              {"$set": {"status": "free", "updated_at": datetime.utcnow()}, "$unset": {"booking_id": ""}})
+    if res.modified_count:
+        return True
+    try:
+        db.slots.insert_one({"_id": key, "doctor_id": doctor_id, "slot_start": _utc(slot_start),
+                             "status": "free", "updated_at": datetime.utcnow()})
+        return True
+    except DuplicateKeyError:
+        return False   # someone else already holds or freed it
+
+# -------------------------------------------------
+# Waitlist heap
+# -------------------------------------------------
+
+class WaitlistIndex:
+    """Per-(doctor_id, day) heaps of (-score, joined_ts, entry_id), refreshed from Mongo."""
+
+    def __init__(self, refresh_s: float = HEAP_REFRESH_S):
+        self.refresh_s = refresh_s
+        self._heaps: Dict[Tuple[str, str], List[Tuple[float, float, str]]] = {}
+        self._loaded: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _item(entry: Dict[str, Any]) -> Tuple[float, float, str]:
+        joined = entry.get("joined_at") or datetime.utcnow()
+        return (-float(entry.get("score") or 0), joined.timestamp(), entry["_id"])
+
+    def _ensure(self, col, key: Tuple[str, str]) -> List[Tuple[float, float, str]]:
+        if time.monotonic() - self._loaded.get(key, -1e9) > self.refresh_s:
+            docs = col.find({"doctor_id": key[0], "day": key[1], "status": "waiting"},
+                            {"_id": 1, "score": 1, "joined_at": 1})
+            heap = [self._item(d) for d in docs]
+            heapq.heapify(heap)
+            self._heaps[key], self._loaded[key] = heap, time.monotonic()
+        return self._heaps.setdefault(key, [])
+
+    def push(self, col, entry: Dict[str, Any]) -> None:
+        key = (entry["doctor_id"], entry["day"])
+        with self._lock:
+            heapq.heappush(self._ensure(col, key), self._item(entry))
+
+    def candidates(self, col, doctor_id: str, day: str) -> Iterator[str]:
+        """Entry ids in priority order. Each yielded id is removed from the heap; the
+        caller re-push()es the ones it skips."""
+        key = (doctor_id, day)
+        while True:
+            with self._lock:
+                heap = self._ensure(col, key)
+                if not heap:
+                    return
+                _s, _t, entry_id = heapq.heappop(heap)
+            yield entry_id
+
+
+WAITLIST = WaitlistIndex()
+
+
+def join_waitlist(db, booking: Dict[str, Any], day: date, score: float = 0,
+                  earliest: Optional[str] = None, latest: Optional[str] = None) -> str:
+    """Queue a patient for any opening with booking["doctor_id"] on `day` (clinic-local),
+    optionally only between earliest/latest ("9:00 AM")."""
+    entry = {
+        "_id": "wl_" + secrets.token_hex(4),
+        "doctor_id": booking["doctor_id"],
+        "day": day.isoformat(),
+        "score": float(score or 0),
+        "earliest": earliest, "latest": latest,
+        "booking": {k: booking.get(k) for k in BOOKING_FIELDS},
+        "status": "waiting",
+        "joined_at": datetime.utcnow(),
+    }
+    db.waitlist.insert_one(entry)
+    WAITLIST.push(db.waitlist, entry)
+    return entry["_id"]
+
+
+def _fits(entry: Dict[str, Any], local: datetime) -> bool:
+    lo, hi = parse_time(entry.get("earliest")), parse_time(entry.get("latest"))
+    t = local.time()
+    return (lo is None or t >= lo) and (hi is None or t <= hi)
+
+# -------------------------------------------------
+# Backfill & offers
+# -------------------------------------------------
+
+def _offer_message(entry: Dict[str, Any], label: str, ttl_s: int) -> Tuple[str, str]:
+    b = entry.get("booking") or {}
+    subject = f"An earlier appointment with {b.get('doctor_name')} just opened up"
+    body = f"""Hi {b.get('patient_name') or 'there'},
+
+A slot with {b.get('doctor_name')} opened up: {label}.
+It is held for you for {ttl_s // 60} minutes. To take it, tell the MedBird assistant:
+
+    accept {entry['_id']}
+
+If you don't need it, just ignore this email and you will stay on the waitlist for other openings.
+
+— MedBird"""
+    return subject, body
+
+
+def backfill_slot(db, doctor_id: str, slot_start: datetime, cal, ttl_s: int = OFFER_TTL_S) -> Optional[Dict[str, Any]]:
+    """Offer a free slot to the best eligible waiting patient. Returns the offered entry or None."""
+    key = slot_key(doctor_id, slot_start)
+    local = cal.to_local(slot_start)
+    day = local.date().isoformat()
+    skipped: List[Dict[str, Any]] = []
+    offered = None
+    try:
+        for entry_id in WAITLIST.candidates(db.waitlist, doctor_id, day):
+            entry = db.waitlist.find_one({"_id": entry_id, "status": "waiting"})
+            if entry is None:
+                continue                       # offered / booked / left via another process
+            if not _fits(entry, local) or key in (entry.get("passed") or ()):
+                skipped.append(entry)
+                continue
+            expires = datetime.utcnow() + timedelta(seconds=ttl_s)
+            if db.waitlist.update_one({"_id": entry_id, "status": "waiting"},
+                                      {"$set": {"status": "offered", "offer": {"slot_id": key, "expires_at": expires}}}
+                                      ).modified_count != 1:
+                continue
+            if db.slots.update_one({"_id": key, "status": "free"},
+                                   {"$set": {"status": "offered", "offer_to": entry_id, "offer_expires_at": expires}}
+                                   ).modified_count != 1:
+                # slot got booked / offered meanwhile: put the patient back in line
+                db.waitlist.update_one({"_id": entry_id, "status": "offered"},
+                                       {"$set": {"status": "waiting"}, "$unset": {"offer": ""}})
+                skipped.append(entry)
+                break
+            label = local.strftime("%A, %B %d at %I:%M %p").replace(" at 0", " at ")
+            subject, body = _offer_message(entry, label, ttl_s)
+            enqueue(db, "waitlist_offer", (entry.get("booking") or {}).get("contact"), subject, body,
+                    dedupe_key=f"offer|{key}|{entry_id}", meta={"slot_id": key, "entry_id": entry_id})
+            offered = entry
+            break
+    finally:
+        for e in skipped:
+            WAITLIST.push(db.waitlist, e)
+    return offered
+
+
+def expire_offers(db, cal) -> int:
+    """Lapse unanswered offers and offer each slot onward. The patient goes back in line
+    (as the offer email promises) for every opening but the one they let lapse."""
+    now, n = datetime.utcnow(), 0
+    for slot in db.slots.find({"status": "offered", "offer_expires_at": {"$lte": now}},
+                              {"doctor_id": 1, "slot_start": 1, "offer_to": 1}).limit(200):
+        res = db.slots.update_one(
+            {"_id": slot["_id"], "status": "offered", "offer_to": slot.get("offer_to")},
+            {"$set": {"status": "free", "updated_at": now}, "$unset": {"offer_to": "", "offer_expires_at": ""}})
+        if res.modified_count != 1:
+            continue
+        entry = db.waitlist.find_one_and_update(
+            {"_id": slot.get("offer_to"), "status": "offered"},
+            {"$set": {"status": "waiting"}, "$unset": {"offer": ""}, "$addToSet": {"passed": slot["_id"]}},
+            return_document=True)
+        if entry is not None:
+            WAITLIST.push(db.waitlist, entry)
+        backfill_slot(db, slot["doctor_id"], slot["slot_start"], cal)
+        n += 1
+    return n
+
+
+def accept_offer(db, entry_id: str, contact: Optional[str] = None) -> Dict[str, Any]:
+    """Booking dict for an open offer (pass offer_id=entry_id when claiming the slot).
+    Raises NotFound if the offer does not exist, belongs to someone else or has lapsed."""
+    entry = db.waitlist.find_one({"_id": entry_id, "status": "offered"})
+    booking = (entry or {}).get("booking") or {}
+    if entry is None or (contact and not same_contact(booking.get("contact"), contact)):
+        raise NotFound("No open offer with that code.")
+    slot = db.slots.find_one({"_id": entry["offer"]["slot_id"], "status": "offered", "offer_to": entry_id,
+                              "offer_expires_at": {"$gt": datetime.utcnow()}})
+    if slot is None:
+        raise NotFound("That offer has expired.")
+    return {**booking, "slot_start": slot["slot_start"]}
+
+
+def mark_waitlist_booked(db, entry_id: str, booking_id: str) -> None:
+    db.waitlist.update_one({"_id": entry_id}, {"$set": {"status": "booked", "booking_id": booking_id}})
+
+
+def offer_sweeper_tick(db, cal):
+    """Tick for outbox.start_outbox_worker: expire lapsed offers every loop."""
+    return lambda: expire_offers(db, cal)
+
+# -------------------------------------------------
+# Cancel / reschedule
+# -------------------------------------------------
+
+def same_contact(stored: Optional[str], given: Optional[str]) -> bool:
+    """True when both contacts normalize to the same identity key ("John@X.com" ~ "john@x.com",
+    "(555) 123-4567" ~ "5551234567")."""
+    return bool(set(lookup_keys(given)) & set(lookup_keys(stored)))
+
+
+def _owned_appointment(db, booking_id: str, contact: str) -> Optional[Dict[str, Any]]:
+    appt = db.appointments.find_one({"booking_id": booking_id, "status": "confirmed"})
+    return appt if appt is not None and same_contact(appt.get("contact"), contact) else None
+
+
+def cancel_appointment(db, booking_id: str, contact: str, cal, reason: Optional[str] = None) -> Dict[str, Any]:
+    """confirmed → cancelled (exactly once, even under concurrent requests), then free and backfill the slot."""
+    owned = _owned_appointment(db, booking_id, contact)
+    appt = None if owned is None else db.appointments.find_one_and_update(
+        {"_id": owned["_id"], "status": "confirmed"},
+        {"$set": {"status": "cancelled", "cancelled_at": datetime.utcnow(), "cancel_reason": reason}},
+        return_document=True,
+    )
+    if appt is None:
+        raise NotFound("No confirmed appointment with that booking ID and contact.")
+    remove_from_schedule(db, appt, cal)
+    record_event(db, "cancelled", appt, cal)
+    bump_feed(db, appt.get("doctor_id"), booking_id)
+    drop_reminders(booking_id)
+    if appt.get("doctor_id") and isinstance(appt.get("slot_start"), datetime):
+        if release_slot(db, appt["doctor_id"], appt["slot_start"], booking_id):
+            backfill_slot(db, appt["doctor_id"], appt["slot_start"], cal)
+    return appt
+
+
+def reschedule_appointment(db, booking_id: str, contact: str, new_start: datetime, cal,
+                           selected_day: Optional[str] = None, selected_time: Optional[str] = None) -> Dict[str, Any]:
+    """Claim the new slot first, then move the appointment, then free + backfill the old slot.
+    Raises SlotTaken if the new slot is not available, NotFound if the booking is gone."""
+    appt = _owned_appointment(db, booking_id, contact)
+    if appt is None:
+        raise NotFound("No confirmed appointment with that booking ID and contact.")
+    doctor_id, old_start = appt.get("doctor_id"), appt.get("slot_start")
+    if isinstance(old_start, datetime) and slot_key(doctor_id, old_start) == slot_key(doctor_id, new_start):
+        return appt
+    if not claim_slot(db, doctor_id, new_start, booking_id):
+        raise SlotTaken("That time is already booked.")
+    local = cal.to_local(new_start)
+    moved = db.appointments.find_one_and_update(
+        {"_id": appt["_id"], "status": "confirmed", "slot_start": old_start},
+        {"$set": {
+            "slot_start": new_start,
+            "selected_day": selected_day or local.strftime("%A"),
+            "selected_time": selected_time or local.strftime("%I:%M %p").lstrip("0"),
+            "appointment_slot": f"{local.strftime('%A, %B %d')} at {selected_time or local.strftime('%I:%M %p').lstrip('0')}",
+            "rescheduled_at": datetime.utcnow(),
+        }},
+        return_document=True,
+    )
+    if moved is None:
+        # cancelled / moved concurrently: give the new slot back
+        release_slot(db, doctor_id, new_start, booking_id)
+        raise NotFound("The appointment changed while rescheduling; please try again.")
+    if isinstance(old_start, datetime):
+        move_in_schedule(db, appt, moved, cal)
+        record_move(db, appt, moved, cal)
+    else:
+        add_to_schedule(db, moved, cal)
+        record_event(db, "booked", moved, cal)
+    bump_feed(db, doctor_id, booking_id)
+    schedule_reminders(moved)
+    if isinstance(old_start, datetime) and release_slot(db, doctor_id, old_start, booking_id):
+        backfill_slot(db, doctor_id, old_start, cal)
+    return moved
+
+
+def mark_no_show(db, booking_id: str, cal) -> Dict[str, Any]:
+    """Flag a confirmed appointment whose slot has passed as a no-show (once; the appointment
+    stays confirmed so the day schedule still lists it)."""
+    appt = db.appointments.find_one_and_update(
+        {"booking_id": booking_id, "status": "confirmed", "slot_start": {"$lt": datetime.utcnow()},
+         "attendance": {"$exists": False}},
+        {"$set": {"attendance": "no_show", "no_show_at": datetime.utcnow()}},
+        return_document=True,
+    )
+    if appt is None:
+        raise NotFound("No past confirmed appointment with that booking ID (or it is already marked).")
+    record_event(db, "no_show", appt, cal)
+    return appt
@@ -0,0 +1,159 @@
+# bench_identity.py — identity lookups and fuzzy candidates as the patient base grows
+# ----------------------------------------------------------------------
+#   python bench/bench_identity.py [--n 100000] [--queries 2000]
+#   MONGO_URI=... python bench/bench_identity.py --mongo      # scratch DB medbird_bench_identity
+#
+# Synthetic profiles get names from first x last lists with realistic
+# repetition. Queries use returning-patient contacts typed differently
+# ("Jane.Doe@EXAMPLE.com", "(555) 123-4567") and names with one typo.
+#
+# Offline it reports what a lookup costs without a database: key
+# building, how many profiles a fuzzy lookup fetches (mean / p99 / max,
+# selective tier first) and the time to rank them. With --mongo the
+# profiles are inserted with their keys and indexes, and the numbers are
+# real round trips: exact contact lookup p50/p95, fuzzy candidates
+# p50/p95, and the hit rate of the intended profile.
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+import identity  # noqa: E402
+from identity import find_candidates, key_tiers, lookup_filter, name_similarity, user_identity_fields  # noqa: E402
+
+FIRST = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+         "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+         "Omar", "Aisha", "Wei", "Mei", "Raj", "Priya", "Carlos", "Maria", "Ana", "Luis", "Fatima", "Ahmed",
+         "Lena", "Sven", "Ingrid", "Yuki", "Hiro", "Chidi", "Ngozi", "Dmitri", "Olga", "Jane", "Sam", "Chris"]
+LAST = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+        "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+        "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+        "Haddad", "Park", "Nguyen", "Kim", "Patel", "Shah", "Chen", "Wang", "Okafor", "Ivanov", "Souza", "Doe",
+        "Kowalski", "Novak", "Fischer", "Weber", "Rossi", "Tanaka", "Sato", "Larsen"]
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+def make_profiles(n, rng):
+    out = []
+    for i in range(n):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        if rng.random() < 0.5:        # long tail of rarer surnames
+            last += rng.choice(["son", "ova", "er", "ski", "ez", "ton", "berg", "ini"])
+        u = {"user_id": f"u{i + 1:06d}", "name": f"{first} {last}",
+             "dob": f"{rng.randint(1940, 2010)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"}
+        if rng.random() < 0.6:
+            u["email"] = f"{first}.{last}{i}@example.com".lower()
+        else:
+            u["mobile"] = f"{rng.randint(200, 999)}{rng.randint(200, 999)}{i % 10000:04d}"
+        out.append({**u, **user_identity_fields(u)})
+    return out
+
+
+def retyped_contact(u, rng):
+    if u.get("email"):
+        local, _, dom = u["email"].partition("@")
+        return rng.choice([local.title(), local.upper(), local]) + "@" + dom.upper()
+    m = u["mobile"]
+    return rng.choice([f"({m[:3]}) {m[3:6]}-{m[6:]}", f"{m[:3]}.{m[3:6]}.{m[6:]}", f"+1 {m}"])
+
+
+def typo(name, rng):
+    i = rng.randrange(1, len(name))
+    if name[i] == " ":
+        return name
+    return name[:i] + rng.choice("aeiouy") + name[i + 1:]
+
+
+def offline(profiles, queries, rng):
+    t0 = time.perf_counter()
+    for u in profiles[:queries]:
+        user_identity_fields(u)
+    keys_us = (time.perf_counter() - t0) / min(queries, len(profiles)) * 1e6
+
+    buckets = Counter(k for u in profiles for k in u["name_keys"])
+    by_name = {}
+    for u in profiles:
+        for k in u["name_keys"]:
+            by_name.setdefault(k, []).append(u)
+    sizes, rank_us, broad = [], [], 0
+    for u in rng.sample(profiles, min(queries, len(profiles))):
+        q = typo(u["name"], rng)
+        cands = {}
+        t0 = time.perf_counter()
+        for i, tier in enumerate(key_tiers(q)):          # same tiering as find_candidates
+            fetched = {c["user_id"]: c for k in tier for c in by_name.get(k, ()) if c["user_id"] not in cands}
+            cands.update(fetched)
+            good = sum(name_similarity(q, c["name"]) >= identity.MIN_CANDIDATE_SCORE for c in cands.values())
+            if good >= 5:
+                break
+        broad += i > 0
+        rank_us.append((time.perf_counter() - t0) * 1e6)
+        sizes.append(len(cands))
+    print(f"profiles {len(profiles):,}   distinct name keys {len(buckets):,}")
+    print(f"identity fields   {keys_us:.1f} µs/profile")
+    print(f"fuzzy fetch       mean {sum(sizes) / len(sizes):.1f}  p99 {_pct(sizes, .99)}  max {max(sizes)} profiles"
+          f"   broad tier needed {broad / len(sizes):.0%}   (find_candidates caps each tier at 200)")
+    print(f"rank candidates   p50 {_pct(rank_us, .5):.0f} µs  p95 {_pct(rank_us, .95):.0f} µs")
+
+
+def with_mongo(profiles, queries, rng):
+    from pymongo import MongoClient
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        sys.exit("--mongo needs MONGO_URI")
+    db = MongoClient(uri)["medbird_bench_identity"]
+    db.users.drop()
+    t0 = time.perf_counter()
+    for i in range(0, len(profiles), 5000):
+        db.users.insert_many([dict(u) for u in profiles[i:i + 5000]], ordered=False)
+    identity.ensure_identity_indexes(db.users)
+    print(f"inserted {len(profiles):,} profiles in {time.perf_counter() - t0:.1f}s")
+
+    sample = rng.sample(profiles, min(queries, len(profiles)))
+    exact, hits = [], 0
+    for u in sample:
+        f = lookup_filter(retyped_contact(u, rng), u["name"])
+        t0 = time.perf_counter()
+        got = db.users.find_one(f, {"user_id": 1})
+        exact.append((time.perf_counter() - t0) * 1e3)
+        hits += bool(got and got["user_id"] == u["user_id"])
+    print(f"contact lookup    p50 {_pct(exact, .5):.2f} ms  p95 {_pct(exact, .95):.2f} ms   "
+          f"found {hits / len(sample):.1%}")
+
+    fuzzy, hits = [], 0
+    for u in sample:
+        t0 = time.perf_counter()
+        cands = find_candidates(db.users, typo(u["name"], rng), u["dob"], limit=5)
+        fuzzy.append((time.perf_counter() - t0) * 1e3)
+        hits += any(c["user_id"] == u["user_id"] for _, c in cands)
+    print(f"fuzzy candidates  p50 {_pct(fuzzy, .5):.2f} ms  p95 {_pct(fuzzy, .95):.2f} ms   "
+          f"intended profile in top 5 {hits / len(sample):.1%}")
+    db.users.drop()
+
+
+def main(args):
+    rng = random.Random(7)
+    profiles = make_profiles(args.n, rng)
+    offline(profiles, args.queries, rng)
+    if args.mongo:
+        with_mongo(profiles, args.queries, rng)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--mongo", action="store_true", help="insert into a scratch DB and time real lookups")
+    main(ap.parse_args())
@@ -0,0 +1,133 @@
+# bench_import_time.py — cold import cost of each app (python -X importtime)
+# ----------------------------------------------------------------------
+#   python bench/bench_import_time.py                    # report
+#   python bench/bench_import_time.py --save bench/import_baseline.json
+#   python bench/bench_import_time.py --baseline bench/import_baseline.json
+#
+# The repo has no CI, so this is a manual pre-merge check for changes
+# that touch imports, run after `pip install -r medbird-requirements.txt`:
+#   python bench/bench_import_time.py --baseline bench/import_baseline.json --repeat 5
+# bench/import_baseline.json was recorded that way on Python 3.11
+# (streamlit installed; SDKs present but deferred). Re-save it with --save
+# when a change is meant to move import time, and say so in the commit.
+#
+# For each app the top-level imports are read from its source (ast) and
+# executed in a fresh interpreter under -X importtime, so the numbers are
+# what a container pays before the first st.* call — without running the
+# Streamlit script itself. Best of --repeat runs.
+#
+# Exit status is non-zero when
+#   * a --forbid package (default: ibm_watsonx_ai, pymongo, pyarrow) is imported
+#     eagerly, i.e. someone moved an SDK import back to module top level;
+#   * an app exceeds --budget-ms, or its baseline by more than --tolerance.
+# Imports that are not installed here are listed and skipped.
+# ----------------------------------------------------------------------
+
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APPS = os.path.join(HERE, "..", "apps")
+DEFAULT_APPS = ("medbird_chatbot.py", "summary_generator.py")
+DEFAULT_FORBID = ("ibm_watsonx_ai", "pymongo", "pyarrow")
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def top_level_imports(path):
+    """Module-level import statements (including those inside top-level try blocks)."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    out = []
+
+    def visit(body):
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                out.append(ast.unparse(node))
+            elif isinstance(node, ast.Try):
+                visit(node.body)
+    visit(tree.body)
+    return out
+
+
+def _probe(stmts):
+    lines = ["missing = []"]
+    for s in stmts:
+        lines += ["try:", f"    {s}", "except ImportError as e:", "    missing.append(e.name or repr(e))"]
+    lines.append("print('\\n'.join(sorted(set(missing))))")
+    return "\n".join(lines)
+
+
+def measure(app, repeat):
+    """(total_us, {module: cumulative_us}, missing) — best total of `repeat` runs."""
+    code = _probe(top_level_imports(os.path.join(APPS, app)))
+    env = dict(os.environ, PYTHONPATH=APPS + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    best = None
+    for _ in range(repeat):
+        r = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                           cwd=APPS, env=env, capture_output=True, text=True)
+        if r.returncode:
+            sys.exit(f"{app}: probe failed\n{r.stderr[-2000:]}")
+        cum, total = {}, 0
+        for m in _LINE.finditer(r.stderr):
+            us, depth, name = int(m.group(2)), len(m.group(3)) - 1, m.group(4)
+            cum[name] = max(cum.get(name, 0), us)
+            if depth == 0:
+                total += us
+        if best is None or total < best[0]:
+            best = (total, cum, [x for x in r.stdout.split("\n") if x])
+    return best
+
+
+def main(args):
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    forbid = [p for p in args.forbid.split(",") if p]
+    failures, results = [], {}
+
+    for app in args.apps:
+        total, cum, missing = measure(app, args.repeat)
+        results[app] = round(total / 1000, 1)
+        print(f"\n{app}: {total / 1000:8.1f} ms cumulative import time")
+        tops = sorted(((us, n) for n, us in cum.items() if "." not in n), reverse=True)[:args.top]
+        for us, name in tops:
+            print(f"    {us / 1000:8.1f} ms  {name}")
+        if missing:
+            print(f"    (not installed, skipped: {', '.join(missing)})")
+
+        eager = sorted(p for p in forbid if p in cum)
+        if eager:
+            failures.append(f"{app}: imports {', '.join(eager)} at module level")
+        if args.budget_ms and total / 1000 > args.budget_ms:
+            failures.append(f"{app}: {total / 1000:.1f} ms > budget {args.budget_ms} ms")
+        base = baseline.get(app)
+        if base and total / 1000 > base * args.tolerance:
+            failures.append(f"{app}: {total / 1000:.1f} ms > {args.tolerance}x baseline {base} ms")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nbaseline written to {args.save}")
+    if failures:
+        sys.exit("\nFAIL\n  " + "\n  ".join(failures))
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("apps", nargs="*", default=list(DEFAULT_APPS))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--top", type=int, default=12)
+    ap.add_argument("--forbid", default=",".join(DEFAULT_FORBID), help="comma-separated; '' to allow all")
+    ap.add_argument("--budget-ms", type=float, default=0.0)
+    ap.add_argument("--baseline")
+    ap.add_argument("--tolerance", type=float, default=1.5)
+    ap.add_argument("--save")
+    main(ap.parse_args())
@@ -0,0 +1,127 @@
+# bench_intake_payload.py — bytes read + prompt tokens per summary, before/after
+# ----------------------------------------------------------------------
+#   python bench/bench_intake_payload.py [--n 1000]
+#
+# "before": full appointment + user documents (what _fetch_latest used to
+#           pull) and json.dumps of the old enriched intake as the prompt.
+# "after":  documents cut down by intake.APPOINTMENT_PROJECTION /
+#           USER_PROJECTION, and the messages HandoffSummarizer actually
+#           sends: summary_llm.SYSTEM + free_text_prompt(intake), and no
+#           call at all when there are no symptoms to clean up.
+# Bytes are BSON sizes when pymongo's bson is installed, else JSON sizes.
+# Tokens are estimated (word/punct pieces; ~BPE for English + JSON).
+# ----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+from intake import APPOINTMENT_PROJECTION, USER_PROJECTION, Intake  # noqa: E402
+from schema import normalize_appointment, normalize_user  # noqa: E402
+from summary_llm import SYSTEM, free_text_prompt  # noqa: E402
+
+try:
+    import bson
+
+    def doc_bytes(d):
+        return len(bson.encode(d))
+except Exception:
+    def doc_bytes(d):
+        return len(json.dumps(d, default=str).encode("utf-8"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def est_tokens(s: str) -> int:
+    return len(_TOKEN_RE.findall(s))
+
+
+def project(doc, projection):
+    """Client-side emulation of a Mongo inclusion projection (incl. dotted sub-fields)."""
+    out = {}
+    if projection.get("_id", 1) and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for key, on in projection.items():
+        if not on or key == "_id":
+            continue
+        head, _, tail = key.partition(".")
+        if head not in doc:
+            continue
+        if not tail:
+            out[head] = doc[head]
+        elif isinstance(doc[head], dict) and tail in doc[head]:
+            out.setdefault(head, {})[tail] = doc[head][tail]
+    return out
+
+
+def load_seed():
+    data = os.path.join(HERE, "..", "data")
+    with open(os.path.join(data, "appointments_data.json"), encoding="utf-8") as f:
+        appt = json.load(f)
+    with open(os.path.join(data, "patient_data.json"), encoding="utf-8") as f:
+        user = json.load(f)
+    appt["created_at"] = datetime(2025, 8, 17, 6, 51)
+    return appt, user
+
+
+def variants(appt, user, n, rng):
+    conds = ["severe chest pain", "acne, rash", "knee pain", "headache, nausea", "fever and cold"]
+    for i in range(n):
+        a, u = dict(appt), dict(user)
+        a["_id"], u["_id"] = f"a{i:06d}", f"u{i:06d}"
+        a["condition"] = rng.choice(conds)
+        a["medical"] = dict(a.get("medical") or {}, allergies=rng.choice(["None", "penicillin", None]))
+        a["slot_start"] = datetime(2025, 8, 18, 9 + i % 8, 0)
+        u["symptoms"] = a["condition"]
+        if rng.random() < 0.5:   # half already migrated
+            a, u = normalize_appointment(a), normalize_user(u)
+        yield a, u
+
+
+def old_prompt(a, u):
+    intake = {
+        "patient_name": a.get("patient_name"), "contact": a.get("contact"), "appointment_id": a.get("booking_id"),
+        "condition": a.get("condition"), "symptoms": [a.get("condition")] if a.get("condition") else None,
+        "doctor_name": a.get("doctor_name"), "specialty": a.get("specialty"), "location": a.get("location"),
+        "visit_type": a.get("visit_type"), "selected_day": a.get("selected_day"), "selected_time": a.get("selected_time"),
+        "email": u.get("email"), "mobile": u.get("mobile"), "dob": u.get("dob"), "gender": u.get("gender"),
+        "allergies": u.get("allergies", "None"), "Chronic_condition": u.get("Chronic_condition", "NA"),
+        "medications": u.get("medications", "None"), "history": u.get("history", "None"),
+        "slot_start": a["slot_start"].isoformat(), "scheduled_time_human": "18 Aug 2025, 9:00 AM (EDT)",
+    }
+    return json.dumps(intake, ensure_ascii=False)
+
+
+def main(n, seed):
+    rng = random.Random(seed)
+    appt, user = load_seed()
+    tot = {"bytes_before": 0, "bytes_after": 0, "tok_before": 0, "tok_after": 0, "calls": 0}
+    for a, u in variants(appt, user, n, rng):
+        tot["bytes_before"] += doc_bytes(a) + doc_bytes(u)
+        pa, pu = project(a, APPOINTMENT_PROJECTION), project(u, USER_PROJECTION)
+        tot["bytes_after"] += doc_bytes(pa) + doc_bytes(pu)
+        tot["tok_before"] += est_tokens(old_prompt(a, u))
+        prompt = free_text_prompt(Intake.from_docs(pa, pu))
+        if prompt is not None:
+            tot["calls"] += 1
+            tot["tok_after"] += est_tokens(prompt)
+    print(f"summaries: {n}   model calls after: {tot['calls']}   system prompt after: {est_tokens(SYSTEM)} tokens/call")
+    for label, b, a in (("bytes read / summary", "bytes_before", "bytes_after"),
+                        ("prompt tokens / summary (user message)", "tok_before", "tok_after")):
+        before, after = tot[b] / n, tot[a] / n
+        print(f"{label:40s} before {before:8.1f}  after {after:8.1f}  ({(1 - after / before):.0%} less)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    main(args.n, args.seed)
@@ -0,0 +1,122 @@
+# bench_json_extract.py — fuzz + throughput check for apps/json_extract.py
+# ----------------------------------------------------------------------
+#   python bench/bench_json_extract.py [--iters 2000] [--seed 7]
+#
+# Fuzz: wraps valid turns in random noise (fences, prose, stray braces,
+# extra objects, truncation) and asserts the extractor never raises, only
+# returns schema-valid turns, and recovers the embedded turn whenever it
+# is intact, with every "set" value a string (bare numbers included).
+# Throughput: adversarial inputs vs the old greedy regex.
+# ----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "apps"))
+
+from json_extract import TurnStreamParser, extract_turn, validate_turn  # noqa: E402
+
+
+def legacy_extract(txt):
+    if not txt:
+        return None
+    m = re.search(r'\{.*\}', txt, flags=re.DOTALL)
+    if not m:
+        return None
+    try:
+        return json.loads(m.group())
+    except Exception:
+        return None
+
+
+def random_turn(rng):
+    keys = ["condition", "patient_name", "contact", "selected_day", "selected_time", "allergies"]
+    upd = {k: "".join(rng.choice(string.ascii_letters + ' {}"\\,') for _ in range(rng.randint(0, 12)))
+           for k in rng.sample(keys, rng.randint(0, len(keys)))}
+    for k in upd:
+        if rng.random() < 0.1:   # models sometimes send bare numbers ("contact": 5551234567)
+            upd[k] = rng.choice([5551234567, 3, 4.0, 98.6])
+    return {"say": "".join(rng.choice(string.printable) for _ in range(rng.randint(0, 60))), "set": upd, "done": rng.random() < 0.2}
+
+
+def noise(rng, n):
+    alphabet = string.ascii_letters + " \n{}[]\":,`"
+    return "".join(rng.choice(alphabet) for _ in range(n))
+
+
+def _strings_only(turn):
+    return turn is None or all(isinstance(v, str) for v in turn["set"].values())
+
+
+def fuzz(iters, seed):
+    rng = random.Random(seed)
+    recovered = intact = 0
+    for _ in range(iters):
+        turn = random_turn(rng)
+        body = json.dumps(turn, ensure_ascii=rng.random() < 0.5)
+        pre = rng.choice(["", "Sure! ", "```json\n", noise(rng, rng.randint(0, 40)).replace("{", "(")])
+        post = rng.choice(["", "\n```", " Let me know {if} that helps.", " " + json.dumps({"note": 1}), noise(rng, rng.randint(0, 80))])
+        truncate = rng.random() < 0.1
+        text = pre + (body[: rng.randint(0, len(body))] if truncate else body) + post
+
+        out = extract_turn(text)
+        assert out is None or validate_turn(out) == out, text
+        assert _strings_only(out), f"non-string set value:\n{text!r}\n-> {out!r}"
+        stream = TurnStreamParser()
+        for k in range(0, len(text), 7):
+            stream.feed(text[k:k + 7])
+        sout = stream.close()
+        assert sout is None or validate_turn(sout) == sout, text
+        assert _strings_only(sout), f"stream: non-string set value:\n{text!r}\n-> {sout!r}"
+        if not truncate:
+            intact += 1
+            want = validate_turn(turn)
+            if out == want:
+                recovered += 1
+            else:
+                raise AssertionError(f"lost intact turn:\n{text!r}\n-> {out!r}")
+            assert sout == want, f"stream lost intact turn:\n{text!r}\n-> {sout!r}"
+    print(f"fuzz: {iters} cases, recovered {recovered}/{intact} intact turns, 0 crashes")
+
+
+def adversarial_cases():
+    good = json.dumps({"say": "Booked?", "set": {"selected_day": "Monday"}, "done": False})
+    return {
+        "long prose, no json": "word " * 20000,
+        "open braces only": "{" * 20000,
+        "deep nesting, unclosed": '{"a":' * 2000,
+        "good + trailing braces": good + " note: {use} {braces} " * 2000,
+        "two objects": good + "\n" + json.dumps({"say": "second", "done": True}),
+        "fenced + commentary": "```json\n" + good + "\n```\nHope this {helps}!" + "x" * 20000,
+        "trailing comma": '{"say": "ok", "set": {"condition": "rash",}, "done": false,}',
+    }
+
+
+def bench(reps):
+    print(f"\n{'case':28s} {'new µs':>10s} {'legacy µs':>10s}  new-ok legacy-ok")
+    for name, txt in adversarial_cases().items():
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            new = extract_turn(txt)
+        t_new = (time.perf_counter() - t0) / reps * 1e6
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            old = legacy_extract(txt)
+        t_old = (time.perf_counter() - t0) / reps * 1e6
+        print(f"{name:28s} {t_new:10.1f} {t_old:10.1f}  {str(new is not None):6s} {str(validate_turn(old) is not None if isinstance(old, dict) else False)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iters", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--reps", type=int, default=20)
+    args = ap.parse_args()
+    fuzz(args.iters, args.seed)
+    bench(args.reps)
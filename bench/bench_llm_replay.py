@@ -0,0 +1,173 @@
+# bench_llm_replay.py — end-to-end chat turns + handoff summaries from an LLM cassette
+# ----------------------------------------------------------------------
+#   python bench/bench_llm_replay.py [--latency zero|recorded|0.5] [--repeat 50] [--concurrency 64]
+#   # a real recording, against watsonx (WX_API_KEY / WX_PROJECT_ID / WX_URL set):
+#   python bench/bench_llm_replay.py --record --cassette bench/fixtures/llm_cassette.live.jsonl
+#
+# bench/fixtures/llm_cassette.jsonl ships with the repo and is the default:
+# a synthetic recording of the scripts below (the chat turns answered by
+# bench_turns_to_booking's simulated model, the summaries by a templated
+# one, latencies drawn around watsonx's), so replay works on a fresh
+# checkout. Re-generate it when the scripts change; exact misses after
+# prompt edits still replay through the cassette's loose key.
+#
+# Chat: the scripted conversations below go through BookingService.turn
+# (ai_driver → after_model → save; in-memory sessions, no Mongo), Summary:
+# the payloads below through HandoffSummarizer.generate — the code behind
+# summary_generator.generate_summary_llm. Model calls are answered by
+# llm_cassette.CassetteModel, so the numbers move only with our code
+# (latency=zero) or with our code + the recorded upstream profile.
+#
+# Rate limits are lifted on replay (the quota models watsonx, not us).
+# --min-hit-rate makes a CI job fail when fixtures have gone stale.
+# ----------------------------------------------------------------------
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+from booking_api import BookingService, init_models  # noqa: E402
+from booking_core import load_settings  # noqa: E402
+from clinic_calendar import get_calendar  # noqa: E402
+from json_extract import PARSE_STATS  # noqa: E402
+from lazy_deps import HAS_IBM, wx  # noqa: E402
+from llm_cassette import cassette_model, get_cassette  # noqa: E402
+from llm_gateway import get_gateway  # noqa: E402
+from llm_ratelimit import PRIORITY_BACKGROUND, get_limiter  # noqa: E402
+from summary_llm import HandoffSummarizer  # noqa: E402
+
+DEFAULT_CASSETTE = os.path.join(HERE, "fixtures", "llm_cassette.jsonl")
+
+SCRIPTS = [
+    ["my heart is racing and I feel short of breath", "Jane Doe", "jane.doe@example.com",
+     "in person please", "Monday at 10:00 AM", "no", "yes, book it"],
+    ["I have an itchy rash on my arms", "Omar Haddad, 5551234567", "telehealth",
+     "Wednesday 2 PM", "no allergies", "confirm"],
+    ["I twisted my knee running yesterday", "Lena Park", "lena.park@example.com",
+     "in-person", "earliest you have on Tuesday, 9:00 AM", "none", "sounds good"],
+    ["sore throat and a fever for three days", "Chris Miller chris@example.org",
+     "video visit", "Thursday 11:00 AM", "I take ibuprofen", "yes"],
+    ["crushing chest pain spreading to my arm", "Ana Souza", "ana.souza@example.com",
+     "earliest", "in person", "no", "yes"],
+    ["what is telehealth?", "my back has been aching for weeks", "Sam Lee",
+     "sam.lee@example.com", "telehealth", "Friday 3:00 PM", "no", "ok"],
+]
+
+SUMMARY_PAYLOADS = [
+    {"patient_name": "Jane Doe", "condition": "palpitations, shortness of breath", "duration": "2 days",
+     "severity": "High", "doctor_name": "Dr. Sarah Johnson", "specialty": "Cardiology",
+     "visit_type": "in-person", "selected_day": "Monday", "selected_time": "10:00 AM"},
+    {"patient_name": "Omar Haddad", "condition": "itchy rash on arms", "duration": "1 week",
+     "severity": "Low", "doctor_name": "Dr. Michael Chen", "specialty": "Dermatology",
+     "visit_type": "telehealth", "selected_day": "Wednesday", "selected_time": "2:00 PM"},
+    {"patient_name": "Lena Park", "condition": "knee pain after running, swelling", "duration": "1 day",
+     "severity": "Medium", "doctor_name": "Dr. Alex Nguyen", "specialty": "Orthopedics",
+     "visit_type": "in-person", "selected_day": "Tuesday", "selected_time": "9:00 AM"},
+    {"patient_name": "Chris Miller", "condition": "sore throat, fever", "duration": "3 days",
+     "severity": "Medium", "history": "asthma", "doctor_name": "Dr. Maya Patel",
+     "specialty": "Internal Medicine", "visit_type": "telehealth", "selected_day": "Thursday",
+     "selected_time": "11:00 AM"},
+]
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+async def run_chat(svc, scripts, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    lat, booked = [], 0
+
+    async def one(script):
+        nonlocal booked
+        async with sem:
+            sid, _ = await svc.start()
+            for text in script:
+                t0 = time.perf_counter()
+                r = await svc.turn(sid, text, channel="bench")
+                lat.append(time.perf_counter() - t0)
+                booked += bool(r.get("done"))
+            await svc.end(sid)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(s) for s in scripts))
+    return time.perf_counter() - t0, lat, booked
+
+
+def run_summaries(summarizer, payloads, concurrency):
+    def one(p):
+        t0 = time.perf_counter()
+        summarizer.generate(p)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        lat = list(pool.map(one, payloads))
+    return time.perf_counter() - t0, lat
+
+
+def main(args):
+    mode = "record" if args.record else "replay"
+    if mode == "replay" and not os.path.exists(args.cassette):
+        sys.exit(f"no cassette at {args.cassette}; record one first with --record (needs watsonx credentials)")
+    repeat, concurrency = (1, 1) if args.record else (args.repeat, args.concurrency)
+
+    cfg = load_settings({})
+    cfg.update(LLM_CASSETTE=args.cassette, LLM_CASSETTE_MODE=mode, LLM_CASSETTE_LATENCY=args.latency,
+               MONGO_URI="", MAIL_ENABLED=False)
+    if not args.record:
+        cfg.update(LLM_UPSTREAM_RPS=1e6, LLM_CHAT_RPS=1e6)
+        get_limiter().configure("summary", 1e6)
+    models = init_models(cfg)
+    if models[0] is None:
+        sys.exit("no model: --record needs ibm-watsonx-ai and WX_API_KEY / WX_PROJECT_ID / WX_URL")
+    cassette = get_cassette(args.cassette)
+    print(f"cassette: {args.cassette} ({len(cassette)} exchanges), mode={mode}, latency={args.latency}")
+
+    async def chat():
+        svc = BookingService(cfg, None, None, *models)
+        return await run_chat(svc, SCRIPTS * repeat, concurrency)
+
+    wall, lat, booked = asyncio.run(chat())
+    rates = PARSE_STATS.rates()
+    print(f"\nchat     {len(lat)} turns / {len(SCRIPTS) * repeat} conversations in {wall:.2f}s "
+          f"→ {len(lat) / wall:,.0f} turns/s   p50 {_pct(lat, .5) * 1e3:.2f} ms  p95 {_pct(lat, .95) * 1e3:.2f} ms   "
+          f"booked {booked}   parsed {rates['success_rate']:.0%}")
+
+    live = None
+    if args.record:
+        live = wx().ModelInference(model_id=cfg["MODEL_ID"], credentials={"apikey": cfg["WX_API_KEY"], "url": cfg["WX_URL"]},
+                                   project_id=cfg["WX_PROJECT_ID"]) if HAS_IBM else None
+    model = cassette_model(live, cfg["MODEL_ID"], args.cassette, mode, args.latency)
+    gateway = get_gateway("summary-bench", deadline_s=cfg["LLM_DEADLINE_S"], budget="summary", priority=PRIORITY_BACKGROUND)
+    summarizer = HandoffSummarizer(model, gateway, get_calendar(cfg["CLINIC_TZ"], cfg["CLINIC_HOLIDAYS"]))
+    wall, lat = run_summaries(summarizer, SUMMARY_PAYLOADS * repeat, concurrency)
+    print(f"summary  {len(lat)} handoffs in {wall:.2f}s → {len(lat) / wall:,.0f}/s   "
+          f"p50 {_pct(lat, .5) * 1e3:.2f} ms  p95 {_pct(lat, .95) * 1e3:.2f} ms")
+
+    s = cassette.stats
+    lookups = s["exact"] + s["loose"] + s["misses"]
+    hit_rate = (s["exact"] + s["loose"]) / lookups if lookups else 1.0
+    print(f"\ncassette exact {s['exact']}  loose {s['loose']}  misses {s['misses']}  recorded {s['recorded']}  "
+          f"hit rate {hit_rate:.1%}")
+    if not args.record and hit_rate < args.min_hit_rate:
+        print(f"FAIL: hit rate below {args.min_hit_rate:.0%} — re-record the cassette")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cassette", default=DEFAULT_CASSETTE)
+    ap.add_argument("--record", action="store_true", help="call watsonx and append every exchange")
+    ap.add_argument("--latency", default="zero", help="replay latency: zero, recorded, or a scale factor")
+    ap.add_argument("--repeat", type=int, default=20, help="copies of each script/payload on replay")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--min-hit-rate", type=float, default=0.0)
+    main(ap.parse_args())
@@ -0,0 +1,116 @@
+# bench_reminders.py — reminder heap cost with tens of thousands pending
+# ----------------------------------------------------------------------
+#   python bench/bench_reminders.py [--n 50000]
+#   MONGO_URI=... python bench/bench_reminders.py --mongo      # scratch DB medbird_bench_reminders
+#
+# Offline it times the scheduler's own work: pushing n appointments
+# (their reminders inside the window) into the heap, cancelling a tenth
+# of them, and popping everything due in FIRE_BATCH-sized batches as the
+# clock moves through the window. Per-push cost should stay flat as n grows.
+#
+# With --mongo the appointments are inserted into a scratch DB, and the
+# restart path is timed: the window refill (indexed range queries) and
+# firing due batches into db.outbox (one $in + one insert_many each).
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+from clinic_calendar import get_calendar  # noqa: E402
+from reminders import FIRE_BATCH, ReminderScheduler, ensure_reminder_indexes  # noqa: E402
+
+
+def make_appointments(n, now, window_h, rng):
+    out = []
+    for i in range(n):
+        # half of them tomorrow: their T-24h reminder is the one inside the window
+        slot = now + timedelta(hours=1 + rng.random() * (window_h - 1) + (24 if rng.random() < 0.5 else 0))
+        out.append({"booking_id": f"apt_bench_{i:06d}", "contact": f"p{i}@example.com", "status": "confirmed",
+                    "slot_start": slot.replace(microsecond=0), "patient_name": f"P{i}", "doctor_name": "Dr. Bench",
+                    "location": "Bench Clinic", "visit_type": "in-person"})
+    return out
+
+
+def offline(appts, now, window, rng):
+    sched = ReminderScheduler(None, None, window=window)
+    t0 = time.perf_counter()
+    for a in appts:
+        sched.push(a, now)
+    push_s = time.perf_counter() - t0
+    print(f"pending {len(sched):,} reminders from {len(appts):,} appointments")
+    print(f"push              {push_s / len(appts) * 1e6:.1f} µs/appointment   ({push_s * 1e3:.0f} ms total)")
+
+    t0 = time.perf_counter()
+    for a in rng.sample(appts, len(appts) // 10):
+        sched.drop(a["booking_id"])
+    print(f"cancel 10%        {(time.perf_counter() - t0) * 1e3:.1f} ms")
+
+    t0, popped, batches = time.perf_counter(), 0, 0
+    step = window / 60
+    clock = now
+    while clock <= now + window:
+        due = sched.pop_due(clock)
+        while due:
+            popped += len(due)
+            batches += 1
+            due = sched.pop_due(clock)
+        clock += step
+    pop_s = time.perf_counter() - t0
+    print(f"pop due           {pop_s / max(1, popped) * 1e6:.1f} µs/reminder   {popped:,} live in {batches} batches"
+          f" (<= {FIRE_BATCH}), {sched.stats['stale']:,} stale skipped")
+
+
+def with_mongo(appts, now, window):
+    from pymongo import MongoClient
+
+    uri = os.getenv("MONGO_URI", "")
+    if not uri:
+        sys.exit("--mongo needs MONGO_URI")
+    db = MongoClient(uri)["medbird_bench_reminders"]
+    db.appointments.drop()
+    db.outbox.drop()
+    for i in range(0, len(appts), 5000):
+        db.appointments.insert_many([dict(a) for a in appts[i:i + 5000]], ordered=False)
+    ensure_reminder_indexes(db)
+    db.outbox.create_index("dedupe_key", name="dedupe", unique=True, sparse=True)
+
+    sched = ReminderScheduler(db, get_calendar("America/New_York"), window=window)
+    t0 = time.perf_counter()
+    loaded = sched.refill(now)
+    print(f"restart refill    {(time.perf_counter() - t0) * 1e3:.0f} ms for {loaded:,} reminders")
+
+    t0, queued, batches = time.perf_counter(), 0, 0
+    due = sched.pop_due(now + window)
+    while due:
+        queued += sched.fire(due)
+        batches += 1
+        due = sched.pop_due(now + window)
+    fire_s = time.perf_counter() - t0
+    print(f"fire              {fire_s * 1e3 / max(1, batches):.0f} ms/batch   {queued:,} queued in {batches} batches")
+    db.appointments.drop()
+    db.outbox.drop()
+
+
+def main(args):
+    rng = random.Random(7)
+    now = datetime.utcnow().replace(microsecond=0)
+    window = timedelta(hours=args.window_h)
+    appts = make_appointments(args.n, now, args.window_h, rng)
+    offline(appts, now, window, rng)
+    if args.mongo:
+        with_mongo(appts, now, window)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--window-h", type=float, default=6.0)
+    ap.add_argument("--mongo", action="store_true", help="insert into a scratch DB and time refill + fire")
+    main(ap.parse_args())
@@ -0,0 +1,135 @@
+# bench_summary_format.py — handoffs/sec: per-payload f-string vs compiled batch
+# ----------------------------------------------------------------------
+#   python bench/bench_summary_format.py [--n 100000]
+#
+# "before": the per-payload formatter summary_generator.py used until the
+#           compiled template (copied below as legacy_format).
+# "after":  summary_format.FORMATTER.render_batch over the same payloads.
+# Outputs are compared row by row before timing; any mismatch aborts.
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+from schema import SCHEMA_VERSION, canonical_intake, clean  # noqa: E402
+from summary_format import FORMATTER  # noqa: E402
+
+TODAY = date(2025, 8, 17)
+
+
+def _compute_age(dob_str):
+    if not dob_str or dob_str.upper() == "NA":
+        return None
+    for fmt in ["%Y-%m-%d", "%d-%m-%Y", "%m-%d-%Y", "%d/%m/%Y", "%m/%d/%Y"]:
+        try:
+            dob = datetime.strptime(dob_str, fmt).date()
+            years = TODAY.year - dob.year - ((TODAY.month, TODAY.day) < (dob.month, dob.day))
+            return max(0, years)
+        except Exception:
+            continue
+    return None
+
+
+def legacy_format(p, symptoms_text=None, rationale=None):
+    p = canonical_intake(p)
+
+    def show(v, default="N/A"):
+        v = clean(v)
+        return default if v is None else v
+
+    age = p.get("age")
+    if age is None:
+        age = _compute_age(p.get("dob"))
+    contact = show(clean(p.get("mobile")) or clean(p.get("email")) or p.get("contact"))
+    symptoms = symptoms_text or ", ".join(p.get("symptoms") or []) or "N/A"
+    sev_text = p.get("severity") or "N/A"
+    urgency = p.get("urgency") or (sev_text if sev_text in ("Low","Medium","High") else "N/A")
+    vtype = (p.get("visit_type") or "").replace("telehealth","Telehealth").replace("in-person","In-person") or "N/A"
+
+    return (
+        f"Patient: {show(p.get('patient_name'))}\n"
+        f"Age: {age if age is not None else 'N/A'}\n"
+        f"Gender: {show(p.get('gender'))}\n"
+        f"Contact: {contact}\n"
+        f"Appointment ID: {show(p.get('appointment_id'))}\n"
+        f"Scheduled Time: {p.get('scheduled_time_human') or 'N/A'}\n\n"
+        f"Reason for Visit:\n"
+        f"- Symptoms: {symptoms}\n"
+        f"- Duration: {show(p.get('duration'))}\n"
+        f"- Severity: {sev_text}\n"
+        f"- Suspected cause: {show(p.get('suspected_cause'))}\n\n"
+        f"Medical Background:\n"
+        f"- Allergies: {show(p.get('allergies'), 'None')}\n"
+        f"- Chronic conditions: {show(p.get('chronic_conditions'), 'None')}\n"
+        f"- Current medications: {show(p.get('medications'), 'None')}\n"
+        f"- Relevant history: {show(p.get('history'), 'None')}\n\n"
+        f"Triage Notes:\n"
+        f"- Urgency: {urgency} – {'N/A' if urgency=='N/A' else (rationale or 'as per reported symptoms')}\n"
+        f"- Flag: {show(p.get('flag'), 'None')}\n\n"
+        f"Booking Details:\n"
+        f"- Doctor: {show(p.get('doctor_name'))} ({show(p.get('specialty'))})\n"
+        f"- Appointment Type: {vtype}\n"
+        f"- Location: {show(p.get('location'))}"
+    )
+
+
+def payloads(n, rng):
+    names = ["Ava Patel", "Liam Chen", "Noah Garcia", "Mia Khan", None]
+    dobs = ["1990-04-12", "25/05/1984", "2001-11-30", "NA", None]
+    syms = [["fever", "cough"], ["knee pain"], ["rash"], [], ["chest pain", "shortness of breath"]]
+    for i in range(n):
+        p = {
+            "schema_version": SCHEMA_VERSION,
+            "patient_name": rng.choice(names),
+            "dob": rng.choice(dobs),
+            "gender": rng.choice(["Female", "Male", None]),
+            "mobile": rng.choice(["5551234567", None]),
+            "email": rng.choice(["a@example.com", None]),
+            "appointment_id": f"A{i:07d}",
+            "scheduled_time_human": rng.choice(["18 Aug 2025, 09:00 AM (EDT)", None]),
+            "symptoms": rng.choice(syms),
+            "severity": rng.choice(["Low", "Medium", "High", None]),
+            "allergies": rng.choice(["penicillin", None]),
+            "doctor_name": "Dr. Rivera", "specialty": rng.choice(["Cardiology", None]),
+            "visit_type": rng.choice(["telehealth", "in-person", None]),
+            "location": "Main Campus",
+        }
+        if rng.random() < 0.1:
+            p["age"] = rng.randint(1, 90)
+        yield {k: v for k, v in p.items() if v is not None}
+
+
+def main(n, seed):
+    rng = random.Random(seed)
+    ps = list(payloads(n, rng))
+    rats = [rng.choice([None, "acute onset"]) for _ in ps]
+
+    t0 = time.perf_counter()
+    before = [legacy_format(p, None, r) for p, r in zip(ps, rats)]
+    t_before = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    after = FORMATTER.render_batch(ps, rationales=rats, today=TODAY)
+    t_after = time.perf_counter() - t0
+
+    bad = sum(a != b for a, b in zip(before, after))
+    if bad or len(before) != len(after):
+        sys.exit(f"output mismatch on {bad} of {n} payloads")
+    print(f"payloads: {n} (outputs identical)")
+    print(f"per-payload f-string   {t_before:7.3f}s  {n / t_before:10.0f} summaries/s")
+    print(f"compiled render_batch  {t_after:7.3f}s  {n / t_after:10.0f} summaries/s  ({t_before / t_after:.2f}x)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    main(args.n, args.seed)
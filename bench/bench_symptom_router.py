@@ -0,0 +1,116 @@
+# bench_symptom_router.py — routing accuracy + per-turn latency
+# ----------------------------------------------------------------------
+#   python bench/bench_symptom_router.py [--n 2000] [--no-numpy] [--cases FILE] [--min-accuracy 0.7]
+#
+# Accuracy: the held-out patient phrasings in
+# bench/fixtures/symptom_router_eval.jsonl routed by
+#   keyword  — the substring map match_condition_to_doctor used before
+#              (anything unmatched goes to internal medicine)
+#   router   — symptom_router.get_router().route() (default → internal)
+# Misroutes are listed for the router so corpus gaps are easy to spot.
+# The eval set is never used to tune SYMPTOM_CORPUS: the bench refuses
+# to run if a case contains any corpus phrase or CONDITIONS keyword as
+# whole words, so the figure is generalization, not corpus recall. A
+# corpus phrase may cover what a misrouted case means, never its wording.
+# Exit status is non-zero when router accuracy is below --min-accuracy
+# (default MIN_ACCURACY, 70%; 73.8% on this set when it was set).
+# Latency: µs per route() over the same messages, cold (fresh router,
+# empty feature caches) and warm.
+# ----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+import symptom_router  # noqa: E402
+from symptom_router import CONDITIONS, SymptomRouter  # noqa: E402
+
+DEFAULT_CASES = os.path.join(HERE, "fixtures", "symptom_router_eval.jsonl")
+MIN_ACCURACY = 0.70
+
+
+def load_cases(path):
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["text"], row["specialty"]) for row in rows]
+
+
+def corpus_overlap(cases, phrases):
+    """Cases containing a corpus phrase as whole words: those measure recall, not routing."""
+    out = []
+    for text, _ in cases:
+        tl = text.lower()
+        hits = [p for p in phrases if re.search(rf"\b{re.escape(p)}\b", tl)]
+        if hits:
+            out.append((text, hits))
+    return out
+
+
+def legacy_keyword(text):
+    tl = (text or "").lower()
+    for condition, specialty in CONDITIONS.items():
+        if condition in tl:
+            return specialty
+    return "internal"
+
+
+def accuracy(cases, route_fn):
+    wrong = [(t, want, got) for t, want in cases if (got := route_fn(t)) != want]
+    return 1 - len(wrong) / len(cases), wrong
+
+
+def latency(router, cases, n):
+    msgs = [t for t, _ in cases]
+    t0 = time.perf_counter()
+    for i in range(n):
+        router.route(msgs[i % len(msgs)])
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main(n, use_numpy, cases_path, min_accuracy=MIN_ACCURACY):
+    cases = load_cases(cases_path)
+    t0 = time.perf_counter()
+    router = SymptomRouter(use_numpy=use_numpy)
+    build_ms = (time.perf_counter() - t0) * 1e3
+    mode = "numpy" if router.use_numpy else "pure python"
+
+    leaked = corpus_overlap(cases, router.phrases)
+    if leaked:
+        for text, hits in leaked:
+            print(f"    in corpus: {text!r} contains {hits}")
+        sys.exit(f"{len(leaked)} eval case(s) overlap the router corpus; reword them (don't tune the corpus)")
+
+    acc_kw, _ = accuracy(cases, legacy_keyword)
+    acc_rt, wrong = accuracy(cases, lambda t: router.route(t).category or "internal")
+    print(f"cases: {len(cases)}   backend: {mode}   corpus: {len(router.phrases)} phrases, built in {build_ms:.1f} ms")
+    print(f"keyword map accuracy   {acc_kw:6.1%}")
+    print(f"router accuracy        {acc_rt:6.1%}")
+    for t, want, got in wrong:
+        print(f"    misrouted: {t!r}: want {want}, got {got}")
+
+    symptom_router._word_features.cache_clear()
+    symptom_router._bigram_features.cache_clear()
+    if symptom_router.HAS_NUMPY:
+        symptom_router._word_array.cache_clear()
+        symptom_router._bigram_array.cache_clear()
+    cold = latency(SymptomRouter(use_numpy=use_numpy), cases, len(cases))
+    warm = latency(router, cases, n)
+    print(f"route() latency        cold {cold:8.1f} µs/turn   warm {warm:8.1f} µs/turn")
+    if acc_rt < min_accuracy:
+        sys.exit(f"FAIL: router accuracy {acc_rt:.1%} < floor {min_accuracy:.0%}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--no-numpy", action="store_true")
+    ap.add_argument("--cases", default=DEFAULT_CASES, help="JSONL of {text, specialty}")
+    ap.add_argument("--min-accuracy", type=float, default=MIN_ACCURACY)
+    args = ap.parse_args()
+    main(args.n, not args.no_numpy, args.cases, args.min_accuracy)
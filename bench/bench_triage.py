@@ -0,0 +1,80 @@
+# bench_triage.py — per-turn cost of triage.score_triage + sanity cases
+# ----------------------------------------------------------------------
+#   python bench/bench_triage.py [--n 3000]
+#
+# Scores n distinct complaint strings (cold cache: every call misses the
+# memo) and then the same strings again (warm), and prints the urgency
+# for a few reference complaints, incl. the seed appointment, and for
+# negated phrasings next to the urgency they should get.
+# ----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+from triage import CONDITION_WEIGHTS, SEVERITY_WORDS, score_triage  # noqa: E402
+
+REFERENCE = [
+    ("acne", None, None),
+    ("knee pain after running", "2", "a week"),
+    ("fever and cold", None, "2 days"),
+    ("palpitations", None, None),
+    ("sudden chest pain", "4", "since this morning"),
+    ("I can't breathe properly", None, None),
+]
+
+
+# (complaint, severity, duration, expected urgency)
+NEGATED = [
+    ("not severe, just a rash", None, None, "Low"),
+    ("no chest pain, just a headache", None, None, "Low"),
+    ("denies shortness of breath or palpitations", None, None, "Low"),
+    ("I have never fainted, mild back pain", None, None, "Low"),
+    ("I have not passed out", None, None, "Low"),
+    ("the pain is not getting worse", None, "3 days", "Low"),
+    ("no fever and chest pain since this morning", None, None, "High"),
+    ("I don't have a fever but severe chest pain", None, None, "High"),
+    ("I can not breathe", None, None, "High"),
+]
+
+
+def complaints(n, rng):
+    conds, words = list(CONDITION_WEIGHTS), list(SEVERITY_WORDS)
+    for i in range(n):
+        text = f"{rng.choice(words)} {rng.choice(conds)} and {rng.choice(conds)} (#{i})"
+        yield text, rng.choice([None, "1", "3", "5", "High"]), rng.choice([None, "2 hours", "3 days", "a month"])
+
+
+def main(n, seed):
+    with open(os.path.join(HERE, "..", "data", "appointments_data.json"), encoding="utf-8") as f:
+        seed_appt = json.load(f)
+    for args in REFERENCE + [(seed_appt["condition"], None, seed_appt.get("duration"))]:
+        t = score_triage(*args)
+        print(f"{args[0]!r:32s} score {t.score:2d}  {t.urgency:6s}  {t.flag or ''}")
+    print()
+    for text, sev, dur, want in NEGATED:
+        t = score_triage(text, sev, dur)
+        print(f"{text!r:46s} score {t.score:2d}  {t.urgency:6s}  {'ok' if t.urgency == want else 'MISMATCH, want ' + want}")
+    print()
+
+    cases = list(complaints(n, random.Random(seed)))
+    for label in ("cold", "warm"):
+        t0 = time.perf_counter()
+        for args in cases:
+            score_triage(*args)
+        dt = time.perf_counter() - t0
+        print(f"{label}: {dt / n * 1e6:6.1f} µs/turn over {n} complaints")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=3000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    main(args.n, args.seed)
@@ -0,0 +1,492 @@
+# bench_turns_to_booking.py — turns / calls / tokens to a confirmed booking
+# ----------------------------------------------------------------------
+#   python bench/bench_turns_to_booking.py [--personas 300] [--seed 7] [--sim-miss 0.15]
+#   python bench/bench_turns_to_booking.py --cassette bench/fixtures/personas.jsonl [--record]
+#   python bench/bench_turns_to_booking.py --history
+#
+# Runs generated patient personas through BookingService.turn (the full
+# loop: ai_driver → after_model guards → save; in-memory sessions, no
+# Mongo) and reports:
+#   completion  — share of personas that got to a confirmed booking
+#   turns       — patient messages per completed booking (mean / p50 / p90)
+#   calls       — model calls per completed booking (repair passes included)
+#   tokens      — prompt + completion tokens per completed booking
+#
+# Model:
+#   sim (default) — SimModel below: deterministic, one question at a time.
+#                   It never reads the system prompt (AI_SYSTEM), so its
+#                   turns, calls and completion do not move when the prompt
+#                   changes; only the token count does. What it measures is
+#                   the local loop: --sim-miss is the share of turns where
+#                   it drops a field or forgets done=true, which the local
+#                   guards (CONFIRM_RE, DECLINE_OPT_RE, optional-intake
+#                   nudge) are there to catch. Sim runs are compared with
+#                   earlier sim runs, not across prompt versions.
+#   --cassette    — recorded watsonx answers (llm_cassette.py). This is the
+#                   only mode whose numbers compare prompt versions. No
+#                   persona recording is committed: make one with --record
+#                   (credentials needed) for each PROMPT_VERSION, since a
+#                   prompt edit changes the keys.
+#
+# Personas react to what the bot asked (name, contact, visit type, day,
+# time, optional intake, confirmation) in one of four styles, with typos,
+# unavailable days, questions and confirmation phrasings the regexes may
+# not know. Each run is appended to bench/results/turns_to_booking.jsonl;
+# cassette runs are then compared per prompt version, sim runs per run.
+# ----------------------------------------------------------------------
+
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "apps"))
+
+from booking_api import BookingService, init_models  # noqa: E402
+from booking_core import PROMPT_VERSION, load_settings  # noqa: E402
+from llm_cassette import get_cassette  # noqa: E402
+from llm_ratelimit import get_limiter  # noqa: E402
+
+RESULTS = os.path.join(HERE, "results", "turns_to_booking.jsonl")
+MAX_TURNS = 16
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# -------------------------------------------------
+# Token / call metering (per persona via contextvars)
+# -------------------------------------------------
+
+_meter: contextvars.ContextVar = contextvars.ContextVar("meter", default=None)
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text or "") // 4)
+
+
+class MeteredModel:
+    """Counts calls and tokens (response usage when present, else ~4 chars/token) for the current persona."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.model_id = getattr(inner, "model_id", None)
+
+    def _count(self, messages, resp) -> None:
+        m = _meter.get()
+        if m is None:
+            return
+        usage = (resp or {}).get("usage") or {}
+        prompt = usage.get("prompt_tokens") or sum(_approx_tokens(x.get("content")) for x in messages)
+        out = usage.get("completion_tokens")
+        if out is None:
+            out = _approx_tokens(json.dumps((resp or {}).get("choices") or ""))
+        m["calls"] += 1
+        m["tokens"] += prompt + out
+
+    def chat(self, messages=None, params=None, **kw):
+        resp = self.inner.chat(messages=messages, params=params, **kw)
+        self._count(messages, resp)
+        return resp
+
+    async def achat(self, messages=None, params=None, **kw):
+        if hasattr(self.inner, "achat"):
+            resp = await self.inner.achat(messages=messages, params=params, **kw)
+        else:
+            resp = await asyncio.to_thread(self.inner.chat, messages=messages, params=params, **kw)
+        self._count(messages, resp)
+        return resp
+
+# -------------------------------------------------
+# Simulated model
+# -------------------------------------------------
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)*")
+_PHONE_RE = re.compile(r"(?:\d[\s().-]?){7,}\d")
+_DAY_RE = re.compile(r"\b(" + "|".join(WEEKDAYS) + r")\b", re.I)
+_TIME_RE = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*([ap])\.?m\b", re.I)
+_NAME_RE = re.compile(r"(?:my name is|i'm|i am|this is|name:)\s+([A-Z][a-z]+(?: [A-Z][a-z]+)+)|^([A-Z][a-z]+ [A-Z][a-z]+)\b")
+_ALLERGY_RE = re.compile(r"allergic to ([\w ,]+?)(?:[.;]| and i| i take|$)", re.I)
+_MEDS_RE = re.compile(r"\b(?:i take|taking|i'm on|i am on) ([\w ,]+?)(?:[.;]|$)", re.I)
+_DECLINE_RE = re.compile(r"^\s*(no|nope|none|nothing|no thanks|i'm good|not really|nah)\b", re.I)
+_YES_RE = re.compile(r"\b(yes|yep|yeah|yup|sure|confirm|book it|go ahead|sounds good|perfect|great|ok|okay|do it)\b", re.I)
+
+_QUESTIONS = {
+    "condition": "What symptoms are you experiencing?",
+    "patient_name": "May I have your full name?",
+    "contact": "What's the best email or 10-digit phone number to reach you?",
+    "visit_type": "Would you prefer an in-person or a telehealth visit?",
+    "selected_day": "Which day works best for you?",
+    "selected_time": "What time would you like?",
+}
+
+
+def _extract(text: str, state: Dict[str, Any], doctor: Dict[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    lt = text.lower()
+    m = _NAME_RE.search(text)
+    if m and not _DAY_RE.fullmatch((m.group(1) or m.group(2) or "").split()[0]):
+        out["patient_name"] = m.group(1) or m.group(2)
+    m = _EMAIL_RE.search(text) or _PHONE_RE.search(text)
+    if m:
+        out["contact"] = m.group(0).strip()
+    if any(k in lt for k in ("telehealth", "virtual", "video")) and "?" not in text:
+        out["visit_type"] = "telehealth"
+    elif any(k in lt for k in ("in-person", "in person", "office")):
+        out["visit_type"] = "in-person"
+    m = _DAY_RE.search(text)
+    days = doctor.get("available_days") or []
+    if "earliest" in lt and days and not (state.get("triage") or {}).get("earliest_slot"):
+        out["selected_day"] = days[0]
+        out.setdefault("selected_time", "9:00 AM")
+    elif m:
+        out["selected_day"] = m.group(1).capitalize()
+    m = _TIME_RE.search(text)
+    if m:
+        out["selected_time"] = f"{int(m.group(1))}:{m.group(2) or '00'} {m.group(3).upper()}M"
+    m = _ALLERGY_RE.search(text)
+    if m:
+        out["allergies"] = m.group(1).strip()
+    m = _MEDS_RE.search(text)
+    if m:
+        out["medications"] = m.group(1).strip()
+    if not state.get("condition") and not text.rstrip().endswith("?"):
+        first = re.split(r"[.;]|\bmy name is\b", text, 1)[0].strip(" ,")
+        if first and (not out or len(first.split()) > 2):
+            out["condition"] = first[:120]
+    return out
+
+
+class SimModel:
+    """Deterministic stand-in for watsonx that asks for one missing field at a time. It ignores
+    the system prompt, so it exercises the local guards, not AI_SYSTEM. With miss_rate > 0 a
+    hash-chosen share of turns drops the extracted fields or the done flag."""
+
+    model_id = "sim"
+
+    def __init__(self, miss_rate: float = 0.0):
+        self.miss_rate = miss_rate
+
+    def _miss(self, messages, salt: str) -> bool:
+        h = hashlib.sha1((salt + json.dumps(messages, sort_keys=True)).encode("utf-8")).digest()
+        return int.from_bytes(h[:4], "big") / 2 ** 32 < self.miss_rate
+
+    def _turn(self, messages) -> Dict[str, Any]:
+        ctx = json.loads(messages[1]["content"][len("Context: "):])
+        state, doctor, text = ctx["state"], ctx["doctor"], messages[-1]["content"]
+        upd = _extract(text, state, doctor)
+        say = ""
+        if upd.get("selected_day") and upd["selected_day"] not in (doctor.get("available_days") or []):
+            say = (f"{doctor.get('name')} isn't available on {upd.pop('selected_day')}. "
+                   f"Available: {', '.join(doctor.get('available_days') or [])}. ")
+        if self._miss(messages, "fields"):
+            upd = {}
+        merged = {**state, **upd}
+        if text.rstrip().endswith("?"):
+            say = "Telehealth is a video visit with the doctor from home. " if "telehealth" in text.lower() else "Good question. "
+        missing = [k for k in _QUESTIONS if not merged.get(k)]
+        done = False
+        if missing:
+            say += ("Thanks! " if upd else "") + _QUESTIONS[missing[0]]
+        elif not state.get("asked_optional") and not state.get("optional_declined") and not (
+                upd.get("allergies") or upd.get("medications")):
+            say += "Got it. Any allergies or current medications (optional)? Otherwise, shall I book it?"
+        elif _DECLINE_RE.search(text) or _YES_RE.search(text) or upd.get("allergies") or upd.get("medications"):
+            done = not self._miss(messages, "done")
+            say += "You're booked!" if done else "Great."
+        else:
+            say += "Shall I confirm this booking?"
+        return {"say": say.strip(), "set": upd, "done": done}
+
+    def chat(self, messages=None, params=None, **kw):
+        content = json.dumps(self._turn(messages))
+        return {"choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": sum(_approx_tokens(m["content"]) for m in messages),
+                          "completion_tokens": _approx_tokens(content)}}
+
+    async def achat(self, messages=None, params=None, **kw):
+        return self.chat(messages, params, **kw)
+
+# -------------------------------------------------
+# Personas
+# -------------------------------------------------
+
+SYMPTOMS = [
+    "my heart is racing", "chest tightness when I climb stairs", "palpitations after coffee",
+    "an itchy rash on my arms", "a mole that changed color", "acne that won't go away",
+    "I twisted my ankle", "my lower back aches all day", "my knee gives out on stairs",
+    "sore throat and a cough", "I've been dizzy for a week", "stomach pain and nausea",
+    "crushing chest pain spreading to my arm", "I feel tired all the time",
+]
+FIRST = ["Jane", "Omar", "Lena", "Chris", "Ana", "Sam", "Priya", "Tom", "Mei", "Luis", "Fatima", "Noah"]
+LAST = ["Doe", "Haddad", "Park", "Miller", "Souza", "Lee", "Shah", "Brown", "Chen", "Garcia", "Khan", "Wilson"]
+CONFIRMS = ["yes", "yes please", "sounds good", "book it", "confirm", "ok", "sure", "perfect", "yup", "great, thanks"]
+DECLINES = ["no", "nope", "none", "no thanks", "nothing else", "I'm good", "not really"]
+REPHRASE = ["I already said: ", "like I said, ", "again, ", "it's "]
+STYLES = ("terse", "chatty", "all_at_once", "question_first")
+FIELDS = ("patient_name", "contact", "visit_type", "selected_day", "selected_time")
+
+
+@dataclass
+class Persona:
+    pid: int
+    style: str
+    symptom: str
+    name: str
+    contact: str
+    typo_contact: Optional[str]
+    visit: str
+    day: str
+    time: str
+    optional: str          # decline | answer
+    decline: str
+    confirm: str
+    given: set = field(default_factory=set)
+    asked: List[str] = field(default_factory=list)
+
+    def piece(self, f: str) -> str:
+        if f == "patient_name":
+            return f"my name is {self.name}"
+        if f == "contact":
+            return self.typo_contact or self.contact
+        return {"condition": self.symptom, "visit_type": self.visit, "selected_day": self.day, "selected_time": self.time}[f]
+
+    def say(self, fields: List[str]) -> str:
+        self.given.update(fields)
+        return ", ".join(self.piece(f) for f in fields)
+
+    def opening(self) -> str:
+        if self.style == "question_first":
+            return "what is telehealth?"
+        if self.style == "all_at_once":
+            return f"{self.symptom}. " + self.say(list(FIELDS))
+        if self.style == "chatty":
+            return f"{self.symptom}. " + self.say(["patient_name"])
+        return self.symptom
+
+    def reply(self, bot: str, turn: int) -> str:
+        b = bot.lower()
+        if turn == 1 and self.style == "question_first":
+            return self.symptom
+        if "look valid" in b:
+            self.typo_contact = None
+            return self.contact
+        m = re.search(r"available: ([a-z, ]+)", b)
+        if m and "isn't available" in b:
+            self.day = m.group(1).split(",")[0].strip().capitalize()
+            return self.day + (f" at {self.time}" if self.style != "terse" else "")
+        m = re.search(r"time doesn't work: .*?(?:working hours \(|e\.g\. )(\d{1,2}:\d{2} [ap]m)", b)
+        if m:
+            self.time = m.group(1).upper()
+            return self.time
+        if "reply 'earliest'" in b and "selected_day" not in self.given:
+            self.given.update({"selected_day", "selected_time"})
+            return "earliest"
+        if re.search(r"allerg|medicat", b):
+            return self.decline if self.optional == "decline" else "I'm allergic to penicillin and I take lisinopril"
+        asked = None
+        for f, pat in (("condition", r"symptom"), ("patient_name", r"\bname\b"), ("contact", r"email|phone|contact|reach"),
+                       ("visit_type", r"in-person|telehealth"), ("selected_day", r"\bday\b|when"),
+                       ("selected_time", r"\btime\b")):
+            if re.search(pat, b):
+                asked = f
+                break
+        pending = [f for f in FIELDS if f not in self.given]
+        if asked is None:
+            if re.search(r"confirm|book|shall i|great\.", b) or not pending:
+                return self.confirm
+            asked = pending[0]
+        fields = [asked]
+        if self.style in ("chatty", "all_at_once"):
+            fields += [f for f in pending if f != asked][:1]
+        text = self.say(fields)
+        # asked again → say it differently, like a patient would
+        repeats = self.asked.count(asked)
+        self.asked.append(asked)
+        return (REPHRASE[(repeats - 1) % len(REPHRASE)] + text) if repeats else text
+
+
+def make_personas(n: int, seed: int) -> List[Persona]:
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        first, last = rnd.choice(FIRST), rnd.choice(LAST)
+        email = f"{first.lower()}.{last.lower()}{i}@example.com"
+        phone = f"555{rnd.randrange(10**6, 10**7)}"
+        contact = email if rnd.random() < 0.7 else phone
+        out.append(Persona(
+            pid=i, style=STYLES[i % len(STYLES)], symptom=rnd.choice(SYMPTOMS), name=f"{first} {last}",
+            contact=contact, typo_contact=(email.replace(".com", "") if rnd.random() < 0.1 else None),
+            visit=rnd.choice(["in person", "in-person", "telehealth", "video visit"]),
+            day=rnd.choice(WEEKDAYS[:5]), time=rnd.choice(["9:00 AM", "10:30 AM", "11 am", "2:00 PM", "3 PM"]),
+            optional=("decline" if rnd.random() < 0.75 else "answer"),
+            decline=rnd.choice(DECLINES), confirm=rnd.choice(CONFIRMS),
+        ))
+    return out
+
+# -------------------------------------------------
+# Run + report
+# -------------------------------------------------
+
+async def run_persona(svc: BookingService, p: Persona) -> Dict[str, Any]:
+    meter = {"calls": 0, "tokens": 0}
+    _meter.set(meter)
+    sid, _ = await svc.start()
+    text, done, turns = p.opening(), False, 0
+    while turns < MAX_TURNS:
+        turns += 1
+        r = await svc.turn(sid, text, channel="bench")
+        if r.get("done"):
+            done = True
+            break
+        text = p.reply(r["say"], turns)
+    await svc.end(sid)
+    return {"style": p.style, "done": done, "turns": turns, **meter}
+
+
+async def run_all(svc: BookingService, personas: List[Persona], concurrency: int) -> List[Dict[str, Any]]:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(p):
+        async with sem:
+            return await run_persona(svc, p)
+
+    # gather wraps each coroutine in its own task (own context copy → own meter)
+
+    return await asyncio.gather(*(one(p) for p in personas))
+
+
+def _q(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    done = [r for r in rows if r["done"]]
+    n = max(1, len(done))
+    turns = [r["turns"] for r in done]
+    return {
+        "personas": len(rows), "completed": len(done), "completion_rate": round(len(done) / max(1, len(rows)), 4),
+        "turns_mean": round(sum(turns) / n, 2), "turns_p50": _q(turns, .5), "turns_p90": _q(turns, .9),
+        # all model traffic (abandoned conversations too) per confirmed booking
+        "calls_per_booking": round(sum(r["calls"] for r in rows) / n, 2),
+        "tokens_per_booking": round(sum(r["tokens"] for r in rows) / n),
+    }
+
+
+def print_row(label: str, s: Dict[str, Any]) -> None:
+    print(f"{label:<24} {s['completion_rate']:>9.1%} {s['turns_mean']:>7.2f} {s['turns_p50']:>5} {s['turns_p90']:>5} "
+          f"{s['calls_per_booking']:>7.2f} {s['tokens_per_booking']:>9,}")
+
+
+def print_header(first: str) -> None:
+    print(f"{first:<24} {'complete':>9} {'turns':>7} {'p50':>5} {'p90':>5} {'calls':>7} {'tokens':>9}")
+
+
+def history(model: str, personas: int, seed: int, per_version: bool = True, last: int = 10) -> List[Dict[str, Any]]:
+    """Earlier runs for this model / persona set: the last one per prompt version (cassette
+    runs), or simply the last `last` runs (sim runs, which the prompt doesn't steer)."""
+    if not os.path.exists(RESULTS):
+        return []
+    with open(RESULTS, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    rows = [r for r in rows if (r["model"], r["summary"]["personas"], r["seed"]) == (model, personas, seed)]
+    if not per_version:
+        return rows[-last:]
+    latest: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        latest[r["prompt_version"]] = r          # last run per version wins
+    return sorted(latest.values(), key=lambda r: r["at"])
+
+
+def print_history(past: List[Dict[str, Any]], per_version: bool, label: str) -> None:
+    if per_version:
+        print_header(f"prompt ({label})")
+        for r in past:
+            print_row(r["prompt_version"] + (" *" if r["prompt_version"] == PROMPT_VERSION else ""), r["summary"])
+        return
+    print_header(f"sim run ({label})")
+    for r in past:
+        print_row(r["at"].replace("T", " ")[:16], r["summary"])
+
+
+def main(args) -> None:
+    if args.cassette:
+        mode = "auto" if args.record else "replay"
+        model_label = f"cassette:{os.path.basename(args.cassette)}"
+    else:
+        mode = None
+        model_label = f"sim(miss={args.sim_miss:g})"
+
+    per_version = bool(args.cassette)
+    if args.history:
+        print_history(history(model_label, args.personas, args.seed, per_version), per_version, model_label)
+        return
+
+    cfg = load_settings({})
+    cfg.update(MONGO_URI="", MAIL_ENABLED=False, LLM_UPSTREAM_RPS=1e6, LLM_CHAT_RPS=1e6)
+    if args.cassette:
+        cfg.update(LLM_CASSETTE=args.cassette, LLM_CASSETTE_MODE=mode, LLM_CASSETTE_LATENCY="zero")
+        model, params, repair_model, repair_params = init_models(cfg)
+        if model is None:
+            sys.exit("no model: --record needs ibm-watsonx-ai and WX_API_KEY / WX_PROJECT_ID / WX_URL")
+    else:
+        model, params, repair_model, repair_params = SimModel(args.sim_miss), {}, None, None
+    get_limiter().configure("chat", 1e6)
+
+    personas = make_personas(args.personas, args.seed)
+
+    async def go():
+        svc = BookingService(cfg, None, None, MeteredModel(model), params,
+                             MeteredModel(repair_model) if repair_model is not None else None, repair_params)
+        svc.llm.coalesce = False   # identical prompts from two personas are two calls here
+        return await run_all(svc, personas, args.concurrency)
+
+    t0 = time.perf_counter()
+    rows = asyncio.run(go())
+    wall = time.perf_counter() - t0
+    s = summarize(rows)
+
+    print(f"prompt {PROMPT_VERSION} · model {model_label} · {len(rows)} personas (seed {args.seed}) · {wall:.1f}s")
+    if args.cassette:
+        st = get_cassette(args.cassette).stats
+        print(f"cassette exact {st['exact']}  loose {st['loose']}  misses {st['misses']}  recorded {st['recorded']}")
+    else:
+        print("sim ignores the prompt: turns / calls / completion measure the local guards; "
+              "compare prompt versions with --cassette")
+    print()
+    print_header("style")
+    for style in STYLES:
+        print_row(style, summarize([r for r in rows if r["style"] == style]))
+    print_row("ALL", s)
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+        with open(RESULTS, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"prompt_version": PROMPT_VERSION, "model": model_label, "seed": args.seed,
+                                "at": datetime.now().isoformat(timespec="seconds"), "summary": s}) + "\n")
+
+    past = history(model_label, args.personas, args.seed, per_version)
+    if len(past) > 1 or (past and past[-1]["prompt_version"] != PROMPT_VERSION):
+        print()
+        print_history(past, per_version, model_label)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--personas", type=int, default=300)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--sim-miss", type=float, default=0.15, help="share of sim turns that drop fields / done")
+    ap.add_argument("--cassette", help="replay model answers from this cassette instead of the sim")
+    ap.add_argument("--record", action="store_true", help="with --cassette: fill misses from watsonx")
+    ap.add_argument("--no-save", action="store_true", help="don't append this run to the results file")
+    ap.add_argument("--history", action="store_true", help="print earlier runs per prompt version and exit")
+    main(ap.parse_args())